@@ -0,0 +1,52 @@
+"""
+账号数据API端点
+文件: backend-ai/app/api/endpoints/account.py
+功能: 删除用户账号或单个会话的全部数据；删除在后台分块执行，接口立即返回任务ID
+"""
+
+import logging
+
+from fastapi import APIRouter, HTTPException, Depends
+
+from app.models.emotion import User, Session as SessionModel, get_db
+from app.models.sharding import get_user_read_db
+from app.services.bulk_delete import bulk_deleter
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api/v1/account", tags=["account"])
+
+
+# ==================== 路由端点 ====================
+
+@router.delete("/{user_id}", status_code=202)
+async def delete_account(user_id: int, db=Depends(get_db)):
+    """
+    删除用户账号及其全部会话、记忆、情绪读数和DApp历史
+
+    返回任务ID，用 GET /jobs/{job_id} 查询进度；同一用户已有进行中的任务时返回该任务
+    """
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="用户不存在")
+    job = bulk_deleter.submit_user(user_id)
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.delete("/{user_id}/sessions/{session_id}", status_code=202)
+async def delete_session(user_id: int, session_id: int, db=Depends(get_user_read_db)):
+    """删除一个会话及其记忆和情绪读数"""
+    exists = db.query(SessionModel.id).filter(
+        SessionModel.id == session_id, SessionModel.user_id == user_id
+    ).first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    job = bulk_deleter.submit_session(user_id, session_id)
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get("/jobs/{job_id}")
+async def get_deletion_job(job_id: str):
+    """删除任务状态和各表已删除的行数"""
+    job = bulk_deleter.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job.to_dict()
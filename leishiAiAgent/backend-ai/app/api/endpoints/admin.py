@@ -0,0 +1,85 @@
+"""
+管理API端点
+文件: backend-ai/app/api/endpoints/admin.py
+功能: 查询API调用量、费用和延迟（读取小时汇总表），以及响应缓存的命中情况
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Header
+
+from app.models.emotion import get_read_db
+from app.services import api_usage
+from app.services.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+# 设置后请求必须带 X-Admin-Token 头
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="需要管理员令牌")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+# ==================== 路由端点 ====================
+
+@router.get("/usage")
+async def get_usage(
+    start: Optional[datetime] = Query(None, description="起始时间（UTC），默认24小时前"),
+    end: Optional[datetime] = Query(None, description="结束时间（UTC，不含），默认现在"),
+    group_by: str = Query("api,endpoint,model", description=f"汇总维度，逗号分隔: {', '.join(api_usage.GROUP_COLUMNS)}"),
+    api_name: Optional[str] = Query(None, description="只看某个API，如 openai_chat"),
+    endpoint: Optional[str] = Query(None, description="只看某个调用位置"),
+    db=Depends(get_read_db)
+):
+    """
+    API调用量、token、费用、错误率和延迟
+
+    数据按小时汇总，起始时间向下取整到小时；最近几秒内的调用可能还在写入缓冲区中
+    """
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必须早于 end")
+
+    dimensions = [name.strip() for name in group_by.split(",") if name.strip()]
+    unknown = [name for name in dimensions if name not in api_usage.GROUP_COLUMNS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未知的汇总维度: {', '.join(unknown)}（可选 {', '.join(api_usage.GROUP_COLUMNS)}）"
+        )
+
+    try:
+        groups = api_usage.query_usage(db, start, end, dimensions, api_name=api_name, endpoint=endpoint)
+    except Exception as e:
+        logger.error(f"查询API用量失败: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "group_by": dimensions,
+        "total": {
+            "calls": sum(g["calls"] for g in groups),
+            "errors": sum(g["errors"] for g in groups),
+            "tokens": sum(g["tokens"] for g in groups),
+            "cost_usd": round(sum(g["cost_usd"] for g in groups), 6)
+        },
+        "groups": groups,
+        "pending": api_usage.recorder.pending
+    }
+
+
+@router.get("/response-cache")
+async def get_response_cache_stats():
+    """响应缓存的命中/未命中/304次数、淘汰次数和当前占用"""
+    return response_cache.stats()
@@ -4,16 +4,24 @@
 功能: 提供情绪识别接口 - 支持文本和音频输入
 """
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Response
 from pydantic import BaseModel
 from typing import Optional, Dict, List
 import logging
 import io
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from app.models.emotion import Session as SessionModel, Memory, User, engine, SessionLocal
+from app.models.emotion import Memory, User, engine, SessionLocal
+from app.models.sharding import get_user_db, get_user_read_db
 from app.services.emotion_analyzer import EmotionAnalyzer
+from app.services.write_behind import get_write_behind_writer
+from app.services.emotion_rollup import intensity_trend
+from app.services.emotion_events import daily_counts, history_page
+from app.services.pagination import InvalidCursorError
+from app.services.response_cache import response_cache
+from app.services import sketches
+from app.services import memory_archive
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/v1/emotion", tags=["emotion"])
@@ -52,6 +60,8 @@ class EmotionHistoryResponse(BaseModel):
     intensity: float
     created_at: str
     content_summary: str
+    # memory: 记忆（emotion_id 为记忆ID）；text / audio: 识别读数（emotion_id 为读数ID）
+    source: str = "memory"
 
 
 class EmotionStatisticsResponse(BaseModel):
@@ -61,6 +71,8 @@ class EmotionStatisticsResponse(BaseModel):
     emotion_distribution: Dict[str, int]
     average_intensity: float
     trend: str  # "improving", "declining", "stable"
+    # 全部历史的强度分位数（t-digest 近似）: {情绪或"all": {"p50": ..., "p90": ..., "p99": ..., "count": ...}}
+    intensity_percentiles: Dict[str, Dict[str, float]] = {}
 
 
 # ==================== 初始化 ====================
@@ -80,10 +92,7 @@ def get_db():
 # ==================== API端点 ====================
 
 @router.post("/analyze", response_model=EmotionResponse)
-async def analyze_emotion(
-    request: EmotionAnalyzeRequest,
-    db: SessionLocal = Depends(get_db)
-):
+async def analyze_emotion(request: EmotionAnalyzeRequest):
     """
     分析情绪 - 支持文本和音频输入
     
@@ -115,47 +124,20 @@ async def analyze_emotion(
         )
         
         # 保存到数据库（如果提供了user_id）
+        # 只记录一条情绪读数事件（不创建记忆），会话更新和事件写入交给写后队列批量提交
         if request.user_id:
             try:
-                # 创建或更新会话
-                if not request.session_id:
-                    session_record = SessionModel(
-                        user_id=request.user_id,
-                        current_emotion=analysis_result["emotion"],
-                        emotion_intensity=analysis_result["intensity"],
-                        current_dapp=None,
-                        started_at=datetime.utcnow()
-                    )
-                    db.add(session_record)
-                    db.commit()
-                    db.refresh(session_record)
-                    session_id = session_record.id
-                else:
-                    session_id = request.session_id
-                    session_record = db.query(SessionModel).filter(
-                        SessionModel.id == session_id
-                    ).first()
-                    if session_record:
-                        session_record.current_emotion = analysis_result["emotion"]
-                        session_record.emotion_intensity = analysis_result["intensity"]
-                        db.commit()
-                
-                # 创建记忆记录
-                if session_id:
-                    memory = Memory(
-                        user_id=request.user_id,
-                        session_id=session_id,
-                        memory_type="text" if request.text else "audio",
-                        emotion_type=analysis_result["emotion"],
-                        emotion_intensity=analysis_result["intensity"],
-                        content=request.text or "Audio message",
-                        summary=analysis_result["reasoning"][:200],
-                        tags=[request.scene, analysis_result["emotion"]],
-                        created_at=datetime.utcnow()
-                    )
-                    db.add(memory)
-                    db.commit()
-                
+                await get_write_behind_writer().submit_async({
+                    "user_id": request.user_id,
+                    "session_id": request.session_id,
+                    "emotion": analysis_result["emotion"],
+                    "intensity": analysis_result["intensity"],
+                    "valence": analysis_result.get("valence"),
+                    "arousal": analysis_result.get("arousal"),
+                    "confidence": analysis_result.get("confidence"),
+                    "source": "text" if request.text else "audio",
+                    "created_at": datetime.utcnow()
+                })
             except Exception as e:
                 logger.warning(f"数据库保存失败: {e}")
                 # 继续返回分析结果，不影响主要功能
@@ -187,8 +169,10 @@ async def analyze_emotion(
 @router.get("/history/{user_id}", response_model=List[EmotionHistoryResponse])
 async def get_emotion_history(
     user_id: int,
+    response: Response,
     limit: int = 50,
-    db: SessionLocal = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     获取用户情绪历史
@@ -196,35 +180,90 @@ async def get_emotion_history(
     参数:
     - user_id: 用户ID
     - limit: 返回记录数（最多50条）
+    - cursor: 上一页响应头 X-Next-Cursor 的值（可选）
     
     返回:
-    - 情绪历史列表（按时间倒序）
+    - 情绪历史列表（识别读数和记忆按时间倒序合并），还有更多时在 X-Next-Cursor 响应头返回下一页游标
     """
     try:
-        memories = db.query(Memory).filter(
-            Memory.user_id == user_id
-        ).order_by(Memory.created_at.desc()).limit(limit).all()
+        limit = max(1, min(limit, 50))
+        # /analyze 只写读数事件，历史需要合并读数和记忆（含归档）
+        rows, next_cursor = history_page(db, user_id, limit, cursor)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         
         return [
             EmotionHistoryResponse(
-                emotion_id=m.id,
-                emotion=m.emotion_type,
-                intensity=m.emotion_intensity,
-                created_at=m.created_at.isoformat(),
-                content_summary=m.summary or m.content[:100]
+                emotion_id=row.id,
+                emotion=row.emotion_type,
+                intensity=row.emotion_intensity,
+                created_at=row.created_at.isoformat(),
+                content_summary=row.content_summary or "",
+                source=row.source
             )
-            for m in memories
+            for row in rows
         ]
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取历史失败: {e}")
         raise HTTPException(status_code=500, detail="获取历史失败")
 
 
+@router.get("/statistics/global/tags")
+async def get_global_top_tags(limit: int = 20):
+    """
+    全站出现最多的标签（count-min + top-k 摘要，各分片合并）
+
+    返回:
+    - total: 标签总次数；max_error: 单个计数的误差上界（只会高估）
+    """
+    if not 1 <= limit <= sketches.SKETCH_TOP_K:
+        raise HTTPException(status_code=400, detail=f"limit 取值范围 1-{sketches.SKETCH_TOP_K}")
+    return sketches.global_top_tags(limit)
+
+
+@router.get("/statistics/global/active-users")
+async def get_global_active_users(days: int = 7):
+    """
+    最近 days 天每天的活跃用户数和整个区间的去重用户数（HyperLogLog 摘要，误差约 1.6%）
+    """
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days 取值范围 1-366")
+    end_day = datetime.utcnow().date()
+    return sketches.global_active_users(end_day - timedelta(days=days - 1), end_day)
+
+
+@router.get("/statistics/global/percentiles")
+async def get_global_percentiles():
+    """全站各情绪的强度分位数（t-digest 摘要，各分片合并）"""
+    return sketches.global_percentiles()
+
+
+@router.get("/statistics/{user_id}/percentiles")
+async def get_intensity_percentiles(
+    user_id: int,
+    emotion: Optional[str] = None,
+    db: SessionLocal = Depends(get_user_read_db)
+):
+    """
+    用户全部历史的情绪强度分位数（p50/p90/p99，t-digest 近似）
+
+    参数:
+    - emotion: 只返回该情绪；不传时返回每种情绪和合并后的 "all"
+    """
+    percentiles = sketches.user_percentiles(db, user_id, emotion=emotion)
+    if not percentiles:
+        raise HTTPException(status_code=404, detail="没有数据记录")
+    return {"user_id": user_id, "percentiles": percentiles}
+
+
 @router.get("/statistics/{user_id}", response_model=EmotionStatisticsResponse)
 async def get_emotion_statistics(
+    request: Request,
     user_id: int,
     days: int = 7,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     获取用户情绪统计
@@ -234,51 +273,51 @@ async def get_emotion_statistics(
     - days: 统计天数（默认7天）
     
     返回:
-    - 情绪分布、趋势等统计数据
+    - 情绪分布、趋势、强度分位数等统计数据（按用户版本号缓存，带 ETag）
     """
+    start_day = (datetime.utcnow() - timedelta(days=days)).date()
+    cache_key = response_cache.key("statistics", user_id, start_day=start_day, days=days)
+    cached = response_cache.lookup(request, cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        from datetime import timedelta
-        
-        start_date = datetime.utcnow() - timedelta(days=days)
-        memories = db.query(Memory).filter(
-            Memory.user_id == user_id,
-            Memory.created_at >= start_date
-        ).all()
+        # 从情绪读数事件按天聚合（覆盖索引，不回表）
+        rows = daily_counts(db, user_id, start_day)
         
-        if not memories:
+        if not rows:
             raise HTTPException(status_code=404, detail="没有数据记录")
         
         # 计算情绪分布
         emotion_counts = {}
+        daily = {}
+        total_records = 0
         total_intensity = 0
         
-        for m in memories:
-            emotion = m.emotion_type
-            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + 1
-            total_intensity += m.emotion_intensity
+        for day, emotion, count, sum_intensity in rows:
+            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + count
+            day_count, day_sum = daily.get(day, (0, 0.0))
+            daily[day] = (day_count + count, day_sum + sum_intensity)
+            total_records += count
+            total_intensity += sum_intensity
         
         # 确定主要情绪
         primary_emotion = max(emotion_counts, key=emotion_counts.get)
         
         # 简单趋势分析（前半段 vs 后半段）
-        mid_point = len(memories) // 2
-        first_half_intensity = sum(m.emotion_intensity for m in memories[:mid_point]) / len(memories[:mid_point])
-        second_half_intensity = sum(m.emotion_intensity for m in memories[mid_point:]) / len(memories[mid_point:])
+        trend = intensity_trend([
+            (day, count, sum_intensity)
+            for day, (count, sum_intensity) in sorted(daily.items())
+        ])
         
-        if second_half_intensity > first_half_intensity:
-            trend = "improving"
-        elif second_half_intensity < first_half_intensity:
-            trend = "declining"
-        else:
-            trend = "stable"
-        
-        return EmotionStatisticsResponse(
-            total_records=len(memories),
+        return response_cache.respond(request, cache_key, EmotionStatisticsResponse(
+            total_records=total_records,
             primary_emotion=primary_emotion,
             emotion_distribution=emotion_counts,
-            average_intensity=total_intensity / len(memories),
-            trend=trend
-        )
+            average_intensity=total_intensity / total_records,
+            trend=trend,
+            intensity_percentiles=sketches.user_percentiles(db, user_id)
+        ))
     
     except HTTPException:
         raise
@@ -332,16 +371,19 @@ async def batch_analyze_emotions(
 async def delete_memory(
     memory_id: int,
     user_id: int,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_user_db)
 ):
     """
     删除特定的记忆记录（用户本人确认）
     """
     try:
-        memory = db.query(Memory).filter(
+        query = db.query(Memory).filter(
             Memory.id == memory_id,
             Memory.user_id == user_id
-        ).first()
+        )
+        memory = query.first()
+        if not memory and memory_archive.restore(db, user_id, memory_id):
+            memory = query.first()
         
         if not memory:
             raise HTTPException(status_code=404, detail="记录不存在")
@@ -4,15 +4,30 @@
 功能: 提供记忆CRUD操作和情绪时间线可视化
 """
 
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import logging
-from datetime import datetime, timedelta
-from sqlalchemy import func, desc
+from datetime import datetime, date, timedelta
+from sqlalchemy.orm import defer
 
-from app.models.emotion import Memory, Session as SessionModel, User, SessionLocal
+from app.models.emotion import Memory, User, SessionLocal, EMOTION_VALENCE, ROLLUP_LEVELS
+# 主库只读会话（校验用户）；记忆相关查询使用 get_user_db / get_user_read_db，按 user_id 路由到分片
+from app.models.emotion import get_read_db
+from app.models.sharding import shard_router, get_user_db, get_user_read_db
 from app.services.emotion_analyzer import EmotionAnalyzer
+from app.services.emotion_rollup import query_daily, query_rollup, first_day
+from app.services.downsample import lttb_indices
+from app.services import memory_search, memory_archive, memory_transfer, memory_dedup, memory_vectors
+from app.services.memory_tags import tag_emotion_counts, filter_by_tag
+from app.services.pagination import paginate, count_cache, InvalidCursorError
+from app.services.response_cache import response_cache
+from app.services.memory_fields import (
+    parse_fields, list_columns, serialize_row, InvalidFieldsError,
+    SEARCH_FIELDS, DEFAULT_SEARCH_FIELDS
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/v1/memory", tags=["memory"])
@@ -55,6 +70,7 @@ class MemoryResponse(BaseModel):
     image_path: Optional[str]
     created_at: str
     updated_at: Optional[str]
+    duplicate_of: Optional[int] = None  # 与已有记忆近似重复时为该记忆ID
 
 
 class MemoryTimelineResponse(BaseModel):
@@ -79,23 +95,12 @@ class MemoryTagResponse(BaseModel):
     emotions: Dict[str, int]
 
 
-# ==================== 初始化 ====================
-
-def get_db():
-    """获取数据库会话"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 # ==================== API端点 ====================
 
 @router.post("/create", response_model=MemoryResponse)
 async def create_memory(
     request: MemoryCreateRequest,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_read_db)
 ):
     """
     创建新的记忆记录
@@ -113,14 +118,45 @@ async def create_memory(
     - image_path: 图像文件路径（可选）
     
     返回:
-    - 创建的记忆记录
+    - 创建的记忆记录；与已有记忆近似重复时带 duplicate_of，
+      合并模式（MEMORY_DEDUP_MODE=merge）下不新建记录，标签并入已有记忆后返回该记忆
     """
+    # 用户在主库，记忆写入用户所在分片
+    shard_db = shard_router.session(request.user_id)
     try:
         # 验证用户存在
         user = db.query(User).filter(User.id == request.user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         
+        duplicate = memory_dedup.find_duplicate(shard_db.connection(), request.user_id, request.content)
+        memory = None
+        if duplicate and memory_dedup.MEMORY_DEDUP_MODE == "merge":
+            memory = shard_db.get(Memory, duplicate[0])
+            if memory is None:
+                # 签名命中的记忆刚被并发删除或归档，按新记忆写入
+                duplicate = None
+        if memory is not None:
+            new_tags = [tag for tag in (request.tags or []) if tag not in (memory.tags or [])]
+            if new_tags:
+                memory.tags = (memory.tags or []) + new_tags
+                shard_db.commit()
+            logger.info(f"用户{request.user_id}的新记忆与记忆 {memory.id} 近似重复（{duplicate[1]:.2f}），已合并")
+            return MemoryResponse(
+                id=memory.id,
+                memory_type=memory.memory_type,
+                emotion_type=memory.emotion_type,
+                emotion_intensity=memory.emotion_intensity,
+                content=memory.content,
+                summary=memory.summary,
+                tags=memory.tags or [],
+                audio_path=memory.audio_path,
+                image_path=memory.image_path,
+                created_at=memory.created_at.isoformat(),
+                updated_at=memory.updated_at.isoformat() if memory.updated_at else None,
+                duplicate_of=memory.id
+            )
+        
         # 创建记忆记录
         memory = Memory(
             user_id=request.user_id,
@@ -136,9 +172,9 @@ async def create_memory(
             created_at=datetime.utcnow()
         )
         
-        db.add(memory)
-        db.commit()
-        db.refresh(memory)
+        shard_db.add(memory)
+        shard_db.commit()
+        shard_db.refresh(memory)
         
         logger.info(f"用户{request.user_id}创建了记忆 {memory.id}")
         
@@ -153,22 +189,25 @@ async def create_memory(
             audio_path=memory.audio_path,
             image_path=memory.image_path,
             created_at=memory.created_at.isoformat(),
-            updated_at=None
+            updated_at=None,
+            duplicate_of=duplicate[0] if duplicate else None
         )
     
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"创建记忆失败: {e}")
-        db.rollback()
+        shard_db.rollback()
         raise HTTPException(status_code=500, detail="创建记忆失败")
+    finally:
+        shard_db.close()
 
 
 @router.get("/{memory_id}", response_model=MemoryResponse)
 async def get_memory(
     memory_id: int,
     user_id: int,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     获取单个记忆记录（仅允许查看自己的记忆）
@@ -179,6 +218,9 @@ async def get_memory(
             Memory.user_id == user_id
         ).first()
         
+        if not memory:
+            # 热表没有时查归档
+            memory = memory_archive.get_archived(db, user_id, memory_id)
         if not memory:
             raise HTTPException(status_code=404, detail="记忆不存在")
         
@@ -209,7 +251,11 @@ async def list_user_memories(
     limit: int = 50,
     offset: int = 0,
     emotion_filter: Optional[str] = None,
-    db: SessionLocal = Depends(get_db)
+    tag: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    fields: Optional[str] = None,
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     列出用户的所有记忆（分页）
@@ -217,44 +263,58 @@ async def list_user_memories(
     参数:
     - user_id: 用户ID
     - limit: 返回数量（最多50）
-    - offset: 偏移量
+    - offset: 偏移量（兼容旧客户端，传入cursor时忽略）
     - emotion_filter: 情绪过滤（可选）
+    - tag: 标签过滤（可选）
+    - cursor: 上一页返回的 next_cursor（可选）
+    - include_total: 是否返回总数（读汇总表并短时缓存）
+    - fields: 逗号分隔的返回字段（可选），如 "id,emotion_type,created_at"
     
     返回:
-    - 记忆列表和总数
+    - 记忆列表、总数和下一页游标
     """
     try:
-        query = db.query(Memory).filter(Memory.user_id == user_id)
+        limit = max(1, min(limit, 50))
+        selected = parse_fields(fields)
+        
+        # 只查询需要的列，正文预览在SQL中截断
+        query = db.query(*list_columns(selected)).filter(Memory.user_id == user_id)
         
         # 应用情绪过滤
         if emotion_filter:
             query = query.filter(Memory.emotion_type == emotion_filter)
         
-        # 获取总数
-        total = query.count()
+        # 应用标签过滤
+        if tag:
+            query = filter_by_tag(query, user_id, tag)
+        
+        # 键集分页：按 (created_at, id) 倒序从游标处继续，热数据翻完后继续读归档
+        after = memory_archive.parse_cold_cursor(cursor)
+        if after is None:
+            memories, next_cursor = paginate(query, cursor, limit, offset)
+        else:
+            memories, next_cursor = [], None
+        memories, next_cursor = memory_archive.fall_through(
+            db, user_id, memories, next_cursor, limit, after,
+            emotion_type=emotion_filter,
+            predicate=memory_archive.matcher(tag=tag),
+            offset=0 if cursor else offset,
+            hot_count=query.count
+        )
         
-        # 分页查询
-        memories = query.order_by(desc(Memory.created_at)).limit(limit).offset(offset).all()
+        # 获取总数
+        total = count_cache.get_or_count(db, user_id, emotion_filter, tag) if include_total else None
         
         return {
             "total": total,
             "limit": limit,
             "offset": offset,
-            "memories": [
-                {
-                    "id": m.id,
-                    "memory_type": m.memory_type,
-                    "emotion_type": m.emotion_type,
-                    "emotion_intensity": m.emotion_intensity,
-                    "content": m.content[:100] + ("..." if len(m.content) > 100 else ""),
-                    "summary": m.summary,
-                    "tags": m.tags or [],
-                    "created_at": m.created_at.isoformat()
-                }
-                for m in memories
-            ]
+            "next_cursor": next_cursor,
+            "memories": [serialize_row(m, selected) for m in memories]
         }
     
+    except (InvalidCursorError, InvalidFieldsError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"列出记忆失败: {e}")
         raise HTTPException(status_code=500, detail="列出记忆失败")
@@ -265,16 +325,20 @@ async def update_memory(
     memory_id: int,
     user_id: int,
     request: MemoryUpdateRequest,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_user_db)
 ):
     """
     更新记忆记录
     """
     try:
-        memory = db.query(Memory).filter(
+        query = db.query(Memory).filter(
             Memory.id == memory_id,
             Memory.user_id == user_id
-        ).first()
+        )
+        memory = query.first()
+        if not memory and memory_archive.restore(db, user_id, memory_id):
+            # 归档的记忆先恢复到热表再更新
+            memory = query.first()
         
         if not memory:
             raise HTTPException(status_code=404, detail="记忆不存在")
@@ -312,16 +376,21 @@ async def update_memory(
 async def delete_memory(
     memory_id: int,
     user_id: int,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_user_db)
 ):
     """
     删除记忆记录
     """
     try:
-        memory = db.query(Memory).filter(
+        # 删除不需要正文，延迟加载 content 列
+        query = db.query(Memory).options(defer(Memory.content)).filter(
             Memory.id == memory_id,
             Memory.user_id == user_id
-        ).first()
+        )
+        memory = query.first()
+        if not memory and memory_archive.restore(db, user_id, memory_id):
+            # 归档的记忆先恢复到热表，删除时由ORM钩子同步汇总、标签和索引
+            memory = query.first()
         
         if not memory:
             raise HTTPException(status_code=404, detail="记忆不存在")
@@ -346,27 +415,28 @@ async def delete_memory(
 
 @router.get("/user/{user_id}/timeline")
 async def get_memory_timeline(
+    request: Request,
     user_id: int,
     days: int = 30,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     获取用户的记忆时间线
     
-    返回按日期聚合的情绪数据
+    返回按日期聚合的情绪数据（读取每日汇总表）；
+    结果按用户版本号缓存，带 ETag，If-None-Match 匹配时返回 304
     """
+    start_day = (datetime.utcnow() - timedelta(days=days)).date()
+    cache_key = response_cache.key("timeline", user_id, start_day=start_day, days=days)
+    cached = response_cache.lookup(request, cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        start_date = datetime.utcnow() - timedelta(days=days)
-        
-        memories = db.query(Memory).filter(
-            Memory.user_id == user_id,
-            Memory.created_at >= start_date
-        ).all()
-        
         # 按日期聚合
         timeline = {}
-        for memory in memories:
-            date_key = memory.created_at.date().isoformat()
+        for day, emotion, count, _ in query_daily(db, user_id, start_day):
+            date_key = day.isoformat()
             if date_key not in timeline:
                 timeline[date_key] = {
                     "emotions": {},
@@ -374,88 +444,147 @@ async def get_memory_timeline(
                     "primary_emotion": None
                 }
             
-            emotion = memory.emotion_type
-            timeline[date_key]["emotions"][emotion] = timeline[date_key]["emotions"].get(emotion, 0) + 1
-            timeline[date_key]["memory_count"] += 1
+            timeline[date_key]["emotions"][emotion] = count
+            timeline[date_key]["memory_count"] += count
         
         # 确定每天的主要情绪
         for date_key in timeline:
             emotions = timeline[date_key]["emotions"]
             timeline[date_key]["primary_emotion"] = max(emotions, key=emotions.get) if emotions else None
         
-        return {
+        return response_cache.respond(request, cache_key, {
             "user_id": user_id,
             "period_days": days,
             "timeline": timeline
-        }
+        })
     
     except Exception as e:
         logger.error(f"获取时间线失败: {e}")
         raise HTTPException(status_code=500, detail="获取时间线失败")
 
 
+# 趋势各层级每个点覆盖的天数（自动选择层级时用）
+_LEVEL_DAYS = {"day": 1, "week": 7, "month": 30}
+# resolution=auto 且未指定 max_points 时的点数上限
+TREND_AUTO_MAX_POINTS = 366
+
+
+def _pick_level(start_day: Optional[date], end_day: date, max_points: int) -> str:
+    """选点数不超过 max_points 的最细层级，都超过时用月（之后再降采样）"""
+    if start_day is None:
+        return "month"
+    span = (end_day - start_day).days + 1
+    for level, days in _LEVEL_DAYS.items():
+        if span / days <= max_points:
+            return level
+    return "month"
+
+
 @router.get("/user/{user_id}/emotions/trend")
 async def get_emotion_trend(
+    request: Request,
     user_id: int,
     period: str = "week",  # week, month, all
-    db: SessionLocal = Depends(get_db)
+    start: Optional[date] = Query(None, description="起始日期（含），传入时忽略 period"),
+    end: Optional[date] = Query(None, description="结束日期（含），默认今天"),
+    resolution: str = Query("day", description="day / week / month / auto（按 max_points 选层级）"),
+    max_points: Optional[int] = Query(None, ge=3, le=5000, description="最多返回的点数，超出时按LTTB降采样"),
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     获取情绪趋势分析
     
-    返回一段时间内的情绪变化趋势
+    返回一段时间内的情绪变化趋势（强度和效价），读取预先汇总的日/周/月金字塔；
+    点数超过 max_points 时用LTTB保留形状，返回的点数和耗时与历史长度无关。
+    结果按用户版本号缓存
     """
+    levels = ("day",) + ROLLUP_LEVELS
+    if resolution not in levels + ("auto",):
+        raise HTTPException(status_code=400, detail=f"resolution 可选 {', '.join(levels)}, auto")
+    
+    # 确定时间范围
+    end_day = end or datetime.utcnow().date()
+    if start:
+        start_day = start
+    elif period == "week":
+        start_day = (datetime.utcnow() - timedelta(days=7)).date()
+    elif period == "month":
+        start_day = (datetime.utcnow() - timedelta(days=30)).date()
+    else:
+        start_day = None
+    if start_day and start_day > end_day:
+        raise HTTPException(status_code=400, detail="start 不能晚于 end")
+    
+    cache_key = response_cache.key(
+        "trend", user_id, start_day=start_day, end_day=end_day, period=period,
+        resolution=resolution, max_points=max_points
+    )
+    cached = response_cache.lookup(request, cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        # 确定时间范围
-        if period == "week":
-            start_date = datetime.utcnow() - timedelta(days=7)
-        elif period == "month":
-            start_date = datetime.utcnow() - timedelta(days=30)
-        else:
-            start_date = None
-        
-        # 查询数据
-        query = db.query(Memory).filter(Memory.user_id == user_id)
-        if start_date:
-            query = query.filter(Memory.created_at >= start_date)
+        level = resolution
+        if level == "auto":
+            max_points = max_points or TREND_AUTO_MAX_POINTS
+            level = _pick_level(start_day or first_day(db, user_id), end_day, max_points)
         
-        memories = query.order_by(Memory.created_at).all()
+        rows = query_rollup(db, user_id, level, start_day, end_day)
         
-        if not memories:
+        if not rows:
             raise HTTPException(status_code=404, detail="没有数据")
         
         # 按日期和情绪聚合
         trend_data = {}
-        for memory in memories:
-            date_key = memory.created_at.date().isoformat()
+        for day, emotion, count, sum_intensity in rows:
+            date_key = day.isoformat()
             if date_key not in trend_data:
                 trend_data[date_key] = {
                     "emotions": {},
                     "avg_intensity": 0,
+                    "avg_valence": 0,
                     "count": 0
                 }
             
-            emotion = memory.emotion_type
-            trend_data[date_key]["emotions"][emotion] = trend_data[date_key]["emotions"].get(emotion, 0) + 1
-            trend_data[date_key]["avg_intensity"] += memory.emotion_intensity
-            trend_data[date_key]["count"] += 1
+            trend_data[date_key]["emotions"][emotion] = count
+            trend_data[date_key]["avg_intensity"] += sum_intensity
+            trend_data[date_key]["avg_valence"] += count * EMOTION_VALENCE.get(emotion, 0.5)
+            trend_data[date_key]["count"] += count
         
-        # 计算平均强度
+        # 计算平均强度和效价
         for date_key in trend_data:
             if trend_data[date_key]["count"] > 0:
                 trend_data[date_key]["avg_intensity"] /= trend_data[date_key]["count"]
+                trend_data[date_key]["avg_valence"] /= trend_data[date_key]["count"]
+        
+        dates = sorted(trend_data.keys())
+        total_points = len(dates)
+        if max_points and total_points > max_points:
+            # 按强度和效价两条曲线的形状选代表点
+            keep = lttb_indices(
+                [date.fromisoformat(d).toordinal() for d in dates],
+                [
+                    [trend_data[d]["avg_intensity"] for d in dates],
+                    [trend_data[d]["avg_valence"] for d in dates]
+                ],
+                max_points
+            )
+            dates = [dates[i] for i in keep]
         
-        return {
+        return response_cache.respond(request, cache_key, {
             "user_id": user_id,
             "period": period,
+            "resolution": level,
+            "total_points": total_points,
+            "downsampled": len(dates) < total_points,
             "data": [
                 {
-                    "date": date,
-                    **trend_data[date]
+                    "date": date_key,
+                    **trend_data[date_key]
                 }
-                for date in sorted(trend_data.keys())
+                for date_key in dates
             ]
-        }
+        })
     
     except HTTPException:
         raise
@@ -466,30 +595,33 @@ async def get_emotion_trend(
 
 @router.get("/user/{user_id}/tags")
 async def get_memory_tags(
+    request: Request,
     user_id: int,
-    db: SessionLocal = Depends(get_db)
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     获取用户的所有标签及其关联的情绪数据
+    
+    标签计数直接读取 memory_tags 索引表，不加载记忆正文；结果按用户版本号缓存
     """
+    cache_key = response_cache.key("tags", user_id)
+    cached = response_cache.lookup(request, cache_key)
+    if cached is not None:
+        return cached
+    
     try:
-        memories = db.query(Memory).filter(Memory.user_id == user_id).all()
-        
         # 统计标签
         tags_stats = {}
-        for memory in memories:
-            if memory.tags:
-                for tag in memory.tags:
-                    if tag not in tags_stats:
-                        tags_stats[tag] = {
-                            "count": 0,
-                            "emotions": {}
-                        }
-                    tags_stats[tag]["count"] += 1
-                    emotion = memory.emotion_type
-                    tags_stats[tag]["emotions"][emotion] = tags_stats[tag]["emotions"].get(emotion, 0) + 1
+        for tag_value, emotion, count in tag_emotion_counts(db, user_id):
+            if tag_value not in tags_stats:
+                tags_stats[tag_value] = {
+                    "count": 0,
+                    "emotions": {}
+                }
+            tags_stats[tag_value]["count"] += count
+            tags_stats[tag_value]["emotions"][emotion] = count
         
-        return {
+        return response_cache.respond(request, cache_key, {
             "user_id": user_id,
             "tags": [
                 {
@@ -499,7 +631,7 @@ async def get_memory_tags(
                 }
                 for tag, stats in sorted(tags_stats.items(), key=lambda x: x[1]["count"], reverse=True)
             ]
-        }
+        })
     
     except Exception as e:
         logger.error(f"获取标签失败: {e}")
@@ -511,50 +643,192 @@ async def search_memories(
     user_id: int,
     query: str,
     emotion_type: Optional[str] = None,
-    db: SessionLocal = Depends(get_db)
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: SessionLocal = Depends(get_user_read_db)
 ):
     """
     搜索用户的记忆
     
-    支持全文搜索和情绪过滤
+    支持全文搜索和情绪过滤；全文检索走FTS5索引（jieba分词），
+    结果按相关度排序并带高亮片段，之后是按时间倒序的归档记忆（无高亮）。
+    传入上一页的 next_cursor 继续翻页，fields 可指定返回字段
     """
     try:
-        # 构建查询
-        search_query = db.query(Memory).filter(Memory.user_id == user_id)
-        
-        # 全文搜索
-        if query:
-            search_query = search_query.filter(
-                (Memory.content.like(f"%{query}%")) |
-                (Memory.summary.like(f"%{query}%")) |
-                (Memory.tags.any(query))  # 标签中包含
-            )
-        
-        # 情绪过滤
-        if emotion_type:
-            search_query = search_query.filter(Memory.emotion_type == emotion_type)
+        limit = max(1, min(limit, 50))
+        selected = parse_fields(fields, DEFAULT_SEARCH_FIELDS, SEARCH_FIELDS)
+        after = memory_archive.parse_cold_cursor(cursor)
+        page = None if after else memory_search.search_page(db, user_id, query, emotion_type, limit, cursor)
+        
+        if after:
+            # 热数据已翻完，继续读归档
+            results, next_cursor = [], None
+        elif page is not None:
+            results, next_cursor = page
+        else:
+            # 没有可检索的词（或FTS不可用）时按时间倒序返回
+            search_query = db.query(*list_columns(selected, 150, "")).filter(Memory.user_id == user_id)
+            
+            if query:
+                # 正文可能压缩存储，只匹配明文前缀
+                search_query = search_query.filter(
+                    (Memory.content_head.like(f"%{query}%")) |
+                    (Memory.summary.like(f"%{query}%"))
+                )
+            
+            # 情绪过滤
+            if emotion_type:
+                search_query = search_query.filter(Memory.emotion_type == emotion_type)
+            
+            memories, next_cursor = paginate(search_query, cursor, limit)
+            results = [
+                {
+                    **m._asdict(),
+                    "highlight": None,
+                    "summary_highlight": None,
+                    "score": None
+                }
+                for m in memories
+            ]
         
-        results = search_query.order_by(desc(Memory.created_at)).limit(50).all()
+        # 归档的记忆不在全文索引中，解压后按关键词匹配，排在热数据之后
+        results, next_cursor = memory_archive.fall_through(
+            db, user_id, results, next_cursor, limit, after,
+            emotion_type=emotion_type,
+            predicate=memory_archive.matcher(query=query),
+            project=lambda memory: memory_archive.preview(
+                memory, 150, "", highlight=None, summary_highlight=None, score=None
+            )
+        )
         
         return {
             "query": query,
             "emotion_filter": emotion_type,
             "count": len(results),
+            "next_cursor": next_cursor,
+            "results": [serialize_row(r, selected) for r in results]
+        }
+    
+    except (InvalidCursorError, InvalidFieldsError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"搜索失败: {e}")
+        raise HTTPException(status_code=500, detail="搜索失败")
+
+
+@router.get("/user/{user_id}/related")
+async def related_memories(
+    user_id: int,
+    query: str,
+    emotion_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    tag: Optional[List[str]] = Query(None),
+    limit: int = 10,
+    db: SessionLocal = Depends(get_user_read_db)
+):
+    """
+    语义相关的记忆（向量余弦相似度，只含热数据）
+    
+    参数:
+    - query: 查询文本
+    - emotion_type / start / end / tag: 过滤条件，可组合；tag 可重复，含任一即可
+    - limit: 返回数量（最多50）
+    
+    新写入的记忆由后台线程计算向量，约 EMBEDDING_FLUSH_S 秒后可检索到
+    """
+    try:
+        limit = max(1, min(limit, 50))
+        vector = await memory_vectors.embed_query(query, user_id)
+        matches = memory_vectors.similar_memories(
+            db, user_id, vector, limit, emotion=emotion_type, start=start, end=end, tags=tag
+        )
+        return {
+            "query": query,
+            "count": len(matches),
             "results": [
                 {
-                    "id": m.id,
-                    "memory_type": m.memory_type,
-                    "emotion_type": m.emotion_type,
-                    "emotion_intensity": m.emotion_intensity,
-                    "content": m.content[:150],
-                    "summary": m.summary,
-                    "tags": m.tags or [],
-                    "created_at": m.created_at.isoformat()
+                    "id": memory.id,
+                    "memory_type": memory.memory_type,
+                    "emotion_type": memory.emotion_type,
+                    "emotion_intensity": memory.emotion_intensity,
+                    "content": (memory.content or "")[:150],
+                    "summary": memory.summary,
+                    "tags": memory.tags or [],
+                    "created_at": memory.created_at.isoformat(),
+                    "score": round(score, 4)
                 }
-                for m in results
+                for memory, score in matches
             ]
         }
     
     except Exception as e:
-        logger.error(f"搜索失败: {e}")
-        raise HTTPException(status_code=500, detail="搜索失败")
+        logger.error(f"相关记忆检索失败: {e}")
+        raise HTTPException(status_code=500, detail="相关记忆检索失败")
+
+
+@router.get("/user/{user_id}/export")
+async def export_memories(
+    user_id: int,
+    gzip: bool = False,
+    db: SessionLocal = Depends(get_read_db)
+):
+    """
+    导出用户的全部记忆（含归档），流式返回 NDJSON
+
+    参数:
+    - gzip: 是否以 gzip 压缩（文件名 .ndjson.gz）
+
+    返回:
+    - 每行一条记忆的JSON，按创建时间倒序；服务端游标逐块读取，内存占用与记忆数无关
+    """
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="用户不存在")
+
+    filename = f"memories-{user_id}.ndjson" + (".gz" if gzip else "")
+    chunks = memory_transfer.ndjson_chunks(memory_transfer.iter_export(user_id), compress=gzip)
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.post("/user/{user_id}/import")
+async def import_memories(
+    request: Request,
+    user_id: int,
+    db: SessionLocal = Depends(get_read_db)
+):
+    """
+    批量导入记忆（请求体为导出接口的 NDJSON，可 gzip 压缩）
+
+    边读请求体边解析，每 MEMORY_TRANSFER_CHUNK 条一个事务；记忆分配新ID，
+    格式错误的行跳过。中途出错时已提交的块保留，返回 imported 为已导入条数
+
+    返回:
+    - imported: 导入条数；skipped: 跳过的行数；duplicates: 合并去重模式下跳过的近似重复条数；
+      errors: 前若干个错误行号和原因
+    """
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="用户不存在")
+
+    importer = memory_transfer.MemoryImporter(user_id)
+    splitter = memory_transfer.LineSplitter()
+    try:
+        async for chunk in request.stream():
+            for line in splitter.feed(chunk):
+                if importer.add(line):
+                    await run_in_threadpool(importer.flush)
+        for line in splitter.close():
+            importer.add(line)
+        await run_in_threadpool(importer.flush)
+    except memory_transfer.InvalidImportError as e:
+        raise HTTPException(status_code=400, detail=f"{e}（已导入 {importer.imported} 条）")
+    except Exception as e:
+        logger.error(f"导入记忆失败: {e}")
+        raise HTTPException(status_code=500, detail=f"导入记忆失败（已导入 {importer.imported} 条）")
+
+    logger.info(f"用户{user_id}导入了 {importer.imported} 条记忆，跳过 {importer.skipped} 行")
+    return importer.result()
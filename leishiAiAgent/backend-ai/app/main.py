@@ -17,6 +17,15 @@ from app.services.emotion_analyzer import EmotionAnalyzer
 from app.services.story_generator import StoryGenerator
 from app.services.music_mixer import MusicMixer
 from app.services.voice_synthesizer import VoiceSynthesizer
+from app.services.write_behind import shutdown_write_behind_writer
+from app.services.memory_archive import start_memory_archiver, stop_memory_archiver
+from app.services.content_cache import start_content_cache_sweeper, stop_content_cache_sweeper
+from app.services.api_usage import start_api_usage_recorder, stop_api_usage_recorder
+from app.services.bulk_delete import stop_bulk_deleter
+from app.services.sketches import start_sketch_recorder, stop_sketch_recorder
+from app.services.memory_vectors import start_embedding_indexer, stop_embedding_indexer
+from app.models import compression
+from app.models.sharding import check_layout
 
 app = FastAPI(
     title="AI Emotion Companion API",
@@ -39,6 +48,32 @@ story_generator = StoryGenerator()
 music_mixer = MusicMixer()
 voice_synthesizer = VoiceSynthesizer()
 
+
+@app.on_event("startup")
+async def startup_event():
+    """启动后台记忆归档（首次归档延迟 MEMORY_ARCHIVE_START_DELAY_S 秒）、缓存维护、API计量、统计摘要和记忆向量线程"""
+    # 修改 MEMORY_SHARDS 后未重新分布的记忆对用户不可见，拒绝启动
+    check_layout()
+    # 预先读入压缩字典，写入路径不必再查询
+    compression.dictionaries.active()
+    start_memory_archiver()
+    start_content_cache_sweeper()
+    start_api_usage_recorder()
+    start_sketch_recorder()
+    start_embedding_indexer()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭服务前落盘写后队列、记忆向量、API计量和统计摘要缓冲区中的待写记录，停止归档、缓存维护和批量删除线程"""
+    shutdown_write_behind_writer()
+    stop_embedding_indexer()  # 计算向量会产生API计量记录，先于计量线程停止
+    stop_api_usage_recorder()
+    stop_sketch_recorder()
+    stop_memory_archiver()
+    stop_content_cache_sweeper()
+    stop_bulk_deleter()
+
 # WebSocket连接管理
 class ConnectionManager:
     def __init__(self):
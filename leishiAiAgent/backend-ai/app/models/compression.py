@@ -0,0 +1,371 @@
+"""
+记忆正文压缩存储
+文件: backend-ai/app/models/compression.py
+功能: CompressedText 列类型，SQLite上超过阈值的正文用zlib压缩为BLOB存储，
+      可使用由已有正文训练的预置字典（对短中文文本效果明显），读取时解压；
+      未压缩的旧数据和短文本仍是TEXT，读写透明
+
+      压缩值格式: 魔数(3字节) + 字典ID(2字节) + 原始字节数(4字节) + zlib数据
+      字典保存在同一数据库的 content_dictionaries 表中（分片时每个分片一份），
+      随数据库一起备份和恢复；字典ID为0表示不使用字典
+
+用法:
+    python -m app.models.compression --report        # 压缩率
+    python -m app.models.compression --train         # 用已有正文训练新字典
+    python -m app.models.compression --recompress    # 用当前字典重写所有正文
+"""
+
+import os
+import zlib
+import struct
+import logging
+import argparse
+import threading
+from collections import Counter
+from typing import Optional, Dict, Iterable, Callable, List
+
+from sqlalchemy import Text, text, inspect, select, insert, func
+from sqlalchemy.types import TypeDecorator
+
+logger = logging.getLogger(__name__)
+
+# 超过该字节数的正文才压缩
+COMPRESS_MIN_BYTES = int(os.getenv("CONTENT_COMPRESS_MIN_BYTES", "256"))
+COMPRESS_LEVEL = int(os.getenv("CONTENT_COMPRESS_LEVEL", "9"))
+# 旧版本把字典存为 <ID>.zdict 文件的目录，只在迁移时导入数据库
+LEGACY_DICT_DIR = os.getenv("CONTENT_DICT_DIR", "./content_dicts")
+# zlib预置字典最多使用32KB
+DICT_MAX_BYTES = 32 * 1024
+
+MAGIC = b"\x1fZC"
+HEADER = struct.Struct(">3sHI")
+
+
+# ==================== 字典 ====================
+
+def _shard_engines() -> List:
+    from app.models.sharding import shard_router
+    return shard_router.engines()
+
+
+def _shard_read_engines() -> List:
+    from app.models.sharding import shard_router
+    return shard_router.read_engines()
+
+
+class DictionaryRegistry:
+    """
+    按ID加载预置字典（content_dictionaries 表），最新训练的字典用于压缩
+
+    字典很少（每个最多32KB），进程启动时（或首次使用时）读入全部，遇到未知ID再重新读取。
+    读取走只读引擎：压缩发生在写会话flush期间，SQLite写引擎只有一个连接且正被占用
+    """
+
+    def __init__(
+        self,
+        engines: Callable[[], List] = _shard_read_engines,
+        writers: Callable[[], List] = _shard_engines
+    ):
+        """
+        Args:
+            engines: 返回读取字典的各库引擎（默认为所有分片的只读引擎）
+            writers: 返回写入新字典的各库引擎（默认为所有分片的写引擎）
+        """
+        self._engines = engines
+        self._writers = writers
+        self._dicts: Dict[int, bytes] = {}
+        self._active: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        from app.models.emotion import ContentDictionary
+
+        table = ContentDictionary.__table__
+        for engine in self._engines():
+            # 迁移前的库还没有字典表
+            if not inspect(engine).has_table(table.name):
+                continue
+            with engine.connect() as connection:
+                for dict_id, data in connection.execute(select(table.c.id, table.c.data)):
+                    self._dicts.setdefault(dict_id, bytes(data))
+
+    def get(self, dict_id: int) -> bytes:
+        """读取字典，找不到时抛出 LookupError（数据无法解压）"""
+        with self._lock:
+            if dict_id not in self._dicts:
+                self._load()
+            data = self._dicts.get(dict_id)
+            if data is None:
+                raise LookupError(f"缺少压缩字典 {dict_id}（content_dictionaries 表）")
+            return data
+
+    def active(self) -> int:
+        """当前用于压缩的字典ID（0表示没有字典）"""
+        with self._lock:
+            if self._active is None:
+                try:
+                    self._load()
+                except Exception as e:
+                    # 本次不用字典压缩（字典ID 0 始终可解压），下次写入时重试
+                    logger.warning(f"读取压缩字典失败: {e}")
+                    return 0
+                self._active = max(self._dicts, default=0)
+            return self._active
+
+    def add(self, data: bytes) -> int:
+        """把新字典写入每个库并设为当前字典，返回其ID"""
+        from app.models.emotion import ContentDictionary
+
+        table = ContentDictionary.__table__
+        with self._lock:
+            engines = self._writers()
+            dict_id = 1
+            for engine in engines:
+                with engine.connect() as connection:
+                    latest = connection.execute(select(func.max(table.c.id))).scalar() or 0
+                dict_id = max(dict_id, latest + 1)
+            for engine in engines:
+                with engine.begin() as connection:
+                    connection.execute(insert(table).values(id=dict_id, data=data))
+            self._dicts[dict_id] = data
+            self._active = dict_id
+            return dict_id
+
+
+def import_legacy_dictionaries(connection, directory: Optional[str] = None) -> int:
+    """把旧版本保存在目录中的 <ID>.zdict 字典导入字典表（已存在的ID跳过）"""
+    from app.models.emotion import ContentDictionary
+
+    directory = directory or LEGACY_DICT_DIR
+    if not os.path.isdir(directory):
+        return 0
+    table = ContentDictionary.__table__
+    existing = set(connection.execute(select(table.c.id)).scalars())
+    imported = 0
+    for name in sorted(os.listdir(directory)):
+        stem = name[:-len(".zdict")]
+        if not name.endswith(".zdict") or not stem.isdigit() or int(stem) in existing:
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            connection.execute(insert(table).values(id=int(stem), data=f.read()))
+        imported += 1
+    return imported
+
+
+dictionaries = DictionaryRegistry()
+
+
+def train_dictionary(samples: Iterable[str], max_bytes: int = DICT_MAX_BYTES) -> bytes:
+    """
+    用样本正文训练zlib预置字典
+
+    按 (出现次数 × 字节数) 选出高频词，最常用的放在字典末尾
+    （zlib回溯距离越短编码越省）
+    """
+    import jieba
+
+    counter = Counter()
+    for sample in samples:
+        for token in jieba.cut(sample or ""):
+            if len(token.strip()) >= 2:
+                counter[token] += 1
+
+    ranked = sorted(counter.items(), key=lambda kv: kv[1] * len(kv[0].encode("utf-8")), reverse=True)
+    pieces, total = [], 0
+    for token, count in ranked:
+        if count < 2:
+            break
+        encoded = token.encode("utf-8")
+        if total + len(encoded) > max_bytes:
+            break
+        pieces.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(pieces))
+
+
+# ==================== 压缩/解压 ====================
+
+class CompressionStats:
+    """进程内压缩统计（写入方向）"""
+
+    def __init__(self):
+        self.values = 0
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, raw: int, stored: int, compressed: bool):
+        with self._lock:
+            self.values += 1
+            self.compressed += int(compressed)
+            self.raw_bytes += raw
+            self.stored_bytes += stored
+
+    @property
+    def ratio(self) -> float:
+        """原始字节数 / 存储字节数"""
+        return self.raw_bytes / self.stored_bytes if self.stored_bytes else 1.0
+
+
+stats = CompressionStats()
+
+
+def compress(value: str, dict_id: Optional[int] = None, min_bytes: int = COMPRESS_MIN_BYTES):
+    """
+    压缩正文；低于阈值或压缩后没有变小时原样返回字符串
+
+    Returns:
+        bytes（压缩值）或 str（原文）
+    """
+    raw = value.encode("utf-8")
+    if len(raw) < min_bytes:
+        stats.record(len(raw), len(raw), False)
+        return value
+
+    dict_id = dictionaries.active() if dict_id is None else dict_id
+    if dict_id:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zdict=dictionaries.get(dict_id))
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL)
+    packed = HEADER.pack(MAGIC, dict_id, len(raw)) + compressor.compress(raw) + compressor.flush()
+
+    if len(packed) >= len(raw):
+        stats.record(len(raw), len(raw), False)
+        return value
+    stats.record(len(raw), len(packed), True)
+    return packed
+
+
+def decompress(value):
+    """解压 compress() 的结果；字符串（未压缩）原样返回"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    magic, dict_id, _ = HEADER.unpack_from(value)
+    if magic != MAGIC:
+        raise ValueError("不是压缩的正文")
+    if dict_id:
+        decompressor = zlib.decompressobj(zdict=dictionaries.get(dict_id))
+    else:
+        decompressor = zlib.decompressobj()
+    data = decompressor.decompress(value[HEADER.size:]) + decompressor.flush()
+    return data.decode("utf-8")
+
+
+class CompressedText(TypeDecorator):
+    """
+    透明压缩的文本列
+
+    只在SQLite上压缩（PostgreSQL由TOAST负责）；SQL函数（substr/length/LIKE）
+    不能用于压缩值，需要预览时使用明文的前缀列
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        return compress(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress(value)
+
+
+# ==================== 报告与维护 ====================
+
+def report(connection, table: str = "memories", column: str = "content") -> Dict:
+    """
+    统计库中正文的压缩情况（只读取压缩值的头部）
+
+    Returns:
+        {rows, compressed, raw_bytes, stored_bytes, ratio}
+    """
+    rows, plain_bytes = connection.execute(text(
+        f"SELECT count(*), coalesce(sum(length(CAST({column} AS BLOB))), 0) FROM {table} "
+        f"WHERE typeof({column}) != 'blob'"
+    )).one()
+
+    compressed, raw_bytes, stored_bytes = 0, 0, 0
+    result = connection.execute(text(
+        f"SELECT substr({column}, 1, {HEADER.size}), length({column}) FROM {table} "
+        f"WHERE typeof({column}) = 'blob'"
+    ))
+    for header, stored in result:
+        _, _, original = HEADER.unpack(bytes(header))
+        compressed += 1
+        raw_bytes += original
+        stored_bytes += stored
+
+    raw_total = raw_bytes + plain_bytes
+    stored_total = stored_bytes + plain_bytes
+    return {
+        "rows": rows + compressed,
+        "compressed": compressed,
+        "raw_bytes": raw_total,
+        "stored_bytes": stored_total,
+        "ratio": raw_total / stored_total if stored_total else 1.0
+    }
+
+
+def recompress(db, chunk_size: int = 500) -> int:
+    """用当前字典和阈值重写所有正文，返回处理的行数"""
+    from sqlalchemy import select, update, bindparam
+    from app.models.emotion import Memory
+
+    table = Memory.__table__
+    total, last_id = 0, 0
+    while True:
+        rows = db.execute(
+            select(table.c.id, table.c.content)
+            .where(table.c.id > last_id, table.c.content.isnot(None))
+            .order_by(table.c.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        db.execute(
+            update(table).where(table.c.id == bindparam("row_id")).values(content=bindparam("new_content")),
+            [{"row_id": row.id, "new_content": row.content} for row in rows]
+        )
+        db.commit()
+        total += len(rows)
+        last_id = rows[-1].id
+    return total
+
+
+def _sample_contents(db, limit: int):
+    from sqlalchemy import select, func
+    from app.models.emotion import Memory
+
+    return db.execute(
+        select(Memory.content).where(Memory.content.isnot(None)).order_by(func.random()).limit(limit)
+    ).scalars().all()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="记忆正文压缩")
+    parser.add_argument("--report", action="store_true", help="显示各分片的压缩率")
+    parser.add_argument("--train", action="store_true", help="用已有正文训练新字典")
+    parser.add_argument("--samples", type=int, default=5000, help="训练时每个分片的样本数")
+    parser.add_argument("--recompress", action="store_true", help="用当前字典重写所有正文")
+    args = parser.parse_args()
+
+    from app.models.sharding import shard_router
+
+    if args.train:
+        samples = [s for batch in shard_router.fan_out(lambda db: _sample_contents(db, args.samples)) for s in batch]
+        data = train_dictionary(samples)
+        dict_id = dictionaries.add(data)
+        print(f"✓ 字典 {dict_id} 已保存（{len(data)} 字节，{len(samples)} 条样本）")
+    if args.recompress:
+        count = sum(shard_router.fan_out(recompress, readonly=False))
+        print(f"✓ 已重写 {count} 条正文")
+    if args.report or not (args.train or args.recompress):
+        for index, result in enumerate(shard_router.fan_out(lambda db: report(db.connection()))):
+            print(
+                f"分片 {index:02d}: {result['compressed']}/{result['rows']} 条压缩，"
+                f"{result['raw_bytes'] / 1024:.1f} KB -> {result['stored_bytes'] / 1024:.1f} KB，"
+                f"压缩比 {result['ratio']:.2f}"
+            )
@@ -1,24 +1,132 @@
 """
 数据库模型 - SQLAlchemy ORM
-优化为轻量级SQLite，1GB内存服务器
+优化为轻量级SQLite，1GB内存服务器；DATABASE_URL 指向PostgreSQL时切换为连接池部署
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey, JSON, create_engine
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, String, Float, REAL, Date, DateTime, Text, Boolean, LargeBinary, ForeignKey, JSON, Index, create_engine, event
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
 from datetime import datetime, timedelta
+from typing import Optional
 import os
 
+from app.models.compression import CompressedText
+
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./soundscape.db")
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
-    pool_pre_ping=True,
-    echo=False  # 关闭SQL日志以节省内存
-)
+
+# SQLite连接参数（1GB内存服务器的默认值，单位见变量名）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "8192"))  # 每个连接
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))  # 每个连接缓存的预编译语句数
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "4"))
+
+# PostgreSQL连接池参数（每个worker进程）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# JSON列在PostgreSQL上使用JSONB（可建GIN索引）
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
+
+def _is_sqlite_file(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+
+def create_sqlite_engine(url: str, readonly: bool = False, **kwargs):
+    """
+    创建调优过的SQLite引擎
+
+    - 写引擎: 单连接池，进程内写入排队，避免 SQLITE_BUSY
+    - 读引擎: 多连接池，query_only 防止误写；WAL下读不阻塞写
+    两者都设置 synchronous=NORMAL、mmap、页缓存、busy_timeout 和语句缓存。
+    WAL是数据库文件的持久属性，由迁移步骤开启，不在每次连接时设置
+    """
+    if readonly:
+        kwargs.setdefault("pool_size", SQLITE_READ_POOL_SIZE)
+        kwargs.setdefault("max_overflow", 0)
+    else:
+        kwargs.setdefault("pool_size", 1)
+        kwargs.setdefault("max_overflow", 0)
+
+    sqlite_engine = create_engine(
+        url,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+            "cached_statements": SQLITE_STATEMENT_CACHE
+        },
+        echo=False,  # 关闭SQL日志以节省内存
+        **kwargs
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    return sqlite_engine
+
+
+def _is_postgres(url: str) -> bool:
+    return make_url(url).get_backend_name() == "postgresql"
+
+
+def _pool_options() -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True
+    }
+
+
+def create_postgres_engine(url: str):
+    """
+    创建PostgreSQL引擎
+
+    所有ORM代码（接口内的同步会话、写后线程、回填任务）都是同步的，
+    因此只建一个psycopg同步连接池；异步接口通过线程池使用它
+    """
+    return create_engine(
+        make_url(url).set(drivername="postgresql+psycopg"),
+        echo=False,
+        **_pool_options()
+    )
+
+
+if _is_sqlite_file(DATABASE_URL):
+    engine = create_sqlite_engine(DATABASE_URL)
+    read_engine = create_sqlite_engine(DATABASE_URL, readonly=True)
+elif _is_postgres(DATABASE_URL):
+    engine = create_postgres_engine(DATABASE_URL)
+    read_engine = engine
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+        pool_pre_ping=True,
+        echo=False  # 关闭SQL日志以节省内存
+    )
+    read_engine = engine
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 只读查询使用的会话（读连接池）
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
 
@@ -39,9 +147,11 @@ class User(Base):
     language = Column(String(10), default="zh")  # 语言偏好
     
     # 关系
-    sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan")
-    memories = relationship("Memory", back_populates="user", cascade="all, delete-orphan")
-    dapp_history = relationship("DAppHistory", back_populates="user", cascade="all, delete-orphan")
+    # 子表由数据库 ON DELETE CASCADE 删除，ORM不再逐行加载；
+    # SQLite未开启外键约束且记忆可能在其他分片，删除账号走 app/services/bulk_delete.py
+    sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    memories = relationship("Memory", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    dapp_history = relationship("DAppHistory", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
     
     def __repr__(self):
         return f"<User(username={self.username})>"
@@ -52,7 +162,7 @@ class Session(Base):
     __tablename__ = "sessions"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
     session_token = Column(String(255), unique=True, index=True)
     
     # 会话信息
@@ -67,7 +177,7 @@ class Session(Base):
     
     # 关系
     user = relationship("User", back_populates="sessions")
-    memories = relationship("Memory", back_populates="session", cascade="all, delete-orphan")
+    memories = relationship("Memory", back_populates="session", cascade="all, delete-orphan", passive_deletes=True)
     
     def is_active(self):
         """检查会话是否仍活跃"""
@@ -81,20 +191,32 @@ class Session(Base):
 
 
 # ==================== 记忆模型 ====================
+
+# 预览最长200字符，多存一个字符用于判断是否需要省略号
+CONTENT_HEAD_LENGTH = 201
+
+
+def _content_head(content: Optional[str]) -> Optional[str]:
+    return content[:CONTENT_HEAD_LENGTH] if content is not None else None
+
+
 class Memory(Base):
     __tablename__ = "memories"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), index=True)
-    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))  # 由下方复合索引覆盖
+    session_id = Column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), nullable=True, index=True)
     
     # 记忆内容
     memory_type = Column(String(30), index=True)  # diary, conversation, music, story
     emotion_type = Column(String(20), index=True)  # happy, sad, calm, neutral
     emotion_intensity = Column(Float, default=0.5)
-    content = Column(Text)  # 主要内容
+    # 主要内容：超过阈值时压缩存储，延迟加载，访问时才读取并解压
+    content = deferred(Column(CompressedText))
+    # 正文前 CONTENT_HEAD_LENGTH 个字符的明文，列表预览和SQL截断只读这一列
+    content_head = Column(Text, default=lambda context: _content_head(context.get_current_parameters().get("content")))
     summary = Column(String(500), nullable=True)  # AI生成摘要
-    tags = Column(JSON, default=list)  # 标签列表，用于分类
+    tags = Column(JSONType, default=list)  # 标签列表，用于分类
     
     # 多媒体资源
     audio_path = Column(String(255), nullable=True)  # 音频文件路径
@@ -110,16 +232,208 @@ class Memory(Base):
     user = relationship("User", back_populates="memories")
     session = relationship("Session", back_populates="memories")
     
+    # 列表/历史按 (created_at, id) 倒序做键集分页；按情绪过滤时走第二个索引
+    __table_args__ = (
+        Index("ix_memories_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_memories_user_emotion_created", "user_id", "emotion_type", "created_at"),
+        Index("ix_memories_tags_gin", "tags", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+    
     def __repr__(self):
         return f"<Memory(type={self.memory_type}, emotion={self.emotion_type})>"
 
 
+@event.listens_for(Memory.content, "set")
+def _sync_content_head(target, value, oldvalue, initiator):
+    """ORM修改正文时同步明文前缀（Core插入由列默认值计算）"""
+    target.content_head = _content_head(value)
+
+
+# ==================== 记忆标签索引 ====================
+class MemoryTag(Base):
+    """
+    Memory.tags 的规范化副本，每个 (记忆, 标签) 一行
+    由 app/services/memory_tags.py 在记忆增删改时同步维护，
+    用于在SQL中完成标签计数和按标签过滤
+    """
+    __tablename__ = "memory_tags"
+    __table_args__ = (
+        Index("ix_memory_tags_user_tag", "user_id", "tag", "memory_id"),
+    )
+
+    memory_id = Column(Integer, ForeignKey("memories.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String(100), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    
+    def __repr__(self):
+        return f"<MemoryTag(memory_id={self.memory_id}, tag={self.tag})>"
+
+
+# ==================== 近似重复检测（MinHash / LSH） ====================
+class MemorySignature(Base):
+    """
+    记忆正文的 MinHash 签名（jieba 分词后的词二元组），由 app/services/memory_dedup.py 维护
+    只覆盖热表中的记忆；归档时随全文索引一起移除
+    """
+    __tablename__ = "memory_signatures"
+
+    memory_id = Column(Integer, ForeignKey("memories.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    signature = Column(LargeBinary, nullable=False)  # MINHASH_PERMUTATIONS 个 uint32
+
+    def __repr__(self):
+        return f"<MemorySignature(memory_id={self.memory_id})>"
+
+
+class MemoryLSHBand(Base):
+    """
+    签名分带后的桶，每条记忆每个带一行；同一用户任一带的桶相同即为候选近似重复
+    """
+    __tablename__ = "memory_lsh_bands"
+
+    # 主键 (user_id, bucket, ...) 即查找候选时使用的索引；桶是64位哈希，几乎不会跨带重复
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    band = Column(SmallInteger, primary_key=True)
+    memory_id = Column(Integer, ForeignKey("memories.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+    def __repr__(self):
+        return f"<MemoryLSHBand(memory_id={self.memory_id}, band={self.band})>"
+
+
+# ==================== 正文压缩字典 ====================
+class ContentDictionary(Base):
+    """
+    正文压缩使用的zlib预置字典（app/models/compression.py）
+    与压缩的正文存放在同一个库中，随数据库一起备份和恢复；分片时每个分片保存相同的一份
+    """
+    __tablename__ = "content_dictionaries"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # 压缩值头部记录的字典ID
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ContentDictionary(id={self.id}, bytes={len(self.data or b'')})>"
+
+
+# ==================== 每日情绪汇总（增量维护） ====================
+class EmotionDailyRollup(Base):
+    """
+    按 (用户, 日期, 情绪) 汇总的记忆计数和强度之和
+    由 app/services/emotion_rollup.py 在记忆增删改的同一事务中维护，
+    时间线/趋势/统计接口只需读取 O(天数) 行
+    """
+    __tablename__ = "emotion_daily_rollup"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    emotion_type = Column(String(20), primary_key=True)
+    
+    count = Column(Integer, default=0, nullable=False)
+    sum_intensity = Column(Float, default=0.0, nullable=False)
+    
+    def __repr__(self):
+        return f"<EmotionDailyRollup(user_id={self.user_id}, day={self.day}, emotion={self.emotion_type})>"
+
+
+# 汇总金字塔的粗粒度层级（日粒度即 emotion_daily_rollup）
+ROLLUP_LEVELS = ("week", "month")
+
+
+class EmotionPeriodRollup(Base):
+    """
+    按周/按月的汇总（汇总金字塔的上两层），与每日汇总在同一事务中维护；
+    period_start 为周一或月初。长时间范围的趋势直接读这里，行数与历史长度无关
+    """
+    __tablename__ = "emotion_period_rollup"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    level = Column(String(5), primary_key=True)  # week, month
+    period_start = Column(Date, primary_key=True)
+    emotion_type = Column(String(20), primary_key=True)
+    
+    count = Column(Integer, default=0, nullable=False)
+    sum_intensity = Column(Float, default=0.0, nullable=False)
+    
+    def __repr__(self):
+        return f"<EmotionPeriodRollup(user_id={self.user_id}, {self.level}={self.period_start}, emotion={self.emotion_type})>"
+
+
+# ==================== 情绪读数事件（窄表，只追加） ====================
+
+# 情绪和来源以小整数存储；新增情绪只能追加编码，不能改动已有编码
+EMOTION_CODES = {
+    "unknown": 0, "neutral": 1, "happy": 2, "sad": 3, "calm": 4,
+    "angry": 5, "anxious": 6, "excited": 7,
+}
+EMOTION_NAMES = {code: name for name, code in EMOTION_CODES.items()}
+EVENT_SOURCES = {"text": 1, "audio": 2, "memory": 3}
+# 各情绪的正负向（与 EmotionAnalyzer.emotion_map 一致），汇总表只有情绪类别时用它估算效价
+EMOTION_VALENCE = {
+    "happy": 0.8, "excited": 0.9, "calm": 0.6, "sad": 0.2,
+    "angry": 0.1, "anxious": 0.3, "neutral": 0.5,
+}
+
+
+class EmotionEvent(Base):
+    """
+    一次情绪识别的读数（/emotion/analyze 等高频写入）
+    只有定长列，不含正文；用户可浏览的内容仍写入 memories。
+    与记忆一样按用户分片，统计接口从这张表聚合
+    """
+    __tablename__ = "emotion_events"
+    __table_args__ = (
+        # 覆盖按用户、时间范围聚合的统计查询，不需要回表
+        Index("ix_emotion_events_user_ts", "user_id", "ts", "emotion", "intensity"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    session_id = Column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), nullable=True, index=True)
+    ts = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    emotion = Column(SmallInteger, nullable=False)  # EMOTION_CODES
+    intensity = Column(REAL, nullable=False)
+    valence = Column(REAL, nullable=True)
+    arousal = Column(REAL, nullable=True)
+    confidence = Column(REAL, nullable=True)
+    source = Column(SmallInteger, nullable=False)  # EVENT_SOURCES
+
+    # 新建会话时在同一次flush中取得会话ID
+    session = relationship("Session")
+
+    def __repr__(self):
+        return f"<EmotionEvent(user_id={self.user_id}, emotion={EMOTION_NAMES.get(self.emotion)})>"
+
+
+# ==================== 流式统计摘要（可合并的近似统计） ====================
+class EmotionSketch(Base):
+    """
+    序列化的统计摘要，由 app/services/sketches.py 在写入提交后批量合并更新
+    - tdigest: 强度分位数，key 为 user:<用户>:<情绪> 或 all:<情绪>
+    - cms:     标签计数（count-min + top-k），key 为 tags
+    - hll:     每日活跃用户数（HyperLogLog），key 为日期
+    每个分片各自维护，全站统计在读取时合并
+    """
+    __tablename__ = "emotion_sketches"
+
+    kind = Column(String(10), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<EmotionSketch(kind={self.kind}, key={self.key})>"
+
+
 # ==================== DApp历史模型 ====================
 class DAppHistory(Base):
     __tablename__ = "dapp_history"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
     
     # DApp信息
     dapp_name = Column(String(50), index=True)  # HealingStation, SoundTheatre, MusicWorkshop, VoiceAssistant
@@ -151,13 +465,13 @@ class DAppRecommendation(Base):
     id = Column(Integer, primary_key=True, index=True)
     
     # 情绪条件
-    trigger_emotion = Column(String(20), index=True, nullable=False)  # happy, sad, calm, neutral
+    trigger_emotion = Column(String(20), nullable=False)  # happy, sad, calm, neutral
     min_intensity = Column(Float, default=0.0)  # 最小强度
     max_intensity = Column(Float, default=1.0)  # 最大强度
     
     # 推荐的DApp
     dapp_name = Column(String(50), index=True, nullable=False)
-    recommended_modes = Column(JSON, default=list)  # 推荐的模式列表
+    recommended_modes = Column(JSONType, default=list)  # 推荐的模式列表
     
     # 优先级（越高越先推荐）
     priority = Column(Integer, default=5)
@@ -166,6 +480,12 @@ class DAppRecommendation(Base):
     description = Column(String(500))
     icon_url = Column(String(255), nullable=True)
     
+    # 按情绪取推荐并按优先级排序
+    __table_args__ = (
+        Index("ix_dapp_rec_emotion_priority", "trigger_emotion", "priority"),
+        Index("ix_dapp_rec_modes_gin", "recommended_modes", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+    
     def __repr__(self):
         return f"<DAppRecommendation(emotion={self.trigger_emotion}, dapp={self.dapp_name})>"
 
@@ -186,7 +506,16 @@ class ContentCache(Base):
     # 元数据
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     expire_at = Column(DateTime)  # 过期时间，TTL
-    hit_count = Column(Integer, default=0)  # 命中次数
+    hit_count = Column(Integer, default=0)  # 命中次数（由缓存管理器批量写回）
+    size_bytes = Column(Integer, default=0)  # 内容字节数，用于按类型限额
+    last_accessed_at = Column(DateTime, default=datetime.utcnow)  # 最后命中时间（LRU）
+    
+    # 过期清理和按类型淘汰（LRU / LFU）的扫描顺序
+    __table_args__ = (
+        Index("ix_content_cache_expire", "expire_at"),
+        Index("ix_content_cache_type_accessed", "cache_type", "last_accessed_at"),
+        Index("ix_content_cache_type_hits", "cache_type", "hit_count", "last_accessed_at"),
+    )
     
     def is_expired(self):
         """检查缓存是否过期"""
@@ -201,15 +530,22 @@ class APIUsageLog(Base):
     __tablename__ = "api_usage_log"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
     
     # API信息
-    api_name = Column(String(50), index=True)  # openai_whisper, openai_gpt4, etc.
-    endpoint = Column(String(255))
+    api_name = Column(String(50), index=True)  # openai_chat, openai_whisper, openai_tts
+    endpoint = Column(String(255))  # 调用位置，如 healing_generator.generate_comfort_response
+    model = Column(String(50))
+    status = Column(String(20), default="ok")  # ok / error / http_<状态码>
     
     # 使用情况
     tokens_used = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    audio_seconds = Column(Float, default=0.0)  # Whisper 输入音频时长
+    input_chars = Column(Integer, default=0)  # TTS 输入字符数
     cost_usd = Column(Float, default=0.0)
+    latency_ms = Column(Float, default=0.0)
     
     # 时间戳
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
@@ -218,10 +554,37 @@ class APIUsageLog(Base):
         return f"<APIUsageLog(api={self.api_name}, cost={self.cost_usd})>"
 
 
+class APIUsageHourly(Base):
+    """
+    按 (小时, API, 调用位置, 模型) 汇总的调用量、用量、费用和延迟
+    由 app/services/api_usage.py 在写入明细的同一事务中累加，/admin/usage 只读这张表
+    """
+    __tablename__ = "api_usage_hourly"
+
+    hour = Column(DateTime, primary_key=True)
+    api_name = Column(String(50), primary_key=True)
+    endpoint = Column(String(255), primary_key=True)
+    model = Column(String(50), primary_key=True)
+
+    calls = Column(Integer, default=0, nullable=False)
+    errors = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    audio_seconds = Column(Float, default=0.0, nullable=False)
+    input_chars = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Float, default=0.0, nullable=False)
+    latency_ms_sum = Column(Float, default=0.0, nullable=False)
+    latency_ms_max = Column(Float, default=0.0, nullable=False)
+
+    def __repr__(self):
+        return f"<APIUsageHourly(hour={self.hour}, api={self.api_name}, calls={self.calls})>"
+
+
 # ==================== 数据库初始化 ====================
 def init_db():
     """初始化数据库表和推荐映射数据"""
-    Base.metadata.create_all(bind=engine)
+    from app.models.migrations import migrate
+    migrate(engine)
     
     # 插入默认DApp推荐规则
     session = SessionLocal()
@@ -286,5 +649,14 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    """依赖注入用的只读数据库会话"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,371 @@
+"""
+数据库版本化迁移
+文件: backend-ai/app/models/migrations.py
+功能: 记录结构版本（SQLite用 PRAGMA user_version，其他数据库用 schema_version 表），
+      按顺序在线执行迁移，
+      把任意历史数据库（旧 init_db.py 结构或早期ORM结构）升级到当前ORM结构，
+      不删除已有数据
+
+用法:
+    python -m app.models.migrations            # 升级到最新版本
+    python -m app.models.migrations --status   # 查看当前版本
+"""
+
+import logging
+import argparse
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session as OrmSession
+
+from app.models.emotion import Base, engine, CONTENT_HEAD_LENGTH
+
+logger = logging.getLogger(__name__)
+
+Migration = Tuple[int, str, Callable[[OrmSession], None]]
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    """注册一个迁移步骤，版本号必须连续递增"""
+    def decorator(fn):
+        assert version == len(MIGRATIONS) + 1, f"迁移版本不连续: {version}"
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return decorator
+
+
+# ==================== 版本读写 ====================
+
+# PostgreSQL没有 user_version，版本号记在单行表中
+VERSION_TABLE = "schema_version"
+
+
+def _is_sqlite(connection) -> bool:
+    return connection.dialect.name == "sqlite"
+
+
+def current_version(connection) -> int:
+    if _is_sqlite(connection):
+        return connection.exec_driver_sql("PRAGMA user_version").scalar() or 0
+    if not inspect(connection).has_table(VERSION_TABLE):
+        return 0
+    return connection.exec_driver_sql(f"SELECT max(version) FROM {VERSION_TABLE}").scalar() or 0
+
+
+def _set_version(connection, version: int):
+    if _is_sqlite(connection):
+        # PRAGMA 不支持参数绑定
+        connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+        return
+    connection.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (version INTEGER NOT NULL)")
+    connection.exec_driver_sql(f"DELETE FROM {VERSION_TABLE}")
+    connection.execute(text(f"INSERT INTO {VERSION_TABLE} (version) VALUES (:version)"), {"version": version})
+
+
+# ==================== 迁移步骤 ====================
+
+# 旧 init_db.py 中与ORM同名但结构不同的表（TEXT主键）
+_LEGACY_TABLES = ("users", "sessions", "memories")
+
+
+def _utc(column: str) -> str:
+    """
+    旧表的 ISO 8601 文本时间（Node toISOString 的 ...Z 或带 +08:00 偏移）转为不带时区的UTC时间；
+    无法解析的值只把 T 换成空格
+    """
+    return f"coalesce(strftime('%Y-%m-%d %H:%M:%f', {column}), replace({column}, 'T', ' '))"
+
+
+def _is_legacy(connection, table: str) -> bool:
+    columns = {c["name"]: c for c in inspect(connection).get_columns(table)}
+    return "id" in columns and str(columns["id"]["type"]).upper() == "TEXT"
+
+
+@migration(1, "ORM基线表结构（迁移旧 init_db.py 表）")
+def _baseline(db: OrmSession):
+    connection = db.connection()
+    existing = set(inspect(connection).get_table_names())
+    legacy = [t for t in _LEGACY_TABLES if t in existing and _is_legacy(connection, t)]
+
+    # 旧表改名保留，原始数据不丢失
+    for table in legacy:
+        connection.exec_driver_sql(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+
+    # 记忆表创建时由 after_create 钩子一并建立全文索引表
+    from app.services import memory_search  # noqa: F401
+    Base.metadata.create_all(bind=connection)
+
+    if "users" in legacy:
+        connection.exec_driver_sql(
+            "INSERT INTO users (username, password_hash, email, created_at, last_login) "
+            f"SELECT username, '', email, {_utc('created_at')}, {_utc('last_login')} "
+            "FROM legacy_users ORDER BY rowid"
+        )
+    if "sessions" in legacy:
+        connection.exec_driver_sql(
+            "INSERT INTO sessions (user_id, session_token, started_at, ended_at) "
+            f"SELECT u.id, s.token, {_utc('s.created_at')}, {_utc('s.ended_at')} "
+            "FROM legacy_sessions s "
+            "JOIN legacy_users lu ON lu.id = s.user_id "
+            "JOIN users u ON u.username = lu.username "
+            "ORDER BY s.rowid"
+        )
+    if "memories" in legacy:
+        # 非法的JSON标签无法由ORM读出，置为空数组（原值保留在 legacy_memories）
+        connection.exec_driver_sql(
+            "INSERT INTO memories (user_id, memory_type, emotion_type, emotion_intensity, content, "
+            "summary, tags, created_at, updated_at, is_shared, share_token) "
+            "SELECT u.id, 'text', m.emotion_type, m.emotion_intensity, m.content, m.summary, "
+            "CASE WHEN json_valid(m.tags) = 0 THEN '[]' ELSE m.tags END, "
+            f"{_utc('m.created_at')}, {_utc('m.updated_at')}, "
+            "m.is_shared, m.share_token "
+            "FROM legacy_memories m "
+            "JOIN legacy_users lu ON lu.id = m.user_id "
+            "JOIN users u ON u.username = lu.username "
+            f"ORDER BY {_utc('m.created_at')}, m.rowid"
+        )
+    if legacy:
+        logger.info(f"已迁移旧表: {', '.join(legacy)}（原表保留为 legacy_*）")
+
+
+# 与查询形状匹配的复合索引；单列前缀索引随之冗余
+_COMPOSITE_INDEXES = {
+    "ix_memories_user_created_id": "memories (user_id, created_at, id)",
+    "ix_memories_user_emotion_created": "memories (user_id, emotion_type, created_at)",
+    "ix_dapp_rec_emotion_priority": "dapp_recommendations (trigger_emotion, priority)",
+}
+_REDUNDANT_INDEXES = ("ix_memories_user_id", "ix_dapp_recommendations_trigger_emotion")
+
+
+@migration(2, "复合索引")
+def _composite_indexes(db: OrmSession):
+    connection = db.connection()
+    for name, target in _COMPOSITE_INDEXES.items():
+        connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    for name in _REDUNDANT_INDEXES:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    connection.exec_driver_sql("ANALYZE")
+
+
+@migration(3, "回填派生表（标签索引、每日汇总、全文索引）")
+def _derived_tables(db: OrmSession):
+    from app.services import emotion_rollup, memory_tags, memory_search
+
+    memory_tags.backfill(db)
+    emotion_rollup.backfill(db)
+
+    connection = db.connection()
+    # PostgreSQL的tsvector无需编译选项
+    if not _is_sqlite(connection) or connection.exec_driver_sql(
+        "SELECT sqlite_compileoption_used('ENABLE_FTS5')"
+    ).scalar():
+        memory_search.rebuild(db)
+    else:
+        logger.warning("SQLite未启用FTS5，跳过全文索引，搜索将退回LIKE查询")
+
+
+@migration(4, "WAL日志模式")
+def _wal_journal(db: OrmSession):
+    # journal_mode 保存在数据库文件中，设置一次即可；不能在事务内切换
+    connection = db.connection()
+    if not _is_sqlite(connection):
+        return
+    mode = connection.exec_driver_sql("PRAGMA journal_mode=WAL").scalar()
+    if mode != "wal":
+        logger.warning(f"无法切换到WAL模式，当前为 {mode}")
+
+
+@migration(5, "正文明文前缀列（正文压缩存储后用于预览）")
+def _content_head(db: OrmSession):
+    connection = db.connection()
+    columns = {c["name"] for c in inspect(connection).get_columns("memories")}
+    if "content_head" not in columns:
+        connection.exec_driver_sql("ALTER TABLE memories ADD COLUMN content_head TEXT")
+    # 已有正文都是未压缩的TEXT；压缩已有数据用 python -m app.models.compression --recompress
+    # （PostgreSQL上正文不压缩，没有typeof）
+    plain = "typeof(content) = 'text'" if _is_sqlite(connection) else "content IS NOT NULL"
+    connection.exec_driver_sql(
+        f"UPDATE memories SET content_head = substr(content, 1, {CONTENT_HEAD_LENGTH}) "
+        f"WHERE content_head IS NULL AND {plain}"
+    )
+
+
+
+@migration(6, "内容缓存的字节数、访问时间列和淘汰索引")
+def _content_cache_eviction(db: OrmSession):
+    connection = db.connection()
+    sqlite = _is_sqlite(connection)
+    columns = {c["name"] for c in inspect(connection).get_columns("content_cache")}
+    if "size_bytes" not in columns:
+        size = "length(CAST(content AS BLOB))" if sqlite else "octet_length(content)"
+        connection.exec_driver_sql("ALTER TABLE content_cache ADD COLUMN size_bytes INTEGER DEFAULT 0")
+        connection.exec_driver_sql(f"UPDATE content_cache SET size_bytes = coalesce({size}, 0)")
+    if "last_accessed_at" not in columns:
+        timestamp = "DATETIME" if sqlite else "TIMESTAMP"
+        connection.exec_driver_sql(f"ALTER TABLE content_cache ADD COLUMN last_accessed_at {timestamp}")
+        connection.exec_driver_sql("UPDATE content_cache SET last_accessed_at = created_at")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_content_cache_expire ON content_cache (expire_at)")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_content_cache_type_accessed ON content_cache (cache_type, last_accessed_at)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_content_cache_type_hits "
+        "ON content_cache (cache_type, hit_count, last_accessed_at)"
+    )
+
+
+
+_API_USAGE_COLUMNS = {
+    "model": "VARCHAR(50)",
+    "status": "VARCHAR(20) DEFAULT 'ok'",
+    "prompt_tokens": "INTEGER DEFAULT 0",
+    "completion_tokens": "INTEGER DEFAULT 0",
+    "audio_seconds": "FLOAT DEFAULT 0.0",
+    "input_chars": "INTEGER DEFAULT 0",
+    "latency_ms": "FLOAT DEFAULT 0.0",
+}
+
+
+@migration(7, "API调用明细列和按小时汇总表")
+def _api_usage(db: OrmSession):
+    from app.models.emotion import APIUsageHourly
+
+    connection = db.connection()
+    columns = {c["name"] for c in inspect(connection).get_columns("api_usage_log")}
+    for name, ddl in _API_USAGE_COLUMNS.items():
+        if name not in columns:
+            connection.exec_driver_sql(f"ALTER TABLE api_usage_log ADD COLUMN {name} {ddl}")
+    APIUsageHourly.__table__.create(connection, checkfirst=True)
+
+
+@migration(8, "情绪读数事件窄表（由已有记忆回填）")
+def _emotion_events(db: OrmSession):
+    from app.models.emotion import EmotionEvent
+    from app.services.emotion_events import backfill_from_memories
+
+    connection = db.connection()
+    EmotionEvent.__table__.create(connection, checkfirst=True)
+    # 新库由基线步骤建表；表为空时（含刚迁入的旧数据）才回填
+    if connection.exec_driver_sql("SELECT 1 FROM emotion_events LIMIT 1").first() is None:
+        count = backfill_from_memories(db)
+        logger.info(f"由已有记忆回填 {count} 条情绪读数")
+
+
+# 按会话、按用户批量删除时使用的索引
+_BULK_DELETE_INDEXES = {
+    "ix_memories_session_id": "memories (session_id)",
+    "ix_emotion_events_session_id": "emotion_events (session_id)",
+    "ix_api_usage_log_user_id": "api_usage_log (user_id)",
+}
+
+
+@migration(9, "批量删除索引")
+def _bulk_delete_indexes(db: OrmSession):
+    # 已有表的外键不能在SQLite中修改，ON DELETE CASCADE 只对新建的表生效；
+    # 级联删除由 app/services/bulk_delete.py 分批显式执行
+    connection = db.connection()
+    for name, target in _BULK_DELETE_INDEXES.items():
+        connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+@migration(10, "按周/按月情绪汇总（由每日汇总回填）")
+def _period_rollup(db: OrmSession):
+    from app.models.emotion import EmotionPeriodRollup
+    from app.services.emotion_rollup import backfill_periods
+
+    connection = db.connection()
+    EmotionPeriodRollup.__table__.create(connection, checkfirst=True)
+    if connection.exec_driver_sql("SELECT 1 FROM emotion_period_rollup LIMIT 1").first() is None:
+        count = backfill_periods(db)
+        logger.info(f"由每日汇总回填 {count} 行周/月汇总")
+
+
+@migration(11, "流式统计摘要表（由已有记忆和情绪读数重建）")
+def _emotion_sketches(db: OrmSession):
+    from app.models.emotion import EmotionSketch
+    from app.services.sketches import rebuild
+
+    connection = db.connection()
+    EmotionSketch.__table__.create(connection, checkfirst=True)
+    if connection.exec_driver_sql("SELECT 1 FROM emotion_sketches LIMIT 1").first() is None:
+        count = rebuild(db)
+        logger.info(f"由已有数据重建统计摘要，合并 {count} 条更新")
+
+
+@migration(12, "近似重复检测签名表（由已有记忆计算）")
+def _memory_signatures(db: OrmSession):
+    from app.models.emotion import MemorySignature, MemoryLSHBand
+    from app.services.memory_dedup import backfill
+
+    connection = db.connection()
+    MemorySignature.__table__.create(connection, checkfirst=True)
+    MemoryLSHBand.__table__.create(connection, checkfirst=True)
+    if connection.exec_driver_sql("SELECT 1 FROM memory_signatures LIMIT 1").first() is None:
+        count = backfill(db)
+        logger.info(f"为 {count} 条已有记忆计算签名")
+
+
+@migration(13, "压缩字典存入数据库（导入旧字典目录）")
+def _content_dictionaries(db: OrmSession):
+    from app.models.emotion import ContentDictionary
+    from app.models.compression import import_legacy_dictionaries
+
+    connection = db.connection()
+    ContentDictionary.__table__.create(connection, checkfirst=True)
+    count = import_legacy_dictionaries(connection)
+    if count:
+        logger.info(f"从旧字典目录导入 {count} 个压缩字典")
+
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+# ==================== 执行 ====================
+
+def migrate(bind=None) -> int:
+    """
+    把数据库升级到最新版本，每个步骤在独立事务中执行并记录版本号
+
+    Returns:
+        执行的迁移步骤数
+    """
+    bind = bind or engine
+    applied = 0
+    db = OrmSession(bind=bind)
+    try:
+        version = current_version(db.connection())
+        for step, description, fn in MIGRATIONS:
+            if step <= version:
+                continue
+            logger.info(f"执行迁移 {step}: {description}")
+            fn(db)
+            _set_version(db.connection(), step)
+            db.commit()
+            applied += 1
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="数据库结构迁移")
+    parser.add_argument("--status", action="store_true", help="只显示当前版本")
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        version = current_version(conn)
+
+    if args.status:
+        print(f"当前版本 {version}，最新版本 {SCHEMA_VERSION}")
+    else:
+        from app.models.sharding import shard_router
+
+        count = migrate()
+        if shard_router.shards > 1:
+            count += shard_router.migrate()
+        print(f"✓ 迁移完成，执行 {count} 步，当前版本 {SCHEMA_VERSION}")
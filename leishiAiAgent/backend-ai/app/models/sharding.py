@@ -0,0 +1,282 @@
+"""
+按用户分片的记忆库
+文件: backend-ai/app/models/sharding.py
+功能: 记忆、会话、情绪读数事件及记忆的派生表（标签、每日汇总、全文索引）按 user_id 哈希
+      分布到 MEMORY_SHARDS 个SQLite文件，每个分片有独立的写连接和读连接池，
+      不同用户的写入不再争用同一把写锁；跨用户的统计和维护任务并行扇出到所有分片
+
+      用户、DApp、内容缓存等全局表仍在主库（DATABASE_URL）。
+      MEMORY_SHARDS=1（默认）时唯一的分片就是主库，行为与不分片相同
+
+注意:
+    - 记忆ID、会话ID只在分片内唯一，按ID访问的接口都必须同时带 user_id
+    - 分片数决定数据分布，修改 MEMORY_SHARDS 前需要重新分布已有数据；
+      主库仍有记忆或分片中有不属于该分片的用户时服务拒绝启动（这些记忆对用户不可见）
+
+用法:
+    python -m app.models.sharding --status    # 各分片的记忆数
+    python -m app.models.sharding --check     # 检查已有记忆是否与分片配置一致
+    python -m app.models.sharding --migrate   # 把所有分片升级到最新结构
+"""
+
+import os
+import zlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import func, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, Session as OrmSession
+
+from app.models.emotion import (
+    DATABASE_URL, Memory, SessionLocal, ReadSessionLocal,
+    create_sqlite_engine, _is_sqlite_file
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 分片数和分片文件目录（默认为主库所在目录下的 shards/）
+MEMORY_SHARDS = int(os.getenv("MEMORY_SHARDS", "1"))
+MEMORY_SHARD_DIR = os.getenv("MEMORY_SHARD_DIR", "")
+# 跨分片扇出的最大并行线程数
+SHARD_FAN_OUT_WORKERS = int(os.getenv("SHARD_FAN_OUT_WORKERS", "8"))
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    """用户所在的分片编号（crc32取模，跨进程、跨重启稳定）"""
+    if shards <= 1:
+        return 0
+    return zlib.crc32(str(int(user_id)).encode("ascii")) % shards
+
+
+def shard_urls(database_url: str, shards: int, directory: str = "") -> List[str]:
+    """根据主库地址生成各分片的SQLite地址"""
+    main_path = make_url(database_url).database
+    directory = directory or os.path.join(os.path.dirname(main_path) or ".", "shards")
+    return [
+        f"sqlite:///{os.path.join(directory, f'memories_{index:02d}.db')}"
+        for index in range(shards)
+    ]
+
+
+class ShardRouter:
+    """
+    按用户路由的会话工厂
+
+    - session(user_id) / read_session(user_id): 该用户所在分片的写会话 / 只读会话
+    - fan_out(fn): 在每个分片上并行执行 fn(db)，用于跨用户统计和维护
+    不带用户维度的全局表继续使用主库的 SessionLocal
+    """
+
+    def __init__(
+        self,
+        factories: List[Tuple[sessionmaker, sessionmaker]],
+        max_workers: int = SHARD_FAN_OUT_WORKERS
+    ):
+        """
+        Args:
+            factories: 每个分片的 (写会话工厂, 读会话工厂)
+            max_workers: 扇出时的最大并行线程数
+        """
+        self._writers = [writer for writer, _ in factories]
+        self._readers = [reader for _, reader in factories]
+        self.max_workers = max(1, min(max_workers, len(factories)))
+
+    @classmethod
+    def from_urls(cls, urls: List[str], **kwargs) -> "ShardRouter":
+        """为每个分片文件创建调优过的写引擎和读连接池"""
+        factories = []
+        for url in urls:
+            os.makedirs(os.path.dirname(make_url(url).database) or ".", exist_ok=True)
+            factories.append((
+                sessionmaker(autocommit=False, autoflush=False, bind=create_sqlite_engine(url)),
+                sessionmaker(autocommit=False, autoflush=False, bind=create_sqlite_engine(url, readonly=True))
+            ))
+        return cls(factories, **kwargs)
+
+    @property
+    def shards(self) -> int:
+        return len(self._writers)
+
+    def shard_for(self, user_id: int) -> int:
+        return shard_for(user_id, self.shards)
+
+    # ==================== 单用户路由 ====================
+
+    def session(self, user_id: int) -> OrmSession:
+        """用户所在分片的写会话"""
+        return self._writers[self.shard_for(user_id)]()
+
+    def read_session(self, user_id: int) -> OrmSession:
+        """用户所在分片的只读会话"""
+        return self._readers[self.shard_for(user_id)]()
+
+    def writer_factory(self, shard: int) -> sessionmaker:
+        return self._writers[shard]
+
+    def reader_factory(self, shard: int) -> sessionmaker:
+        return self._readers[shard]
+
+    def engines(self) -> List:
+        """各分片的写引擎"""
+        return [factory.kw["bind"] for factory in self._writers]
+
+    def read_engines(self) -> List:
+        """各分片的只读引擎"""
+        return [factory.kw["bind"] for factory in self._readers]
+
+    # ==================== 跨分片 ====================
+
+    def fan_out(self, fn: Callable[[OrmSession], T], readonly: bool = True) -> List[T]:
+        """
+        在每个分片上并行执行 fn(db)
+
+        每个线程使用各自分片的会话，执行后关闭；任一分片出错时异常向上抛出
+
+        Returns:
+            按分片编号排列的结果列表
+        """
+        factories = self._readers if readonly else self._writers
+
+        def run(factory):
+            db = factory()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        if len(factories) == 1:
+            return [run(factories[0])]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="shard") as pool:
+            return list(pool.map(run, factories))
+
+    def migrate(self) -> int:
+        """把所有分片升级到最新结构，返回执行的迁移步骤总数"""
+        from app.models.migrations import migrate
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="shard") as pool:
+            return sum(pool.map(migrate, self.engines()))
+
+    def dispose(self):
+        for factory in self._writers + self._readers:
+            factory.kw["bind"].dispose()
+
+
+def _build_router() -> ShardRouter:
+    if MEMORY_SHARDS > 1 and _is_sqlite_file(DATABASE_URL):
+        return ShardRouter.from_urls(shard_urls(DATABASE_URL, MEMORY_SHARDS, MEMORY_SHARD_DIR))
+    if MEMORY_SHARDS > 1:
+        logger.warning("记忆分片只支持SQLite文件数据库，已忽略 MEMORY_SHARDS")
+    return ShardRouter([(SessionLocal, ReadSessionLocal)])
+
+
+# 全局路由器
+shard_router = _build_router()
+
+
+def get_user_db(user_id: int):
+    """获取用户所在分片的数据库会话（FastAPI依赖，user_id取自路径或查询参数）"""
+    db = shard_router.session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_user_read_db(user_id: int):
+    """获取用户所在分片的只读数据库会话"""
+    db = shard_router.read_session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _memory_count(db) -> int:
+    return db.query(func.count(Memory.id)).scalar() or 0
+
+
+# ==================== 分布检查 ====================
+
+class ShardLayoutError(RuntimeError):
+    """已有记忆与当前分片配置不符"""
+
+
+def layout_problems(router: ShardRouter, main_factory: sessionmaker = ReadSessionLocal) -> List[str]:
+    """
+    已有记忆与分片配置不符之处：分片时主库仍有记忆，或分片中有按 shard_for 不属于该分片的用户
+
+    Returns:
+        问题描述列表，为空表示一致
+    """
+    if router.shards <= 1:
+        return []
+
+    problems = []
+    db = main_factory()
+    try:
+        if inspect(db.get_bind()).has_table(Memory.__tablename__):
+            count = _memory_count(db)
+            if count:
+                problems.append(f"主库仍有 {count} 条记忆")
+    finally:
+        db.close()
+
+    for shard in range(router.shards):
+        db = router.reader_factory(shard)()
+        try:
+            if not inspect(db.get_bind()).has_table(Memory.__tablename__):
+                continue
+            misplaced = [
+                user_id for user_id, in db.query(Memory.user_id).distinct()
+                if user_id is not None and router.shard_for(user_id) != shard
+            ]
+        finally:
+            db.close()
+        if misplaced:
+            problems.append(f"分片 {shard:02d} 中有 {len(misplaced)} 个用户的记忆不属于该分片")
+    return problems
+
+
+def check_layout(router: Optional[ShardRouter] = None, main_factory: sessionmaker = ReadSessionLocal):
+    """
+    启动前检查记忆分布
+
+    Raises:
+        ShardLayoutError: 修改 MEMORY_SHARDS 后未重新分布已有数据
+    """
+    router = router or shard_router
+    problems = layout_problems(router, main_factory)
+    if problems:
+        raise ShardLayoutError(
+            f"记忆分布与 MEMORY_SHARDS={router.shards} 不一致（{'；'.join(problems)}），"
+            "请先重新分布已有数据或恢复原分片数"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="记忆分片维护")
+    parser.add_argument("--status", action="store_true", help="显示各分片的记忆数")
+    parser.add_argument("--check", action="store_true", help="检查已有记忆是否与分片配置一致")
+    parser.add_argument("--migrate", action="store_true", help="把所有分片升级到最新结构")
+    args = parser.parse_args()
+
+    if args.check:
+        problems = layout_problems(shard_router)
+        for problem in problems:
+            print(f"✗ {problem}")
+        if not problems:
+            print(f"✓ 记忆分布与 {shard_router.shards} 个分片一致")
+    elif args.migrate:
+        count = shard_router.migrate()
+        print(f"✓ {shard_router.shards} 个分片迁移完成，执行 {count} 步")
+    elif args.status:
+        for index, count in enumerate(shard_router.fan_out(_memory_count)):
+            print(f"分片 {index:02d}: {count} 条记忆")
+    else:
+        parser.print_help()
@@ -0,0 +1,158 @@
+"""
+离线分析
+文件: backend-ai/app/services/analytics.py
+功能: 读取 parquet_export 导出的 Parquet 文件做常用统计，不访问线上数据库
+      - 只读取需要的列；--since/--until 按 date 分区裁剪，不打开范围外的文件
+      - dapp_history 导出的是快照，按主键保留 last_accessed 最新的一条
+
+用法:
+    python -m app.services.analytics emotions --since 2024-06-01
+    python -m app.services.analytics dapps
+    python -m app.services.analytics api-cost --since 2024-06-01 --until 2024-06-30 --csv cost.csv
+    python -m app.services.analytics sessions
+"""
+
+import os
+import argparse
+from typing import Optional, List
+
+import pandas as pd
+
+from app.services.parquet_export import PARQUET_EXPORT_DIR
+
+
+def load(
+    table: str,
+    columns: List[str],
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    data_dir: str = PARQUET_EXPORT_DIR
+) -> pd.DataFrame:
+    """
+    读取一张导出表
+
+    Args:
+        since / until: 日期分区范围（YYYY-MM-DD，含两端）
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    path = os.path.join(data_dir, table)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=columns)
+
+    filters = []
+    if since:
+        filters.append(("date", ">=", since))
+    if until:
+        filters.append(("date", "<=", until))
+    return pd.read_parquet(
+        path,
+        columns=columns,
+        filters=filters or None,
+        partitioning=ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    )
+
+
+def latest_snapshots(frame: pd.DataFrame, key: str = "id", order_by: str = "last_accessed") -> pd.DataFrame:
+    """同一主键多次导出时保留最新的快照"""
+    return frame.sort_values(order_by).drop_duplicates(key, keep="last")
+
+
+# ==================== 报表 ====================
+
+def emotion_report(since=None, until=None, data_dir=PARQUET_EXPORT_DIR) -> pd.DataFrame:
+    """每天各情绪的记忆数，以及当天的平均强度和活跃用户数"""
+    frame = load("memories", ["id", "user_id", "emotion_type", "emotion_intensity", "created_at"], since, until, data_dir)
+    if frame.empty:
+        return frame
+    frame = frame.drop_duplicates("id")
+    frame["day"] = frame["created_at"].dt.date
+    counts = frame.pivot_table(index="day", columns="emotion_type", values="id", aggfunc="count", fill_value=0)
+    daily = frame.groupby("day").agg(
+        avg_intensity=("emotion_intensity", "mean"),
+        active_users=("user_id", "nunique")
+    )
+    return counts.join(daily.round(3))
+
+
+def dapp_report(since=None, until=None, data_dir=PARQUET_EXPORT_DIR) -> pd.DataFrame:
+    """各 DApp 的用户数、打开次数、使用时长和平均评分"""
+    frame = load(
+        "dapp_history",
+        ["id", "user_id", "dapp_name", "open_count", "total_duration_seconds", "user_rating", "last_accessed"],
+        since, until, data_dir
+    )
+    if frame.empty:
+        return frame
+    frame = latest_snapshots(frame)
+    report = frame.groupby("dapp_name").agg(
+        users=("user_id", "nunique"),
+        opens=("open_count", "sum"),
+        hours=("total_duration_seconds", lambda seconds: round(seconds.sum() / 3600, 1)),
+        avg_rating=("user_rating", "mean")
+    )
+    return report.sort_values("opens", ascending=False)
+
+
+def api_cost_report(since=None, until=None, data_dir=PARQUET_EXPORT_DIR) -> pd.DataFrame:
+    """每天每个API的调用数、token、费用和 p95 延迟"""
+    frame = load(
+        "api_usage_log",
+        ["id", "api_name", "status", "tokens_used", "cost_usd", "latency_ms", "timestamp"],
+        since, until, data_dir
+    )
+    if frame.empty:
+        return frame
+    frame = frame.drop_duplicates("id")
+    frame["day"] = frame["timestamp"].dt.date
+    frame["errors"] = frame["status"] != "ok"
+    return frame.groupby(["day", "api_name"]).agg(
+        calls=("id", "count"),
+        errors=("errors", "sum"),
+        tokens=("tokens_used", "sum"),
+        cost_usd=("cost_usd", "sum"),
+        p95_latency_ms=("latency_ms", lambda latency: latency.quantile(0.95))
+    ).round(4)
+
+
+def session_report(since=None, until=None, data_dir=PARQUET_EXPORT_DIR) -> pd.DataFrame:
+    """每天开始的会话数、用户数和平均时长"""
+    frame = load("sessions", ["id", "user_id", "started_at", "duration_seconds"], since, until, data_dir)
+    if frame.empty:
+        return frame
+    frame = frame.drop_duplicates("id")
+    frame["day"] = frame["started_at"].dt.date
+    return frame.groupby("day").agg(
+        sessions=("id", "count"),
+        users=("user_id", "nunique"),
+        avg_duration_s=("duration_seconds", "mean")
+    ).round(1)
+
+
+REPORTS = {
+    "emotions": emotion_report,
+    "dapps": dapp_report,
+    "api-cost": api_cost_report,
+    "sessions": session_report,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基于 Parquet 导出的离线分析")
+    parser.add_argument("report", choices=list(REPORTS), help="报表")
+    parser.add_argument("--data", default=PARQUET_EXPORT_DIR, help="导出目录")
+    parser.add_argument("--since", default=None, help="起始日期 YYYY-MM-DD（含）")
+    parser.add_argument("--until", default=None, help="结束日期 YYYY-MM-DD（含）")
+    parser.add_argument("--csv", default=None, help="同时写入CSV文件")
+    args = parser.parse_args()
+
+    report = REPORTS[args.report](args.since, args.until, args.data)
+    if report.empty:
+        print("没有数据（先运行 python -m app.services.parquet_export）")
+    else:
+        with pd.option_context("display.max_rows", 500, "display.width", 200):
+            print(report)
+        if args.csv:
+            report.to_csv(args.csv)
+            print(f"✓ 已写入 {args.csv}")
@@ -0,0 +1,456 @@
+"""
+API调用计量服务
+文件: backend-ai/app/services/api_usage.py
+功能: 记录每次 LLM / Embeddings / Whisper / TTS 调用的调用位置、模型、token数、音频时长、
+      延迟和状态，写入 api_usage_log 明细并累加到 api_usage_hourly 小时汇总
+
+      - 请求路径上只把一条记录追加到内存缓冲区（加锁追加，不做IO），
+        后台线程每 API_USAGE_FLUSH_S 秒或攒满 API_USAGE_MAX_BATCH 条时单事务写入
+      - 缓冲区满时丢弃最旧的记录并计数，计量失败不影响业务调用
+      - 费用按下方价格表在写入时估算，未知模型记为0
+
+用法:
+    response = await api_usage.chat_completion(model="gpt-4-turbo-preview", messages=[...])
+
+    async with api_usage.track("openai_chat", model, "openai_service.generate_text") as call:
+        ...
+        call.add_usage(result["usage"])
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, Dict, List, Tuple
+
+import openai
+from sqlalchemy import insert, select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.models.emotion import APIUsageLog, APIUsageHourly, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+API_USAGE_FLUSH_S = float(os.getenv("API_USAGE_FLUSH_S", "5"))
+API_USAGE_MAX_BATCH = int(os.getenv("API_USAGE_MAX_BATCH", "500"))
+# 缓冲区上限，超出时丢弃最旧的记录
+API_USAGE_BUFFER_SIZE = int(os.getenv("API_USAGE_BUFFER_SIZE", "20000"))
+
+# ==================== 价格表（美元） ====================
+
+# 每1K token的 (输入, 输出) 价格；按最长前缀匹配模型名
+CHAT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4-1106": (0.01, 0.03),
+    "gpt-4-0125": (0.01, 0.03),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+# Whisper 每分钟音频
+WHISPER_PRICE_PER_MIN = {"whisper-1": 0.006}
+# TTS 每1K字符
+TTS_PRICE_PER_1K_CHARS = {"tts-1-hd": 0.03, "tts-1": 0.015}
+# Embeddings 每1K输入token
+EMBEDDING_PRICES = {
+    "text-embedding-3-small": 0.00002,
+    "text-embedding-3-large": 0.00013,
+    "text-embedding-ada-002": 0.0001,
+}
+
+
+def _price(table: Dict, model: Optional[str]):
+    if not model:
+        return None
+    matches = [prefix for prefix in table if model.startswith(prefix)]
+    return table[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(record: Dict) -> float:
+    """按价格表估算一次调用的费用"""
+    model = record.get("model")
+    if record["api_name"] == "openai_chat":
+        price = _price(CHAT_PRICES, model)
+        if price:
+            return (record["prompt_tokens"] * price[0] + record["completion_tokens"] * price[1]) / 1000
+    elif record["api_name"] == "openai_whisper":
+        price = _price(WHISPER_PRICE_PER_MIN, model)
+        if price:
+            return record["audio_seconds"] / 60 * price
+    elif record["api_name"] == "openai_tts":
+        price = _price(TTS_PRICE_PER_1K_CHARS, model)
+        if price:
+            return record["input_chars"] / 1000 * price
+    elif record["api_name"] == "openai_embedding":
+        price = _price(EMBEDDING_PRICES, model)
+        if price:
+            return record["prompt_tokens"] / 1000 * price
+    return 0.0
+
+
+# ==================== 缓冲与批量写入 ====================
+
+def hour_of(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+_SUM_COLUMNS = (
+    "calls", "errors", "prompt_tokens", "completion_tokens",
+    "audio_seconds", "input_chars", "cost_usd", "latency_ms_sum"
+)
+
+
+def apply_hourly(connection, records: List[Dict]):
+    """把一批明细累加进小时汇总表（UPSERT）"""
+    totals: Dict[Tuple, Dict] = {}
+    for record in records:
+        key = (hour_of(record["timestamp"]), record["api_name"], record["endpoint"] or "", record["model"] or "")
+        total = totals.setdefault(key, dict.fromkeys(_SUM_COLUMNS + ("latency_ms_max",), 0))
+        total["calls"] += 1
+        total["errors"] += int(record["status"] != "ok")
+        total["prompt_tokens"] += record["prompt_tokens"]
+        total["completion_tokens"] += record["completion_tokens"]
+        total["audio_seconds"] += record["audio_seconds"]
+        total["input_chars"] += record["input_chars"]
+        total["cost_usd"] += record["cost_usd"]
+        total["latency_ms_sum"] += record["latency_ms"]
+        total["latency_ms_max"] = max(total["latency_ms_max"], record["latency_ms"])
+    if not totals:
+        return
+
+    table = APIUsageHourly.__table__
+    postgres = connection.dialect.name == "postgresql"
+    stmt = (pg_insert if postgres else sqlite_insert)(table)
+    greatest = func.greatest if postgres else func.max
+    set_ = {column: table.c[column] + stmt.excluded[column] for column in _SUM_COLUMNS}
+    set_["latency_ms_max"] = greatest(table.c.latency_ms_max, stmt.excluded.latency_ms_max)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.hour, table.c.api_name, table.c.endpoint, table.c.model],
+        set_=set_
+    )
+    connection.execute(stmt, [
+        {"hour": hour, "api_name": api_name, "endpoint": endpoint, "model": model, **total}
+        for (hour, api_name, endpoint, model), total in totals.items()
+    ])
+
+
+class UsageRecorder:
+    """
+    API调用计量缓冲区
+
+    - record(): 只在内存中追加，可在事件循环中直接调用
+    - 后台线程定期或攒满一批时 flush()，明细和小时汇总在同一事务中写入
+    - stop() 写入剩余记录后返回
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_interval: float = API_USAGE_FLUSH_S,
+        max_batch: int = API_USAGE_MAX_BATCH,
+        buffer_size: int = API_USAGE_BUFFER_SIZE
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 事件循环和后台线程都会更新计数，统一在 _lock 下修改
+        self.stats = {"recorded": 0, "written": 0, "batches": 0, "dropped": 0, "failed": 0}
+
+    def record(
+        self,
+        api_name: str,
+        endpoint: str,
+        model: Optional[str] = None,
+        status: str = "ok",
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        audio_seconds: float = 0.0,
+        input_chars: int = 0,
+        latency_ms: float = 0.0,
+        user_id: Optional[int] = None,
+        timestamp: Optional[datetime] = None
+    ):
+        """追加一条调用记录（不做IO）"""
+        entry = {
+            "api_name": api_name,
+            "endpoint": endpoint,
+            "model": model,
+            "status": status,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "audio_seconds": audio_seconds or 0.0,
+            "input_chars": input_chars or 0,
+            "latency_ms": latency_ms,
+            "user_id": user_id,
+            "timestamp": timestamp or datetime.utcnow()
+        }
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.stats["dropped"] += 1
+            self._buffer.append(entry)
+            self.stats["recorded"] += 1
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def snapshot(self) -> Dict[str, int]:
+        """计数的一致快照"""
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, **increments: int):
+        with self._lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def flush(self) -> int:
+        """把缓冲区中的记录写入数据库，返回写入条数"""
+        written = 0
+        while True:
+            with self._lock:
+                batch = [self._buffer.popleft() for _ in range(min(self.max_batch, len(self._buffer)))]
+            if not batch:
+                return written
+
+            for record in batch:
+                record["tokens_used"] = record["prompt_tokens"] + record["completion_tokens"]
+                record["cost_usd"] = estimate_cost(record)
+
+            db = self.session_factory()
+            try:
+                connection = db.connection()
+                connection.execute(insert(APIUsageLog.__table__), batch)
+                apply_hourly(connection, batch)
+                db.commit()
+                written += len(batch)
+                self._count(written=len(batch), batches=1)
+            except Exception as e:
+                # 计量是尽力而为的，写入失败的批次丢弃，不阻塞后续记录
+                db.rollback()
+                self._count(failed=len(batch))
+                logger.error(f"写入API调用记录失败 ({len(batch)}条): {e}")
+            finally:
+                db.close()
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="api-usage-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+        logger.info(f"API计量已关闭: {self.snapshot()}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+# 全局实例
+recorder = UsageRecorder()
+
+
+def start_api_usage_recorder():
+    recorder.start()
+
+
+def stop_api_usage_recorder():
+    recorder.stop()
+
+
+# ==================== 调用包装 ====================
+
+def _field(obj, name: str):
+    """兼容字典和响应对象的取值"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _call_site(depth: int = 2) -> str:
+    """调用者的 "模块.函数"（depth=2 为包装函数的调用者）"""
+    frame = sys._getframe(depth)
+    module = frame.f_globals.get("__name__", "?").rsplit(".", 1)[-1]
+    return f"{module}.{frame.f_code.co_name}"
+
+
+class UsageCall:
+    """一次调用的计量数据，由 track() 在结束时记录"""
+
+    def __init__(self):
+        self.status = "ok"
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.audio_seconds = 0.0
+        self.input_chars = 0
+
+    def add_usage(self, usage):
+        """记录聊天接口返回的 usage"""
+        self.prompt_tokens += _field(usage, "prompt_tokens") or 0
+        self.completion_tokens += _field(usage, "completion_tokens") or 0
+
+
+@asynccontextmanager
+async def track(api_name: str, model: Optional[str], call_site: str, user_id: Optional[int] = None):
+    """
+    计量一次API调用：测量延迟，异常时状态记为 error（异常继续抛出）
+
+    调用方在块内设置 call.status / add_usage() / audio_seconds / input_chars
+    """
+    call = UsageCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.status = "error"
+        raise
+    finally:
+        recorder.record(
+            api_name, call_site, model,
+            status=call.status,
+            prompt_tokens=call.prompt_tokens,
+            completion_tokens=call.completion_tokens,
+            audio_seconds=call.audio_seconds,
+            input_chars=call.input_chars,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            user_id=user_id
+        )
+
+
+async def chat_completion(call_site: Optional[str] = None, user_id: Optional[int] = None, **kwargs):
+    """openai.ChatCompletion.acreate 并计量"""
+    call_site = call_site or _call_site()
+    async with track("openai_chat", kwargs.get("model"), call_site, user_id) as call:
+        response = await openai.ChatCompletion.acreate(**kwargs)
+        call.add_usage(_field(response, "usage"))
+        return response
+
+
+async def speech(call_site: Optional[str] = None, user_id: Optional[int] = None, **kwargs):
+    """openai.Audio.acreate（TTS）并计量输入字符数"""
+    call_site = call_site or _call_site()
+    async with track("openai_tts", kwargs.get("model"), call_site, user_id) as call:
+        call.input_chars = len(kwargs.get("input") or "")
+        return await openai.Audio.acreate(**kwargs)
+
+
+async def embedding(call_site: Optional[str] = None, user_id: Optional[int] = None, **kwargs):
+    """
+    Embeddings接口并计量输入token数
+
+    openai>=1.0 已移除 openai.Embedding，使用v1客户端 AsyncOpenAI().embeddings.create；
+    当前SDK版本没有 dimensions 参数，经 extra_body 原样传给接口
+    """
+    call_site = call_site or _call_site()
+    dimensions = kwargs.pop("dimensions", None)
+    if dimensions:
+        kwargs["extra_body"] = {**(kwargs.get("extra_body") or {}), "dimensions": dimensions}
+    async with track("openai_embedding", kwargs.get("model"), call_site, user_id) as call:
+        # 后台线程每批用 asyncio.run 调用，连接池不能跨事件循环复用，每次调用新建客户端
+        async with openai.AsyncOpenAI() as client:
+            response = await client.embeddings.create(**kwargs)
+        call.add_usage(_field(response, "usage"))
+        return response
+
+
+async def transcription(call_site: Optional[str] = None, user_id: Optional[int] = None, **kwargs):
+    """openai.Audio.atranscribe 并计量音频时长（verbose_json 响应中的 duration）"""
+    call_site = call_site or _call_site()
+    async with track("openai_whisper", kwargs.get("model"), call_site, user_id) as call:
+        response = await openai.Audio.atranscribe(**kwargs)
+        call.audio_seconds = float(_field(response, "duration") or 0.0)
+        return response
+
+
+# ==================== 查询 ====================
+
+GROUP_COLUMNS = {
+    "api": APIUsageHourly.api_name,
+    "endpoint": APIUsageHourly.endpoint,
+    "model": APIUsageHourly.model,
+    "hour": APIUsageHourly.hour,
+    "day": func.date(APIUsageHourly.hour),
+}
+
+
+def query_usage(
+    db,
+    start: datetime,
+    end: datetime,
+    group_by: List[str],
+    api_name: Optional[str] = None,
+    endpoint: Optional[str] = None
+) -> List[Dict]:
+    """
+    按维度汇总 [start, end) 内的调用量（小时粒度）
+
+    Args:
+        group_by: GROUP_COLUMNS 中的维度名
+
+    Returns:
+        每组的 {维度..., calls, errors, error_rate, tokens, cost_usd, avg_latency_ms, max_latency_ms, ...}，
+        按费用降序
+    """
+    table = APIUsageHourly
+    dimensions = [GROUP_COLUMNS[name].label(name) for name in group_by]
+    cost = func.sum(table.cost_usd)
+    query = select(
+        *dimensions,
+        func.sum(table.calls).label("calls"),
+        func.sum(table.errors).label("errors"),
+        func.sum(table.prompt_tokens).label("prompt_tokens"),
+        func.sum(table.completion_tokens).label("completion_tokens"),
+        func.sum(table.audio_seconds).label("audio_seconds"),
+        func.sum(table.input_chars).label("input_chars"),
+        cost.label("cost_usd"),
+        func.sum(table.latency_ms_sum).label("latency_ms_sum"),
+        func.max(table.latency_ms_max).label("max_latency_ms")
+    ).where(table.hour >= hour_of(start), table.hour < end)
+    if api_name:
+        query = query.where(table.api_name == api_name)
+    if endpoint:
+        query = query.where(table.endpoint == endpoint)
+    if dimensions:
+        query = query.group_by(*dimensions)
+    query = query.order_by(cost.desc())
+
+    results = []
+    for row in db.execute(query).mappings():
+        row = dict(row)
+        calls = row["calls"] or 0
+        if not calls:
+            continue
+        latency_sum = row.pop("latency_ms_sum") or 0.0
+        row["tokens"] = (row["prompt_tokens"] or 0) + (row["completion_tokens"] or 0)
+        row["error_rate"] = round((row["errors"] or 0) / calls, 4)
+        row["avg_latency_ms"] = round(latency_sum / calls, 1)
+        row["cost_usd"] = round(row["cost_usd"] or 0.0, 6)
+        results.append(row)
+    return results
@@ -0,0 +1,364 @@
+"""
+批量删除服务
+文件: backend-ai/app/services/bulk_delete.py
+功能: 按块删除用户账号和会话的全部数据，不把子行加载进Python
+      - 每块一个短事务（按ID子查询删除 BULK_DELETE_CHUNK 行），块之间让出写锁
+      - 记忆按块删除时同步每日汇总、标签表和全文索引（绕过了ORM钩子）
+      - 账号删除还会清理冷库、记忆向量文件、主库中的DApp历史，并把API调用记录的 user_id 置空
+      - 用户/会话行最后删除，中途失败后重新提交即可从断点继续
+
+      删除任务由后台线程串行执行，接口立即返回任务ID；
+      任务状态只保存在进程内存中，进程重启后需重新提交
+
+用法:
+    python -m app.services.bulk_delete --user 42
+    python -m app.services.bulk_delete --user 42 --session 7
+"""
+
+import os
+import time
+import uuid
+import queue
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, List
+
+from sqlalchemy import select, delete, update
+
+from app.models.emotion import (
+    User, Session as SessionModel, Memory, MemoryTag, MemorySignature, MemoryLSHBand, EmotionDailyRollup, EmotionPeriodRollup, EmotionEvent,
+    EmotionSketch, DAppHistory, APIUsageLog, SessionLocal
+)
+from app.models.sharding import ShardRouter, shard_router
+from app.services import emotion_rollup, emotion_events, memory_search, memory_tags, memory_archive, memory_dedup, memory_vectors
+from app.services.response_cache import bump_users
+
+logger = logging.getLogger(__name__)
+
+# 每个删除事务的行数，以及块之间让出写锁的时间
+BULK_DELETE_CHUNK = int(os.getenv("BULK_DELETE_CHUNK", "500"))
+BULK_DELETE_PAUSE_MS = float(os.getenv("BULK_DELETE_PAUSE_MS", "10"))
+# 保留的已完成任务数
+BULK_DELETE_KEEP_JOBS = 1000
+
+
+# ==================== 批量删除 ====================
+
+def delete_memories(connection, memory_ids: List[int]) -> int:
+    """
+    删除一批记忆，并在同一事务中同步汇总、读数事件、标签、全文索引和重复检测签名
+
+    绕过ORM删除记忆的路径都应调用此函数
+    """
+    if not memory_ids:
+        return 0
+    table = Memory.__table__
+    rows = connection.execute(
+        select(table.c.user_id, table.c.created_at, table.c.emotion_type, table.c.emotion_intensity)
+        .where(table.c.id.in_(memory_ids))
+    ).mappings().all()
+
+    emotion_rollup.apply_deltas(connection, emotion_rollup.row_deltas(rows, sign=-1))
+    emotion_events.remove_memory_events(connection, rows)
+    memory_tags.remove_tags(connection, memory_ids)
+    if memory_search.fts_available(connection):
+        memory_search.remove_memories(connection, memory_ids)
+    memory_dedup.remove_signatures(connection, memory_ids)
+    return connection.execute(delete(table).where(table.c.id.in_(memory_ids))).rowcount
+
+
+class ChunkedDeleter:
+    """按块删除，每块提交一次并暂停 pause 秒"""
+
+    def __init__(self, chunk_size: int = BULK_DELETE_CHUNK, pause_ms: float = BULK_DELETE_PAUSE_MS):
+        self.chunk_size = chunk_size
+        self.pause = pause_ms / 1000
+
+    def _loop(self, db, step) -> int:
+        total = 0
+        while True:
+            done = step(db.connection())
+            db.commit()
+            total += done
+            if done < self.chunk_size:
+                return total
+            time.sleep(self.pause)
+
+    def rows(self, db, table, *where) -> int:
+        """删除 table 中满足条件的行"""
+        ids = select(table.c.id).where(*where).limit(self.chunk_size)
+        return self._loop(db, lambda connection: connection.execute(
+            delete(table).where(table.c.id.in_(ids))
+        ).rowcount)
+
+    def memories(self, db, *where) -> int:
+        """删除满足条件的记忆（同步派生表）"""
+        table = Memory.__table__
+
+        def step(connection):
+            ids = connection.execute(
+                select(table.c.id).where(*where).limit(self.chunk_size)
+            ).scalars().all()
+            return delete_memories(connection, ids)
+
+        return self._loop(db, step)
+
+    def nullify(self, db, table, column, *where) -> int:
+        """把满足条件的行的 column 置空"""
+        ids = select(table.c.id).where(*where).limit(self.chunk_size)
+        return self._loop(db, lambda connection: connection.execute(
+            update(table).where(table.c.id.in_(ids)).values({column: None})
+        ).rowcount)
+
+
+def purge_session(db, user_id: int, session_id: int, deleter: Optional[ChunkedDeleter] = None) -> Dict[str, int]:
+    """
+    删除一个会话及其记忆和情绪读数（db 为用户所在分片的会话）
+
+    Returns:
+        各表删除的行数
+    """
+    deleter = deleter or ChunkedDeleter()
+    memories = Memory.__table__
+    events = EmotionEvent.__table__
+    counts = {
+        "memories": deleter.memories(db, memories.c.user_id == user_id, memories.c.session_id == session_id),
+        "emotion_events": deleter.rows(db, events, events.c.user_id == user_id, events.c.session_id == session_id),
+    }
+
+    store = memory_archive.cold_store(db.get_bind())
+    archived = 0
+    if store is not None:
+        in_session = lambda memory: memory.get("session_id") == session_id  # noqa: E731
+        after = None
+        while True:
+            batch = store.scan(user_id, after, deleter.chunk_size, predicate=in_session)
+            store.remove([memory["id"] for memory in batch])
+            archived += len(batch)
+            if len(batch) < deleter.chunk_size:
+                break
+            after = (batch[-1]["created_at"], batch[-1]["id"])
+    counts["archived_memories"] = archived
+
+    sessions = SessionModel.__table__
+    counts["sessions"] = db.execute(
+        delete(sessions).where(sessions.c.id == session_id, sessions.c.user_id == user_id)
+    ).rowcount
+    db.commit()
+    bump_users([user_id])
+    return counts
+
+
+def purge_user(
+    user_id: int,
+    router: ShardRouter = shard_router,
+    main_factory=SessionLocal,
+    deleter: Optional[ChunkedDeleter] = None
+) -> Dict[str, int]:
+    """
+    删除一个用户的全部数据：先清分片中的记忆、事件、会话、冷库和向量文件，
+    再清主库中的DApp历史、API调用记录关联，最后删除用户行
+
+    Returns:
+        各表删除（或置空）的行数
+    """
+    deleter = deleter or ChunkedDeleter()
+    counts: Dict[str, int] = {}
+
+    db = router.session(user_id)
+    try:
+        memories = Memory.__table__
+        events = EmotionEvent.__table__
+        sessions = SessionModel.__table__
+        counts["memories"] = deleter.memories(db, memories.c.user_id == user_id)
+        counts["emotion_events"] = deleter.rows(db, events, events.c.user_id == user_id)
+        counts["sessions"] = deleter.rows(db, sessions, sessions.c.user_id == user_id)
+
+        # 汇总、标签和签名随记忆同步删除，这里清理历史上可能残留的行
+        db.execute(delete(MemoryTag.__table__).where(MemoryTag.user_id == user_id))
+        db.execute(delete(MemoryLSHBand.__table__).where(MemoryLSHBand.user_id == user_id))
+        db.execute(delete(MemorySignature.__table__).where(MemorySignature.user_id == user_id))
+        db.execute(delete(EmotionDailyRollup.__table__).where(EmotionDailyRollup.user_id == user_id))
+        db.execute(delete(EmotionPeriodRollup.__table__).where(EmotionPeriodRollup.user_id == user_id))
+        # 用户自己的分位数摘要；全站摘要只累加，不随删除回退
+        db.execute(delete(EmotionSketch.__table__).where(EmotionSketch.user_id == user_id))
+        db.commit()
+
+        store = memory_archive.cold_store(db.get_bind())
+        counts["archived_memories"] = store.remove_user(user_id, deleter.chunk_size) if store else 0
+        vectors = memory_vectors.vector_store(db.get_bind())
+        counts["memory_vectors"] = vectors.remove_user(user_id) if vectors else 0
+    finally:
+        db.close()
+        bump_users([user_id])
+
+    db = main_factory()
+    try:
+        history = DAppHistory.__table__
+        usage = APIUsageLog.__table__
+        counts["dapp_history"] = deleter.rows(db, history, history.c.user_id == user_id)
+        counts["api_usage_log"] = deleter.nullify(db, usage, "user_id", usage.c.user_id == user_id)
+        counts["users"] = db.execute(delete(User.__table__).where(User.id == user_id)).rowcount
+        db.commit()
+    finally:
+        db.close()
+    return counts
+
+
+# ==================== 后台任务 ====================
+
+class DeletionJob:
+    """一个删除任务"""
+
+    def __init__(self, user_id: int, session_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.session_id = session_id
+        self.status = "queued"  # queued / running / done / failed
+        self.deleted: Dict[str, int] = {}
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def kind(self) -> str:
+        return "session" if self.session_id is not None else "user"
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "deleted": self.deleted,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class BulkDeleter:
+    """
+    删除任务队列
+
+    submit_user / submit_session 立即返回任务；同一目标已有未完成任务时返回该任务。
+    任务由一个后台线程串行执行（删除本身已分块，串行避免多个任务争用写锁）
+    """
+
+    def __init__(
+        self,
+        router: ShardRouter = shard_router,
+        main_factory=SessionLocal,
+        deleter: Optional[ChunkedDeleter] = None
+    ):
+        self.router = router
+        self.main_factory = main_factory
+        self.deleter = deleter or ChunkedDeleter()
+        self._jobs: "OrderedDict[str, DeletionJob]" = OrderedDict()
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def submit_user(self, user_id: int) -> DeletionJob:
+        return self._submit(user_id, None)
+
+    def submit_session(self, user_id: int, session_id: int) -> DeletionJob:
+        return self._submit(user_id, session_id)
+
+    def get(self, job_id: str) -> Optional[DeletionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _submit(self, user_id: int, session_id: Optional[int]) -> DeletionJob:
+        with self._lock:
+            for job in self._jobs.values():
+                if (job.user_id, job.session_id) == (user_id, session_id) and job.status in ("queued", "running"):
+                    return job
+            job = DeletionJob(user_id, session_id)
+            self._jobs[job.id] = job
+            while len(self._jobs) > BULK_DELETE_KEEP_JOBS:
+                self._jobs.popitem(last=False)
+        self._queue.put(job)
+        self.start()
+        return job
+
+    def run(self, job: DeletionJob):
+        """在当前线程执行一个任务"""
+        job.status = "running"
+        started = time.monotonic()
+        try:
+            if job.session_id is None:
+                job.deleted = purge_user(job.user_id, self.router, self.main_factory, self.deleter)
+            else:
+                db = self.router.session(job.user_id)
+                try:
+                    job.deleted = purge_session(db, job.user_id, job.session_id, self.deleter)
+                finally:
+                    db.close()
+            job.status = "done"
+            logger.info(
+                f"删除任务 {job.id} 完成（{job.kind} user={job.user_id}），"
+                f"耗时 {time.monotonic() - started:.1f}s: {job.deleted}"
+            )
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"删除任务 {job.id} 失败: {e}")
+        finally:
+            job.finished_at = datetime.utcnow()
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="bulk-deleter", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """停止线程（当前任务完成当前块后结束，未开始的任务需重新提交）"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wait(self):
+        """阻塞直到已提交的任务全部执行完"""
+        self._queue.join()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.run(job)
+            finally:
+                self._queue.task_done()
+
+
+# 全局实例（首次提交任务时启动后台线程）
+bulk_deleter = BulkDeleter()
+
+
+def stop_bulk_deleter():
+    bulk_deleter.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="批量删除用户或会话数据")
+    parser.add_argument("--user", type=int, required=True, help="用户ID")
+    parser.add_argument("--session", type=int, help="只删除该会话")
+    args = parser.parse_args()
+
+    job = DeletionJob(args.user, args.session)
+    bulk_deleter.run(job)
+    print(f"{'✓' if job.status == 'done' else '✗'} {job.to_dict()}")
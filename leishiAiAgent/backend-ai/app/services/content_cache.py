@@ -0,0 +1,458 @@
+"""
+内容缓存管理
+文件: backend-ai/app/services/content_cache.py
+功能: 管理 content_cache 表（生成的音频、文本、图片）
+      - 每个 cache_type 有独立的字节预算，写入后超出预算时按 LRU 或 LFU 淘汰
+      - 命中只在内存中计数，由后台线程定期批量写回 hit_count / last_accessed_at，
+        读路径不产生写事务
+      - 过期行由后台线程分小批删除，每批一个短事务，不长时间占用写锁
+
+      缓存表在主库（不分片）；字节用量在进程内累计，每轮清理后按表重新校准
+
+用法:
+    python -m app.services.content_cache --status   # 各类型用量
+    python -m app.services.content_cache --sweep    # 立即清理过期并执行预算
+"""
+
+import os
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List
+
+from sqlalchemy import select, update, delete, func, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.models.emotion import ContentCache, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# 淘汰策略: lru（最久未访问）或 lfu（命中最少，其次最久未访问）
+CACHE_POLICY = os.getenv("CONTENT_CACHE_POLICY", "lru")
+# 各类型字节预算（MB），如 "audio=512,text=16,image=128"；未列出的类型使用默认值
+CACHE_BUDGETS_MB = os.getenv("CONTENT_CACHE_BUDGETS_MB", "audio=512,text=16,image=128")
+CACHE_DEFAULT_BUDGET_MB = float(os.getenv("CONTENT_CACHE_DEFAULT_BUDGET_MB", "64"))
+CACHE_DEFAULT_TTL_S = int(os.getenv("CONTENT_CACHE_DEFAULT_TTL_S", str(7 * 86400)))
+# 命中计数写回间隔、过期清理间隔
+CACHE_HIT_FLUSH_S = float(os.getenv("CONTENT_CACHE_HIT_FLUSH_S", "5"))
+CACHE_SWEEP_INTERVAL_S = float(os.getenv("CONTENT_CACHE_SWEEP_INTERVAL_S", "60"))
+# 每个删除事务的行数，以及批次之间让出写锁的时间
+CACHE_SWEEP_BATCH = int(os.getenv("CONTENT_CACHE_SWEEP_BATCH", "200"))
+CACHE_SWEEP_PAUSE_MS = float(os.getenv("CONTENT_CACHE_SWEEP_PAUSE_MS", "10"))
+
+POLICIES = ("lru", "lfu")
+
+
+def parse_budgets(spec: str, unit: int = 1024 * 1024) -> Dict[str, int]:
+    """解析 "audio=512,text=16" 形式的预算配置，返回字节数"""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        cache_type, _, value = item.partition("=")
+        budgets[cache_type.strip()] = int(float(value) * unit)
+    return budgets
+
+
+def content_size(content: Optional[str]) -> int:
+    """缓存内容占用的字节数（UTF-8）"""
+    return len(content.encode("utf-8")) if content else 0
+
+
+class ContentCacheManager:
+    """
+    按类型限额的内容缓存
+
+    - get(key): 读取未过期的内容，命中计数先记在内存
+    - put(key, cache_type, content): 写入或覆盖，超出该类型预算时淘汰
+    - flush_hits(): 把内存中的命中计数批量写回
+    - sweep(): 分批删除过期行并执行所有类型的预算
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        budgets: Optional[Dict[str, int]] = None,
+        default_budget: int = int(CACHE_DEFAULT_BUDGET_MB * 1024 * 1024),
+        policy: str = CACHE_POLICY,
+        default_ttl: int = CACHE_DEFAULT_TTL_S,
+        sweep_batch: int = CACHE_SWEEP_BATCH,
+        sweep_pause_ms: float = CACHE_SWEEP_PAUSE_MS
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的淘汰策略: {policy}（可选 {', '.join(POLICIES)}）")
+        self.session_factory = session_factory
+        self.budgets = parse_budgets(CACHE_BUDGETS_MB) if budgets is None else budgets
+        self.default_budget = default_budget
+        self.policy = policy
+        self.default_ttl = default_ttl
+        self.sweep_batch = sweep_batch
+        self.sweep_pause = sweep_pause_ms / 1000
+
+        # cache_key -> [未写回的命中次数, 最后访问时间]
+        self._hits: Dict[str, List] = {}
+        # cache_type -> 字节用量；None 表示尚未从表中加载
+        self._usage: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+
+        self.stats = {"hits": 0, "misses": 0, "puts": 0, "evicted": 0, "expired": 0}
+
+    def budget_for(self, cache_type: str) -> int:
+        return self.budgets.get(cache_type, self.default_budget)
+
+    # ==================== 读写 ====================
+
+    def get(self, cache_key: str, now: Optional[datetime] = None) -> Optional[str]:
+        """读取缓存内容，不存在或已过期返回 None（过期行留给清理线程删除）"""
+        now = now or datetime.utcnow()
+        table = ContentCache.__table__
+        db = self.session_factory()
+        try:
+            row = db.execute(
+                select(table.c.content, table.c.expire_at).where(table.c.cache_key == cache_key)
+            ).first()
+        finally:
+            db.close()
+
+        if row is None or (row.expire_at is not None and row.expire_at <= now):
+            self.stats["misses"] += 1
+            return None
+
+        with self._lock:
+            entry = self._hits.setdefault(cache_key, [0, now])
+            entry[0] += 1
+            entry[1] = max(entry[1], now)
+        self.stats["hits"] += 1
+        return row.content
+
+    def put(
+        self,
+        cache_key: str,
+        cache_type: str,
+        content: str,
+        ttl: Optional[int] = None,
+        now: Optional[datetime] = None
+    ):
+        """
+        写入缓存（同一键覆盖旧内容），之后该类型超出预算时立即淘汰
+
+        Args:
+            ttl: 存活秒数，默认 default_ttl；0 表示不过期
+        """
+        now = now or datetime.utcnow()
+        ttl = self.default_ttl if ttl is None else ttl
+        size = content_size(content)
+        if size > self.budget_for(cache_type):
+            logger.warning(f"缓存内容 {size} 字节超过 {cache_type} 类型预算，不写入")
+            return
+
+        table = ContentCache.__table__
+        db = self.session_factory()
+        try:
+            usage = self._load_usage(db)
+            connection = db.connection()
+            previous = connection.execute(
+                select(table.c.cache_type, table.c.size_bytes).where(table.c.cache_key == cache_key)
+            ).first()
+
+            insert = pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+            stmt = insert(table).values(
+                cache_key=cache_key,
+                cache_type=cache_type,
+                content=content,
+                size_bytes=size,
+                created_at=now,
+                last_accessed_at=now,
+                expire_at=now + timedelta(seconds=ttl) if ttl else None,
+                hit_count=0
+            )
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.cache_key],
+                set_={
+                    column: stmt.excluded[column]
+                    for column in ("cache_type", "content", "size_bytes", "created_at",
+                                   "last_accessed_at", "expire_at", "hit_count")
+                }
+            ))
+            db.commit()
+
+            with self._lock:
+                if previous is not None:
+                    usage[previous.cache_type] = usage.get(previous.cache_type, 0) - (previous.size_bytes or 0)
+                usage[cache_type] = usage.get(cache_type, 0) + size
+                over = usage[cache_type] > self.budget_for(cache_type)
+            self.stats["puts"] += 1
+
+            if over:
+                self._enforce(db, cache_type)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def invalidate(self, cache_key: str) -> bool:
+        """删除一个缓存键"""
+        table = ContentCache.__table__
+        db = self.session_factory()
+        try:
+            usage = self._load_usage(db)
+            row = db.execute(
+                delete(table).where(table.c.cache_key == cache_key)
+                .returning(table.c.cache_type, table.c.size_bytes)
+            ).first()
+            db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            self._hits.pop(cache_key, None)
+            if row is not None:
+                usage[row.cache_type] = usage.get(row.cache_type, 0) - (row.size_bytes or 0)
+        return row is not None
+
+    # ==================== 命中计数 ====================
+
+    def flush_hits(self) -> int:
+        """把内存中累计的命中次数批量写回，返回写回的键数"""
+        with self._lock:
+            pending, self._hits = self._hits, {}
+        if not pending:
+            return 0
+
+        table = ContentCache.__table__
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(table)
+                .where(table.c.cache_key == bindparam("key"))
+                .values(
+                    hit_count=func.coalesce(table.c.hit_count, 0) + bindparam("hits"),
+                    last_accessed_at=bindparam("accessed")
+                ),
+                [{"key": key, "hits": hits, "accessed": accessed} for key, (hits, accessed) in pending.items()]
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 写回失败时放回内存，下一轮重试
+            with self._lock:
+                for key, (hits, accessed) in pending.items():
+                    entry = self._hits.setdefault(key, [0, accessed])
+                    entry[0] += hits
+                    entry[1] = max(entry[1], accessed)
+            raise
+        finally:
+            db.close()
+        return len(pending)
+
+    # ==================== 淘汰与清理 ====================
+
+    def _load_usage(self, db) -> Dict[str, int]:
+        with self._lock:
+            if self._usage is None:
+                self._usage = self._table_usage(db)
+            return self._usage
+
+    @staticmethod
+    def _table_usage(db) -> Dict[str, int]:
+        table = ContentCache.__table__
+        return {
+            cache_type: int(total or 0)
+            for cache_type, total in db.execute(
+                select(table.c.cache_type, func.sum(table.c.size_bytes)).group_by(table.c.cache_type)
+            )
+        }
+
+    def _victims(self, cache_type: str):
+        """按策略排序的淘汰候选"""
+        table = ContentCache.__table__
+        if self.policy == "lfu":
+            order = (table.c.hit_count, table.c.last_accessed_at, table.c.id)
+        else:
+            order = (table.c.last_accessed_at, table.c.id)
+        return (
+            select(table.c.id, table.c.cache_key, table.c.size_bytes)
+            .where(table.c.cache_type == cache_type)
+            .order_by(*order)
+            .limit(self.sweep_batch)
+        )
+
+    def _enforce(self, db, cache_type: str) -> int:
+        """淘汰 cache_type 的条目直到用量不超过预算，返回淘汰的行数"""
+        # 先写回命中计数，LRU/LFU 排序才准确
+        self.flush_hits()
+
+        table = ContentCache.__table__
+        usage = self._load_usage(db)
+        budget = self.budget_for(cache_type)
+        evicted = 0
+        while usage.get(cache_type, 0) > budget:
+            excess = usage[cache_type] - budget
+            ids, freed = [], 0
+            for row in db.execute(self._victims(cache_type)):
+                ids.append(row.id)
+                freed += row.size_bytes or 0
+                if freed >= excess:
+                    break
+            if not ids:
+                # 内存中的用量与表不一致，按表重新校准
+                with self._lock:
+                    usage[cache_type] = self._table_usage(db).get(cache_type, 0)
+                break
+
+            db.execute(delete(table).where(table.c.id.in_(ids)))
+            db.commit()
+            with self._lock:
+                usage[cache_type] -= freed
+            evicted += len(ids)
+
+        self.stats["evicted"] += evicted
+        if evicted:
+            logger.info(f"缓存 {cache_type} 超出预算，按 {self.policy} 淘汰 {evicted} 条")
+        return evicted
+
+    def sweep(self, now: Optional[datetime] = None, max_batches: Optional[int] = None) -> int:
+        """
+        分批删除过期行，然后重新校准用量并执行所有类型的预算
+
+        每批一个短事务，批次之间暂停 sweep_pause 秒让出写锁
+
+        Returns:
+            删除的过期行数
+        """
+        now = now or datetime.utcnow()
+        table = ContentCache.__table__
+        expired_ids = (
+            select(table.c.id)
+            .where(table.c.expire_at.isnot(None), table.c.expire_at <= now)
+            .limit(self.sweep_batch)
+        )
+
+        total, batches = 0, 0
+        db = self.session_factory()
+        try:
+            while max_batches is None or batches < max_batches:
+                deleted = db.execute(delete(table).where(table.c.id.in_(expired_ids))).rowcount
+                db.commit()
+                total += deleted
+                batches += 1
+                if deleted < self.sweep_batch:
+                    break
+                time.sleep(self.sweep_pause)
+
+            usage = self._table_usage(db)
+            db.commit()
+            with self._lock:
+                self._usage = usage
+            for cache_type in list(usage):
+                self._enforce(db, cache_type)
+        finally:
+            db.close()
+
+        self.stats["expired"] += total
+        if total:
+            logger.info(f"缓存清理: 删除 {total} 条过期内容")
+        return total
+
+    def usage(self) -> Dict[str, Dict]:
+        """各类型的 {bytes, budget, rows}（直接查表）"""
+        table = ContentCache.__table__
+        db = self.session_factory()
+        try:
+            rows = db.execute(
+                select(table.c.cache_type, func.count(), func.sum(table.c.size_bytes))
+                .group_by(table.c.cache_type)
+            ).all()
+        finally:
+            db.close()
+        return {
+            cache_type: {"bytes": int(total or 0), "budget": self.budget_for(cache_type), "rows": count}
+            for cache_type, count, total in rows
+        }
+
+
+# ==================== 后台线程 ====================
+
+class ContentCacheSweeper:
+    """每 hit_flush 秒写回命中计数，每 sweep_interval 秒清理过期内容"""
+
+    def __init__(
+        self,
+        manager: ContentCacheManager,
+        hit_flush: float = CACHE_HIT_FLUSH_S,
+        sweep_interval: float = CACHE_SWEEP_INTERVAL_S
+    ):
+        self.manager = manager
+        self.hit_flush = hit_flush
+        self.sweep_interval = sweep_interval
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="content-cache-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """停止线程并写回剩余的命中计数"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        try:
+            self.manager.flush_hits()
+        except Exception as e:
+            logger.error(f"写回缓存命中计数失败: {e}")
+
+    def _run(self):
+        next_sweep = time.monotonic() + self.sweep_interval
+        while not self._stopping.wait(self.hit_flush):
+            try:
+                self.manager.flush_hits()
+                if time.monotonic() >= next_sweep:
+                    self.manager.sweep()
+                    next_sweep = time.monotonic() + self.sweep_interval
+            except Exception as e:
+                logger.error(f"缓存维护失败: {e}")
+
+
+# 全局实例
+content_cache = ContentCacheManager()
+_sweeper: Optional[ContentCacheSweeper] = None
+
+
+def start_content_cache_sweeper() -> ContentCacheSweeper:
+    """启动缓存后台维护线程"""
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = ContentCacheSweeper(content_cache)
+        _sweeper.start()
+    return _sweeper
+
+
+def stop_content_cache_sweeper():
+    global _sweeper
+    if _sweeper:
+        _sweeper.stop()
+        _sweeper = None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="内容缓存维护")
+    parser.add_argument("--status", action="store_true", help="显示各类型的用量和预算")
+    parser.add_argument("--sweep", action="store_true", help="立即清理过期内容并执行预算")
+    args = parser.parse_args()
+
+    if args.sweep:
+        count = content_cache.sweep()
+        print(f"✓ 清理完成，删除 {count} 条过期内容，淘汰 {content_cache.stats['evicted']} 条")
+    if args.status or not args.sweep:
+        for cache_type, info in sorted(content_cache.usage().items()):
+            print(
+                f"{cache_type:<8} {info['rows']:>8} 条  "
+                f"{info['bytes'] / 1024 / 1024:>8.1f} / {info['budget'] / 1024 / 1024:.0f} MB"
+            )
@@ -0,0 +1,62 @@
+"""
+时间序列降采样
+文件: backend-ai/app/services/downsample.py
+功能: Largest-Triangle-Three-Buckets (LTTB) 降采样，长时间线只返回 max_points 个代表点，
+      保留峰谷形状；多条序列（强度、效价）共用一组采样点，按各自值域归一化后面积相加。
+      每个桶内候选点的三角形面积用 numpy 向量化计算，只在桶之间循环
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+
+
+def lttb_indices(x: Sequence[float], series: Sequence[Sequence[float]], max_points: int) -> List[int]:
+    """
+    选出 LTTB 代表点的下标（升序，始终包含首尾两点）
+
+    Args:
+        x: 横坐标（升序，如日期序号）
+        series: 一条或多条与 x 等长的纵坐标序列，缺失值用 NaN
+        max_points: 最多保留的点数（小于3时按3处理）
+
+    Returns:
+        被保留的点在原序列中的下标
+    """
+    n = len(x)
+    max_points = max(3, max_points)
+    if n <= max_points:
+        return list(range(n))
+
+    xs = np.asarray(x, dtype=np.float64)
+    ys = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    # 缺失值按序列均值处理；按值域归一化，避免某条序列主导面积
+    means = np.nanmean(ys, axis=1, keepdims=True)
+    ys = np.where(np.isnan(ys), np.nan_to_num(means), ys)
+    spans = np.ptp(ys, axis=1, keepdims=True)
+    ys = (ys - ys.min(axis=1, keepdims=True)) / np.where(spans > 0, spans, 1.0)
+
+    # 首尾之外的点均分到 max_points - 2 个桶: 第 i 个桶为 [edges[i], edges[i+1])
+    buckets = max_points - 2
+    edges = (np.arange(buckets + 1) * (n - 2) / buckets).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # 每个桶的平均点（作为下一桶的第三个顶点），最后一个桶之后是终点
+    x_sums = np.add.reduceat(xs[1:n - 1], edges[:-1] - 1)
+    y_sums = np.add.reduceat(ys[:, 1:n - 1], edges[:-1] - 1, axis=1)
+    sizes = np.diff(edges)
+    avg_x = np.append(x_sums / sizes, xs[-1])
+    avg_y = np.concatenate([y_sums / sizes, ys[:, -1:]], axis=1)
+
+    selected = [0]
+    a = 0
+    for i in range(buckets):
+        start, end = edges[i], edges[i + 1]
+        cx, cy = avg_x[i + 1], avg_y[:, i + 1:i + 2]
+        bx, by = xs[start:end], ys[:, start:end]
+        # 以 a、候选点 b、下一桶均值 c 为顶点的三角形面积（省略常数 1/2）
+        areas = np.abs((xs[a] - cx) * (by - ys[:, a:a + 1]) - (xs[a] - bx) * (cy - ys[:, a:a + 1])).sum(axis=0)
+        a = int(start + np.argmax(areas))
+        selected.append(a)
+    selected.append(n - 1)
+    return selected
@@ -11,6 +11,8 @@ from typing import Optional, Dict, List
 import os
 from datetime import datetime
 
+from app.services import api_usage
+
 class EmotionAnalyzer:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -81,7 +83,7 @@ class EmotionAnalyzer:
             audio_bytes = base64.b64decode(audio_base64)
             
             # 使用Whisper API
-            transcription = await openai.Audio.atranscribe(
+            transcription = await api_usage.transcription(
                 model="whisper-1",
                 file=audio_bytes,
                 response_format="verbose_json"
@@ -105,7 +107,7 @@ class EmotionAnalyzer:
             }}
             """
             
-            response = await openai.ChatCompletion.acreate(
+            response = await api_usage.chat_completion(
                 model="gpt-4-turbo-preview",
                 messages=[
                     {"role": "system", "content": "你是一个专业的情感分析专家。"},
@@ -174,7 +176,7 @@ class EmotionAnalyzer:
         """
         
         try:
-            response = await openai.ChatCompletion.acreate(
+            response = await api_usage.chat_completion(
                 model="gpt-4-turbo-preview",
                 messages=[
                     {"role": "system", "content": "你是情感分析专家,擅长理解不同年龄段和场景的情感表达。"},
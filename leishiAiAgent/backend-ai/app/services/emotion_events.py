@@ -0,0 +1,286 @@
+"""
+情绪读数事件服务
+文件: backend-ai/app/services/emotion_events.py
+功能: emotion_events 窄表的编码和按天聚合；统计接口从这里读取。
+      情绪识别的高频读数只写这张表（经写后队列批量提交），
+      不再为每次识别创建记忆；单独创建的记忆同步写一条 source=memory 的事件
+"""
+
+import logging
+from types import SimpleNamespace
+from datetime import datetime, date
+from typing import List, Tuple, Optional
+
+from sqlalchemy import event, func, select, update, delete, case, literal, and_, or_, true
+from sqlalchemy.orm import Session as OrmSession, attributes
+
+from app.models.emotion import EmotionEvent, Memory, EMOTION_CODES, EMOTION_NAMES, EVENT_SOURCES
+from app.services import memory_archive
+from app.services.pagination import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+
+def emotion_code(emotion) -> int:
+    """情绪名称 -> 编码，未知情绪记为 unknown"""
+    return EMOTION_CODES.get(emotion or "unknown", EMOTION_CODES["unknown"])
+
+
+def daily_counts(db, user_id: int, start_day: date) -> List[Tuple[date, str, int, float]]:
+    """
+    用户自 start_day 起每天各情绪的读数次数和强度之和
+
+    Returns:
+        [(day, emotion, count, sum_intensity), ...]，与 emotion_rollup.query_daily 的行结构相同
+    """
+    day = func.date(EmotionEvent.ts)
+    rows = db.execute(
+        select(day, EmotionEvent.emotion, func.count(), func.sum(EmotionEvent.intensity))
+        .where(
+            EmotionEvent.user_id == user_id,
+            EmotionEvent.ts >= datetime.combine(start_day, datetime.min.time())
+        )
+        .group_by(day, EmotionEvent.emotion)
+        .order_by(day)
+    ).all()
+    return [
+        (
+            date.fromisoformat(d) if isinstance(d, str) else d,
+            EMOTION_NAMES.get(code, "unknown"),
+            count,
+            float(total or 0.0)
+        )
+        for d, code, count, total in rows
+    ]
+
+
+def backfill_from_memories(db) -> int:
+    """
+    由已有记忆生成读数事件（迁移用；此前每次识别都写一条记忆）
+
+    Returns:
+        写入的事件数
+    """
+    emotion = case(
+        *((Memory.emotion_type == name, literal(code)) for name, code in EMOTION_CODES.items()),
+        else_=literal(EMOTION_CODES["unknown"])
+    )
+    # SQLAlchemy在psycopg下拿不到 INSERT ... SELECT 的rowcount（恒为-1），改为前后计数
+    count = select(func.count()).select_from(EmotionEvent.__table__)
+    before = db.execute(count).scalar()
+    db.execute(
+        EmotionEvent.__table__.insert().from_select(
+            ["user_id", "session_id", "ts", "emotion", "intensity", "source"],
+            select(
+                Memory.user_id,
+                Memory.session_id,
+                func.coalesce(Memory.created_at, func.current_timestamp()),
+                emotion,
+                func.coalesce(Memory.emotion_intensity, 0.5),
+                literal(EVENT_SOURCES["memory"])
+            ).where(Memory.user_id.isnot(None)).order_by(Memory.id)
+        )
+    )
+    return db.execute(count).scalar() - before
+
+
+# ==================== 记忆事件 ====================
+
+_MEMORY_EVENT_ATTRS = ("emotion_type", "emotion_intensity", "created_at")
+_WITH_READING_KEY = "memories_with_reading"
+
+
+def memory_event(user_id: int, session_id, created_at: datetime, emotion_type, intensity) -> dict:
+    """一条记忆对应的读数事件行（记忆强度为空时按列默认值 0.5 计）"""
+    return {
+        "user_id": user_id,
+        "session_id": session_id,
+        "ts": created_at,
+        "emotion": emotion_code(emotion_type),
+        "intensity": 0.5 if intensity is None else intensity,
+        "source": EVENT_SOURCES["memory"]
+    }
+
+
+def _memory_event_id(row):
+    """与记忆行对应的一条 source=memory 事件（事件表不记录记忆ID，按用户、时间和情绪匹配）"""
+    return (
+        select(EmotionEvent.id)
+        .where(
+            EmotionEvent.user_id == row["user_id"],
+            EmotionEvent.ts == row["created_at"],
+            EmotionEvent.emotion == emotion_code(row["emotion_type"]),
+            EmotionEvent.source == EVENT_SOURCES["memory"]
+        )
+        .order_by(EmotionEvent.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def remove_memory_events(connection, rows) -> int:
+    """
+    删除记忆时同步删除对应的 source=memory 事件（绕过ORM删除记忆的路径调用）
+
+    Args:
+        rows: 含 user_id, created_at, emotion_type 的映射
+
+    Returns:
+        删除的事件数
+    """
+    removed = 0
+    for row in rows:
+        if row["user_id"] is not None:
+            removed += connection.execute(
+                delete(EmotionEvent.__table__).where(EmotionEvent.id == _memory_event_id(row))
+            ).rowcount
+    return removed
+
+
+def mark_with_reading(session: OrmSession, memory: Memory):
+    """记忆随一条识别读数一起写入（写后队列），统计已包含那条读数，不再生成事件"""
+    session.info.setdefault(_WITH_READING_KEY, set()).add(memory)
+
+
+def _committed_row(session: OrmSession, obj: Memory):
+    return session.connection().execute(
+        select(Memory.user_id, Memory.created_at, Memory.emotion_type).where(Memory.id == obj.id)
+    ).mappings().first()
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _sync_memory_events(session, flush_context, instances):
+    """经ORM增删改记忆时在同一事务中维护对应的读数事件，统计接口只读事件表"""
+    with_reading = session.info.pop(_WITH_READING_KEY, set())
+    for obj in list(session.new):
+        if isinstance(obj, Memory) and obj.user_id is not None and obj not in with_reading:
+            # 与汇总钩子一样显式补齐时间戳，事件时间与落库值一致
+            if obj.created_at is None:
+                obj.created_at = datetime.utcnow()
+            session.add(EmotionEvent(**memory_event(
+                obj.user_id, obj.session_id, obj.created_at, obj.emotion_type, obj.emotion_intensity
+            )))
+
+    for obj in session.deleted:
+        if isinstance(obj, Memory):
+            row = _committed_row(session, obj)
+            if row is not None:
+                remove_memory_events(session.connection(), [row])
+
+    for obj in session.dirty:
+        if isinstance(obj, Memory) and any(
+            attributes.get_history(obj, attr).has_changes() for attr in _MEMORY_EVENT_ATTRS
+        ):
+            row = _committed_row(session, obj)
+            if row is not None and row["user_id"] is not None:
+                session.connection().execute(
+                    update(EmotionEvent.__table__)
+                    .where(EmotionEvent.id == _memory_event_id(row))
+                    .values(
+                        ts=obj.created_at,
+                        emotion=emotion_code(obj.emotion_type),
+                        intensity=0.5 if obj.emotion_intensity is None else obj.emotion_intensity
+                    )
+                )
+
+
+# ==================== 情绪历史 ====================
+
+# 同一时间戳内的合并顺序：记忆在前、识别读数在后（倒序）
+HISTORY_EVENT, HISTORY_MEMORY = 0, 1
+# 游标之后同一时间戳的行全部保留 / 全部跳过时使用的ID边界
+_MAX_ID = 2 ** 63 - 1
+
+_SOURCE_NAMES = {code: name for name, code in EVENT_SOURCES.items()}
+
+
+def _keyset(ts_column, id_column, after: Optional[Tuple[datetime, int]]):
+    """(ts, id) 倒序下位于 after 之后的条件"""
+    if after is None:
+        return true()
+    return and_(ts_column <= after[0], or_(ts_column < after[0], id_column < after[1]))
+
+
+def history_page(db, user_id: int, limit: int, cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """
+    用户的情绪历史：识别读数（emotion_events，不含由记忆生成的事件）和记忆（热表与归档）
+    按 (时间, 类型, ID) 倒序合并后的一页
+
+    每个来源从游标处各取 limit + 1 行再归并，翻页成本与页码无关
+
+    Returns:
+        ([行(id, source, emotion_type, emotion_intensity, created_at, content_summary)], 下一页游标)
+
+    Raises:
+        InvalidCursorError: 游标格式不正确
+    """
+    position = decode_cursor(cursor, datetime, int, int) if cursor else None
+
+    def after(kind: int) -> Optional[Tuple[datetime, int]]:
+        if position is None:
+            return None
+        ts, last_kind, last_id = position
+        if kind == last_kind:
+            return ts, last_id
+        # 同一时间戳内排在游标类型之后的来源全部保留，之前的全部跳过
+        return ts, _MAX_ID if kind < last_kind else 0
+
+    events = db.execute(
+        select(EmotionEvent.id, EmotionEvent.ts, EmotionEvent.emotion, EmotionEvent.intensity, EmotionEvent.source)
+        .where(
+            EmotionEvent.user_id == user_id,
+            EmotionEvent.source != EVENT_SOURCES["memory"],
+            _keyset(EmotionEvent.ts, EmotionEvent.id, after(HISTORY_EVENT))
+        )
+        .order_by(EmotionEvent.ts.desc(), EmotionEvent.id.desc())
+        .limit(limit + 1)
+    ).all()
+    rows = [
+        (HISTORY_EVENT, SimpleNamespace(
+            id=event.id,
+            source=_SOURCE_NAMES.get(event.source, "text"),
+            emotion_type=EMOTION_NAMES.get(event.emotion, "unknown"),
+            emotion_intensity=event.intensity,
+            created_at=event.ts,
+            content_summary=""
+        ))
+        for event in events
+    ]
+
+    memories = db.execute(
+        select(
+            Memory.id,
+            Memory.emotion_type,
+            Memory.emotion_intensity,
+            Memory.created_at,
+            func.coalesce(
+                func.nullif(Memory.summary, ""), func.substr(Memory.content_head, 1, 100)
+            ).label("content_summary")
+        )
+        .where(Memory.user_id == user_id, _keyset(Memory.created_at, Memory.id, after(HISTORY_MEMORY)))
+        .order_by(Memory.created_at.desc(), Memory.id.desc())
+        .limit(limit + 1)
+    ).all()
+    rows.extend((HISTORY_MEMORY, SimpleNamespace(source="memory", **memory._asdict())) for memory in memories)
+
+    # 归档的记忆与热表ID不重叠，同属记忆类型
+    store = memory_archive.cold_store(db.get_bind())
+    if store is not None:
+        rows.extend(
+            (HISTORY_MEMORY, SimpleNamespace(
+                id=memory["id"],
+                source="memory",
+                emotion_type=memory.get("emotion_type"),
+                emotion_intensity=memory.get("emotion_intensity"),
+                created_at=memory["created_at"],
+                content_summary=memory.get("summary") or (memory.get("content") or "")[:100]
+            ))
+            for memory in store.scan(user_id, after(HISTORY_MEMORY), limit + 1)
+        )
+
+    rows.sort(key=lambda item: (item[1].created_at, item[0], item[1].id), reverse=True)
+    if len(rows) <= limit:
+        return [row for _, row in rows], None
+    rows = rows[:limit]
+    kind, last = rows[-1]
+    return [row for _, row in rows], encode_cursor(last.created_at, kind, last.id)
@@ -0,0 +1,447 @@
+"""
+每日情绪汇总服务
+文件: backend-ai/app/services/emotion_rollup.py
+功能: 在记忆增删改的同一事务中增量维护 emotion_daily_rollup 表
+      及其上层的按周/按月汇总（emotion_period_rollup，汇总金字塔），
+      并为时间线、趋势和统计接口提供按天/周/月聚合的读取；
+      跨用户统计在记忆分片上并行扇出后合并
+"""
+
+import logging
+import argparse
+from datetime import datetime, date, timedelta
+from typing import Optional, List, Dict, Tuple
+
+from sqlalchemy import event, func, select, delete
+from sqlalchemy.orm import Session as OrmSession, attributes
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.models.emotion import Memory, EmotionDailyRollup, EmotionPeriodRollup, ROLLUP_LEVELS
+from app.models.sharding import ShardRouter, shard_router
+
+logger = logging.getLogger(__name__)
+
+# 情绪为空的记忆归入该类别（主键列不能为NULL）
+UNKNOWN_EMOTION = "unknown"
+
+# 与 Memory.emotion_intensity 的列默认值保持一致
+DEFAULT_INTENSITY = 0.5
+
+RollupKey = Tuple[int, date, str]
+PeriodKey = Tuple[int, str, date, str]
+
+
+# ==================== 增量维护 ====================
+
+def _rollup_key(user_id, created_at, emotion_type) -> Optional[RollupKey]:
+    if user_id is None:
+        return None
+    created_at = created_at or datetime.utcnow()
+    return (user_id, created_at.date(), emotion_type or UNKNOWN_EMOTION)
+
+
+def _intensity(value) -> float:
+    return DEFAULT_INTENSITY if value is None else value
+
+
+def period_start(day: date, level: str) -> date:
+    """日期所在周期的起点: day 原样返回，week 为周一，month 为月初"""
+    if level == "week":
+        return day - timedelta(days=day.weekday())
+    if level == "month":
+        return day.replace(day=1)
+    return day
+
+
+def period_deltas(deltas: Dict[RollupKey, List[float]]) -> Dict[PeriodKey, List[float]]:
+    """把每日增量折算到周/月汇总"""
+    periods: Dict[PeriodKey, List[float]] = {}
+    for (user_id, day, emotion_type), (count, sum_intensity) in deltas.items():
+        for level in ROLLUP_LEVELS:
+            delta = periods.setdefault((user_id, level, period_start(day, level), emotion_type), [0, 0.0])
+            delta[0] += count
+            delta[1] += sum_intensity
+    return periods
+
+
+_ROLLUP_ATTRS = ("user_id", "created_at", "emotion_type", "emotion_intensity")
+
+
+def _committed_key(session: OrmSession, obj: Memory) -> Tuple[Optional[RollupKey], float]:
+    """取记忆在本次flush之前（数据库中）的汇总键和强度"""
+    values = {}
+    for attr in _ROLLUP_ATTRS:
+        history = attributes.get_history(obj, attr)
+        if history.deleted:
+            values[attr] = history.deleted[0]
+        elif history.unchanged:
+            values[attr] = history.unchanged[0]
+        elif not history.added:
+            values[attr] = getattr(obj, attr)
+
+    # 对象过期后被修改时旧值未加载，直接从数据库读取
+    if len(values) < len(_ROLLUP_ATTRS):
+        row = session.connection().execute(
+            select(*(getattr(Memory, attr) for attr in _ROLLUP_ATTRS)).where(Memory.id == obj.id)
+        ).first()
+        if row is None:
+            return None, 0.0
+        values = dict(zip(_ROLLUP_ATTRS, row))
+
+    key = _rollup_key(values["user_id"], values["created_at"], values["emotion_type"])
+    return key, _intensity(values["emotion_intensity"])
+
+
+def _add(deltas: Dict[RollupKey, List[float]], key: Optional[RollupKey], count: int, intensity: float):
+    if key is None:
+        return
+    delta = deltas.setdefault(key, [0, 0.0])
+    delta[0] += count
+    delta[1] += intensity
+
+
+def collect_deltas(session: OrmSession) -> Dict[RollupKey, List[float]]:
+    """根据会话中待flush的记忆变更计算汇总表增量"""
+    deltas: Dict[RollupKey, List[float]] = {}
+
+    for obj in session.new:
+        if isinstance(obj, Memory):
+            # 显式补齐时间戳，保证汇总日期与落库值一致
+            if obj.created_at is None:
+                obj.created_at = datetime.utcnow()
+            _add(deltas, _rollup_key(obj.user_id, obj.created_at, obj.emotion_type),
+                 1, _intensity(obj.emotion_intensity))
+
+    for obj in session.deleted:
+        if isinstance(obj, Memory):
+            key, intensity = _committed_key(session, obj)
+            _add(deltas, key, -1, -intensity)
+
+    for obj in session.dirty:
+        if isinstance(obj, Memory) and session.is_modified(obj):
+            key, intensity = _committed_key(session, obj)
+            _add(deltas, key, -1, -intensity)
+            _add(deltas, _rollup_key(obj.user_id, obj.created_at, obj.emotion_type),
+                 1, _intensity(obj.emotion_intensity))
+
+    return {
+        key: delta for key, delta in deltas.items()
+        if delta[0] != 0 or abs(delta[1]) > 1e-9
+    }
+
+
+def row_deltas(rows, sign: int = 1) -> Dict[RollupKey, List[float]]:
+    """
+    由记忆行计算汇总表增量（绕过ORM的批量插入 sign=1，批量删除 sign=-1）
+
+    Args:
+        rows: 含 user_id, created_at, emotion_type, emotion_intensity 的映射
+    """
+    deltas: Dict[RollupKey, List[float]] = {}
+    for row in rows:
+        _add(deltas, _rollup_key(row["user_id"], row["created_at"], row["emotion_type"]),
+             sign, sign * _intensity(row["emotion_intensity"]))
+    return deltas
+
+
+def _upsert_counts(connection, table, key_columns: List[str], rows: List[Dict]):
+    """按主键累加 count / sum_intensity，计数归零的行随即删除"""
+    insert = pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c[name] for name in key_columns],
+        set_={
+            "count": table.c.count + stmt.excluded.count,
+            "sum_intensity": table.c.sum_intensity + stmt.excluded.sum_intensity
+        }
+    )
+    connection.execute(stmt, rows)
+
+    user_ids = {row["user_id"] for row in rows}
+    connection.execute(
+        delete(table).where(table.c.user_id.in_(user_ids), table.c.count <= 0)
+    )
+
+
+def apply_deltas(connection, deltas: Dict[RollupKey, List[float]]):
+    """
+    把增量合并进每日汇总和周/月汇总（UPSERT），计数归零的行随即删除
+
+    批量写入路径（导入、生成器等绕过ORM的场景）也应调用此函数
+    """
+    if not deltas:
+        return
+
+    _upsert_counts(connection, EmotionDailyRollup.__table__, ["user_id", "day", "emotion_type"], [
+        {
+            "user_id": user_id,
+            "day": day,
+            "emotion_type": emotion_type,
+            "count": count,
+            "sum_intensity": sum_intensity
+        }
+        for (user_id, day, emotion_type), (count, sum_intensity) in deltas.items()
+    ])
+    _upsert_counts(connection, EmotionPeriodRollup.__table__, ["user_id", "level", "period_start", "emotion_type"], [
+        {
+            "user_id": user_id,
+            "level": level,
+            "period_start": start,
+            "emotion_type": emotion_type,
+            "count": count,
+            "sum_intensity": sum_intensity
+        }
+        for (user_id, level, start, emotion_type), (count, sum_intensity) in period_deltas(deltas).items()
+    ])
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _maintain_rollup(session, flush_context, instances):
+    """记忆增删改时在同一事务中更新汇总表"""
+    deltas = collect_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+# ==================== 回填 ====================
+
+def backfill(db, user_id: Optional[int] = None) -> int:
+    """
+    根据 memories 表重建汇总表（聚合在SQLite内完成）
+
+    Args:
+        db: 数据库会话
+        user_id: 只重建指定用户，默认全部
+
+    Returns:
+        写入的汇总行数
+    """
+    table = EmotionDailyRollup.__table__
+    clear = delete(table)
+    # 按标签分组：PostgreSQL把两处 coalesce(..., :param) 视为不同表达式，不能直接重复写
+    day = func.date(Memory.created_at).label("day")
+    emotion = func.coalesce(Memory.emotion_type, UNKNOWN_EMOTION).label("emotion")
+    source = select(
+        Memory.user_id,
+        day,
+        emotion,
+        func.count(),
+        func.sum(func.coalesce(Memory.emotion_intensity, DEFAULT_INTENSITY))
+    ).where(Memory.user_id.isnot(None))
+
+    if user_id is not None:
+        clear = clear.where(table.c.user_id == user_id)
+        source = source.where(Memory.user_id == user_id)
+
+    source = source.group_by(Memory.user_id, day, emotion)
+
+    db.execute(clear)
+    db.execute(table.insert().from_select(
+        ["user_id", "day", "emotion_type", "count", "sum_intensity"],
+        source
+    ))
+    # SQLAlchemy在psycopg下拿不到 INSERT ... SELECT 的rowcount（恒为-1），改为清空后计数
+    written = select(func.count()).select_from(table)
+    if user_id is not None:
+        written = written.where(table.c.user_id == user_id)
+    written = db.execute(written).scalar()
+    backfill_periods(db, user_id)
+    db.commit()
+    return written
+
+
+def backfill_periods(db, user_id: Optional[int] = None, chunk_size: int = 10000) -> int:
+    """
+    由每日汇总重建周/月汇总（不提交）
+
+    Returns:
+        写入的周/月汇总行数
+    """
+    daily = EmotionDailyRollup.__table__
+    table = EmotionPeriodRollup.__table__
+    clear = delete(table)
+    source = select(daily.c.user_id, daily.c.day, daily.c.emotion_type, daily.c.count, daily.c.sum_intensity)
+    if user_id is not None:
+        clear = clear.where(table.c.user_id == user_id)
+        source = source.where(daily.c.user_id == user_id)
+
+    connection = db.connection()
+    connection.execute(clear)
+    periods: Dict[PeriodKey, List[float]] = {}
+    for partition in connection.execute(source.execution_options(yield_per=chunk_size)).partitions():
+        deltas = {(uid, day, emotion): [count, total] for uid, day, emotion, count, total in partition}
+        for key, (count, total) in period_deltas(deltas).items():
+            delta = periods.setdefault(key, [0, 0.0])
+            delta[0] += count
+            delta[1] += total
+
+    rows = [
+        {"user_id": uid, "level": level, "period_start": start, "emotion_type": emotion,
+         "count": count, "sum_intensity": total}
+        for (uid, level, start, emotion), (count, total) in periods.items()
+    ]
+    for i in range(0, len(rows), chunk_size):
+        connection.execute(table.insert(), rows[i:i + chunk_size])
+    return len(rows)
+
+
+# ==================== 读取 ====================
+
+def query_daily(
+    db,
+    user_id: int,
+    start_day: Optional[date] = None,
+    end_day: Optional[date] = None
+) -> List[Tuple[date, str, int, float]]:
+    """
+    读取用户的每日汇总（end_day 含当天）
+
+    Returns:
+        [(day, emotion_type, count, sum_intensity), ...] 按日期升序
+    """
+    query = db.query(
+        EmotionDailyRollup.day,
+        EmotionDailyRollup.emotion_type,
+        EmotionDailyRollup.count,
+        EmotionDailyRollup.sum_intensity
+    ).filter(EmotionDailyRollup.user_id == user_id)
+
+    if start_day:
+        query = query.filter(EmotionDailyRollup.day >= start_day)
+    if end_day:
+        query = query.filter(EmotionDailyRollup.day <= end_day)
+
+    return query.order_by(EmotionDailyRollup.day).all()
+
+
+def first_day(db, user_id: int) -> Optional[date]:
+    """用户最早有记忆的日期（主键索引，无记忆时为None）"""
+    return db.query(func.min(EmotionDailyRollup.day)).filter(EmotionDailyRollup.user_id == user_id).scalar()
+
+
+def query_rollup(
+    db,
+    user_id: int,
+    level: str = "day",
+    start_day: Optional[date] = None,
+    end_day: Optional[date] = None
+) -> List[Tuple[date, str, int, float]]:
+    """
+    按层级读取汇总金字塔: day 读每日汇总，week / month 读周/月汇总
+    （起止日期对齐到所在周期的起点）
+
+    Returns:
+        [(period_start, emotion_type, count, sum_intensity), ...] 按时间升序
+    """
+    if level == "day":
+        return query_daily(db, user_id, start_day, end_day)
+    if level not in ROLLUP_LEVELS:
+        raise ValueError(f"未知的汇总层级: {level}")
+
+    query = db.query(
+        EmotionPeriodRollup.period_start,
+        EmotionPeriodRollup.emotion_type,
+        EmotionPeriodRollup.count,
+        EmotionPeriodRollup.sum_intensity
+    ).filter(EmotionPeriodRollup.user_id == user_id, EmotionPeriodRollup.level == level)
+
+    if start_day:
+        query = query.filter(EmotionPeriodRollup.period_start >= period_start(start_day, level))
+    if end_day:
+        query = query.filter(EmotionPeriodRollup.period_start <= period_start(end_day, level))
+
+    return query.order_by(EmotionPeriodRollup.period_start).all()
+
+
+def emotion_totals(db, start_day: Optional[date] = None) -> Dict[str, Tuple[int, float]]:
+    """
+    所有用户按情绪汇总（单个数据库/分片）
+
+    Returns:
+        {emotion_type: (count, sum_intensity)}
+    """
+    query = db.query(
+        EmotionDailyRollup.emotion_type,
+        func.sum(EmotionDailyRollup.count),
+        func.sum(EmotionDailyRollup.sum_intensity)
+    )
+    if start_day:
+        query = query.filter(EmotionDailyRollup.day >= start_day)
+
+    return {
+        emotion: (int(count or 0), float(sum_intensity or 0.0))
+        for emotion, count, sum_intensity in query.group_by(EmotionDailyRollup.emotion_type)
+    }
+
+
+def global_emotion_totals(
+    start_day: Optional[date] = None,
+    router: ShardRouter = shard_router
+) -> Dict[str, Tuple[int, float]]:
+    """
+    全站按情绪汇总（管理端统计），在各分片上并行计算后合并
+
+    Returns:
+        {emotion_type: (count, sum_intensity)}
+    """
+    merged: Dict[str, Tuple[int, float]] = {}
+    for totals in router.fan_out(lambda db: emotion_totals(db, start_day)):
+        for emotion, (count, sum_intensity) in totals.items():
+            prev_count, prev_sum = merged.get(emotion, (0, 0.0))
+            merged[emotion] = (prev_count + count, prev_sum + sum_intensity)
+    return merged
+
+
+def intensity_trend(daily: List[Tuple[date, int, float]]) -> str:
+    """
+    比较前半段与后半段记录的平均强度
+
+    Args:
+        daily: [(day, count, sum_intensity), ...] 按日期升序
+
+    Returns:
+        "improving", "declining" 或 "stable"
+    """
+    total = sum(count for _, count, _ in daily)
+    mid_point = total // 2
+    if mid_point == 0:
+        return "stable"
+
+    # 跨越中点的那一天按当天平均强度拆分
+    first_sum = 0.0
+    seen = 0
+    for _, count, sum_intensity in daily:
+        take = min(count, mid_point - seen)
+        if take <= 0:
+            break
+        first_sum += sum_intensity * take / count
+        seen += take
+
+    total_sum = sum(s for _, _, s in daily)
+    first_half = first_sum / mid_point
+    second_half = (total_sum - first_sum) / (total - mid_point)
+
+    if abs(second_half - first_half) < 1e-9:
+        return "stable"
+    return "improving" if second_half > first_half else "declining"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="每日情绪汇总表维护")
+    parser.add_argument("--backfill", action="store_true", help="根据现有记忆重建汇总表")
+    parser.add_argument("--user-id", type=int, default=None, help="只处理指定用户")
+    args = parser.parse_args()
+
+    if args.backfill:
+        if args.user_id is not None:
+            db = shard_router.session(args.user_id)
+            try:
+                rows = backfill(db, args.user_id)
+            finally:
+                db.close()
+        else:
+            rows = sum(shard_router.fan_out(backfill, readonly=False))
+        print(f"✓ 汇总表回填完成，共 {rows} 行")
+    else:
+        parser.print_help()
@@ -10,6 +10,8 @@ import os
 from typing import Dict, List, Optional
 from datetime import datetime
 
+from app.services import api_usage
+
 class HealingGenerator:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -81,7 +83,7 @@ class HealingGenerator:
         messages.append({"role": "user", "content": user_message})
         
         # 调用OpenAI
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=messages,
             temperature=0.8,
@@ -143,7 +145,7 @@ class HealingGenerator:
 以JSON格式返回音乐结构。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -210,7 +212,7 @@ class HealingGenerator:
 请生成完整的引导词。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -278,7 +280,7 @@ class HealingGenerator:
 请生成日记。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -313,7 +315,7 @@ class HealingGenerator:
         
         # 调用OpenAI TTS
         try:
-            response = await openai.Audio.acreate(
+            response = await api_usage.speech(
                 model="tts-1-hd",  # 高清版,音质更好
                 input=text,
                 voice=voice,
@@ -353,7 +355,7 @@ AI: {ai_response}
 以JSON返回。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"},
@@ -0,0 +1,549 @@
+"""
+记忆冷热分层服务
+文件: backend-ai/app/services/memory_archive.py
+功能: 后台归档器把超过 MEMORY_ARCHIVE_AFTER_DAYS 天的记忆从热表移到同目录的
+      归档库（<库名>.archive.db，每个分片各一个），整行JSON经zlib压缩后存储；
+      热表只保留近期数据，索引和页缓存随之变小，归档后执行 ANALYZE / VACUUM
+
+      - 每日汇总和标签索引留在热库，统计、总数和标签计数不受归档影响
+      - 全文索引只覆盖热数据，冷数据检索时解压后逐条匹配
+      - 单条查询、列表、历史和搜索在热数据翻完后透明地继续读冷数据，
+        游标中带层级标记
+      - 更新或删除冷记忆时先把它恢复到热表，再走正常的ORM路径
+      - 汇总表/标签表的 backfill 只基于热表，应在开始归档之前完成
+
+用法:
+    python -m app.services.memory_archive --run      # 立即归档一次
+    python -m app.services.memory_archive --status   # 各分片热/冷数据量
+"""
+
+import os
+import json
+import zlib
+import logging
+import argparse
+import threading
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Tuple, Callable, Any
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime, LargeBinary, Index,
+    select, delete, insert, func, or_
+)
+
+from app.models.emotion import Memory, create_sqlite_engine, _is_sqlite_file
+from app.models.sharding import ShardRouter, shard_router
+from app.services import memory_search, memory_dedup
+from app.services.memory_tags import normalize_tags
+from app.services.pagination import encode_cursor, decode_cursor, InvalidCursorError
+
+logger = logging.getLogger(__name__)
+
+# 超过多少天的记忆归档（0 关闭归档）
+ARCHIVE_AFTER_DAYS = int(os.getenv("MEMORY_ARCHIVE_AFTER_DAYS", "180"))
+# 归档间隔和进程启动后首次归档的延迟
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("MEMORY_ARCHIVE_INTERVAL_HOURS", "24"))
+ARCHIVE_START_DELAY_S = float(os.getenv("MEMORY_ARCHIVE_START_DELAY_S", "600"))
+# 每个事务移动的记忆数
+ARCHIVE_BATCH_SIZE = int(os.getenv("MEMORY_ARCHIVE_BATCH_SIZE", "500"))
+# 单次归档移出的行数达到该值时 VACUUM 热库
+ARCHIVE_VACUUM_MIN_ROWS = int(os.getenv("MEMORY_ARCHIVE_VACUUM_MIN_ROWS", "1000"))
+
+COMPRESS_LEVEL = 6
+
+# 游标中的层级标记
+COLD_TIER = "cold"
+
+# 冷库表结构（独立数据库，不属于ORM的 Base）
+archive_metadata = MetaData()
+
+memory_archive = Table(
+    "memory_archive",
+    archive_metadata,
+    Column("id", Integer, primary_key=True),  # 与热表中的记忆ID相同
+    Column("user_id", Integer, nullable=False),
+    Column("emotion_type", String(20)),
+    Column("created_at", DateTime, nullable=False),
+    Column("payload", LargeBinary, nullable=False),  # zlib压缩的整行JSON
+    Column("archived_at", DateTime, default=datetime.utcnow),
+    Index("ix_memory_archive_user_created_id", "user_id", "created_at", "id"),
+)
+
+_DATETIME_COLUMNS = ("created_at", "updated_at")
+
+
+# ==================== 行编解码 ====================
+
+def encode_row(row: Dict) -> bytes:
+    """把一行记忆压缩为归档载荷"""
+    payload = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in row.items()
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, COMPRESS_LEVEL)
+
+
+def decode_row(payload: bytes) -> Dict:
+    """解压归档载荷，时间列还原为 datetime"""
+    row = json.loads(zlib.decompress(payload))
+    for key in _DATETIME_COLUMNS:
+        if row.get(key):
+            row[key] = datetime.fromisoformat(row[key])
+    return row
+
+
+# ==================== 冷库 ====================
+
+def archive_path(database: str) -> str:
+    """热库文件对应的归档库文件"""
+    stem, _ = os.path.splitext(database)
+    return f"{stem}.archive.db"
+
+
+class ColdStore:
+    """一个热库对应的归档库"""
+
+    def __init__(self, path: str):
+        url = f"sqlite:///{path}"
+        self.path = path
+        self.engine = create_sqlite_engine(url)
+        archive_metadata.create_all(bind=self.engine)
+        with self.engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+        self.read_engine = create_sqlite_engine(url, readonly=True, pool_size=2)
+
+    def append(self, rows: List[Dict]):
+        """写入一批记忆（同ID覆盖，归档中断后重跑是幂等的）"""
+        if not rows:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(
+                insert(memory_archive).prefix_with("OR REPLACE"),
+                [
+                    {
+                        "id": row["id"],
+                        "user_id": row["user_id"],
+                        "emotion_type": row.get("emotion_type"),
+                        "created_at": row["created_at"],
+                        "payload": encode_row(row)
+                    }
+                    for row in rows
+                ]
+            )
+
+    def get(self, user_id: int, memory_id: int) -> Optional[Dict]:
+        with self.read_engine.connect() as connection:
+            payload = connection.execute(
+                select(memory_archive.c.payload).where(
+                    memory_archive.c.id == memory_id,
+                    memory_archive.c.user_id == user_id
+                )
+            ).scalar()
+        return decode_row(payload) if payload is not None else None
+
+    def remove(self, memory_ids: List[int]):
+        if memory_ids:
+            with self.engine.begin() as connection:
+                connection.execute(delete(memory_archive).where(memory_archive.c.id.in_(memory_ids)))
+
+    def remove_user(self, user_id: int, chunk_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """分批删除用户的全部冷记忆，返回删除条数"""
+        table = memory_archive
+        total = 0
+        while True:
+            with self.engine.begin() as connection:
+                deleted = connection.execute(delete(table).where(table.c.id.in_(
+                    select(table.c.id).where(table.c.user_id == user_id).limit(chunk_size)
+                ))).rowcount
+            total += deleted
+            if deleted < chunk_size:
+                return total
+
+    def scan(
+        self,
+        user_id: int,
+        after: Optional[Tuple[datetime, int]],
+        limit: int,
+        emotion_type: Optional[str] = None,
+        predicate: Optional[Callable[[Dict], bool]] = None,
+        skip: int = 0
+    ) -> List[Dict]:
+        """
+        按 (created_at, id) 倒序读取用户的冷记忆
+
+        Args:
+            after: 从该排序键之后继续，None 表示从头开始
+            predicate: 解压后的过滤条件（标签、关键词），按块扫描直到凑满 limit 条
+            skip: 先跳过的匹配条数（兼容offset翻页）
+        """
+        table = memory_archive
+        chunk = max(limit * 4, 100) if predicate else limit
+        results = []
+        while len(results) < limit:
+            stmt = select(table.c.id, table.c.created_at, table.c.payload).where(
+                table.c.user_id == user_id
+            )
+            if emotion_type:
+                stmt = stmt.where(table.c.emotion_type == emotion_type)
+            if after:
+                stmt = stmt.where(
+                    table.c.created_at <= after[0],
+                    or_(table.c.created_at < after[0], table.c.id < after[1])
+                )
+            stmt = stmt.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(chunk)
+            if skip and predicate is None:
+                # 没有解压后的过滤条件时直接在SQL中跳过，不解压被跳过的行
+                stmt = stmt.offset(skip)
+                skip = 0
+
+            with self.read_engine.connect() as connection:
+                batch = connection.execute(stmt).all()
+            for row in batch:
+                memory = decode_row(row.payload)
+                if predicate is None or predicate(memory):
+                    if skip:
+                        skip -= 1
+                        continue
+                    results.append(memory)
+                    if len(results) == limit:
+                        break
+            if len(batch) < chunk:
+                break
+            after = (batch[-1].created_at, batch[-1].id)
+        return results
+
+    def stats(self) -> Tuple[int, int]:
+        """(归档条数, 压缩后字节数)"""
+        with self.read_engine.connect() as connection:
+            count, size = connection.execute(
+                select(func.count(), func.coalesce(func.sum(func.length(memory_archive.c.payload)), 0))
+            ).one()
+        return count, size
+
+    def analyze(self):
+        with self.engine.connect() as connection:
+            connection.exec_driver_sql("ANALYZE")
+            connection.commit()
+
+    def dispose(self):
+        self.engine.dispose()
+        self.read_engine.dispose()
+
+
+_stores: Dict[str, ColdStore] = {}
+_stores_lock = threading.Lock()
+
+
+def cold_store(bind, create: bool = False) -> Optional[ColdStore]:
+    """
+    热库（引擎或连接）对应的归档库
+
+    非SQLite文件库不分层，返回None；create=False 时归档库尚未建立也返回None，
+    读路径不会因此创建文件
+    """
+    url = bind.engine.url
+    if not _is_sqlite_file(str(url)):
+        return None
+    path = archive_path(os.path.abspath(url.database))
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None and (create or os.path.exists(path)):
+            store = _stores[path] = ColdStore(path)
+        return store
+
+
+# ==================== 归档 ====================
+
+def archive(db, before: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    把 created_at 早于 before 的记忆移到归档库
+
+    先写入并提交冷库，再从热表删除（绕过ORM，汇总和标签不变）并移除全文索引；
+    中途失败时重跑即可，冷库按ID覆盖
+
+    Returns:
+        移动的记忆条数
+    """
+    store = cold_store(db.get_bind(), create=True)
+    if store is None:
+        return 0
+
+    table = Memory.__table__
+    total = 0
+    while True:
+        connection = db.connection()
+        rows = connection.execute(
+            select(table).where(table.c.created_at < before).order_by(table.c.id).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+
+        store.append([dict(row) for row in rows])
+        ids = [row["id"] for row in rows]
+        connection.execute(delete(table).where(table.c.id.in_(ids)))
+        if memory_search.fts_available(connection):
+            memory_search.remove_memories(connection, ids)
+        memory_dedup.remove_signatures(connection, ids)
+        db.commit()
+        total += len(rows)
+
+    return total
+
+
+def compact(db, archived: int):
+    """归档后更新查询统计；移出的行数较多时 VACUUM 回收热库空间"""
+    db.connection().exec_driver_sql("ANALYZE")
+    db.commit()
+
+    store = cold_store(db.get_bind())
+    if store is not None:
+        store.analyze()
+
+    if archived >= ARCHIVE_VACUUM_MIN_ROWS:
+        # VACUUM 不能在事务中执行
+        with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+        logger.info(f"归档 {archived} 条后已 VACUUM")
+
+
+def restore(db, user_id: int, memory_id: int) -> bool:
+    """
+    把一条冷记忆恢复到热表（更新、删除前调用）
+
+    用Core插入，不经过ORM钩子：汇总和标签中本来就包含这条记忆，只需重建全文索引和重复检测签名
+
+    Returns:
+        是否找到并恢复
+    """
+    store = cold_store(db.get_bind())
+    memory = store.get(user_id, memory_id) if store else None
+    if memory is None:
+        return False
+
+    connection = db.connection()
+    connection.execute(insert(Memory.__table__), [memory])
+    if memory_search.fts_available(connection):
+        memory_search.index_memories(connection, [memory])
+    if memory_dedup.enabled():
+        memory_dedup.index_signatures(connection, [memory])
+    db.commit()
+    store.remove([memory_id])
+    return True
+
+
+# ==================== 透明读取 ====================
+
+def get_archived(db, user_id: int, memory_id: int) -> Optional[SimpleNamespace]:
+    """读取一条冷记忆（属性与 Memory 相同）"""
+    store = cold_store(db.get_bind())
+    memory = store.get(user_id, memory_id) if store else None
+    return SimpleNamespace(**memory) if memory else None
+
+
+def parse_cold_cursor(token: Optional[str]) -> Optional[Tuple[Optional[datetime], int]]:
+    """
+    解析冷数据游标
+
+    Returns:
+        冷数据游标返回 (created_at, id)，从冷数据开头继续时为 (None, 0)；
+        热数据游标或没有游标时返回None
+    """
+    if not token:
+        return None
+    try:
+        tier, created_at, memory_id = decode_cursor(token, str, str, int)
+    except InvalidCursorError:
+        return None
+    if tier != COLD_TIER:
+        raise InvalidCursorError(f"无效的游标: {token}")
+    try:
+        return (datetime.fromisoformat(created_at) if created_at else None, memory_id)
+    except ValueError as e:
+        raise InvalidCursorError(f"无效的游标: {token}") from e
+
+
+def _cold_cursor(last: Optional[Dict]) -> str:
+    if last is None:
+        return encode_cursor(COLD_TIER, "", 0)
+    return encode_cursor(COLD_TIER, last["created_at"].isoformat(), last["id"])
+
+
+def preview(memory: Dict, length: int = 100, ellipsis: str = "...", **extra) -> SimpleNamespace:
+    """冷记忆的列表行，正文截断规则与 memory_fields.content_preview 一致；extra 为附加字段"""
+    content = memory.get("content") or ""
+    if len(content) > length:
+        content = content[:length] + ellipsis
+    return SimpleNamespace(**{**memory, "content": content, **extra})
+
+
+def matcher(query: Optional[str] = None, tag: Optional[str] = None) -> Optional[Callable[[Dict], bool]]:
+    """冷数据的过滤条件：标签精确匹配，关键词按分词全部命中（没有可检索的词时按子串匹配）"""
+    if not query and not tag:
+        return None
+    tokens = [t.casefold() for t in memory_search.query_tokens(query)] if query else []
+    needle = (query or "").casefold()
+
+    def match(memory: Dict) -> bool:
+        if tag and tag not in normalize_tags(memory.get("tags")):
+            return False
+        if not query:
+            return True
+        text = " ".join([
+            memory.get("content") or "",
+            memory.get("summary") or "",
+            " ".join(str(t) for t in memory.get("tags") or [])
+        ]).casefold()
+        return all(t in text for t in tokens) if tokens else needle in text
+
+    return match
+
+
+def fall_through(
+    db,
+    user_id: int,
+    rows: List,
+    next_cursor: Optional[str],
+    limit: int,
+    after: Optional[Tuple[Optional[datetime], int]] = None,
+    emotion_type: Optional[str] = None,
+    predicate: Optional[Callable[[Dict], bool]] = None,
+    project: Callable[[Dict], Any] = preview,
+    offset: int = 0,
+    hot_count: Optional[Callable[[], int]] = None
+) -> Tuple[List, Optional[str]]:
+    """
+    热数据翻完后用冷数据补齐本页
+
+    Args:
+        rows, next_cursor: 热数据的本页结果和游标；next_cursor 不为空时直接返回
+        after: parse_cold_cursor 的结果（已经翻到冷数据时）
+        project: 把解压后的记忆转换为与热数据相同形状的行
+        offset, hot_count: 旧客户端的offset翻页；偏移超过热数据时，
+            冷数据从 offset - hot_count() 处开始（hot_count 只在热数据本页为空时调用）
+
+    Returns:
+        (本页结果, 下一页游标)
+    """
+    if next_cursor is not None:
+        return rows, next_cursor
+    store = cold_store(db.get_bind())
+    if store is None:
+        return rows, None
+
+    remaining = limit - len(rows)
+    start = after if after and after[0] is not None else None
+    skip = 0
+    if after is None and offset and not rows and hot_count is not None:
+        skip = max(offset - hot_count(), 0)
+    cold = store.scan(user_id, start, remaining + 1, emotion_type, predicate, skip)
+    if len(cold) > remaining:
+        cold = cold[:remaining]
+        next_cursor = _cold_cursor(cold[-1] if cold else None)
+    return rows + [project(memory) for memory in cold], next_cursor
+
+
+# ==================== 后台归档 ====================
+
+def archive_shard(db, before: datetime) -> int:
+    """归档一个分片并整理"""
+    archived = archive(db, before)
+    if archived:
+        compact(db, archived)
+    return archived
+
+
+class MemoryArchiver:
+    """
+    后台归档线程
+
+    进程启动 start_delay 秒后首次归档，之后每 interval_hours 小时一次；
+    每次在所有分片上并行执行
+    """
+
+    def __init__(
+        self,
+        router: ShardRouter = shard_router,
+        after_days: int = ARCHIVE_AFTER_DAYS,
+        interval_hours: float = ARCHIVE_INTERVAL_HOURS,
+        start_delay: float = ARCHIVE_START_DELAY_S
+    ):
+        self.router = router
+        self.after_days = after_days
+        self.interval = interval_hours * 3600
+        self.start_delay = start_delay
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def run_once(self, now: Optional[datetime] = None) -> int:
+        """立即归档一次，返回移动的记忆条数"""
+        before = (now or datetime.utcnow()) - timedelta(days=self.after_days)
+        archived = sum(self.router.fan_out(lambda db: archive_shard(db, before), readonly=False))
+        logger.info(f"记忆归档完成: {archived} 条早于 {before:%Y-%m-%d} 的记忆移入冷库")
+        return archived
+
+    def start(self):
+        if self.after_days <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="memory-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        delay = self.start_delay
+        while not self._stopping.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"记忆归档失败: {e}")
+            delay = self.interval
+
+
+_archiver: Optional[MemoryArchiver] = None
+
+
+def start_memory_archiver() -> MemoryArchiver:
+    """启动后台归档器（MEMORY_ARCHIVE_AFTER_DAYS=0 时不启动线程）"""
+    global _archiver
+    if _archiver is None:
+        _archiver = MemoryArchiver()
+        _archiver.start()
+    return _archiver
+
+
+def stop_memory_archiver():
+    global _archiver
+    if _archiver:
+        _archiver.stop()
+        _archiver = None
+
+
+def _shard_status(db) -> Tuple[int, int, int]:
+    hot = db.query(func.count(Memory.id)).scalar() or 0
+    store = cold_store(db.get_bind())
+    cold, size = store.stats() if store else (0, 0)
+    return hot, cold, size
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="记忆冷热分层")
+    parser.add_argument("--run", action="store_true", help="立即归档一次")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="归档超过多少天的记忆")
+    parser.add_argument("--status", action="store_true", help="显示各分片的热/冷数据量")
+    args = parser.parse_args()
+
+    if args.run:
+        count = MemoryArchiver(after_days=args.days).run_once()
+        print(f"✓ 归档完成，共移动 {count} 条记忆")
+    elif args.status:
+        for index, (hot, cold, size) in enumerate(shard_router.fan_out(_shard_status)):
+            print(f"分片 {index:02d}: 热 {hot} 条，冷 {cold} 条（压缩后 {size / 1024:.1f} KB）")
+    else:
+        parser.print_help()
@@ -0,0 +1,300 @@
+"""
+记忆近似重复检测
+文件: backend-ai/app/services/memory_dedup.py
+功能: 为每条记忆的正文计算 MinHash 签名（jieba 分词后的词二元组），
+      分带（LSH）后写入桶表，写入新记忆前按桶查出候选、再比较签名估计 Jaccard 相似度
+
+      - 签名 MINHASH_PERMUTATIONS 个 uint32（256字节），桶表每条记忆 LSH_BANDS 行
+      - LSH_BANDS 个带 × 每带 4 行：相似度 0.8 的两条记忆几乎必然成为候选（>99.9%），
+        0.5 的约 64%、0.3 的约 12%，候选再逐个比较签名
+      - 只在同一用户的热数据中查找；归档的记忆不参与
+
+      MEMORY_DEDUP_MODE:
+      - off:    不计算签名
+      - detect: 维护签名，创建接口返回 duplicate_of，仍然保存
+      - merge:  重复的记忆不再保存（创建接口合并标签到已有记忆，导入直接跳过），需显式开启
+      两种检测模式下 MemoryManager 对重复内容都复用已有摘要和标签，不再调用LLM
+
+用法:
+    python -m app.services.memory_dedup --backfill   # 为已有记忆计算签名
+    python -m app.services.memory_dedup --stats
+"""
+
+import os
+import hashlib
+import logging
+import argparse
+from typing import Optional, Dict, List, Tuple, Iterable
+
+import jieba
+import numpy as np
+from sqlalchemy import event, select, delete, insert, func
+from sqlalchemy.orm import Session as OrmSession, attributes
+
+from app.models.emotion import Memory, MemorySignature, MemoryLSHBand
+from app.models.sharding import shard_router
+
+logger = logging.getLogger(__name__)
+
+jieba.setLogLevel(logging.WARNING)
+
+MEMORY_DEDUP_MODE = os.getenv("MEMORY_DEDUP_MODE", "detect")  # off / detect / merge
+MEMORY_DEDUP_THRESHOLD = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.8"))
+
+# 签名参数已随数据持久化，修改后需要 --backfill 重算
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+# 哈希族 h(x) = (a*x + b) mod p；x、a、b 都小于 2^32，乘加不会溢出 uint64
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def enabled() -> bool:
+    return MEMORY_DEDUP_MODE != "off"
+
+
+# ==================== 签名 ====================
+
+def shingles(text: Optional[str]) -> set:
+    """分词后的相邻词对（不足两个词时用单词），忽略空白和标点"""
+    tokens = [token for token in jieba.cut((text or "").lower()) if any(ch.isalnum() for ch in token)]
+    grams = tokens if len(tokens) < 2 else [f"{a}\x01{b}" for a, b in zip(tokens, tokens[1:])]
+    return {
+        int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "little")
+        for gram in grams
+    }
+
+
+def signature(text: Optional[str]) -> Optional[np.ndarray]:
+    """正文的 MinHash 签名；没有可用的词时返回 None"""
+    hashes = np.fromiter(shingles(text), dtype=np.uint64)
+    if not hashes.size:
+        return None
+    values = (np.outer(hashes, _A) + _B) % _MERSENNE_PRIME
+    return (values.min(axis=0) & np.uint64(0xFFFFFFFF)).astype("<u4")
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """两个签名估计的 Jaccard 相似度"""
+    return float(np.count_nonzero(a == b)) / MINHASH_PERMUTATIONS
+
+
+def band_buckets(sig: np.ndarray) -> List[Tuple[int, int]]:
+    """[(带号, 桶)]，桶为该带签名值的64位哈希（有符号，适配 BIGINT）"""
+    return [
+        (band, int.from_bytes(
+            hashlib.blake2b(sig[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(), digest_size=8).digest(),
+            "little", signed=True
+        ))
+        for band in range(LSH_BANDS)
+    ]
+
+
+def _decode(data: bytes) -> np.ndarray:
+    return np.frombuffer(bytes(data), dtype="<u4")
+
+
+# ==================== 索引维护 ====================
+
+def index_signatures(connection, rows: Iterable[Dict], signatures: Optional[List[Optional[np.ndarray]]] = None):
+    """
+    写入或覆盖记忆的签名和桶
+
+    Args:
+        rows: [{id, user_id, content}, ...]
+        signatures: 已计算好的签名（与 rows 对应），缺省时由正文计算
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    if signatures is None:
+        signatures = [signature(row.get("content")) for row in rows]
+
+    remove_signatures(connection, [row["id"] for row in rows])
+    sig_params, band_params = [], []
+    for row, sig in zip(rows, signatures):
+        if sig is None or row.get("user_id") is None:
+            continue
+        sig_params.append({"memory_id": row["id"], "user_id": row["user_id"], "signature": sig.tobytes()})
+        band_params.extend(
+            {"user_id": row["user_id"], "band": band, "bucket": bucket, "memory_id": row["id"]}
+            for band, bucket in band_buckets(sig)
+        )
+    if sig_params:
+        connection.execute(insert(MemorySignature.__table__), sig_params)
+        connection.execute(insert(MemoryLSHBand.__table__), band_params)
+
+
+def remove_signatures(connection, memory_ids: List[int]):
+    """删除记忆的签名和桶"""
+    if memory_ids:
+        connection.execute(delete(MemoryLSHBand.__table__).where(MemoryLSHBand.memory_id.in_(memory_ids)))
+        connection.execute(delete(MemorySignature.__table__).where(MemorySignature.memory_id.in_(memory_ids)))
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _maintain_signatures(session, flush_context):
+    """记忆增删、正文修改后在同一事务中同步签名"""
+    if not enabled():
+        return
+    to_index, to_remove = [], []
+    for obj in session.new:
+        if isinstance(obj, Memory):
+            to_index.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Memory) and attributes.get_history(obj, "content").has_changes():
+            to_index.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Memory) and obj.id is not None:
+            to_remove.append(obj.id)
+    if not (to_index or to_remove):
+        return
+
+    connection = session.connection()
+    remove_signatures(connection, to_remove)
+    index_signatures(connection, [
+        {"id": obj.id, "user_id": obj.user_id, "content": obj.content} for obj in to_index
+    ])
+
+
+# ==================== 查找 ====================
+
+def find_duplicates(
+    connection,
+    user_id: int,
+    signatures: List[Optional[np.ndarray]],
+    threshold: float = MEMORY_DEDUP_THRESHOLD
+) -> List[Optional[Tuple[int, float]]]:
+    """
+    为每个签名在用户已有的记忆中找最相似的近似重复
+
+    Returns:
+        与 signatures 对应的 (记忆ID, 相似度) 或 None
+    """
+    buckets = [band_buckets(sig) if sig is not None else [] for sig in signatures]
+    values = sorted({bucket for entries in buckets for _, bucket in entries})
+    if not values:
+        return [None] * len(signatures)
+
+    table = MemoryLSHBand.__table__
+    members: Dict[Tuple[int, int], List[int]] = {}
+    for start in range(0, len(values), 500):
+        for band, bucket, memory_id in connection.execute(
+            select(table.c.band, table.c.bucket, table.c.memory_id)
+            .where(table.c.user_id == user_id, table.c.bucket.in_(values[start:start + 500]))
+        ):
+            members.setdefault((band, bucket), []).append(memory_id)
+
+    candidates = [{mid for key in entries for mid in members.get(key, ())} for entries in buckets]
+    candidate_ids = sorted(set().union(*candidates))
+    stored = {}
+    for start in range(0, len(candidate_ids), 500):
+        stored.update(connection.execute(
+            select(MemorySignature.memory_id, MemorySignature.signature)
+            .where(MemorySignature.memory_id.in_(candidate_ids[start:start + 500]))
+        ).all())
+
+    results = []
+    for sig, ids in zip(signatures, candidates):
+        best = None
+        for memory_id in ids:
+            if memory_id in stored:
+                score = similarity(sig, _decode(stored[memory_id]))
+                if score >= threshold and (best is None or score > best[1]):
+                    best = (memory_id, score)
+        results.append(best)
+    return results
+
+
+def find_duplicate(connection, user_id: int, text: Optional[str], threshold: float = MEMORY_DEDUP_THRESHOLD):
+    """单条正文的近似重复 (记忆ID, 相似度)；未启用或没有时返回 None"""
+    if not enabled():
+        return None
+    sig = signature(text)
+    return find_duplicates(connection, user_id, [sig], threshold)[0] if sig is not None else None
+
+
+def duplicate_flags(
+    connection,
+    items: List[Tuple[int, Optional[np.ndarray]]],
+    threshold: float = MEMORY_DEDUP_THRESHOLD
+) -> List[bool]:
+    """
+    一批待写入的 (用户, 签名) 是否为近似重复：与库中已有记忆重复，或与同批次中更早的一条重复
+    """
+    flags = [False] * len(items)
+    by_user: Dict[int, List[int]] = {}
+    for i, (user_id, sig) in enumerate(items):
+        if sig is not None:
+            by_user.setdefault(user_id, []).append(i)
+
+    for user_id, indexes in by_user.items():
+        matches = find_duplicates(connection, user_id, [items[i][1] for i in indexes], threshold)
+        kept: List[np.ndarray] = []
+        for i, match in zip(indexes, matches):
+            sig = items[i][1]
+            if match is not None or any(similarity(sig, other) >= threshold for other in kept):
+                flags[i] = True
+            else:
+                kept.append(sig)
+    return flags
+
+
+# ==================== 回填 ====================
+
+def backfill(db, chunk_size: int = 1000) -> int:
+    """
+    为热表中的全部记忆重新计算签名（由调用方提交）
+
+    Returns:
+        写入签名的记忆条数
+    """
+    connection = db.connection()
+    connection.execute(delete(MemoryLSHBand.__table__))
+    connection.execute(delete(MemorySignature.__table__))
+    total = 0
+    result = connection.execute(
+        select(Memory.id, Memory.user_id, Memory.content).execution_options(yield_per=chunk_size)
+    )
+    for partition in result.mappings().partitions():
+        index_signatures(connection, partition)
+        total += len(partition)
+    return total
+
+
+def _stats(db) -> Tuple[int, int, int]:
+    """(签名数, 有重复桶的候选对数, 签名总字节数)"""
+    signatures, size = db.execute(
+        select(func.count(), func.coalesce(func.sum(func.length(MemorySignature.signature)), 0))
+    ).one()
+    bands = MemoryLSHBand.__table__
+    shared = db.execute(
+        select(func.count()).select_from(
+            select(bands.c.user_id, bands.c.band, bands.c.bucket)
+            .group_by(bands.c.user_id, bands.c.band, bands.c.bucket)
+            .having(func.count() > 1).subquery()
+        )
+    ).scalar()
+    return signatures, shared, size
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="记忆近似重复检测（MinHash / LSH）")
+    parser.add_argument("--backfill", action="store_true", help="为已有记忆重新计算签名")
+    parser.add_argument("--stats", action="store_true", help="各分片的签名数量")
+    args = parser.parse_args()
+
+    if args.backfill:
+        def backfill_shard(db):
+            total = backfill(db)
+            db.commit()
+            return total
+
+        print(f"✓ 已为 {sum(shard_router.fan_out(backfill_shard, readonly=False))} 条记忆计算签名")
+    else:
+        for shard, (signatures, shared, size) in enumerate(shard_router.fan_out(_stats)):
+            print(f"分片 {shard}: {signatures} 个签名（{size / 1024:.1f} KB），{shared} 个桶含多条记忆")
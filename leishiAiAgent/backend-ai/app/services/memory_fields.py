@@ -0,0 +1,107 @@
+"""
+记忆列表字段投影
+文件: backend-ai/app/services/memory_fields.py
+功能: 列表类接口只查询需要的列，正文在SQL中用substr()截断，
+      并支持 fields= 稀疏字段集，避免加载完整的Memory对象
+"""
+
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+from sqlalchemy import func, case, literal
+
+from app.models.emotion import Memory, CONTENT_HEAD_LENGTH
+
+
+class InvalidFieldsError(ValueError):
+    """请求了不存在的字段"""
+    pass
+
+
+# 列表接口可返回的字段；content 为截断后的预览
+LIST_FIELDS = (
+    "id", "memory_type", "emotion_type", "emotion_intensity", "content",
+    "summary", "tags", "audio_path", "image_path", "created_at", "updated_at"
+)
+
+# 未指定 fields 时的默认字段（与原列表响应一致）
+DEFAULT_LIST_FIELDS = (
+    "id", "memory_type", "emotion_type", "emotion_intensity", "content",
+    "summary", "tags", "created_at"
+)
+
+# 搜索接口额外返回的字段
+SEARCH_FIELDS = LIST_FIELDS + ("highlight", "summary_highlight", "score")
+
+DEFAULT_SEARCH_FIELDS = DEFAULT_LIST_FIELDS + ("highlight", "summary_highlight", "score")
+
+# 键集分页依赖的列，总是查询
+_KEY_FIELDS = ("id", "created_at")
+
+
+def content_preview(length: int, ellipsis: str = ""):
+    """
+    正文预览表达式：在SQL中截取前length个字符，超长时追加省略号
+
+    读明文前缀列 content_head（正文可能压缩存储），length 不能超过其长度减一
+    """
+    assert length < CONTENT_HEAD_LENGTH, f"预览长度超过 {CONTENT_HEAD_LENGTH - 1}"
+    preview = func.substr(Memory.content_head, 1, length)
+    if not ellipsis:
+        return preview
+    return case(
+        (func.length(Memory.content_head) > length, preview + literal(ellipsis)),
+        else_=preview
+    )
+
+
+def parse_fields(
+    fields: Optional[str],
+    default=DEFAULT_LIST_FIELDS,
+    allowed=LIST_FIELDS
+) -> List[str]:
+    """
+    解析逗号分隔的字段列表
+
+    Raises:
+        InvalidFieldsError: 包含未知字段
+    """
+    if not fields:
+        return list(default)
+
+    requested = []
+    for name in fields.split(","):
+        name = name.strip()
+        if name and name not in requested:
+            requested.append(name)
+
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise InvalidFieldsError(f"未知字段: {', '.join(unknown)}")
+    return requested or list(default)
+
+
+def list_columns(fields: List[str], preview_length: int = 100, ellipsis: str = "...") -> List:
+    """把字段名转换为查询列（总是包含分页键列，忽略非列字段）"""
+    columns = []
+    for name in list(_KEY_FIELDS) + [f for f in fields if f not in _KEY_FIELDS]:
+        if name not in LIST_FIELDS:
+            continue
+        if name == "content":
+            columns.append(content_preview(preview_length, ellipsis).label("content"))
+        else:
+            columns.append(getattr(Memory, name).label(name))
+    return columns
+
+
+def serialize_row(row, fields: List[str]) -> Dict[str, Any]:
+    """按请求字段输出一行（行对象或字典）"""
+    item = {}
+    for name in fields:
+        value = row[name] if isinstance(row, dict) else getattr(row, name)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif name == "tags":
+            value = value or []
+        item[name] = value
+    return item
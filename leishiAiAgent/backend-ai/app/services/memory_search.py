@@ -0,0 +1,465 @@
+"""
+记忆全文检索服务
+文件: backend-ai/app/services/memory_search.py
+功能: 记忆全文索引，入库前用jieba分词，结果按相关度排序并返回高亮片段
+      - SQLite: FTS5虚拟表，bm25排序
+      - PostgreSQL: tsvector列 + GIN索引，ts_rank排序，ts_headline高亮
+"""
+
+import logging
+import argparse
+import weakref
+from typing import Optional, List, Dict, Iterable, Tuple
+
+import jieba
+from sqlalchemy import DDL, event, inspect, text, select, JSON, DateTime
+from sqlalchemy.orm import Session as OrmSession, attributes
+
+from app.models.emotion import Memory
+from app.models.sharding import shard_router
+from app.services.pagination import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+jieba.setLogLevel(logging.WARNING)
+
+FTS_TABLE = "memories_fts"
+
+# 分词之间插入的不可见分隔符（U+2063），FTS5按它切词，高亮结果去掉它即可还原原文
+SEPARATOR = "\u2063"
+# PostgreSQL解析器是否把U+2063当作字母取决于库的LC_CTYPE（C.UTF-8下不切词），
+# 改用ASCII单元分隔符（U+001F），任何locale下都会被当作空白
+PG_SEPARATOR = "\x1f"
+
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+
+# bm25列权重: owner, content, summary, tags, terms
+BM25_WEIGHTS = "0.0, 1.0, 2.0, 3.0, 0.5"
+
+# 参与索引的记忆字段，变化时需要重建该行索引
+_INDEXED_ATTRS = ("user_id", "content", "summary", "tags")
+
+# owner列存放 "u<user_id>"，用于把匹配限定在单个用户的文档内
+# terms列存放jieba搜索模式产生的细粒度词，只参与匹配不参与展示
+CREATE_FTS_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"owner, content, summary, tags, terms, "
+    f"tokenize=\"unicode61 separators '{SEPARATOR}'\")"
+)
+
+# PostgreSQL: content/summary 存分词后的文本供 ts_headline 使用，
+# document 按 tags > summary > content > terms 加权
+PG_CREATE_FTS_TABLE = (
+    f"CREATE TABLE IF NOT EXISTS {FTS_TABLE} ("
+    f"memory_id INTEGER PRIMARY KEY REFERENCES memories (id) ON DELETE CASCADE, "
+    f"owner INTEGER NOT NULL, content TEXT, summary TEXT, document TSVECTOR NOT NULL)"
+)
+PG_CREATE_FTS_INDEXES = (
+    f"CREATE INDEX IF NOT EXISTS ix_{FTS_TABLE}_document ON {FTS_TABLE} USING gin (document)",
+    f"CREATE INDEX IF NOT EXISTS ix_{FTS_TABLE}_owner ON {FTS_TABLE} (owner)",
+)
+PG_DOCUMENT = (
+    "setweight(to_tsvector('simple', :tags), 'A') || "
+    "setweight(to_tsvector('simple', :summary), 'B') || "
+    "setweight(to_tsvector('simple', :content), 'C') || "
+    "setweight(to_tsvector('simple', :terms), 'D')"
+)
+PG_HEADLINE_OPTIONS = (
+    f"StartSel={HIGHLIGHT_OPEN}, StopSel={HIGHLIGHT_CLOSE}, "
+    f"MaxFragments=1, MaxWords=24, MinWords=8, FragmentDelimiter=…"
+)
+PG_SUMMARY_HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_OPEN}, StopSel={HIGHLIGHT_CLOSE}, HighlightAll=true"
+
+event.listen(
+    Memory.__table__,
+    "after_create",
+    DDL(CREATE_FTS_TABLE).execute_if(dialect="sqlite")
+)
+event.listen(
+    Memory.__table__,
+    "after_create",
+    DDL(PG_CREATE_FTS_TABLE).execute_if(dialect="postgresql")
+)
+for _statement in PG_CREATE_FTS_INDEXES:
+    event.listen(
+        Memory.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="postgresql")
+    )
+event.listen(
+    Memory.__table__,
+    "before_drop",
+    DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+)
+
+
+# ==================== 分词 ====================
+
+def _segment(value: Optional[str], separator: str = SEPARATOR) -> str:
+    """精确模式分词，分词结果恰好覆盖原文，便于高亮还原"""
+    if not value:
+        return ""
+    return separator.join(jieba.cut(value))
+
+
+def _extra_terms(*values: Optional[str], separator: str = SEPARATOR) -> str:
+    """搜索模式下额外切出的子词（如"共和国"之于"中华人民共和国"）"""
+    precise, fine = set(), set()
+    for value in values:
+        if value:
+            precise.update(jieba.cut(value))
+            fine.update(jieba.cut_for_search(value))
+    return separator.join(sorted(fine - precise))
+
+
+def _owner(user_id) -> str:
+    return f"u{user_id}"
+
+
+def query_tokens(query: str) -> List[str]:
+    """用户输入分词后的检索词（去掉标点和空白）"""
+    tokens = [t.strip() for t in jieba.cut(query or "")]
+    return [t for t in tokens if t and any(ch.isalnum() for ch in t)]
+
+
+def build_match_expression(user_id: int, query: str) -> Optional[str]:
+    """
+    把用户输入转换为FTS5 MATCH表达式
+
+    每个分词都必须出现（前缀匹配），且文档属于该用户
+    """
+    tokens = query_tokens(query)
+    if not tokens:
+        return None
+
+    terms = " AND ".join('"' + t.replace('"', '""') + '"*' for t in tokens)
+    return f'owner : "{_owner(user_id)}" AND {{content summary tags terms}} : ({terms})'
+
+
+def build_tsquery(query: str) -> Optional[str]:
+    """把用户输入转换为PostgreSQL tsquery（每个分词前缀匹配，AND连接）"""
+    tokens = query_tokens(query)
+    if not tokens:
+        return None
+    return " & ".join(
+        "'" + t.replace("\\", "\\\\").replace("'", "''") + "':*" for t in tokens
+    )
+
+
+# ==================== 索引维护 ====================
+
+_fts_engines = weakref.WeakKeyDictionary()
+
+
+def _is_postgres(connection) -> bool:
+    return connection.dialect.name == "postgresql"
+
+
+def fts_available(connection) -> bool:
+    """当前数据库是否已建立全文索引表（SQLite未编译FTS5时为False）"""
+    dialect = connection.dialect.name
+    if dialect not in ("sqlite", "postgresql"):
+        return False
+    engine = connection.engine
+    if _fts_engines.get(engine):
+        return True
+    if dialect == "postgresql":
+        exists = connection.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": FTS_TABLE}
+        ).scalar()
+    else:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE}
+        ).first() is not None
+    if exists:
+        _fts_engines[engine] = True
+    return exists
+
+
+def ensure_fts_table(connection):
+    """为已有数据库补建全文索引表"""
+    if _is_postgres(connection):
+        connection.execute(text(PG_CREATE_FTS_TABLE))
+        for statement in PG_CREATE_FTS_INDEXES:
+            connection.execute(text(statement))
+    else:
+        connection.execute(text(CREATE_FTS_TABLE))
+
+
+def index_memories(connection, rows: Iterable[Dict]):
+    """
+    写入或覆盖记忆的索引行
+
+    Args:
+        rows: [{id, user_id, content, summary, tags}, ...]
+    """
+    postgres = _is_postgres(connection)
+    separator = PG_SEPARATOR if postgres else SEPARATOR
+    params = []
+    for row in rows:
+        tags = " ".join(str(tag) for tag in (row.get("tags") or []))
+        params.append({
+            "rowid": row["id"],
+            "owner": row["user_id"] if postgres else _owner(row["user_id"]),
+            "content": _segment(row.get("content"), separator),
+            "summary": _segment(row.get("summary"), separator),
+            "tags": _segment(tags, separator),
+            "terms": _extra_terms(
+                row.get("content"), row.get("summary"), tags, separator=separator
+            )
+        })
+    if not params:
+        return
+
+    remove_memories(connection, [p["rowid"] for p in params])
+    if postgres:
+        sql = (
+            f"INSERT INTO {FTS_TABLE} (memory_id, owner, content, summary, document) "
+            f"VALUES (:rowid, :owner, :content, :summary, {PG_DOCUMENT})"
+        )
+    else:
+        sql = (
+            f"INSERT INTO {FTS_TABLE} (rowid, owner, content, summary, tags, terms) "
+            f"VALUES (:rowid, :owner, :content, :summary, :tags, :terms)"
+        )
+    connection.execute(text(sql), params)
+
+
+def remove_memories(connection, memory_ids: List[int]):
+    """删除记忆的索引行"""
+    if memory_ids:
+        key = "memory_id" if _is_postgres(connection) else "rowid"
+        connection.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE {key} = :rowid"),
+            [{"rowid": memory_id} for memory_id in memory_ids]
+        )
+
+
+def _index_row(obj: Memory) -> Dict:
+    return {
+        "id": obj.id,
+        "user_id": obj.user_id,
+        "content": obj.content,
+        "summary": obj.summary,
+        "tags": obj.tags
+    }
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _maintain_fts(session, flush_context):
+    """记忆增删改后在同一事务中同步FTS索引"""
+    to_index, to_remove = [], []
+
+    for obj in session.new:
+        if isinstance(obj, Memory):
+            to_index.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Memory) and any(
+            attributes.get_history(obj, attr).has_changes() for attr in _INDEXED_ATTRS
+        ):
+            to_index.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Memory):
+            identity = inspect(obj).identity
+            if identity:
+                to_remove.append(identity[0])
+
+    if not (to_index or to_remove):
+        return
+
+    connection = session.connection()
+    if not fts_available(connection):
+        return
+
+    remove_memories(connection, to_remove)
+    index_memories(connection, [_index_row(obj) for obj in to_index])
+
+
+def rebuild(db, chunk_size: int = 1000) -> int:
+    """
+    根据 memories 表重建全部全文索引
+
+    Returns:
+        索引的记忆条数
+    """
+    connection = db.connection()
+    ensure_fts_table(connection)
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+
+    total = 0
+    result = connection.execute(
+        select(Memory.id, Memory.user_id, Memory.content, Memory.summary, Memory.tags)
+        .execution_options(yield_per=chunk_size)
+    )
+    for partition in result.mappings().partitions():
+        index_memories(connection, partition)
+        total += len(partition)
+
+    db.commit()
+    return total
+
+
+# ==================== 检索 ====================
+
+def _strip(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return value
+    return value.replace(SEPARATOR, "").replace(PG_SEPARATOR, "")
+
+
+def search_page(
+    db,
+    user_id: int,
+    query: str,
+    emotion_type: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Optional[Tuple[List[Dict], Optional[str]]]:
+    """
+    全文检索用户的记忆（分页）
+
+    结果按 (bm25, id) 排序，游标记录上一页最后一条的排序键
+
+    Returns:
+        (本页结果, 下一页游标)；FTS不可用或查询没有可检索的词时返回None，
+        由调用方退回普通查询
+    """
+    connection = db.connection()
+    if not fts_available(connection):
+        return None
+    if _is_postgres(connection):
+        return _search_page_postgres(db, user_id, query, emotion_type, limit, cursor)
+
+    match = build_match_expression(user_id, query)
+    if match is None:
+        return None
+
+    sql = (
+        f"SELECT m.id, m.memory_type, m.emotion_type, m.emotion_intensity, "
+        f"substr(m.content_head, 1, 150) AS content, m.summary, m.tags, "
+        f"m.audio_path, m.image_path, m.created_at, m.updated_at, "
+        f"snippet({FTS_TABLE}, 1, :open, :close, '…', 24) AS highlight, "
+        f"highlight({FTS_TABLE}, 2, :open, :close) AS summary_highlight, "
+        f"bm25({FTS_TABLE}, {BM25_WEIGHTS}) AS score "
+        f"FROM {FTS_TABLE} JOIN memories m ON m.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :match"
+    )
+    params = {"match": match, "open": HIGHLIGHT_OPEN, "close": HIGHLIGHT_CLOSE, "limit": limit + 1}
+    if emotion_type:
+        sql += " AND m.emotion_type = :emotion_type"
+        params["emotion_type"] = emotion_type
+
+    sql = f"SELECT * FROM ({sql})"
+    if cursor:
+        params["after_score"], params["after_id"] = decode_cursor(cursor, float, int)
+        sql += " WHERE score > :after_score OR (score = :after_score AND id > :after_id)"
+    sql += " ORDER BY score, id LIMIT :limit"
+
+    rows = db.execute(
+        text(sql).columns(tags=JSON, created_at=DateTime, updated_at=DateTime),
+        params
+    ).mappings().all()
+
+    return _page_results(rows, limit)
+
+
+def _search_page_postgres(db, user_id, query, emotion_type, limit, cursor):
+    """PostgreSQL: tsvector匹配，ts_rank排序，分页后再计算高亮"""
+    tsquery = build_tsquery(query)
+    if tsquery is None:
+        return None
+
+    ranked = (
+        f"SELECT m.id, m.memory_type, m.emotion_type, m.emotion_intensity, "
+        f"substr(m.content_head, 1, 150) AS content, m.summary, m.tags, "
+        f"m.audio_path, m.image_path, m.created_at, m.updated_at, "
+        f"f.content AS segmented_content, f.summary AS segmented_summary, "
+        f"-ts_rank(f.document, q) AS score "
+        f"FROM {FTS_TABLE} f JOIN memories m ON m.id = f.memory_id, "
+        f"to_tsquery('simple', :tsquery) q "
+        f"WHERE f.owner = :user_id AND f.document @@ q"
+    )
+    params = {
+        "tsquery": tsquery,
+        "user_id": user_id,
+        "limit": limit + 1,
+        "options": PG_HEADLINE_OPTIONS,
+        "summary_options": PG_SUMMARY_HEADLINE_OPTIONS
+    }
+    if emotion_type:
+        ranked += " AND m.emotion_type = :emotion_type"
+        params["emotion_type"] = emotion_type
+
+    page = f"SELECT * FROM ({ranked}) ranked"
+    if cursor:
+        params["after_score"], params["after_id"] = decode_cursor(cursor, float, int)
+        page += " WHERE score > :after_score OR (score = :after_score AND id > :after_id)"
+    page += " ORDER BY score, id LIMIT :limit"
+
+    sql = (
+        f"SELECT p.id, p.memory_type, p.emotion_type, p.emotion_intensity, p.content, "
+        f"p.summary, p.tags, p.audio_path, p.image_path, p.created_at, p.updated_at, "
+        f"ts_headline('simple', p.segmented_content, q, :options) AS highlight, "
+        f"ts_headline('simple', p.segmented_summary, q, :summary_options) AS summary_highlight, "
+        f"p.score "
+        f"FROM ({page}) p, to_tsquery('simple', :tsquery) q "
+        f"ORDER BY p.score, p.id"
+    )
+    rows = db.execute(
+        text(sql).columns(tags=JSON, created_at=DateTime, updated_at=DateTime),
+        params
+    ).mappings().all()
+
+    return _page_results(rows, limit)
+
+
+def _page_results(rows, limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """截取本页结果并生成下一页游标（游标记录数据库原始得分）"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["score"], rows[-1]["id"])
+
+    results = [
+        {
+            **row,
+            "highlight": _strip(row["highlight"]),
+            "summary_highlight": _strip(row["summary_highlight"]),
+            # bm25（及取负的ts_rank）越小越相关，转为越大越相关
+            "score": -row["score"]
+        }
+        for row in rows
+    ]
+    return results, next_cursor
+
+
+def search(
+    db,
+    user_id: int,
+    query: str,
+    emotion_type: Optional[str] = None,
+    limit: int = 50
+) -> Optional[List[Dict]]:
+    """
+    全文检索用户的记忆
+
+    Returns:
+        按bm25相关度排序的结果列表；FTS不可用或查询没有可检索的词时返回None，
+        由调用方退回普通查询
+    """
+    page = search_page(db, user_id, query, emotion_type, limit)
+    return None if page is None else page[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="记忆全文索引维护")
+    parser.add_argument("--rebuild", action="store_true", help="根据现有记忆重建全文索引")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        # 各分片的全文索引互不相关，并行重建
+        count = sum(shard_router.fan_out(rebuild, readonly=False))
+        print(f"✓ 全文索引重建完成，共 {count} 条记忆")
+    else:
+        parser.print_help()
@@ -0,0 +1,188 @@
+"""
+记忆标签索引服务
+文件: backend-ai/app/services/memory_tags.py
+功能: 把 Memory.tags (JSON) 同步到规范化的 memory_tags 表，
+      提供标签计数、标签-情绪分布和按标签过滤的SQL查询
+"""
+
+import logging
+import argparse
+from typing import Optional, List, Dict, Iterable, Tuple
+
+from sqlalchemy import event, func, select, delete, insert, inspect, true, case, cast
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session as OrmSession, attributes
+
+from app.models.emotion import Memory, MemoryTag
+from app.models.sharding import shard_router
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== 索引维护 ====================
+
+def normalize_tags(tags) -> List[str]:
+    """去除空白和重复标签，保持原有顺序"""
+    seen = []
+    for tag in tags or []:
+        value = str(tag).strip()
+        if value and value not in seen:
+            seen.append(value)
+    return seen
+
+
+def replace_tags(connection, rows: Iterable[Dict]):
+    """
+    覆盖记忆的标签行
+
+    Args:
+        rows: [{id, user_id, tags}, ...]
+    """
+    rows = list(rows)
+    if not rows:
+        return
+
+    remove_tags(connection, [row["id"] for row in rows])
+    params = [
+        {"memory_id": row["id"], "user_id": row["user_id"], "tag": tag}
+        for row in rows
+        if row.get("user_id") is not None
+        for tag in normalize_tags(row.get("tags"))
+    ]
+    if params:
+        connection.execute(insert(MemoryTag.__table__), params)
+
+
+def remove_tags(connection, memory_ids: List[int]):
+    """删除记忆的全部标签行"""
+    if memory_ids:
+        connection.execute(
+            delete(MemoryTag.__table__).where(MemoryTag.memory_id.in_(memory_ids))
+        )
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _maintain_tags(session, flush_context):
+    """记忆增删改后在同一事务中同步标签表"""
+    to_replace, to_remove = [], []
+
+    for obj in session.new:
+        if isinstance(obj, Memory):
+            to_replace.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Memory) and (
+            attributes.get_history(obj, "tags").has_changes()
+            or attributes.get_history(obj, "user_id").has_changes()
+        ):
+            to_replace.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Memory):
+            identity = inspect(obj).identity
+            if identity:
+                to_remove.append(identity[0])
+
+    if not (to_replace or to_remove):
+        return
+
+    connection = session.connection()
+    remove_tags(connection, to_remove)
+    replace_tags(connection, [
+        {"id": obj.id, "user_id": obj.user_id, "tags": obj.tags}
+        for obj in to_replace
+    ])
+
+
+def backfill(db, user_id: Optional[int] = None) -> int:
+    """
+    根据 Memory.tags 重建标签表（在数据库内展开JSON数组：
+    SQLite用json_each，PostgreSQL用jsonb_array_elements_text）
+
+    Returns:
+        写入的标签行数
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # 非数组（如JSON null）按空数组处理，否则函数报错
+        tags = case(
+            (func.jsonb_typeof(Memory.tags) == "array", Memory.tags),
+            else_=cast("[]", JSONB)
+        )
+        tag = func.jsonb_array_elements_text(tags).table_valued("value").alias("tag")
+    else:
+        # 旧库迁移来的非法JSON（如逗号分隔的文本）按空数组处理，否则 json_each 报错
+        tags = case((func.json_valid(Memory.tags) == 1, Memory.tags), else_=func.json_array())
+        tag = func.json_each(tags).table_valued("value").alias("tag")
+    clear = delete(MemoryTag.__table__)
+    source = select(
+        Memory.id,
+        Memory.user_id,
+        func.trim(tag.c.value)
+    ).select_from(Memory).join(tag, true()).where(
+        Memory.user_id.isnot(None),
+        func.trim(tag.c.value) != ""
+    ).distinct()
+
+    if user_id is not None:
+        clear = clear.where(MemoryTag.user_id == user_id)
+        source = source.where(Memory.user_id == user_id)
+
+    db.execute(clear)
+    db.execute(
+        insert(MemoryTag.__table__).from_select(["memory_id", "user_id", "tag"], source)
+    )
+    # SQLAlchemy在psycopg下拿不到 INSERT ... SELECT 的rowcount（恒为-1），改为清空后计数
+    written = select(func.count()).select_from(MemoryTag.__table__)
+    if user_id is not None:
+        written = written.where(MemoryTag.user_id == user_id)
+    written = db.execute(written).scalar()
+    db.commit()
+    return written
+
+
+# ==================== 查询 ====================
+
+def tag_emotion_counts(db, user_id: int) -> List[Tuple[str, str, int]]:
+    """
+    按 (标签, 情绪) 统计用户的记忆数
+
+    Returns:
+        [(tag, emotion_type, count), ...]
+    """
+    return db.query(
+        MemoryTag.tag,
+        Memory.emotion_type,
+        func.count()
+    ).join(
+        Memory, Memory.id == MemoryTag.memory_id
+    ).filter(
+        MemoryTag.user_id == user_id
+    ).group_by(MemoryTag.tag, Memory.emotion_type).all()
+
+
+def filter_by_tag(query, user_id: int, tag: str):
+    """给记忆查询追加标签过滤条件（走 (user_id, tag, memory_id) 索引）"""
+    return query.filter(Memory.id.in_(
+        select(MemoryTag.memory_id).where(
+            MemoryTag.user_id == user_id,
+            MemoryTag.tag == tag
+        )
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="记忆标签索引维护")
+    parser.add_argument("--backfill", action="store_true", help="根据现有JSON标签重建标签表")
+    parser.add_argument("--user-id", type=int, default=None, help="只处理指定用户")
+    args = parser.parse_args()
+
+    if args.backfill:
+        if args.user_id is not None:
+            db = shard_router.session(args.user_id)
+            try:
+                rows = backfill(db, args.user_id)
+            finally:
+                db.close()
+        else:
+            rows = sum(shard_router.fan_out(backfill, readonly=False))
+        print(f"✓ 标签表回填完成，共 {rows} 行")
+    else:
+        parser.print_help()
@@ -0,0 +1,381 @@
+"""
+记忆批量导出/导入服务
+文件: backend-ai/app/services/memory_transfer.py
+功能: 以 NDJSON（每行一条记忆的JSON，可 gzip 压缩）导出和导入用户的全部记忆
+      - 导出: 服务端游标（yield_per）流式读取热表，之后继续读冷库，内存只占一块；
+              按 (created_at, id) 倒序，与列表接口一致
+      - 导入: 请求体边读边按行解析，每 MEMORY_TRANSFER_CHUNK 条一个事务，
+              executemany 批量插入记忆和情绪读数，并在同一事务中同步标签表、全文索引、
+              每日/周/月汇总（绕过了ORM钩子）；提交后更新统计摘要并使缓存失效
+      - 导入的记忆分配新ID，不保留原ID和会话ID；格式错误的行跳过并报告行号
+
+用法:
+    python -m app.services.memory_transfer --export 42 --out memories-42.ndjson.gz
+    python -m app.services.memory_transfer --import 42 --file memories-42.ndjson.gz
+"""
+
+import os
+import sys
+import json
+import zlib
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Iterable, Iterator
+
+from sqlalchemy import select, insert
+
+from app.models.emotion import Memory, EmotionEvent, EVENT_SOURCES, CONTENT_HEAD_LENGTH
+from app.models.sharding import ShardRouter, shard_router
+from app.services import emotion_rollup, memory_search, memory_tags, memory_archive, memory_dedup, memory_vectors, sketches
+from app.services.emotion_events import emotion_code
+from app.services.pagination import count_cache
+from app.services.response_cache import bump_users
+
+logger = logging.getLogger(__name__)
+
+# 导出每次从游标读取的行数，导入每个事务的条数
+MEMORY_TRANSFER_CHUNK = int(os.getenv("MEMORY_TRANSFER_CHUNK", "1000"))
+# 导入时单行的最大字节数（解压后）
+MEMORY_IMPORT_MAX_LINE_BYTES = int(os.getenv("MEMORY_IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+# 导入结果中最多报告的错误行数
+MAX_REPORTED_ERRORS = 20
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# 导出的字段（导入时读取同样的字段，id 仅供参考）
+EXPORT_FIELDS = (
+    "id", "memory_type", "emotion_type", "emotion_intensity", "content", "summary", "tags",
+    "audio_path", "image_path", "is_shared", "created_at", "updated_at"
+)
+
+
+class InvalidImportError(ValueError):
+    """导入数据无法继续解析（行过长或压缩数据损坏）"""
+
+
+# ==================== 导出 ====================
+
+def _export_record(row) -> Dict:
+    record = {field: row.get(field) for field in EXPORT_FIELDS}
+    for key in ("created_at", "updated_at"):
+        if isinstance(record[key], datetime):
+            record[key] = record[key].isoformat()
+    record["tags"] = record["tags"] or []
+    return record
+
+
+def iter_export(user_id: int, router: ShardRouter = shard_router, chunk_size: int = MEMORY_TRANSFER_CHUNK) -> Iterator[Dict]:
+    """
+    按 (created_at, id) 倒序逐条产出用户的全部记忆（热表之后是冷库）
+
+    使用自己的只读会话，生成器结束或关闭时释放
+    """
+    table = Memory.__table__
+    columns = [table.c[field] for field in EXPORT_FIELDS]
+    db = router.read_session(user_id)
+    try:
+        result = db.execute(
+            select(*columns)
+            .where(table.c.user_id == user_id)
+            .order_by(table.c.created_at.desc(), table.c.id.desc())
+            .execution_options(yield_per=chunk_size)
+        )
+        for partition in result.mappings().partitions():
+            for row in partition:
+                yield _export_record(row)
+
+        store = memory_archive.cold_store(db.get_bind())
+        after = None
+        while store is not None:
+            batch = store.scan(user_id, after, chunk_size)
+            for memory in batch:
+                yield _export_record(memory)
+            if len(batch) < chunk_size:
+                break
+            after = (batch[-1]["created_at"], batch[-1]["id"])
+    finally:
+        db.close()
+
+
+def ndjson_chunks(records: Iterable[Dict], compress: bool = False, lines_per_chunk: int = 200) -> Iterator[bytes]:
+    """把记录编码为 NDJSON 字节块（compress=True 时为 gzip 流）"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+        if len(lines) >= lines_per_chunk:
+            data = b"".join(lines)
+            lines = []
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b"".join(lines)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+# ==================== 导入解析 ====================
+
+class LineSplitter:
+    """把请求体字节块增量切分为行；首个块以 gzip 魔数开头时先解压"""
+
+    def __init__(self, max_line_bytes: int = MEMORY_IMPORT_MAX_LINE_BYTES):
+        self.max_line_bytes = max_line_bytes
+        self._buffer = b""
+        self._decompressor = None
+        self._sniffed = False
+
+    def _decompress(self, chunk: bytes) -> Iterator[bytes]:
+        if not self._sniffed:
+            self._sniffed = True
+            if chunk.startswith(GZIP_MAGIC):
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._decompressor is None:
+            yield chunk
+            return
+        try:
+            # 限制每次解压的输出，压缩比很高的数据也不会一次展开
+            data = self._decompressor.decompress(chunk, self.max_line_bytes)
+            while data:
+                yield data
+                data = self._decompressor.decompress(self._decompressor.unconsumed_tail, self.max_line_bytes)
+        except zlib.error as e:
+            raise InvalidImportError(f"gzip 数据损坏: {e}")
+
+    def feed(self, chunk: bytes) -> Iterator[bytes]:
+        for data in self._decompress(chunk):
+            self._buffer += data
+            *lines, self._buffer = self._buffer.split(b"\n")
+            yield from lines
+            if len(self._buffer) > self.max_line_bytes:
+                raise InvalidImportError(f"单行超过 {self.max_line_bytes} 字节")
+
+    def close(self) -> Iterator[bytes]:
+        if self._decompressor is not None and not self._decompressor.eof:
+            raise InvalidImportError("gzip 数据不完整")
+        if self._buffer:
+            yield self._buffer
+            self._buffer = b""
+
+
+def _parse_datetime(value, default: datetime) -> datetime:
+    if value is None:
+        return default
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _optional_text(value, max_length: int) -> Optional[str]:
+    return str(value)[:max_length] if value is not None else None
+
+
+def parse_record(line: bytes) -> Dict:
+    """
+    把一行导出记录转换为 memories 表的列（不含 user_id）
+
+    Raises:
+        ValueError: JSON无效或缺少正文
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("每行应为一个JSON对象")
+    content = record.get("content")
+    if not isinstance(content, str) or not content:
+        raise ValueError("缺少 content")
+
+    intensity = record.get("emotion_intensity")
+    intensity = emotion_rollup.DEFAULT_INTENSITY if intensity is None else min(1.0, max(0.0, float(intensity)))
+    created_at = _parse_datetime(record.get("created_at"), datetime.utcnow())
+    tags = record.get("tags")
+    if tags is not None and not isinstance(tags, list):
+        raise ValueError("tags 应为列表")
+
+    return {
+        "memory_type": _optional_text(record.get("memory_type") or "text", 30),
+        "emotion_type": _optional_text(record.get("emotion_type") or "neutral", 20),
+        "emotion_intensity": intensity,
+        "content": content,
+        "content_head": content[:CONTENT_HEAD_LENGTH],
+        "summary": _optional_text(record.get("summary"), 500),
+        "tags": memory_tags.normalize_tags(tags),
+        "audio_path": _optional_text(record.get("audio_path"), 255),
+        "image_path": _optional_text(record.get("image_path"), 255),
+        "is_shared": bool(record.get("is_shared", False)),
+        "created_at": created_at,
+        "updated_at": _parse_datetime(record.get("updated_at"), created_at),
+    }
+
+
+# ==================== 导入写入 ====================
+
+def insert_memories(connection, user_id: int, records: List[Dict], signatures: Optional[List] = None) -> List[Dict]:
+    """
+    批量插入一批记忆及对应的情绪读数，并在同一事务中同步标签、全文索引、重复检测签名和汇总
+
+    绕过ORM插入记忆的路径都应调用此函数；提交后调用方需更新统计摘要、登记待计算的向量并使缓存失效
+
+    Args:
+        signatures: 已计算好的 MinHash 签名（与 records 对应），缺省时由正文计算
+
+    Returns:
+        插入的行（带新ID）
+    """
+    if not records:
+        return []
+    table = Memory.__table__
+    rows = [dict(record, user_id=user_id, session_id=None) for record in records]
+    ids = connection.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    for row, memory_id in zip(rows, ids):
+        row["id"] = memory_id
+
+    connection.execute(insert(EmotionEvent.__table__), [
+        {
+            "user_id": user_id,
+            "session_id": None,
+            "ts": row["created_at"],
+            "emotion": emotion_code(row["emotion_type"]),
+            "intensity": row["emotion_intensity"],
+            "source": EVENT_SOURCES["memory"]
+        }
+        for row in rows
+    ])
+    memory_tags.replace_tags(connection, rows)
+    if memory_search.fts_available(connection):
+        memory_search.index_memories(connection, rows)
+    if memory_dedup.enabled():
+        memory_dedup.index_signatures(connection, rows, signatures)
+    emotion_rollup.apply_deltas(connection, emotion_rollup.row_deltas(rows))
+    return rows
+
+
+def sketch_updates(user_id: int, rows: List[Dict]) -> List:
+    """一批导入记录对应的统计摘要更新（记忆 + 情绪读数）"""
+    updates = []
+    for row in rows:
+        updates.extend(sketches.memory_updates(user_id, row["tags"], row["created_at"]))
+        updates.extend(sketches.event_updates(
+            user_id, emotion_code(row["emotion_type"]), row["emotion_intensity"], row["created_at"]
+        ))
+    return updates
+
+
+class MemoryImporter:
+    """
+    按块导入一个用户的记忆
+
+    add() 解析一行并缓冲，缓冲满 chunk_size 条时返回 True，调用方随后调用 flush()
+    （接口中在线程池里执行，不阻塞事件循环）；
+    合并去重模式下与已有记忆（或先导入的记录）近似重复的记录不再写入，计入 duplicates
+    """
+
+    def __init__(self, user_id: int, router: ShardRouter = shard_router, chunk_size: int = MEMORY_TRANSFER_CHUNK):
+        self.user_id = user_id
+        self.router = router
+        self.chunk_size = chunk_size
+        self._pending: List[Dict] = []
+        self.lines = 0
+        self.imported = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.errors: List[Dict] = []
+
+    def add(self, line: bytes) -> bool:
+        self.lines += 1
+        if not line.strip():
+            return False
+        try:
+            self._pending.append(parse_record(line))
+        except (ValueError, TypeError) as e:
+            self.skipped += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append({"line": self.lines, "error": str(e)[:200]})
+        return len(self._pending) >= self.chunk_size
+
+    def flush(self) -> int:
+        """在一个事务中写入缓冲的记录"""
+        records, self._pending = self._pending, []
+        if not records:
+            return 0
+        db = self.router.session(self.user_id)
+        try:
+            signatures = None
+            if memory_dedup.MEMORY_DEDUP_MODE == "merge":
+                signatures = [memory_dedup.signature(record["content"]) for record in records]
+                flags = memory_dedup.duplicate_flags(
+                    db.connection(), [(self.user_id, sig) for sig in signatures]
+                )
+                self.duplicates += sum(flags)
+                kept = [i for i, flag in enumerate(flags) if not flag]
+                records = [records[i] for i in kept]
+                signatures = [signatures[i] for i in kept]
+            rows = insert_memories(db.connection(), self.user_id, records, signatures)
+            db.commit()
+            sketches.sketch_recorder.record(db.get_bind(), sketch_updates(self.user_id, rows))
+            memory_vectors.embedding_indexer.record(db.get_bind(), [
+                (self.user_id, row["id"], memory_vectors.memory_text(row["content"], row.get("summary"))) for row in rows
+            ])
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+            count_cache.invalidate([self.user_id])
+            bump_users([self.user_id])
+        self.imported += len(rows)
+        return len(rows)
+
+    def result(self) -> Dict:
+        return {
+            "user_id": self.user_id,
+            "imported": self.imported,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "errors": self.errors
+        }
+
+
+def import_file(user_id: int, path: str, router: ShardRouter = shard_router, chunk_size: int = MEMORY_TRANSFER_CHUNK) -> Dict:
+    """从 NDJSON 文件（可 gzip）导入记忆"""
+    importer = MemoryImporter(user_id, router, chunk_size)
+    splitter = LineSplitter()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(256 * 1024), b""):
+            for line in splitter.feed(chunk):
+                if importer.add(line):
+                    importer.flush()
+    for line in splitter.close():
+        importer.add(line)
+    importer.flush()
+    return importer.result()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="记忆批量导出/导入（NDJSON）")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--export", type=int, metavar="USER_ID", help="导出用户的全部记忆")
+    group.add_argument("--import", dest="import_user", type=int, metavar="USER_ID", help="为用户导入记忆")
+    parser.add_argument("--out", default=None, help="导出文件（.gz 结尾时压缩），默认输出到标准输出")
+    parser.add_argument("--file", default=None, help="导入文件（NDJSON 或 gzip）")
+    args = parser.parse_args()
+
+    if args.export is not None:
+        compress = bool(args.out and args.out.endswith(".gz"))
+        output = open(args.out, "wb") if args.out else sys.stdout.buffer
+        try:
+            for data in ndjson_chunks(iter_export(args.export), compress=compress):
+                output.write(data)
+        finally:
+            if args.out:
+                output.close()
+    else:
+        if not args.file:
+            parser.error("--import 需要 --file")
+        print(json.dumps(import_file(args.import_user, args.file), ensure_ascii=False, indent=2))
@@ -0,0 +1,676 @@
+"""
+记忆向量检索服务
+文件: backend-ai/app/services/memory_vectors.py
+功能: 每条记忆写入时计算一次向量，按用户追加到内存映射的 float16 矩阵文件，
+      检索时用 numpy 暴力计算余弦相似度取 top-k（用户向量很多时可选 HNSW），
+      可与情绪、时间范围、标签过滤组合
+
+      - float16 转 float32 是暴力检索的主要开销（2万条×256维约10ms），最近检索过的用户
+        解码后的矩阵按 LRU 缓存在进程内（EMBEDDING_CACHE_MB），命中时矩阵乘约1ms；
+        文件追加后只解码新增的尾部
+
+      - 向量目录: EMBEDDING_DIR，缺省为 SQLite 库同目录的 <库名>.vectors/；
+        每个模型一个子目录，每个用户一个文件，记录为 (记忆ID int64, 向量 float16[dim])
+      - 记忆提交后只把正文追加到内存缓冲区，后台线程批量计算向量并追加写入文件（加文件锁）；
+        修改正文时追加新向量，读取时同一记忆以最后一条为准
+      - 删除的记忆在检索时按热表过滤掉，--compact 时从文件中清除；归档的记忆保留向量，
+        恢复到热表后无需重算
+      - 向量模型: EMBEDDING_BACKEND=openai（text-embedding-3-small，截断到 EMBEDDING_DIM 维）
+        或 hashing（本地特征哈希，只反映用词重合，不需要API；未配置 OPENAI_API_KEY 时的缺省）
+
+用法:
+    python -m app.services.memory_vectors --backfill   # 为还没有向量的记忆计算向量
+    python -m app.services.memory_vectors --compact    # 清除已删除记忆的向量
+    python -m app.services.memory_vectors --stats
+"""
+
+import os
+import math
+import fcntl
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+from collections import deque, OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, List, Tuple, Iterable, Sequence
+
+import jieba
+import numpy as np
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session as OrmSession, attributes, undefer
+
+from app.models.emotion import Memory, MemoryTag, _is_sqlite_file
+from app.models.sharding import shard_router
+from app.services import api_usage
+from app.services.memory_archive import cold_store, memory_archive
+
+logger = logging.getLogger(__name__)
+
+jieba.setLogLevel(logging.WARNING)
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND") or ("openai" if os.getenv("OPENAI_API_KEY") else "hashing")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", "")
+# 每次向量接口调用的条数、后台写入间隔（秒）、缓冲区上限（条）
+EMBEDDING_BATCH = int(os.getenv("EMBEDDING_BATCH", "64"))
+EMBEDDING_FLUSH_S = float(os.getenv("EMBEDDING_FLUSH_S", "2"))
+EMBEDDING_BUFFER_SIZE = int(os.getenv("EMBEDDING_BUFFER_SIZE", "20000"))
+# 用户向量数达到该值时建 HNSW 图（需要 hnswlib；0 关闭，始终暴力检索）
+EMBEDDING_HNSW_MIN_ROWS = int(os.getenv("EMBEDDING_HNSW_MIN_ROWS", "0"))
+# 进程内缓存的已解码（float32）用户矩阵总大小上限（MB）
+EMBEDDING_CACHE_MB = float(os.getenv("EMBEDDING_CACHE_MB", "64"))
+
+# 参与计算向量的正文长度
+MAX_EMBED_CHARS = 2000
+
+
+# ==================== 向量模型 ====================
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class HashingEmbedder:
+    """本地特征哈希：jieba 分词 + 字二元组，带符号哈希到 dim 维并做 1+log(tf) 加权"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Dict[str, int]:
+        text = (text or "").lower()
+        counts: Dict[str, int] = {}
+        for token in jieba.cut(text):
+            if any(ch.isalnum() for ch in token):
+                counts[token] = counts.get(token, 0) + 1
+        chars = [ch for ch in text if ch.isalnum()]
+        for a, b in zip(chars, chars[1:]):
+            key = f"{a}{b}\x01"
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def embed(self, texts: Sequence[str], user_id: Optional[int] = None) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, h % self.dim] += (1.0 if h >> 63 else -1.0) * (1.0 + math.log(count))
+        return _normalize(vectors)
+
+    async def aembed(self, texts: Sequence[str], user_id: Optional[int] = None) -> np.ndarray:
+        return self.embed(texts, user_id)
+
+
+class OpenAIEmbedder:
+    """OpenAI Embeddings 接口（经 api_usage 计量）"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dim: int = EMBEDDING_DIM):
+        self.model = model
+        self.dim = dim
+        self.name = f"{model}-{dim}"
+
+    async def aembed(self, texts: Sequence[str], user_id: Optional[int] = None) -> np.ndarray:
+        response = await api_usage.embedding(
+            call_site="memory_vectors.embed",
+            user_id=user_id,
+            model=self.model,
+            input=[text or " " for text in texts],
+            dimensions=self.dim
+        )
+        data = sorted(response.data, key=lambda item: item.index)
+        return _normalize(np.array([item.embedding for item in data], dtype=np.float32))
+
+    def embed(self, texts: Sequence[str], user_id: Optional[int] = None) -> np.ndarray:
+        """后台线程中同步调用"""
+        return asyncio.run(self.aembed(texts, user_id))
+
+
+embedder = OpenAIEmbedder() if EMBEDDING_BACKEND == "openai" else HashingEmbedder()
+
+
+def memory_text(content: Optional[str], summary: Optional[str] = None) -> str:
+    """参与计算向量的文本"""
+    return (content or summary or "")[:MAX_EMBED_CHARS]
+
+
+# ==================== 向量文件 ====================
+
+def record_dtype(dim: int) -> np.dtype:
+    return np.dtype([("id", "<i8"), ("vec", "<f2", (dim,))])
+
+
+class UserVectors:
+    """
+    一个用户的向量（只读内存映射）
+
+    同一记忆有多条记录时取最后一条；rows 为有效记录在文件中的行号，ids 与之对应
+    """
+
+    def __init__(self, path: str, dim: int, size: int, previous: Optional["UserVectors"] = None):
+        self.path = path
+        self.size = size
+        dtype = record_dtype(dim)
+        self.count = size // dtype.itemsize
+        self._records = np.memmap(path, dtype=dtype, mode="r", shape=(self.count,)) if self.count else np.zeros(0, dtype)
+        self._vectors = self._records["vec"]
+
+        all_ids = np.asarray(self._records["id"])
+        _, last = np.unique(all_ids[::-1], return_index=True)
+        self.rows = np.sort(self.count - 1 - last)
+        self.ids = all_ids[self.rows]
+        self._matrix = self._extend(previous._matrix) if previous is not None and previous._matrix is not None else None
+        self._hnsw = self._build_hnsw(previous)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """进程内占用（已解码矩阵和ID）"""
+        return (self._matrix.nbytes if self._matrix is not None else 0) + self.ids.nbytes + self.rows.nbytes
+
+    def _extend(self, matrix: np.ndarray) -> np.ndarray:
+        """在已解码的矩阵后接上文件新增记录"""
+        if len(matrix) == self.count:
+            return matrix
+        return np.concatenate([matrix, np.asarray(self._vectors[len(matrix):], dtype=np.float32)])
+
+    def matrix(self) -> np.ndarray:
+        """全部记录解码为 float32 的矩阵（首次检索时解码）"""
+        if self._matrix is None:
+            self._matrix = np.asarray(self._vectors, dtype=np.float32)
+        return self._matrix
+
+    def _build_hnsw(self, previous: Optional["UserVectors"]):
+        """向量数达到阈值时建图；文件追加后在原图上增量加入新记录"""
+        count = self.count
+        if not EMBEDDING_HNSW_MIN_ROWS or len(self.ids) < EMBEDDING_HNSW_MIN_ROWS:
+            return None
+        try:
+            import hnswlib
+        except ImportError:
+            logger.warning("未安装 hnswlib，使用暴力检索")
+            return None
+
+        index, start = (previous._hnsw, previous.count) if previous is not None else (None, 0)
+        if index is None:
+            index, start = hnswlib.Index(space="ip", dim=self._vectors.shape[1]), 0
+            index.init_index(max_elements=max(count, 1024), ef_construction=200, M=16)
+        elif index.get_max_elements() < count:
+            index.resize_index(max(count, index.get_max_elements() * 2))
+        if count > start:
+            index.add_items(
+                np.asarray(self._vectors[start:count], dtype=np.float32),
+                np.asarray(self._records["id"][start:count])
+            )
+        index.set_ef(100)
+        return index
+
+    def scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """指定行与查询向量的内积（向量已归一化，即余弦相似度）"""
+        if self._matrix is None and len(rows) * 8 < self.count:
+            # 过滤后只剩少量行时不解码整个矩阵
+            return np.asarray(self._vectors[rows], dtype=np.float32) @ query
+        matrix = self.matrix()
+        if len(rows) * 4 < self.count:
+            return matrix[rows] @ query
+        return (matrix @ query)[rows]
+
+    def search(self, query: np.ndarray, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        余弦相似度最高的 k 条 [(记忆ID, 相似度)]
+
+        Args:
+            allowed: 只在这些记忆ID中检索（过滤条件的结果）
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self._hnsw is not None and (allowed is None or len(allowed) >= EMBEDDING_HNSW_MIN_ROWS):
+            candidates = min(k, len(self.ids))
+            if allowed is None:
+                labels, distances = self._hnsw.knn_query(query, k=candidates)
+            else:
+                allowed_set = set(allowed.tolist())
+                labels, distances = self._hnsw.knn_query(query, k=candidates, filter=lambda label: label in allowed_set)
+            return [(int(label), float(1 - distance)) for label, distance in zip(labels[0], distances[0])]
+
+        rows, ids = self.rows, self.ids
+        if allowed is not None:
+            mask = np.isin(ids, allowed)
+            rows, ids = rows[mask], ids[mask]
+        if not len(rows):
+            return []
+        scores = self.scores(rows, query)
+        top = np.argsort(-scores) if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+class VectorStore:
+    """一个目录下按用户存放的向量文件（每个模型一个子目录）"""
+
+    def __init__(self, root: str, model: str, dim: int):
+        self.root = root
+        self.dim = dim
+        self.directory = os.path.join(root, model)
+        self.dtype = record_dtype(dim)
+        self.cache_bytes = int(EMBEDDING_CACHE_MB * 1024 * 1024)
+        self._cache: "OrderedDict[int, UserVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"{user_id}.vec")
+
+    def users(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".vec"))
+
+    def append(self, user_id: int, memory_ids: Sequence[int], vectors: np.ndarray):
+        """追加一个用户的一批向量（文件锁保证多进程追加不交错）"""
+        if not len(memory_ids):
+            return
+        records = np.zeros(len(memory_ids), dtype=self.dtype)
+        records["id"] = memory_ids
+        records["vec"] = vectors
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(user_id), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(records.tobytes())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self, user_id: int) -> Optional[UserVectors]:
+        """用户当前的向量；文件有追加时重新映射"""
+        path = self.path(user_id)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        size -= size % self.dtype.itemsize  # 忽略正在追加的不完整记录
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached is not None and cached.size == size:
+                self._cache.move_to_end(user_id)
+                return cached
+        vectors = UserVectors(path, self.dim, size, previous=cached if cached and cached.size < size else None)
+        with self._lock:
+            self._cache[user_id] = vectors
+            self._cache.move_to_end(user_id)
+        return vectors
+
+    def trim(self):
+        """按 LRU 淘汰，使缓存的解码矩阵总大小不超过上限（检索后调用）"""
+        with self._lock:
+            total = sum(vectors.nbytes for vectors in self._cache.values())
+            while total > self.cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                total -= evicted.nbytes
+
+    def known_ids(self, user_id: int) -> np.ndarray:
+        vectors = self.load(user_id)
+        return vectors.ids if vectors is not None else np.zeros(0, dtype=np.int64)
+
+    def rewrite(self, user_id: int, keep_ids: Iterable[int]) -> int:
+        """只保留指定记忆的（最新）向量，返回移除的记录数"""
+        vectors = self.load(user_id)
+        if vectors is None:
+            return 0
+        path = self.path(user_id)
+        with open(path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # 加锁后重新读取，包含加锁前刚追加的记录
+                vectors = UserVectors(path, self.dim, os.path.getsize(path))
+                records = np.fromfile(path, dtype=self.dtype, count=vectors.size // self.dtype.itemsize)
+                kept = records[vectors.rows[np.isin(vectors.ids, np.fromiter(keep_ids, dtype=np.int64))]]
+                if len(kept) == len(records):
+                    return 0
+                if len(kept):
+                    tmp = f"{path}.tmp"
+                    kept.tofile(tmp)
+                    os.replace(tmp, path)
+                else:
+                    os.remove(path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        with self._lock:
+            self._cache.pop(user_id, None)
+        return len(records) - len(kept)
+
+    def remove_user(self, user_id: int) -> int:
+        """删除用户的向量文件，返回其中的记录数"""
+        with self._lock:
+            self._cache.pop(user_id, None)
+        path = self.path(user_id)
+        try:
+            count = os.path.getsize(path) // self.dtype.itemsize
+            os.remove(path)
+            return count
+        except FileNotFoundError:
+            return 0
+
+
+_stores: Dict[Tuple[str, str], VectorStore] = {}
+_stores_lock = threading.Lock()
+
+
+def vectors_path(database: str) -> str:
+    """SQLite 库文件对应的向量目录"""
+    stem, _ = os.path.splitext(database)
+    return f"{stem}.vectors"
+
+
+def vector_store(bind) -> Optional[VectorStore]:
+    """
+    数据库（引擎或连接）对应的向量目录
+
+    设置了 EMBEDDING_DIR 时所有分片共用该目录（记忆和用户ID全局唯一）；
+    否则只有 SQLite 文件库有向量目录，其他返回 None（不做向量检索）
+    """
+    if EMBEDDING_DIR:
+        root = os.path.abspath(EMBEDDING_DIR)
+    else:
+        url = bind.engine.url
+        if not _is_sqlite_file(str(url)):
+            return None
+        root = vectors_path(os.path.abspath(url.database))
+    key = (root, embedder.name)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = VectorStore(root, embedder.name, embedder.dim)
+        return store
+
+
+# ==================== 写入时计算 ====================
+
+class EmbeddingIndexer:
+    """
+    待计算向量的记忆缓冲区
+
+    - record(): 提交后由ORM钩子（和批量导入）调用，只追加到内存（缓冲区满时丢弃最旧的）
+    - 后台线程定期 flush()：按向量目录和用户分组，每 EMBEDDING_BATCH 条调用一次向量模型后追加写入
+    - 丢弃或失败的记忆可用 --backfill 补算
+    """
+
+    def __init__(self, flush_interval: float = EMBEDDING_FLUSH_S, buffer_size: int = EMBEDDING_BUFFER_SIZE):
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"recorded": 0, "embedded": 0, "batches": 0, "dropped": 0, "failed": 0}
+
+    def record(self, bind, items: List[Tuple[int, int, str]]):
+        """items: [(user_id, memory_id, 文本), ...]"""
+        store = vector_store(bind)
+        if store is None:
+            return
+        with self._lock:
+            for item in items:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.stats["dropped"] += 1
+                self._buffer.append((store, item))
+            self.stats["recorded"] += len(items)
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def flush(self) -> int:
+        """为缓冲区中的记忆计算向量并写入，返回写入条数"""
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._buffer)
+                self._buffer.clear()
+            if not entries:
+                return 0
+
+            # 同一记忆在缓冲区中多次出现时只算最后一次的正文
+            latest: "OrderedDict[Tuple, Tuple[VectorStore, int, str]]" = OrderedDict()
+            for store, (user_id, memory_id, text) in entries:
+                latest.pop((id(store), memory_id), None)
+                latest[(id(store), memory_id)] = (store, user_id, memory_id, text)
+            items = list(latest.values())
+
+            written = 0
+            for start in range(0, len(items), EMBEDDING_BATCH):
+                batch = items[start:start + EMBEDDING_BATCH]
+                try:
+                    vectors = embedder.embed([text for _, _, _, text in batch])
+                    groups: Dict[Tuple, List[int]] = {}
+                    for i, (store, user_id, _, _) in enumerate(batch):
+                        groups.setdefault((store, user_id), []).append(i)
+                    for (store, user_id), indexes in groups.items():
+                        store.append(user_id, [batch[i][2] for i in indexes], vectors[indexes])
+                    written += len(batch)
+                    self.stats["batches"] += 1
+                except Exception as e:
+                    self.stats["failed"] += len(batch)
+                    logger.error(f"计算记忆向量失败 ({len(batch)}条): {e}")
+            self.stats["embedded"] += written
+            return written
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="embedding-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+
+
+# 全局实例
+embedding_indexer = EmbeddingIndexer()
+
+
+def start_embedding_indexer() -> EmbeddingIndexer:
+    embedding_indexer.start()
+    return embedding_indexer
+
+
+def stop_embedding_indexer():
+    embedding_indexer.stop()
+
+
+_PENDING_KEY = "embedding_items"
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_memories(session, flush_context):
+    """记录本事务中新写入或修改了正文的记忆"""
+    items = []
+    for obj in session.new:
+        if isinstance(obj, Memory):
+            items.append((obj.user_id, obj.id, memory_text(obj.content, obj.summary)))
+    for obj in session.dirty:
+        if isinstance(obj, Memory) and attributes.get_history(obj, "content").has_changes():
+            items.append((obj.user_id, obj.id, memory_text(obj.content, obj.summary)))
+    if items:
+        session.info.setdefault(_PENDING_KEY, []).extend(items)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _record_committed(session):
+    items = session.info.pop(_PENDING_KEY, None)
+    if items:
+        embedding_indexer.record(session.get_bind(), items)
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_pending(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+# ==================== 检索 ====================
+
+async def embed_query(text: str, user_id: Optional[int] = None) -> np.ndarray:
+    """查询文本的向量"""
+    return (await embedder.aembed([memory_text(text)], user_id))[0]
+
+
+def filtered_query(
+    db,
+    user_id: int,
+    emotion: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    tags: Optional[List[str]] = None
+):
+    """用户记忆的过滤条件（情绪、[start, end) 时间范围、含任一标签）"""
+    query = db.query(Memory).filter(Memory.user_id == user_id)
+    if emotion:
+        query = query.filter(Memory.emotion_type == emotion)
+    if start:
+        query = query.filter(Memory.created_at >= start)
+    if end:
+        query = query.filter(Memory.created_at < end)
+    if tags:
+        query = query.filter(Memory.id.in_(
+            select(MemoryTag.memory_id).where(MemoryTag.user_id == user_id, MemoryTag.tag.in_(tags))
+        ))
+    return query
+
+
+def similar_memories(
+    db,
+    user_id: int,
+    query_vector: np.ndarray,
+    limit: int = 20,
+    emotion: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    tags: Optional[List[str]] = None
+) -> List[Tuple[Memory, float]]:
+    """
+    与查询向量最相似的热数据记忆 [(记忆, 相似度)]，按相似度降序
+
+    有过滤条件时先由索引查出符合条件的记忆ID，只在这些向量中检索
+    """
+    store = vector_store(db.get_bind())
+    vectors = store.load(user_id) if store else None
+    if vectors is None or not len(vectors):
+        return []
+
+    allowed = None
+    if emotion or start or end or tags:
+        allowed = np.fromiter(
+            (row[0] for row in filtered_query(db, user_id, emotion, start, end, tags).with_entities(Memory.id)),
+            dtype=np.int64
+        )
+        if not len(allowed):
+            return []
+
+    # 多取一些候选，已删除的记忆在读取时去掉
+    matches = vectors.search(query_vector, limit * 2 + 10 if allowed is None else limit, allowed)
+    store.trim()
+    memories = {
+        memory.id: memory
+        for memory in db.query(Memory).options(undefer(Memory.content)).filter(
+            Memory.user_id == user_id, Memory.id.in_([memory_id for memory_id, _ in matches])
+        )
+    }
+    return [(memories[memory_id], score) for memory_id, score in matches if memory_id in memories][:limit]
+
+
+# ==================== 补算与整理 ====================
+
+def backfill(db, user_id: Optional[int] = None, chunk_size: int = 1000) -> int:
+    """为热表中还没有向量的记忆计算向量，返回计算条数"""
+    store = vector_store(db.get_bind())
+    if store is None:
+        return 0
+    query = select(Memory.user_id, Memory.id, Memory.content, Memory.summary).order_by(Memory.user_id, Memory.id)
+    if user_id is not None:
+        query = query.where(Memory.user_id == user_id)
+
+    total = 0
+    known: Dict[int, set] = {}
+    result = db.connection().execute(query.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        missing = []
+        for row in partition:
+            if row.user_id not in known:
+                known[row.user_id] = set(store.known_ids(row.user_id).tolist())
+            if row.id not in known[row.user_id]:
+                missing.append(row)
+        for start in range(0, len(missing), EMBEDDING_BATCH):
+            batch = missing[start:start + EMBEDDING_BATCH]
+            vectors = embedder.embed([memory_text(row.content, row.summary) for row in batch])
+            groups: Dict[int, List[int]] = {}
+            for i, row in enumerate(batch):
+                groups.setdefault(row.user_id, []).append(i)
+            for uid, indexes in groups.items():
+                store.append(uid, [batch[i].id for i in indexes], vectors[indexes])
+            total += len(batch)
+    return total
+
+
+def compact(db) -> int:
+    """从向量文件中移除已不在热表或归档中的记忆，返回移除的记录数"""
+    store = vector_store(db.get_bind())
+    if store is None:
+        return 0
+    archive = cold_store(db.get_bind())
+    removed = 0
+    for user_id in store.users():
+        live = set(db.execute(select(Memory.id).where(Memory.user_id == user_id)).scalars())
+        if archive is not None:
+            with archive.read_engine.connect() as connection:
+                live.update(connection.execute(
+                    select(memory_archive.c.id).where(memory_archive.c.user_id == user_id)
+                ).scalars())
+        removed += store.rewrite(user_id, live)
+    return removed
+
+
+def _stats(db) -> Tuple[int, int, int]:
+    """(用户文件数, 向量记录数, 字节数)"""
+    store = vector_store(db.get_bind())
+    if store is None:
+        return 0, 0, 0
+    sizes = [os.path.getsize(store.path(user_id)) for user_id in store.users()]
+    return len(sizes), sum(sizes) // store.dtype.itemsize, sum(sizes)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="记忆向量检索索引维护")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--backfill", action="store_true", help="为还没有向量的记忆计算向量")
+    group.add_argument("--compact", action="store_true", help="清除已删除记忆的向量")
+    parser.add_argument("--user-id", type=int, default=None, help="只补算指定用户")
+    args = parser.parse_args()
+
+    if args.backfill:
+        if args.user_id is not None:
+            db = shard_router.read_session(args.user_id)
+            try:
+                total = backfill(db, args.user_id)
+            finally:
+                db.close()
+        else:
+            total = sum(shard_router.fan_out(backfill))
+        print(f"✓ 已为 {total} 条记忆计算向量（{embedder.name}）")
+    elif args.compact:
+        print(f"✓ 已移除 {sum(shard_router.fan_out(compact))} 条失效向量")
+    else:
+        for shard, (users, records, size) in enumerate(shard_router.fan_out(_stats)):
+            print(f"分片 {shard}: {users} 个用户，{records} 条向量（{size / 1024 / 1024:.1f} MB，{embedder.name}）")
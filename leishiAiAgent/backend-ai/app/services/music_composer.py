@@ -7,8 +7,14 @@ AI音乐创作服务
 import openai
 import json
 import os
-from typing import Dict, List
-from datetime import datetime
+import asyncio
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from sqlalchemy.orm import undefer
+
+from app.services import api_usage, memory_dedup, memory_vectors
+from app.models.emotion import Memory
+from app.models.sharding import shard_router
 
 class MusicComposer:
     def __init__(self):
@@ -140,7 +146,7 @@ class MusicComposer:
 以JSON格式返回完整的创作方案。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -207,7 +213,7 @@ class MusicComposer:
 以JSON返回混音方案。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"},
@@ -265,7 +271,7 @@ class MusicComposer:
 以JSON返回。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
@@ -304,7 +310,7 @@ class MusicComposer:
 }}
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -344,7 +350,7 @@ class MusicComposer:
 以JSON返回详细编曲方案。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
@@ -375,13 +381,20 @@ class MemoryManager:
         content: Dict,
         emotion: str
     ) -> Dict:
-        """保存记忆"""
-        
-        # 生成记忆摘要
-        summary = await self._generate_summary(memory_type, content)
+        """保存记忆（与已有记忆近似重复时复用其摘要和标签，不再调用LLM）"""
         
-        # 提取关键标签
-        tags = await self._extract_tags(content)
+        # 签名计算和候选查询在线程池中执行，不阻塞事件循环
+        duplicate = await asyncio.get_running_loop().run_in_executor(
+            None, self._find_duplicate, user_id, content
+        )
+        if duplicate is not None:
+            summary, tags = duplicate.summary, duplicate.tags or []
+        else:
+            # 生成记忆摘要
+            summary = await self._generate_summary(memory_type, content)
+            
+            # 提取关键标签
+            tags = await self._extract_tags(content)
         
         memory = {
             "id": f"memory_{user_id}_{int(datetime.now().timestamp())}",
@@ -391,7 +404,8 @@ class MemoryManager:
             "content": content,
             "emotion": emotion,
             "tags": tags,
-            "created_at": datetime.now().isoformat()
+            "created_at": datetime.now().isoformat(),
+            "duplicate_of": duplicate.id if duplicate is not None else None
         }
         
         # 保存到数据库
@@ -405,15 +419,34 @@ class MemoryManager:
         filters: Dict = None,
         limit: int = 20
     ) -> List[Dict]:
-        """检索记忆"""
-        
-        # 从数据库查询
-        # memories = await db.memories.find(user_id, filters, limit)
-        
-        # 按时间排序
-        # memories.sort(key=lambda x: x['created_at'], reverse=True)
+        """
+        检索记忆（热数据）
         
-        return []  # 返回记忆列表
+        filters:
+        - query: 按与该文本的语义相似度排序（不传时按时间倒序）
+        - emotion: 情绪类型
+        - start / end: 时间范围（datetime 或 ISO 字符串），或 time_range: day/week/month/year
+        - tags: 标签列表（含任一即可）
+        """
+        if not str(user_id).isdigit():
+            return []
+        filters = filters or {}
+        start, end = self._time_range(filters)
+        
+        query_vector = None
+        if filters.get("query"):
+            try:
+                query_vector = await memory_vectors.embed_query(filters["query"], int(user_id))
+            except Exception:
+                # 向量接口不可用时退回按时间倒序
+                query_vector = None
+        
+        # 数据库查询和向量计算在线程池中执行，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self._load_memories, int(user_id), query_vector,
+            filters.get("emotion"), start, end, filters.get("tags"), limit
+        )
     
     async def generate_memory_summary(
         self,
@@ -426,13 +459,14 @@ class MemoryManager:
         """
         
         # 获取时间范围内的记忆
-        # memories = await self.retrieve_memories(user_id, {"time_range": time_range})
+        memories = await self.retrieve_memories(user_id, {"time_range": time_range}, limit=50)
         
         prompt = f"""
 总结用户这段时间的情感历程。
 
 时间范围: {time_range}
-记忆数量: X条
+记忆数量: {len(memories)}条
+{self._format_memories(memories)}
 
 请生成:
 1. 整体情感趋势
@@ -454,7 +488,7 @@ class MemoryManager:
 }}
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"},
@@ -474,12 +508,16 @@ class MemoryManager:
         """
         
         # 获取记忆内容
-        # memories = [await get_memory(mid) for mid in memory_ids]
+        memories = await asyncio.get_running_loop().run_in_executor(
+            None, self._get_memories, user_id, memory_ids
+        )
         
         prompt = f"""
 将这些记忆片段组合成一个完整的故事或作品。
 
 记忆类型: [音乐、对话、播客、日记]
+记忆片段:
+{self._format_memories(memories)}
 
 请创作:
 1. 一个标题
@@ -492,7 +530,7 @@ class MemoryManager:
 以JSON返回创作结果。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"},
@@ -510,6 +548,100 @@ class MemoryManager:
             "created_at": datetime.now().isoformat()
         }
     
+    def _time_range(self, filters: Dict):
+        """过滤条件中的 [start, end) 时间范围"""
+        start, end = filters.get("start"), filters.get("end")
+        start = datetime.fromisoformat(start) if isinstance(start, str) else start
+        end = datetime.fromisoformat(end) if isinstance(end, str) else end
+        days = {"day": 1, "week": 7, "month": 30, "year": 365}.get(filters.get("time_range"))
+        if days and start is None:
+            start = datetime.utcnow() - timedelta(days=days)
+        return start, end
+    
+    def _load_memories(
+        self,
+        user_id: int,
+        query_vector,
+        emotion: Optional[str],
+        start: Optional[datetime],
+        end: Optional[datetime],
+        tags: Optional[List[str]],
+        limit: int
+    ) -> List[Dict]:
+        """按相似度（有查询向量且已建索引时）或时间倒序读取记忆"""
+        db = shard_router.read_session(user_id)
+        try:
+            results = []
+            if query_vector is not None:
+                results = memory_vectors.similar_memories(
+                    db, user_id, query_vector, limit, emotion=emotion, start=start, end=end, tags=tags
+                )
+            if not results:
+                query = memory_vectors.filtered_query(db, user_id, emotion, start, end, tags)
+                results = [
+                    (memory, None)
+                    for memory in query.options(undefer(Memory.content))
+                    .order_by(Memory.created_at.desc(), Memory.id.desc()).limit(limit)
+                ]
+            return [self._memory_dict(memory, score) for memory, score in results]
+        finally:
+            db.close()
+    
+    def _get_memories(self, user_id: str, memory_ids: List[str]) -> List[Dict]:
+        """按ID读取用户的记忆（保持传入顺序）"""
+        ids = [int(mid) for mid in memory_ids if str(mid).isdigit()]
+        if not str(user_id).isdigit() or not ids:
+            return []
+        db = shard_router.read_session(int(user_id))
+        try:
+            memories = {
+                memory.id: memory
+                for memory in db.query(Memory).options(undefer(Memory.content))
+                .filter(Memory.user_id == int(user_id), Memory.id.in_(ids))
+            }
+            return [self._memory_dict(memories[mid]) for mid in ids if mid in memories]
+        finally:
+            db.close()
+    
+    def _memory_dict(self, memory: Memory, score: Optional[float] = None) -> Dict:
+        return {
+            "id": memory.id,
+            "user_id": str(memory.user_id),
+            "type": memory.memory_type,
+            "summary": memory.summary,
+            "content": memory.content,
+            "emotion": memory.emotion_type,
+            "intensity": memory.emotion_intensity,
+            "tags": memory.tags or [],
+            "created_at": memory.created_at.isoformat() if memory.created_at else None,
+            "score": score
+        }
+    
+    def _format_memories(self, memories: List[Dict]) -> str:
+        """提示词中的记忆列表（每条一行，优先用摘要）"""
+        return "\n".join(
+            f"- {(m['created_at'] or '')[:10]} [{m['emotion']}] {m['summary'] or (m['content'] or '')[:80]}"
+            for m in memories
+        )
+    
+    def _find_duplicate(self, user_id: str, content: Dict):
+        """用户已有记忆中与本次内容近似重复的一条（只查热数据，未启用去重时为 None）"""
+        if not memory_dedup.enabled() or not str(user_id).isdigit():
+            return None
+        text = content.get("text") if isinstance(content, dict) else None
+        if not text:
+            text = json.dumps(content, ensure_ascii=False, sort_keys=True)
+        
+        db = shard_router.read_session(int(user_id))
+        try:
+            match = memory_dedup.find_duplicate(db.connection(), int(user_id), text)
+            return db.get(Memory, match[0]) if match else None
+        except Exception:
+            # 检测失败时按新内容处理
+            return None
+        finally:
+            db.close()
+    
     async def _generate_summary(
         self,
         memory_type: str,
@@ -519,7 +651,7 @@ class MemoryManager:
         
         prompt = f"用一句话(20字内)概括这段{memory_type}记忆: {str(content)[:200]}"
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.5,
@@ -533,7 +665,7 @@ class MemoryManager:
         
         prompt = f"从内容中提取3-5个关键标签: {str(content)[:300]}"
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.5
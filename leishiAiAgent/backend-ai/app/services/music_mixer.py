@@ -9,6 +9,8 @@ import uuid
 from typing import Dict, List
 import os
 
+from app.services import api_usage
+
 class MusicMixer:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -140,7 +142,7 @@ class MusicMixer:
         以JSON格式返回。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -169,7 +171,7 @@ class MusicMixer:
         用50-80字描述这段音乐的感觉和氛围。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -12,6 +12,8 @@ import httpx
 from typing import Optional, Dict, Any
 import json
 
+from app.services import api_usage
+
 class OpenAIService:
     def __init__(self):
         self.api_key = os.getenv('OPENAI_API_KEY')
@@ -54,12 +56,15 @@ class OpenAIService:
                 'file': ('audio.m4a', audio_data, 'audio/mp4'),
                 'model': (None, 'whisper-1'),
                 'language': (None, language),
+                # verbose_json 带音频时长，用于计量
+                'response_format': (None, 'verbose_json'),
             }
             
             if prompt:
                 files['prompt'] = (None, prompt)
 
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient() as client, \
+                    api_usage.track('openai_whisper', 'whisper-1', 'openai_service.transcribe_audio') as call:
                 response = await client.post(
                     f'{self.api_base}/audio/transcriptions',
                     files=files,
@@ -68,6 +73,7 @@ class OpenAIService:
                 
                 if response.status_code == 200:
                     result = response.json()
+                    call.audio_seconds = float(result.get('duration') or 0.0)
                     return {
                         'text': result.get('text', ''),
                         'language': language,
@@ -75,6 +81,7 @@ class OpenAIService:
                         'success': True
                     }
                 else:
+                    call.status = f'http_{response.status_code}'
                     return {
                         'error': f'Whisper API error: {response.status_code}',
                         'success': False
@@ -129,24 +136,27 @@ class OpenAIService:
                 'max_tokens': max_tokens
             }
 
-            response = await self.client.post(
-                f'{self.api_base}/chat/completions',
-                json=payload
-            )
+            async with api_usage.track('openai_chat', model, 'openai_service.generate_text') as call:
+                response = await self.client.post(
+                    f'{self.api_base}/chat/completions',
+                    json=payload
+                )
 
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    'text': result['choices'][0]['message']['content'],
-                    'tokens_used': result['usage']['total_tokens'],
-                    'finish_reason': result['choices'][0]['finish_reason'],
-                    'success': True
-                }
-            else:
-                return {
-                    'error': f'GPT-4 API error: {response.status_code}',
-                    'success': False
-                }
+                if response.status_code == 200:
+                    result = response.json()
+                    call.add_usage(result.get('usage'))
+                    return {
+                        'text': result['choices'][0]['message']['content'],
+                        'tokens_used': result['usage']['total_tokens'],
+                        'finish_reason': result['choices'][0]['finish_reason'],
+                        'success': True
+                    }
+                else:
+                    call.status = f'http_{response.status_code}'
+                    return {
+                        'error': f'GPT-4 API error: {response.status_code}',
+                        'success': False
+                    }
 
         except Exception as e:
             return {
@@ -222,27 +232,30 @@ class OpenAIService:
                 'speed': speed
             }
 
-            response = await self.client.post(
-                f'{self.api_base}/audio/speech',
-                json=payload
-            )
+            async with api_usage.track('openai_tts', model, 'openai_service.synthesize_speech') as call:
+                call.input_chars = len(text)
+                response = await self.client.post(
+                    f'{self.api_base}/audio/speech',
+                    json=payload
+                )
 
-            if response.status_code == 200:
-                import base64
-                audio_data = base64.b64encode(response.content).decode('utf-8')
-                
-                return {
-                    'audio': audio_data,
-                    'format': 'mp3',
-                    'voice': voice,
-                    'duration_estimate': len(text) / 200,  # 粗略估计
-                    'success': True
-                }
-            else:
-                return {
-                    'error': f'TTS API error: {response.status_code}',
-                    'success': False
-                }
+                if response.status_code == 200:
+                    import base64
+                    audio_data = base64.b64encode(response.content).decode('utf-8')
+                    
+                    return {
+                        'audio': audio_data,
+                        'format': 'mp3',
+                        'voice': voice,
+                        'duration_estimate': len(text) / 200,  # 粗略估计
+                        'success': True
+                    }
+                else:
+                    call.status = f'http_{response.status_code}'
+                    return {
+                        'error': f'TTS API error: {response.status_code}',
+                        'success': False
+                    }
 
         except Exception as e:
             return {
@@ -0,0 +1,192 @@
+"""
+游标分页服务
+文件: backend-ai/app/services/pagination.py
+功能: 基于 (created_at, id) 的键集分页，游标对客户端不透明；
+      记忆总数从汇总表/标签表计算并短时缓存，翻页成本与页码无关
+"""
+
+import os
+import json
+import time
+import base64
+import logging
+import threading
+from datetime import datetime
+from typing import Optional, List, Tuple, Any, Dict
+
+from sqlalchemy import event, func, and_, or_
+from sqlalchemy.orm import Session as OrmSession
+
+from app.models.emotion import Memory, MemoryTag, EmotionDailyRollup
+
+logger = logging.getLogger(__name__)
+
+# 总数缓存的有效期（秒）和最大条目数
+COUNT_CACHE_TTL = float(os.getenv("MEMORY_COUNT_CACHE_TTL", "30"))
+COUNT_CACHE_SIZE = int(os.getenv("MEMORY_COUNT_CACHE_SIZE", "10000"))
+
+
+class InvalidCursorError(ValueError):
+    """游标无法解析"""
+    pass
+
+
+# ==================== 游标编解码 ====================
+
+def encode_cursor(*values) -> str:
+    """把排序键编码为URL安全的不透明字符串"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, *types) -> Tuple[Any, ...]:
+    """
+    解析游标
+
+    Args:
+        token: encode_cursor 生成的字符串
+        types: 每个排序键的类型（datetime/int/float）
+
+    Raises:
+        InvalidCursorError: 游标格式不正确
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError("length mismatch")
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for kind, value in zip(types, payload)
+        )
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"无效的游标: {token}") from e
+
+
+# ==================== 键集分页 ====================
+
+def _after(created_at: datetime, memory_id: int):
+    """(created_at, id) 倒序下位于游标之后的条件
+
+    写成 created_at <= :c AND (...) 的形式，使 (user_id, created_at, id)
+    索引能直接定位起点
+    """
+    return and_(
+        Memory.created_at <= created_at,
+        or_(Memory.created_at < created_at, Memory.id < memory_id)
+    )
+
+
+def paginate(
+    query,
+    cursor: Optional[str],
+    limit: int,
+    offset: int = 0
+) -> Tuple[List, Optional[str]]:
+    """
+    对记忆查询做键集分页，按 (created_at, id) 倒序
+
+    查询的实体/列中必须包含 Memory.created_at 和 Memory.id
+    （ORM对象或带同名属性的行）。offset 仅为兼容旧客户端，传入游标时忽略
+
+    Returns:
+        (本页结果, 下一页游标；没有更多时为None)
+    """
+    if cursor:
+        query = query.filter(_after(*decode_cursor(cursor, datetime, int)))
+        offset = 0
+
+    rows = query.order_by(
+        Memory.created_at.desc(), Memory.id.desc()
+    ).limit(limit + 1).offset(offset or None).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
+
+
+# ==================== 总数 ====================
+
+def count_memories(
+    db,
+    user_id: int,
+    emotion_type: Optional[str] = None,
+    tag: Optional[str] = None
+) -> int:
+    """
+    统计用户记忆数，不扫描 memories 表正文
+
+    无标签过滤时累加每日汇总表，有标签过滤时读 memory_tags 索引
+    """
+    if tag:
+        query = db.query(func.count()).select_from(MemoryTag).filter(
+            MemoryTag.user_id == user_id,
+            MemoryTag.tag == tag
+        )
+        if emotion_type:
+            query = query.join(Memory, Memory.id == MemoryTag.memory_id).filter(
+                Memory.emotion_type == emotion_type
+            )
+        return query.scalar() or 0
+
+    query = db.query(func.sum(EmotionDailyRollup.count)).filter(
+        EmotionDailyRollup.user_id == user_id
+    )
+    if emotion_type:
+        query = query.filter(EmotionDailyRollup.emotion_type == emotion_type)
+    return int(query.scalar() or 0)
+
+
+class CountCache:
+    """按用户失效的短时总数缓存"""
+
+    def __init__(self, ttl: float = COUNT_CACHE_TTL, max_size: int = COUNT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[tuple, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def get_or_count(self, db, user_id: int, emotion_type: Optional[str] = None,
+                     tag: Optional[str] = None) -> int:
+        key = (user_id, emotion_type, tag)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        total = count_memories(db, user_id, emotion_type, tag)
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+            self._entries[key] = (now + self.ttl, total)
+        return total
+
+    def invalidate(self, user_ids):
+        """清除指定用户的缓存条目"""
+        user_ids = set(user_ids)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in user_ids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = CountCache()
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _invalidate_counts(session, flush_context):
+    """记忆增删后清除对应用户的总数缓存"""
+    user_ids = {
+        obj.user_id
+        for obj in list(session.new) + list(session.deleted) + list(session.dirty)
+        if isinstance(obj, Memory)
+    }
+    if user_ids:
+        count_cache.invalidate(user_ids)
@@ -0,0 +1,382 @@
+"""
+Parquet 增量导出服务
+文件: backend-ai/app/services/parquet_export.py
+功能: 把记忆、会话、DApp历史和API调用记录按水位线增量导出为按日期分区的 Parquet 文件，
+      离线分析读导出文件（见 app/services/analytics.py），不再直接查询线上数据库
+
+      - 按主键（或 时间, 主键）键集分块读取，每块一个短读事务，内存只占一块数据
+      - 输出 <目录>/<表>/date=YYYY-MM-DD/part-<批次>-<分片>-<序号>.parquet（Hive 分区）
+      - 先写 .tmp 文件，整张表（每个分片）导出完成后改名，再保存水位线；
+        中途失败时临时文件在下次运行时清除，从上次的水位线重新导出
+      - 列类型由模型列推导，每次导出的 schema 一致
+
+      各表的水位线:
+      - memories / sessions / api_usage_log: 主键，只导出新插入的行（之后的修改不再导出）
+      - dapp_history: (last_accessed, 主键)，每次访问都会更新该行，导出的是快照，
+        分析时按主键取最新一条；只导出 PARQUET_EXPORT_LAG_S 秒之前的变更，避免漏掉仍在提交中的行
+
+      记忆正文不导出（压缩存储且含个人内容），分析使用摘要、标签和情绪列。
+      需要 pyarrow；同一目录不要同时运行多个导出（用文件锁互斥）
+
+用法:
+    python -m app.services.parquet_export                       # 导出全部表的新数据
+    python -m app.services.parquet_export --tables memories --out /data/analytics
+    python -m app.services.parquet_export --status
+"""
+
+import os
+import json
+import fcntl
+import logging
+import argparse
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List, Tuple
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, JSON, select, func, and_, or_
+from sqlalchemy.orm import sessionmaker
+
+from app.models.emotion import Memory, Session as SessionModel, DAppHistory, APIUsageLog, ReadSessionLocal
+from app.models.sharding import ShardRouter, shard_router
+
+logger = logging.getLogger(__name__)
+
+# 导出目录、每块行数、时间水位线的延迟（秒）和同时打开的分区文件数
+PARQUET_EXPORT_DIR = os.getenv("PARQUET_EXPORT_DIR", "./analytics")
+PARQUET_EXPORT_CHUNK = int(os.getenv("PARQUET_EXPORT_CHUNK", "20000"))
+PARQUET_EXPORT_LAG_S = float(os.getenv("PARQUET_EXPORT_LAG_S", "60"))
+PARQUET_EXPORT_OPEN_FILES = int(os.getenv("PARQUET_EXPORT_OPEN_FILES", "8"))
+
+WATERMARK_FILE = "_watermarks.json"
+LOCK_FILE = ".export.lock"
+NULL_PARTITION = "unknown"
+
+
+class ExportSpec:
+    """一张表的导出方式"""
+
+    def __init__(self, table, columns: List[str], partition_by: str, cursor: Optional[str] = None, sharded: bool = False):
+        """
+        Args:
+            table: SQLAlchemy Table
+            columns: 导出的列（第一列为主键）
+            partition_by: 按该时间列的日期分区
+            cursor: 时间水位线列；为空时按主键
+            sharded: 表在记忆分片中（否则在主库）
+        """
+        self.table = table
+        self.columns = [table.c[name] for name in columns]
+        self.partition_by = table.c[partition_by]
+        self.cursor = table.c[cursor] if cursor else None
+        self.sharded = sharded
+
+    @property
+    def name(self) -> str:
+        return self.table.name
+
+
+EXPORT_SPECS: Dict[str, ExportSpec] = {
+    spec.name: spec for spec in [
+        ExportSpec(
+            Memory.__table__,
+            ["id", "user_id", "session_id", "memory_type", "emotion_type", "emotion_intensity",
+             "summary", "tags", "is_shared", "created_at", "updated_at"],
+            partition_by="created_at", sharded=True
+        ),
+        ExportSpec(
+            SessionModel.__table__,
+            ["id", "user_id", "started_at", "ended_at", "duration_seconds",
+             "current_emotion", "emotion_intensity", "current_dapp"],
+            partition_by="started_at", sharded=True
+        ),
+        ExportSpec(
+            DAppHistory.__table__,
+            ["id", "user_id", "dapp_name", "dapp_mode", "open_count", "total_duration_seconds",
+             "last_accessed", "trigger_emotion", "trigger_intensity", "user_rating"],
+            partition_by="last_accessed", cursor="last_accessed"
+        ),
+        ExportSpec(
+            APIUsageLog.__table__,
+            ["id", "user_id", "api_name", "endpoint", "model", "status", "tokens_used", "prompt_tokens",
+             "completion_tokens", "audio_seconds", "input_chars", "cost_usd", "latency_ms", "timestamp"],
+            partition_by="timestamp"
+        ),
+    ]
+}
+
+
+def arrow_schema(spec: ExportSpec):
+    """由模型列类型推导 Arrow schema（JSON 列按字符串列表导出）"""
+    import pyarrow as pa
+
+    fields = []
+    for column in spec.columns:
+        column_type = column.type
+        if isinstance(column_type, JSON):
+            arrow_type = pa.list_(pa.string())
+        elif isinstance(column_type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column_type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column_type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column_type, DateTime):
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _json_list(value) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+    return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+
+
+# ==================== 分区文件 ====================
+
+class PartitionWriters:
+    """
+    按日期分区写 Parquet：每个分区一个打开的 ParquetWriter，每次 write 追加一个行组；
+    打开的文件超过上限时关闭最久未写的（之后再写该分区会新开一个文件）
+    """
+
+    def __init__(self, out_dir: str, table_name: str, schema, prefix: str, max_open: int = PARQUET_EXPORT_OPEN_FILES):
+        self.out_dir = out_dir
+        self.table_name = table_name
+        self.schema = schema
+        self.prefix = prefix
+        self.max_open = max(1, max_open)
+        # 分区 -> (ParquetWriter, 临时文件路径)，最近写入的在末尾
+        self._open: OrderedDict = OrderedDict()
+        self._sequence = 0
+        self.files: List[str] = []
+
+    def write(self, partition: str, table):
+        import pyarrow.parquet as pq
+
+        entry = self._open.get(partition)
+        if entry is None:
+            directory = os.path.join(self.out_dir, self.table_name, f"date={partition}")
+            os.makedirs(directory, exist_ok=True)
+            self._sequence += 1
+            path = os.path.join(directory, f"part-{self.prefix}-{self._sequence:05d}.parquet.tmp")
+            entry = (pq.ParquetWriter(path, self.schema, compression="zstd"), path)
+            self._open[partition] = entry
+            self.files.append(path)
+            while len(self._open) > self.max_open:
+                _, (writer, _) = self._open.popitem(last=False)
+                writer.close()
+        self._open.move_to_end(partition)
+        entry[0].write_table(table)
+
+    def close(self):
+        while self._open:
+            _, (writer, _) = self._open.popitem(last=False)
+            writer.close()
+
+    def commit(self):
+        """关闭全部文件并去掉 .tmp 后缀"""
+        self.close()
+        for path in self.files:
+            os.replace(path, path[:-len(".tmp")])
+
+    def abort(self):
+        self.close()
+        for path in self.files:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# ==================== 水位线 ====================
+
+def load_watermarks(out_dir: str) -> Dict[str, Dict]:
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_watermarks(out_dir: str, watermarks: Dict[str, Dict]):
+    """原子替换水位线文件"""
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(watermarks, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _clean_temp_files(out_dir: str) -> int:
+    """清除上次中断的导出留下的临时文件"""
+    removed = 0
+    for root, _, files in os.walk(out_dir):
+        for name in files:
+            if name.endswith(".parquet.tmp"):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+# ==================== 导出 ====================
+
+def _chunk_query(spec: ExportSpec, watermark: Dict, upper, chunk_size: int):
+    """水位线之后的下一块（键集分页，不用 OFFSET）"""
+    table_id = spec.columns[0]
+    query = select(*spec.columns)
+    if spec.cursor is None:
+        query = query.where(table_id > watermark.get("id", 0), table_id <= upper).order_by(table_id)
+    else:
+        conditions = [spec.cursor.isnot(None), spec.cursor <= upper]
+        if watermark:
+            since = datetime.fromisoformat(watermark["ts"])
+            conditions.append(or_(
+                spec.cursor > since,
+                and_(spec.cursor == since, table_id > watermark["id"])
+            ))
+        query = query.where(*conditions).order_by(spec.cursor, table_id)
+    return query.limit(chunk_size)
+
+
+def export_table(
+    spec: ExportSpec,
+    factory: sessionmaker,
+    watermark: Dict,
+    out_dir: str,
+    prefix: str,
+    chunk_size: int = PARQUET_EXPORT_CHUNK,
+    lag_seconds: float = PARQUET_EXPORT_LAG_S
+) -> Tuple[int, Dict]:
+    """
+    导出一张表（一个分片）在水位线之后的行
+
+    Returns:
+        (导出行数, 新水位线)；失败时删除本次写出的临时文件并抛出异常
+    """
+    import pyarrow as pa
+
+    schema = arrow_schema(spec)
+    list_columns = [i for i, field in enumerate(schema) if pa.types.is_list(field.type)]
+    partition_index = spec.columns.index(spec.partition_by)
+    cursor_index = spec.columns.index(spec.cursor) if spec.cursor is not None else None
+
+    writers = PartitionWriters(out_dir, spec.name, schema, prefix)
+    watermark = dict(watermark)
+    exported = 0
+    db = factory()
+    try:
+        # 本次导出的上界：主键取开始时的最大值，时间列留出延迟，之后写入的行留给下次
+        if spec.cursor is None:
+            upper = db.execute(select(func.max(spec.columns[0]))).scalar() or 0
+        else:
+            upper = datetime.utcnow() - timedelta(seconds=lag_seconds)
+        db.rollback()
+
+        while True:
+            rows = db.execute(_chunk_query(spec, watermark, upper, chunk_size)).all()
+            # 每块一个短读事务，不长时间占用WAL快照
+            db.rollback()
+            if not rows:
+                break
+
+            partitions: Dict[str, List] = {}
+            for row in rows:
+                value = row[partition_index]
+                partitions.setdefault(value.date().isoformat() if value else NULL_PARTITION, []).append(row)
+            for partition, part_rows in partitions.items():
+                columns = [list(values) for values in zip(*part_rows)]
+                for i in list_columns:
+                    columns[i] = [_json_list(value) for value in columns[i]]
+                writers.write(partition, pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema
+                ))
+
+            last = rows[-1]
+            watermark["id"] = last[0]
+            if cursor_index is not None:
+                watermark["ts"] = last[cursor_index].isoformat()
+            exported += len(rows)
+            if len(rows) < chunk_size:
+                break
+
+        writers.commit()
+    except Exception:
+        writers.abort()
+        raise
+    finally:
+        db.close()
+    return exported, watermark
+
+
+def run_export(
+    out_dir: str = PARQUET_EXPORT_DIR,
+    tables: Optional[List[str]] = None,
+    router: ShardRouter = shard_router,
+    main_factory: sessionmaker = ReadSessionLocal,
+    chunk_size: int = PARQUET_EXPORT_CHUNK,
+    lag_seconds: float = PARQUET_EXPORT_LAG_S
+) -> Dict[str, int]:
+    """
+    导出各表水位线之后的新数据，每张表（每个分片）完成后保存水位线
+
+    Returns:
+        {表名: 导出行数}
+    """
+    names = tables or list(EXPORT_SPECS)
+    unknown = set(names) - set(EXPORT_SPECS)
+    if unknown:
+        raise ValueError(f"不支持导出的表: {', '.join(sorted(unknown))}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, LOCK_FILE), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"已有导出在 {out_dir} 中运行")
+
+        removed = _clean_temp_files(out_dir)
+        if removed:
+            logger.info(f"清除上次中断留下的 {removed} 个临时文件")
+
+        watermarks = load_watermarks(out_dir)
+        batch = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        counts: Dict[str, int] = {}
+        for name in names:
+            spec = EXPORT_SPECS[name]
+            if spec.sharded:
+                targets = [(f"{name}@{shard}", f"{batch}-s{shard}", router.reader_factory(shard))
+                           for shard in range(router.shards)]
+            else:
+                targets = [(name, f"{batch}-main", main_factory)]
+
+            counts[name] = 0
+            for key, prefix, factory in targets:
+                exported, watermarks[key] = export_table(
+                    spec, factory, watermarks.get(key, {}), out_dir, prefix, chunk_size, lag_seconds
+                )
+                save_watermarks(out_dir, watermarks)
+                counts[name] += exported
+                logger.info(f"导出 {key}: {exported} 行，水位线 {watermarks[key]}")
+        return counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Parquet 增量导出")
+    parser.add_argument("--out", default=PARQUET_EXPORT_DIR, help="导出目录")
+    parser.add_argument("--tables", nargs="+", choices=list(EXPORT_SPECS), help="只导出这些表")
+    parser.add_argument("--chunk-size", type=int, default=PARQUET_EXPORT_CHUNK, help="每块行数")
+    parser.add_argument("--status", action="store_true", help="只显示各表的水位线")
+    args = parser.parse_args()
+
+    if args.status:
+        for key, watermark in sorted(load_watermarks(args.out).items()):
+            print(f"{key:<20} {watermark}")
+    else:
+        counts = run_export(args.out, args.tables, chunk_size=args.chunk_size)
+        print("✓ 导出完成: " + "，".join(f"{name} {count} 行" for name, count in counts.items()))
@@ -10,6 +10,8 @@ import os
 from typing import Dict, List
 from datetime import datetime
 
+from app.services import api_usage
+
 class PodcastGenerator:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -140,7 +142,7 @@ class PodcastGenerator:
 }}
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -210,7 +212,7 @@ class PodcastGenerator:
 生成章节内容和摘要。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -263,7 +265,7 @@ class PodcastGenerator:
             推荐最合适的话题,并说明理由。
             """
             
-            response = await openai.ChatCompletion.acreate(
+            response = await api_usage.chat_completion(
                 model="gpt-4-turbo-preview",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.5,
@@ -334,7 +336,7 @@ class PodcastGenerator:
 }}
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -497,7 +499,7 @@ class PodcastGenerator:
         """文本转语音"""
         
         try:
-            response = await openai.Audio.acreate(
+            response = await api_usage.speech(
                 model="tts-1-hd",
                 input=text,
                 voice=voice,
@@ -523,7 +525,7 @@ class PodcastGenerator:
         
         prompt = f"用50字概括这一章的核心内容:\n\n{content[:500]}..."
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.5,
@@ -0,0 +1,211 @@
+"""
+按用户版本号的响应缓存
+文件: backend-ai/app/services/response_cache.py
+功能: 时间线、趋势、标签和统计接口的结果只在用户写入记忆或情绪读数后变化
+      - 每个用户一个版本号，ORM提交记忆/读数变更后递增（绕过ORM的批量路径调用 bump_users）
+      - GET 结果按 (接口, 参数, 用户版本号) 缓存已序列化的响应体，带强 ETag（响应体哈希）
+      - If-None-Match 命中时直接返回 304，不访问数据库
+      - 按字节数限制总大小，超出时淘汰最久未用的条目；命中/未命中等计数见 stats()
+
+      版本号只在进程内有效：多进程部署时其他进程的写入要等条目过期（RESPONSE_CACHE_TTL_S）后才可见
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Iterable, Tuple, Any
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+from app.models.emotion import Memory, EmotionEvent
+
+logger = logging.getLogger(__name__)
+
+# 缓存总大小上限（MB）和条目有效期（秒）
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "32"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "300"))
+# 每个条目除响应体外的估计开销（键、ETag、字典槽位）
+ENTRY_OVERHEAD = 256
+
+CacheKey = Tuple[str, int, Tuple[Tuple[str, Any], ...], int]
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "expires_at", "size")
+
+    def __init__(self, body: bytes, etag: str, expires_at: float):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.size = len(body) + len(etag) + ENTRY_OVERHEAD
+
+
+def make_etag(body: bytes) -> str:
+    """强 ETag：响应体内容相同则相同"""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否匹配（按 RFC 7232 用弱比较，忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+class ResponseCache:
+    """用户版本号 + 按字节限额的LRU响应缓存"""
+
+    def __init__(self, max_bytes: int = int(RESPONSE_CACHE_MAX_MB * 1024 * 1024), ttl: float = RESPONSE_CACHE_TTL_S):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._versions: Dict[int, int] = {}
+        self._entries: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._by_user: Dict[int, set] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0, "invalidations": 0}
+
+    # ==================== 版本号 ====================
+
+    def version(self, user_id: int) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def bump(self, user_ids: Iterable[int]):
+        """用户数据已变化：版本号递增并丢弃该用户的全部条目"""
+        with self._lock:
+            for user_id in set(user_ids):
+                if user_id is None:
+                    continue
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+                for key in self._by_user.pop(user_id, ()):
+                    self._drop(key)
+                self._counters["invalidations"] += 1
+
+    # ==================== 读写 ====================
+
+    def key(self, endpoint: str, user_id: int, **params) -> CacheKey:
+        return (endpoint, user_id, tuple(sorted(params.items())), self.version(user_id))
+
+    def get(self, key: CacheKey) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry
+
+    def put(self, key: CacheKey, body: bytes) -> CachedResponse:
+        """保存响应体；计算期间用户版本号已变化时不保存（结果可能已过时）"""
+        entry = CachedResponse(body, make_etag(body), time.monotonic() + self.ttl)
+        user_id = key[1]
+        with self._lock:
+            if key[3] != self._versions.get(user_id, 0) or entry.size > self.max_bytes:
+                return entry
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._by_user.setdefault(user_id, set()).add(key)
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._by_user.get(oldest[1], set()).discard(oldest)
+                self._counters["evictions"] += 1
+        return entry
+
+    def _drop(self, key: CacheKey):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "users_tracked": len(self._versions)
+            }
+
+    # ==================== HTTP ====================
+
+    def _respond(self, request: Request, entry: CachedResponse, status: str) -> Response:
+        headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache", "X-Cache": status}
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            with self._lock:
+                self._counters["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def lookup(self, request: Request, key: CacheKey) -> Optional[Response]:
+        """命中时返回响应（If-None-Match 匹配时为 304），未命中返回 None"""
+        entry = self.get(key)
+        return self._respond(request, entry, "HIT") if entry is not None else None
+
+    def respond(self, request: Request, key: CacheKey, payload) -> Response:
+        """序列化接口结果、写入缓存并返回带 ETag 的响应"""
+        body = JSONResponse(content=jsonable_encoder(payload)).body
+        return self._respond(request, self.put(key, body), "MISS")
+
+
+# 全局实例
+response_cache = ResponseCache()
+
+
+def bump_users(user_ids: Iterable[int]):
+    """绕过ORM修改记忆或读数的路径（批量删除、导入等）提交后调用"""
+    response_cache.bump(user_ids)
+
+
+# ==================== 写入失效 ====================
+
+_PENDING_KEY = "response_cache_users"
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_users(session, flush_context):
+    """记录本事务中变更了记忆或读数的用户"""
+    user_ids = {
+        obj.user_id
+        for obj in list(session.new) + list(session.deleted) + list(session.dirty)
+        if isinstance(obj, (Memory, EmotionEvent))
+    }
+    if user_ids:
+        session.info.setdefault(_PENDING_KEY, set()).update(user_ids)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _bump_committed(session):
+    """提交后再递增版本号，避免并发读取把提交前的结果缓存在新版本下"""
+    user_ids = session.info.pop(_PENDING_KEY, None)
+    if user_ids:
+        response_cache.bump(user_ids)
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_pending(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
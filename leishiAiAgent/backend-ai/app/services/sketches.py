@@ -0,0 +1,663 @@
+"""
+流式统计摘要服务
+文件: backend-ai/app/services/sketches.py
+功能: 写入时增量维护可合并的近似统计，读取时不扫描明细
+      - TDigest:        每个用户每种情绪的强度分位数（及分片内全体用户），取自情绪读数
+                        （直接创建或导入的记忆各有一条 source=memory 读数，同样计入）
+      - CountMinTopK:   记忆标签计数（count-min）和出现最多的 K 个标签
+      - HyperLogLog:    每日活跃（有写入的）用户数，可跨天、跨分片合并去重
+
+      记忆/情绪读数提交后，更新只追加到内存缓冲区（O(1)）；后台线程按数据库分组，
+      批量读出摘要、合并后写回 emotion_sketches（SQLite下读改写在同一写事务中）。
+      摘要只累加写入，不随删除回退；全站统计在读取时合并各分片的摘要
+
+用法:
+    python -m app.services.sketches --rebuild   # 由已有记忆和情绪读数重建全部摘要
+    python -m app.services.sketches --status
+"""
+
+import os
+import math
+import zlib
+import array
+import struct
+import hashlib
+import logging
+import argparse
+import threading
+from collections import deque, Counter
+from datetime import datetime, date, timedelta
+from typing import Optional, Dict, List, Tuple, Iterable
+
+from sqlalchemy import event, select, delete, func
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.models.emotion import Memory, EmotionEvent, EmotionSketch, EMOTION_NAMES
+from app.models.sharding import ShardRouter, shard_router
+from app.services.response_cache import bump_users
+
+logger = logging.getLogger(__name__)
+
+# t-digest 压缩参数（质心数约为其 2 倍）、count-min 宽度/深度、top-k 大小、HLL 精度（2^p 个寄存器）
+SKETCH_TDIGEST_COMPRESSION = int(os.getenv("SKETCH_TDIGEST_COMPRESSION", "100"))
+SKETCH_CMS_WIDTH = int(os.getenv("SKETCH_CMS_WIDTH", "2048"))
+SKETCH_CMS_DEPTH = int(os.getenv("SKETCH_CMS_DEPTH", "4"))
+SKETCH_TOP_K = int(os.getenv("SKETCH_TOP_K", "50"))
+SKETCH_HLL_PRECISION = int(os.getenv("SKETCH_HLL_PRECISION", "12"))
+# 缓冲区上限（条更新）和后台写入间隔（秒）
+SKETCH_BUFFER_SIZE = int(os.getenv("SKETCH_BUFFER_SIZE", "100000"))
+SKETCH_FLUSH_S = float(os.getenv("SKETCH_FLUSH_S", "5"))
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# ==================== t-digest ====================
+
+class TDigest:
+    """
+    合并式 t-digest（k1 尺度函数）：新值先进缓冲区，攒满后与质心一起排序合并，
+    均摊 O(1) 更新；两个摘要合并后分位数误差仍有界，尾部（p99）精度最高
+    """
+
+    def __init__(self, compression: int = SKETCH_TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer: List[Tuple[float, float]] = []
+
+    def add(self, value: float, weight: float = 1.0):
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other: "TDigest"):
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def _k_limit(self, q: float) -> float:
+        """从分位点 q 开始，一个质心最多覆盖到的分位点"""
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        total = sum(weight for _, weight in points)
+
+        means, weights = [], []
+        seen = 0.0
+        limit = total * self._k_limit(0.0)
+        mean, weight = points[0]
+        for value, w in points[1:]:
+            if seen + weight + w <= limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                seen += weight
+                limit = total * self._k_limit(seen / total)
+                mean, weight = value, w
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def quantile(self, q: float) -> Optional[float]:
+        """第 q 分位（0-1）的近似值，空摘要返回 None"""
+        self._compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        target = q * self.count
+        first, last = self.weights[0], self.weights[-1]
+        if target <= first / 2:
+            return self.min + (self.means[0] - self.min) * (target / (first / 2))
+        if target >= self.count - last / 2:
+            rest = (self.count - target) / (last / 2)
+            return self.max - (self.max - self.means[-1]) * rest
+
+        # 质心中点之间线性插值
+        center = first / 2
+        for i in range(len(self.means) - 1):
+            gap = (self.weights[i] + self.weights[i + 1]) / 2
+            if target <= center + gap:
+                return self.means[i] + (self.means[i + 1] - self.means[i]) * (target - center) / gap
+            center += gap
+        return self.means[-1]
+
+    _HEADER = struct.Struct("<HIddd")
+
+    def to_bytes(self) -> bytes:
+        self._compress()
+        header = self._HEADER.pack(self.compression, len(self.means), self.count, self.min, self.max)
+        return header + array.array("d", self.means).tobytes() + array.array("d", self.weights).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TDigest":
+        compression, size, count, low, high = cls._HEADER.unpack_from(data)
+        digest = cls(compression)
+        offset = cls._HEADER.size
+        digest.means = array.array("d", data[offset:offset + 8 * size]).tolist()
+        digest.weights = array.array("d", data[offset + 8 * size:offset + 16 * size]).tolist()
+        digest.count, digest.min, digest.max = count, low, high
+        return digest
+
+
+# ==================== count-min + top-k ====================
+
+class CountMinTopK:
+    """
+    count-min 计数（只会高估，误差约 总数 * e / width）加上按估计值维护的 top-k 候选；
+    合并时计数器逐位相加，候选取并集后按合并后的计数重新排序
+    """
+
+    def __init__(self, width: int = SKETCH_CMS_WIDTH, depth: int = SKETCH_CMS_DEPTH, k: int = SKETCH_TOP_K):
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.total = 0
+        self.counters = array.array("Q", bytes(8 * width * depth))
+        self.top: Dict[str, int] = {}
+
+    def _cells(self, item: str) -> List[int]:
+        h = _hash64(item)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, item: str, count: int = 1):
+        cells = self._cells(item)
+        for cell in cells:
+            self.counters[cell] += count
+        self.total += count
+        self._offer(item, min(self.counters[cell] for cell in cells))
+
+    def estimate(self, item: str) -> int:
+        return min(self.counters[cell] for cell in self._cells(item))
+
+    def _offer(self, item: str, estimate: int):
+        if item in self.top or len(self.top) < self.k:
+            self.top[item] = estimate
+            return
+        smallest = min(self.top, key=self.top.get)
+        if estimate > self.top[smallest]:
+            del self.top[smallest]
+            self.top[item] = estimate
+
+    def merge(self, other: "CountMinTopK"):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("count-min 尺寸不同，不能合并")
+        for i, value in enumerate(other.counters):
+            if value:
+                self.counters[i] += value
+        self.total += other.total
+        candidates = set(self.top) | set(other.top)
+        ranked = sorted(((self.estimate(item), item) for item in candidates), reverse=True)
+        self.top = {item: count for count, item in ranked[:self.k]}
+
+    def top_k(self, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        ranked = sorted(self.top.items(), key=lambda entry: (-entry[1], entry[0]))
+        return ranked[:limit or self.k]
+
+    _HEADER = struct.Struct("<IHHQ")
+
+    def to_bytes(self) -> bytes:
+        top = "\n".join(f"{count}\t{item}" for item, count in self.top.items()).encode("utf-8")
+        header = self._HEADER.pack(self.width, self.depth, self.k, self.total)
+        # 计数器大多为零，压缩后很小
+        return header + zlib.compress(self.counters.tobytes() + top, 6)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CountMinTopK":
+        width, depth, k, total = cls._HEADER.unpack_from(data)
+        sketch = cls(width, depth, k)
+        raw = zlib.decompress(data[cls._HEADER.size:])
+        size = 8 * width * depth
+        sketch.counters = array.array("Q", raw[:size])
+        sketch.total = total
+        for line in raw[size:].decode("utf-8").split("\n") if len(raw) > size else []:
+            count, item = line.split("\t", 1)
+            sketch.top[item] = int(count)
+        return sketch
+
+
+# ==================== HyperLogLog ====================
+
+class HyperLogLog:
+    """HyperLogLog 基数估计（相对误差约 1.04 / sqrt(2^p)），合并时寄存器取最大值"""
+
+    def __init__(self, precision: int = SKETCH_HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item: str):
+        h = _hash64(item)
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - self.precision + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("HyperLogLog 精度不同，不能合并")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 小基数时用线性计数
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers), 6)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        sketch = cls(data[0])
+        sketch.registers = bytearray(zlib.decompress(data[1:]))
+        return sketch
+
+
+SKETCH_TYPES = {"tdigest": TDigest, "cms": CountMinTopK, "hll": HyperLogLog}
+
+
+# ==================== 持久化 ====================
+
+def _digest_key(user_id: Optional[int], emotion: str) -> str:
+    return f"user:{user_id}:{emotion}" if user_id is not None else f"all:{emotion}"
+
+
+def load(connection, kind: str, keys: Iterable[str]) -> Dict[str, object]:
+    """读出摘要 {key: 对象}，不存在的 key 不在结果中"""
+    keys = list(keys)
+    if not keys:
+        return {}
+    table = EmotionSketch.__table__
+    rows = connection.execute(
+        select(table.c.key, table.c.data).where(table.c.kind == kind, table.c.key.in_(keys))
+    ).all()
+    return {key: SKETCH_TYPES[kind].from_bytes(bytes(data)) for key, data in rows}
+
+
+def save(connection, kind: str, sketches: Dict[str, object], user_ids: Optional[Dict[str, int]] = None):
+    """写回摘要（UPSERT）"""
+    if not sketches:
+        return
+    table = EmotionSketch.__table__
+    insert = pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.kind, table.c.key],
+        set_={"data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at}
+    )
+    now = datetime.utcnow()
+    connection.execute(stmt, [
+        {
+            "kind": kind,
+            "key": key,
+            "user_id": (user_ids or {}).get(key),
+            "data": sketch.to_bytes(),
+            "updated_at": now
+        }
+        for key, sketch in sketches.items()
+    ])
+
+
+def apply_updates(connection, updates: List[Tuple]):
+    """
+    把一批更新合并进摘要表
+
+    Args:
+        updates: ("intensity", user_id, emotion, value) / ("tag", tag) / ("active", day, user_id)
+    """
+    digests: Dict[str, List[float]] = {}
+    digest_users: Dict[str, int] = {}
+    tags: Counter = Counter()
+    active: Dict[str, set] = {}
+    for update in updates:
+        if update[0] == "intensity":
+            _, user_id, emotion, value = update
+            for key in (_digest_key(user_id, emotion), _digest_key(None, emotion)):
+                digests.setdefault(key, []).append(value)
+            digest_users[_digest_key(user_id, emotion)] = user_id
+        elif update[0] == "tag":
+            tags[update[1]] += 1
+        elif update[0] == "active":
+            active.setdefault(update[1], set()).add(update[2])
+
+    if digests:
+        sketches = load(connection, "tdigest", digests)
+        for key, values in digests.items():
+            digest = sketches.setdefault(key, TDigest())
+            for value in values:
+                digest.add(value)
+        save(connection, "tdigest", sketches, digest_users)
+
+    if tags:
+        sketches = load(connection, "cms", ["tags"])
+        sketch = sketches.setdefault("tags", CountMinTopK())
+        for tag, count in tags.items():
+            sketch.add(tag, count)
+        save(connection, "cms", sketches)
+
+    if active:
+        sketches = load(connection, "hll", active)
+        for day, user_ids in active.items():
+            sketch = sketches.setdefault(day, HyperLogLog())
+            for user_id in user_ids:
+                sketch.add(str(user_id))
+        save(connection, "hll", sketches)
+
+
+def memory_updates(user_id, tags, created_at) -> List[Tuple]:
+    """
+    一条记忆对应的摘要更新（绕过ORM的批量写入路径也用它生成更新）
+    强度只取自情绪读数：识别写入的记忆随读数一起写入，其他记忆写入时生成 source=memory 读数，
+    记忆上的强度是读数的副本
+    """
+    if user_id is None:
+        return []
+    updates = [("active", (created_at or datetime.utcnow()).date().isoformat(), user_id)]
+    updates.extend(("tag", tag) for tag in set(tags or []))
+    return updates
+
+
+def event_updates(user_id, emotion_code, intensity, ts) -> List[Tuple]:
+    """一条情绪读数对应的摘要更新（强度分位数和活跃用户）"""
+    return [
+        ("intensity", user_id, EMOTION_NAMES.get(emotion_code, "unknown"), float(intensity)),
+        ("active", (ts or datetime.utcnow()).date().isoformat(), user_id)
+    ]
+
+
+# ==================== 写入缓冲 ====================
+
+class SketchRecorder:
+    """
+    摘要更新缓冲区
+
+    - record(): 提交后由ORM钩子调用，只追加到内存（缓冲区满时丢弃最旧的更新）
+    - 后台线程定期 flush()：按数据库分组，每个数据库一个写事务完成读改写
+    """
+
+    def __init__(self, flush_interval: float = SKETCH_FLUSH_S, buffer_size: int = SKETCH_BUFFER_SIZE):
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"recorded": 0, "applied": 0, "batches": 0, "dropped": 0, "failed": 0}
+
+    def record(self, bind, updates: List[Tuple]):
+        with self._lock:
+            for update in updates:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.stats["dropped"] += 1
+                self._buffer.append((bind, update))
+            self.stats["recorded"] += len(updates)
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def flush(self) -> int:
+        """把缓冲区中的更新合并进各数据库的摘要表，返回合并的更新数"""
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._buffer)
+                self._buffer.clear()
+            if not entries:
+                return 0
+
+            by_bind: Dict[object, List[Tuple]] = {}
+            for bind, update in entries:
+                by_bind.setdefault(bind, []).append(update)
+
+            applied = 0
+            for bind, updates in by_bind.items():
+                try:
+                    with bind.begin() as connection:
+                        apply_updates(connection, updates)
+                    applied += len(updates)
+                    self.stats["batches"] += 1
+                    bump_users({u[1] for u in updates if u[0] == "intensity"})
+                except Exception as e:
+                    # 近似统计是尽力而为的，失败的批次丢弃
+                    self.stats["failed"] += len(updates)
+                    logger.error(f"写入统计摘要失败 ({len(updates)}条): {e}")
+            self.stats["applied"] += applied
+            return applied
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sketch-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+
+
+# 全局实例
+sketch_recorder = SketchRecorder()
+
+
+def start_sketch_recorder() -> SketchRecorder:
+    sketch_recorder.start()
+    return sketch_recorder
+
+
+def stop_sketch_recorder():
+    sketch_recorder.stop()
+
+
+# ==================== 写入钩子 ====================
+
+_PENDING_KEY = "sketch_updates"
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_updates(session, flush_context):
+    """记录本事务中新写入的记忆和情绪读数"""
+    updates = []
+    for obj in session.new:
+        if isinstance(obj, Memory):
+            updates.extend(memory_updates(obj.user_id, obj.tags, obj.created_at))
+        elif isinstance(obj, EmotionEvent) and obj.user_id is not None:
+            updates.extend(event_updates(obj.user_id, obj.emotion, obj.intensity, obj.ts))
+    if updates:
+        session.info.setdefault(_PENDING_KEY, []).extend(updates)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _record_committed(session):
+    updates = session.info.pop(_PENDING_KEY, None)
+    if updates:
+        sketch_recorder.record(session.get_bind(), updates)
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_pending(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+# ==================== 读取 ====================
+
+def user_percentiles(
+    db,
+    user_id: int,
+    quantiles: Iterable[float] = DEFAULT_QUANTILES,
+    emotion: Optional[str] = None
+) -> Dict[str, Dict[str, float]]:
+    """
+    用户强度分位数（全部历史）
+
+    Returns:
+        {情绪: {"p50": ..., "count": ...}, ...}，另有合并全部情绪的 "all"；没有数据时为空
+    """
+    table = EmotionSketch.__table__
+    prefix = f"user:{user_id}:"
+    query = select(table.c.key, table.c.data).where(table.c.kind == "tdigest")
+    if emotion:
+        query = query.where(table.c.key == prefix + emotion)
+    else:
+        query = query.where(table.c.user_id == user_id)
+
+    digests = {key[len(prefix):]: TDigest.from_bytes(bytes(data)) for key, data in db.execute(query)}
+    if not digests:
+        return {}
+    if len(digests) > 1:
+        merged = TDigest()
+        for digest in digests.values():
+            merged.merge(digest)
+        digests["all"] = merged
+    return {name: summarize(digest, quantiles) for name, digest in digests.items()}
+
+
+def summarize(digest: TDigest, quantiles: Iterable[float] = DEFAULT_QUANTILES) -> Dict[str, float]:
+    result = {f"p{round(q * 100, 1):g}": round(digest.quantile(q), 4) for q in quantiles}
+    result["count"] = int(digest.count)
+    return result
+
+
+def _merge_all(sketches: List[Dict[str, object]]) -> Dict[str, object]:
+    merged: Dict[str, object] = {}
+    for shard in sketches:
+        for key, sketch in shard.items():
+            if key in merged:
+                merged[key].merge(sketch)
+            else:
+                merged[key] = sketch
+    return merged
+
+
+def global_top_tags(limit: int = 20, router: ShardRouter = shard_router) -> Dict:
+    """全站出现最多的标签（各分片 count-min 合并后估计）"""
+    merged = _merge_all(router.fan_out(lambda db: load(db.connection(), "cms", ["tags"])))
+    sketch = merged.get("tags")
+    if sketch is None:
+        return {"total": 0, "tags": []}
+    return {
+        "total": sketch.total,
+        "max_error": math.ceil(sketch.total * math.e / sketch.width),
+        "tags": [{"tag": tag, "count": count} for tag, count in sketch.top_k(limit)]
+    }
+
+
+def global_percentiles(
+    quantiles: Iterable[float] = DEFAULT_QUANTILES,
+    router: ShardRouter = shard_router
+) -> Dict[str, Dict[str, float]]:
+    """全站各情绪的强度分位数（各分片 all:<情绪> 摘要合并）"""
+    def shard_digests(db):
+        table = EmotionSketch.__table__
+        rows = db.execute(
+            select(table.c.key, table.c.data).where(table.c.kind == "tdigest", table.c.key.like("all:%"))
+        )
+        return {key[4:]: TDigest.from_bytes(bytes(data)) for key, data in rows}
+
+    merged = _merge_all(router.fan_out(shard_digests))
+    return {emotion: summarize(digest, quantiles) for emotion, digest in sorted(merged.items())}
+
+
+def global_active_users(start_day: date, end_day: date, router: ShardRouter = shard_router) -> Dict:
+    """每天和整个区间内去重后的活跃用户数（各分片、各天的 HLL 合并）"""
+    days = [(start_day + timedelta(days=i)).isoformat() for i in range((end_day - start_day).days + 1)]
+    merged = _merge_all(router.fan_out(lambda db: load(db.connection(), "hll", days)))
+    window = HyperLogLog()
+    for sketch in merged.values():
+        window.merge(sketch)
+    return {
+        "daily": [{"day": day, "active_users": merged[day].count() if day in merged else 0} for day in days],
+        "distinct_users": window.count() if merged else 0
+    }
+
+
+# ==================== 重建 ====================
+
+def rebuild(db, chunk_size: int = 5000) -> int:
+    """
+    清空摘要表，由 memories 和 emotion_events 重建（不经过缓冲区，由调用方提交）
+
+    Returns:
+        合并的更新数
+    """
+    connection = db.connection()
+    connection.execute(delete(EmotionSketch.__table__))
+    total = 0
+    sources = [
+        (select(Memory.user_id, Memory.tags, Memory.created_at),
+         memory_updates),
+        (select(EmotionEvent.user_id, EmotionEvent.emotion, EmotionEvent.intensity, EmotionEvent.ts),
+         event_updates),
+    ]
+    for query, to_updates in sources:
+        result = connection.execute(query.execution_options(yield_per=chunk_size))
+        for partition in result.partitions():
+            updates = [update for row in partition for update in to_updates(*row)]
+            apply_updates(connection, updates)
+            total += len(updates)
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="流式统计摘要维护")
+    parser.add_argument("--rebuild", action="store_true", help="由已有记忆和情绪读数重建全部摘要")
+    parser.add_argument("--status", action="store_true", help="查看各分片的摘要数量和大小")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        def rebuild_shard(db):
+            total = rebuild(db)
+            db.commit()
+            return total
+
+        total = sum(shard_router.fan_out(rebuild_shard, readonly=False))
+        print(f"✓ 摘要重建完成，合并 {total} 条更新")
+    else:
+        def status(db):
+            table = EmotionSketch.__table__
+            return db.execute(
+                select(table.c.kind, func.count(), func.sum(func.length(table.c.data))).group_by(table.c.kind)
+            ).all()
+
+        for shard, rows in enumerate(shard_router.fan_out(status)):
+            for kind, count, size in rows:
+                print(f"分片 {shard} {kind:<8} {count:>8} 个  {int(size or 0) / 1024:>10.1f} KB")
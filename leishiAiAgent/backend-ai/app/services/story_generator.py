@@ -13,6 +13,8 @@ import uuid
 from typing import Dict, List
 import os
 
+from app.services import api_usage
+
 class StoryGenerator:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -66,7 +68,7 @@ class StoryGenerator:
             settings
         )
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {
@@ -125,7 +127,7 @@ class StoryGenerator:
         以JSON格式返回。
         """
         
-        response = await openai.ChatCompletion.acreate(
+        response = await api_usage.chat_completion(
             model="gpt-4-turbo-preview",
             messages=[
                 {"role": "system", "content": "继续上一个故事场景。"},
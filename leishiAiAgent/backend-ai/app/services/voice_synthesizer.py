@@ -7,6 +7,8 @@ import openai
 import os
 from typing import Dict
 
+from app.services import api_usage
+
 class VoiceSynthesizer:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -48,7 +50,7 @@ class VoiceSynthesizer:
             voice_config["speed"] = 1.05
         
         # 调用OpenAI TTS
-        response = await openai.Audio.acreate(
+        response = await api_usage.speech(
             model="tts-1",
             input=adjusted_text,
             voice=voice_config["voice"],
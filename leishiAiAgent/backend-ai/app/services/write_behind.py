@@ -0,0 +1,331 @@
+"""
+写后批量提交服务 (Write-behind group commit)
+文件: backend-ai/app/services/write_behind.py
+功能: 将情绪分析产生的会话更新、情绪读数（和可选的记忆）放入进程内队列，
+      由后台线程按批次合并为单个事务提交，减少SQLite单写者锁的争用；
+      记忆分片时每批按用户所在分片拆分，各分片各提交一个事务
+"""
+
+import os
+import queue
+import time
+import atexit
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from collections import defaultdict
+from typing import Optional, List, Dict, Tuple
+
+from app.models.emotion import Session as SessionModel, Memory, EmotionEvent, SessionLocal, EVENT_SOURCES
+from app.models.sharding import ShardRouter, shard_router
+from app.services import emotion_rollup, memory_search, memory_tags, memory_dedup, memory_vectors  # noqa: F401  注册记忆写入维护钩子
+from app.services.emotion_events import emotion_code, mark_with_reading
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueueFullError(Exception):
+    """写队列已满（背压），调用方应降级处理"""
+
+
+class WriteBehindWriter:
+    """
+    写后批量提交器
+
+    - 每 flush_interval_ms 毫秒或累计 max_batch 条记录提交一次事务
+    - 队列满时 submit 最多阻塞 put_timeout 秒，仍满则抛出 WriteQueueFullError
+    - stop() 会把队列中剩余的记录全部落盘后再返回
+    - 传入 router 时按 user_id 写入对应分片，忽略 session_factory
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_batch: int = None,
+        flush_interval_ms: float = None,
+        queue_size: int = None,
+        put_timeout: float = None,
+        router: Optional[ShardRouter] = None
+    ):
+        self.session_factory = session_factory
+        self.router = router
+        self.max_batch = max_batch or int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+        self.flush_interval = (
+            flush_interval_ms if flush_interval_ms is not None
+            else float(os.getenv("WRITE_BEHIND_FLUSH_MS", "5"))
+        ) / 1000
+        self.put_timeout = (
+            put_timeout if put_timeout is not None
+            else float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT", "1.0"))
+        )
+
+        self._queue: queue.Queue = queue.Queue(
+            maxsize=queue_size or int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "5000"))
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        # 请求线程、事件循环和后台线程都会更新计数，统一在 _lock 下修改
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "failed": 0,
+            "rejected": 0
+        }
+
+    # ==================== 生命周期 ====================
+
+    def start(self):
+        """启动后台提交线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="write-behind-writer",
+                daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """停止后台线程，并把队列中剩余记录全部提交"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+        # 线程未运行或已异常退出时，在当前线程完成剩余写入
+        self._write_leftover()
+        logger.info(f"写后队列已关闭: {self.snapshot()}")
+
+    def flush(self):
+        """阻塞直到当前已入队的记录全部提交"""
+        if self._thread and self._thread.is_alive():
+            self._queue.join()
+        else:
+            self._write_leftover()
+
+    @property
+    def pending(self) -> int:
+        """队列中等待提交的记录数"""
+        return self._queue.qsize()
+
+    def snapshot(self) -> Dict[str, int]:
+        """计数的一致快照"""
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, **increments: int):
+        with self._lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    # ==================== 入队 ====================
+
+    def submit(self, record: Dict, timeout: Optional[float] = None):
+        """
+        提交一条情绪分析记录
+
+        Args:
+            record: {user_id, session_id, emotion, intensity, valence, arousal,
+                     confidence, source, created_at}；
+                    带 content 时另外写一条记忆 {memory_type, content, summary, tags}
+            timeout: 队列满时最长等待秒数，默认 put_timeout
+        """
+        if self._stopping.is_set():
+            # 关闭后到达的写入直接同步落盘，保证不丢数据
+            self._write([record])
+            return
+
+        try:
+            self._queue.put(
+                record,
+                timeout=self.put_timeout if timeout is None else timeout
+            )
+        except queue.Full:
+            self._count(rejected=1)
+            raise WriteQueueFullError(f"写队列已满 ({self._queue.maxsize})")
+
+        self._count(enqueued=1)
+
+    async def submit_async(self, record: Dict):
+        """异步提交：队列有空位时不阻塞事件循环，满时在线程池中等待"""
+        if not self._stopping.is_set():
+            try:
+                self._queue.put_nowait(record)
+                self._count(enqueued=1)
+                return
+            except queue.Full:
+                pass
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.submit, record)
+
+    # ==================== 后台提交 ====================
+
+    def _run(self):
+        """后台线程主循环：攒批 -> 单事务提交"""
+        while True:
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    break
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_leftover(self):
+        """在调用线程中提交队列里剩余的所有记录"""
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if records:
+            self._write(records)
+            for _ in records:
+                self._queue.task_done()
+
+    def _partition(self, batch: List[Dict]) -> List[Tuple[object, List[Dict]]]:
+        """按分片拆分一批记录，返回 [(会话工厂, 记录), ...]"""
+        if self.router is None or self.router.shards == 1:
+            factory = self.router.writer_factory(0) if self.router else self.session_factory
+            return [(factory, batch)]
+
+        groups = defaultdict(list)
+        for record in batch:
+            groups[self.router.shard_for(record["user_id"])].append(record)
+        return [(self.router.writer_factory(shard), records) for shard, records in groups.items()]
+
+    def _write(self, batch: List[Dict]):
+        """每个分片在一个事务中写入一批记录"""
+        for factory, records in self._partition(batch):
+            self._commit(factory, records)
+
+    def _commit(self, factory, batch: List[Dict]):
+        """单事务提交；整批失败时逐条重试以隔离坏数据"""
+        db = factory()
+        try:
+            self._apply(db, batch)
+            db.commit()
+            self._count(written=len(batch), batches=1)
+        except Exception as e:
+            db.rollback()
+            if len(batch) > 1:
+                logger.warning(f"批量提交失败，逐条重试 ({len(batch)}条): {e}")
+                db.close()
+                for record in batch:
+                    self._commit(factory, [record])
+                return
+            self._count(failed=1)
+            logger.error(f"写入情绪记录失败: {e}")
+        finally:
+            db.close()
+
+    def _apply(self, db, batch: List[Dict]):
+        """把一批记录转换为会话更新、读数事件和（带正文时的）记忆插入"""
+        session_ids = {r["session_id"] for r in batch if r.get("session_id")}
+        sessions = {}
+        if session_ids:
+            sessions = {
+                s.id: s
+                for s in db.query(SessionModel).filter(SessionModel.id.in_(session_ids))
+            }
+
+        for record in batch:
+            created_at = record.get("created_at") or datetime.utcnow()
+            event = EmotionEvent(
+                user_id=record["user_id"],
+                ts=created_at,
+                emotion=emotion_code(record["emotion"]),
+                intensity=record["intensity"],
+                valence=record.get("valence"),
+                arousal=record.get("arousal"),
+                confidence=record.get("confidence"),
+                source=EVENT_SOURCES.get(record.get("source"), EVENT_SOURCES["text"])
+            )
+            memory = None
+            if record.get("content") is not None:
+                memory = Memory(
+                    user_id=record["user_id"],
+                    memory_type=record.get("memory_type", "text"),
+                    emotion_type=record["emotion"],
+                    emotion_intensity=record["intensity"],
+                    content=record["content"],
+                    summary=record.get("summary"),
+                    tags=record.get("tags") or [],
+                    created_at=created_at
+                )
+
+            if record.get("session_id"):
+                # 更新已有会话的当前情绪（同批次内后到的记录覆盖先到的）
+                session_record = sessions.get(record["session_id"])
+                if session_record:
+                    session_record.current_emotion = record["emotion"]
+                    session_record.emotion_intensity = record["intensity"]
+                event.session_id = record["session_id"]
+                if memory is not None:
+                    memory.session_id = record["session_id"]
+            else:
+                # 新建会话，事件和记忆通过关系在同一次flush中获得会话ID
+                session_record = SessionModel(
+                    user_id=record["user_id"],
+                    current_emotion=record["emotion"],
+                    emotion_intensity=record["intensity"],
+                    current_dapp=None,
+                    started_at=created_at
+                )
+                db.add(session_record)
+                event.session = session_record
+                if memory is not None:
+                    memory.session = session_record
+
+            db.add(event)
+            if memory is not None:
+                db.add(memory)
+                mark_with_reading(db, memory)
+
+
+# 创建全局实例
+_writer: Optional[WriteBehindWriter] = None
+
+
+def get_write_behind_writer() -> WriteBehindWriter:
+    """获取写后提交器实例（首次调用时启动后台线程）"""
+    global _writer
+    if _writer is None:
+        _writer = WriteBehindWriter(router=shard_router)
+        _writer.start()
+    return _writer
+
+
+def shutdown_write_behind_writer():
+    """关闭写后提交器，落盘所有待写记录"""
+    global _writer
+    if _writer:
+        _writer.stop()
+        _writer = None
+
+
+atexit.register(shutdown_write_behind_writer)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+记忆分析查询基准测试
+文件: backend-ai/benchmarks/bench_analytics.py
+功能: 在合成的记忆表上对比三种聚合方式的延迟和内存峰值
+      - orm:    加载完整Memory对象后在Python中聚合（旧实现）
+      - sql:    GROUP BY date(created_at), emotion_type 下推到SQLite
+      - rollup: 读取每日汇总表 emotion_daily_rollup
+      标签统计另对比 json_each 展开与 memory_tags 索引表
+
+用法:
+    python benchmarks/bench_analytics.py --rows 1000000 --users 100
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from pathlib import Path
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine, func, true
+from sqlalchemy.orm import sessionmaker
+
+from app.models.emotion import Base, Memory
+from app.services.emotion_rollup import backfill, query_daily
+from app.services import memory_tags
+
+EMOTIONS = ["happy", "sad", "calm", "neutral", "anxious", "excited", "angry"]
+TAGS = ["工作", "家庭", "朋友", "学习", "运动", "音乐", "旅行", "睡眠", "general", "ktv"]
+SNIPPETS = ["今天", "心情", "有点", "非常", "朋友", "一起", "工作", "压力", "开心", "难过", "散步", "音乐"]
+
+
+def generate(db_path: str, rows: int, users: int, days: int, seed: int = 42):
+    """用 executemany 批量写入合成记忆"""
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executemany(
+        "INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'x')",
+        [(i, f"user{i}") for i in range(1, users + 1)]
+    )
+
+    batch = []
+    for i in range(rows):
+        created_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+        content = "".join(rng.choice(SNIPPETS) for _ in range(rng.randint(10, 80)))
+        tags = '["' + '","'.join(rng.sample(TAGS, rng.randint(1, 3))) + '"]'
+        batch.append((
+            rng.randint(1, users),
+            "text",
+            rng.choice(EMOTIONS),
+            round(rng.random(), 3),
+            content,
+            content[:20],
+            tags,
+            created_at.strftime("%Y-%m-%d %H:%M:%S.%f")
+        ))
+        if len(batch) >= 50000:
+            _insert(conn, batch)
+            batch = []
+    if batch:
+        _insert(conn, batch)
+
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_bench_user_created ON memories (user_id, created_at)")
+    conn.commit()
+    conn.close()
+
+
+def _insert(conn, batch):
+    conn.executemany(
+        "INSERT INTO memories (user_id, memory_type, emotion_type, emotion_intensity, "
+        "content, content_head, summary, tags, created_at) VALUES (?, ?, ?, ?, ?, substr(?5, 1, 201), ?, ?, ?)",
+        batch
+    )
+
+
+# ==================== 三种实现 ====================
+
+def timeline_orm(db, user_id, start):
+    timeline = {}
+    for m in db.query(Memory).filter(Memory.user_id == user_id, Memory.created_at >= start).all():
+        day = timeline.setdefault(m.created_at.date(), {})
+        day[m.emotion_type] = day.get(m.emotion_type, 0) + 1
+    return timeline
+
+
+def timeline_sql(db, user_id, start):
+    day = func.date(Memory.created_at)
+    return db.query(
+        day, Memory.emotion_type, func.count(), func.avg(Memory.emotion_intensity)
+    ).filter(
+        Memory.user_id == user_id, Memory.created_at >= start
+    ).group_by(day, Memory.emotion_type).all()
+
+
+def timeline_rollup(db, user_id, start):
+    return query_daily(db, user_id, start.date())
+
+
+def tags_orm(db, user_id):
+    stats = {}
+    for m in db.query(Memory).filter(Memory.user_id == user_id).all():
+        for tag in m.tags or []:
+            stats[tag] = stats.get(tag, 0) + 1
+    return stats
+
+
+def tags_sql(db, user_id):
+    tag = func.json_each(Memory.tags).table_valued("value").alias("tag")
+    return db.query(tag.c.value, Memory.emotion_type, func.count()).select_from(Memory).join(
+        tag, true()
+    ).filter(Memory.user_id == user_id).group_by(tag.c.value, Memory.emotion_type).all()
+
+
+def tags_index(db, user_id):
+    return memory_tags.tag_emotion_counts(db, user_id)
+
+
+def measure(fn, repeat: int):
+    """返回 (中位延迟ms, Python内存峰值MB)"""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(latencies), peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆分析查询基准测试")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="合成记忆条数")
+    parser.add_argument("--users", type=int, default=100, help="用户数")
+    parser.add_argument("--days", type=int, default=730, help="时间跨度（天）")
+    parser.add_argument("--window", type=int, default=365, help="查询窗口（天）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    parser.add_argument("--db", default=None, help="复用已有数据库文件")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench_analytics.db")
+    if not os.path.exists(db_path) or args.db is None:
+        print(f"生成 {args.rows} 条记忆 -> {db_path}")
+        start = time.perf_counter()
+        generate(db_path, args.rows, args.users, args.days)
+        print(f"  生成耗时 {time.perf_counter() - start:.1f}s")
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    db = sessionmaker(bind=engine)()
+
+    start = time.perf_counter()
+    rollup_rows = backfill(db)
+    print(f"  汇总表回填 {rollup_rows} 行，耗时 {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    tag_rows = memory_tags.backfill(db)
+    print(f"  标签表回填 {tag_rows} 行，耗时 {time.perf_counter() - start:.1f}s\n")
+
+    user_id = 1
+    window_start = datetime.utcnow() - timedelta(days=args.window)
+    user_rows = db.query(func.count()).select_from(Memory).filter(Memory.user_id == user_id).scalar()
+
+    cases = [
+        ("timeline/orm", lambda: timeline_orm(db, user_id, window_start)),
+        ("timeline/sql", lambda: timeline_sql(db, user_id, window_start)),
+        ("timeline/rollup", lambda: timeline_rollup(db, user_id, window_start)),
+        ("tags/orm", lambda: tags_orm(db, user_id)),
+        ("tags/sql", lambda: tags_sql(db, user_id)),
+        ("tags/index", lambda: tags_index(db, user_id)),
+    ]
+
+    print(f"用户 {user_id}: {user_rows} 条记忆，窗口 {args.window} 天")
+    print(f"{'case':<18}{'median ms':>12}{'peak MB':>12}")
+    for name, fn in cases:
+        latency, peak = measure(fn, args.repeat)
+        db.expunge_all()
+        print(f"{name:<18}{latency:>12.2f}{peak:>12.2f}")
+
+    db.close()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+接口查询基准测试
+文件: backend-ai/benchmarks/bench_queries.py
+功能: 在合成数据集（benchmarks/synth_dataset.py）上直接调用接口处理函数，
+      统计每个接口查询的 p50 / p99 延迟
+      - list_user_memories:     首页、按情绪过滤、按标签过滤、第二页（游标）
+      - get_memory_timeline:    30天 / 365天
+      - get_emotion_trend:      全部历史（每天一点）/ 全部历史 max_points=200（日/周/月金字塔 + LTTB）
+      - search_memories:        全文检索（未建索引时为前缀LIKE）
+      - get_emotion_statistics: 7天 / 30天
+
+      用户按均匀随机抽样；记忆总数缓存和响应缓存默认在每次调用前清空，测的是未命中缓存的延迟
+
+用法:
+    python benchmarks/synth_dataset.py --db /tmp/synth.db
+    python benchmarks/bench_queries.py --db /tmp/synth.db --iterations 500
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi import HTTPException, Request
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.models.emotion import Memory, User, create_sqlite_engine
+from app.services import memory_search
+from app.services.pagination import count_cache
+from app.services.response_cache import response_cache
+from app.api.endpoints.memory import list_user_memories, get_memory_timeline, get_emotion_trend, search_memories
+from app.api.endpoints.emotion import get_emotion_statistics
+
+SEARCH_TERMS = ["散步", "失眠", "想家", "海边", "冥想", "演唱会", "面试 紧张", "朋友 公园", "加班"]
+FILTER_EMOTIONS = ["happy", "sad", "calm", "anxious"]
+FILTER_TAGS = ["工作", "朋友", "失眠", "旅行"]
+
+
+def percentile(latencies: List[float], q: int) -> float:
+    """第 q 百分位（样本少于2个时返回唯一值）"""
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[q - 1]
+
+
+def build_cases(db, rng: random.Random) -> Dict[str, Callable]:
+    """每个用例接收 user_id，返回待执行的协程"""
+    request = Request({"type": "http", "method": "GET", "headers": []})
+    # 直接调用处理函数时 Query() 默认值不会被解析，需显式传参
+    trend_all = {"period": "all", "start": None, "end": None}
+
+    async def second_page(user_id):
+        first = await list_user_memories(user_id, include_total=False, db=db)
+        if first["next_cursor"]:
+            await list_user_memories(user_id, cursor=first["next_cursor"], include_total=False, db=db)
+
+    async def allow_empty(handler, *args, **kwargs):
+        try:
+            await handler(request, *args, db=db, **kwargs)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+
+    return {
+        "list": lambda u: list_user_memories(u, db=db),
+        "list/emotion": lambda u: list_user_memories(u, emotion_filter=rng.choice(FILTER_EMOTIONS), db=db),
+        "list/tag": lambda u: list_user_memories(u, tag=rng.choice(FILTER_TAGS), db=db),
+        "list/page1+2": second_page,
+        "timeline/30d": lambda u: get_memory_timeline(request, u, days=30, db=db),
+        "timeline/365d": lambda u: get_memory_timeline(request, u, days=365, db=db),
+        "trend/all": lambda u: allow_empty(get_emotion_trend, u, **trend_all, resolution="day", max_points=None),
+        "trend/all@200": lambda u: allow_empty(get_emotion_trend, u, **trend_all, resolution="auto", max_points=200),
+        "search": lambda u: search_memories(u, query=rng.choice(SEARCH_TERMS), db=db),
+        "statistics/7d": lambda u: allow_empty(get_emotion_statistics, u, days=7),
+        "statistics/30d": lambda u: allow_empty(get_emotion_statistics, u, days=30),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接口查询 p50/p99 基准测试")
+    parser.add_argument("--db", required=True, help="synth_dataset.py 生成的数据库文件")
+    parser.add_argument("--iterations", type=int, default=300, help="每个用例的调用次数")
+    parser.add_argument("--warmup", type=int, default=20, help="每个用例的预热次数（不计入统计）")
+    parser.add_argument("--keep-caches", action="store_true", help="不清空记忆总数缓存和响应缓存")
+    parser.add_argument("--only", default=None, help="只运行名称包含该字符串的用例")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"数据库不存在: {args.db}（先运行 benchmarks/synth_dataset.py）")
+
+    engine = create_sqlite_engine(f"sqlite:///{args.db}", readonly=True)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    rng = random.Random(args.seed)
+    loop = asyncio.new_event_loop()
+
+    users = db.execute(select(func.count()).select_from(User)).scalar()
+    rows = db.execute(select(func.count()).select_from(Memory)).scalar()
+    heaviest = db.execute(
+        select(Memory.user_id, func.count()).group_by(Memory.user_id).order_by(func.count().desc()).limit(1)
+    ).first()
+    search_mode = "FTS5" if memory_search.fts_available(db.connection()) else "LIKE"
+    print(f"{args.db}: {users} 个用户，{rows} 条记忆（最多的用户 {heaviest[1] if heaviest else 0} 条），检索 {search_mode}")
+    print(f"{'case':<18}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'mean ms':>10}")
+
+    for name, case in build_cases(db, rng).items():
+        if args.only and args.only not in name:
+            continue
+        latencies = []
+        for i in range(args.warmup + args.iterations):
+            user_id = rng.randint(1, users)
+            if not args.keep_caches:
+                count_cache.clear()
+                response_cache.clear()
+            start = time.perf_counter()
+            loop.run_until_complete(case(user_id))
+            elapsed = (time.perf_counter() - start) * 1000
+            if i >= args.warmup:
+                latencies.append(elapsed)
+            db.rollback()
+        print(
+            f"{name:<18}{percentile(latencies, 50):>10.2f}{percentile(latencies, 99):>10.2f}"
+            f"{max(latencies):>10.2f}{statistics.fmean(latencies):>10.2f}"
+        )
+
+    loop.close()
+    db.close()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
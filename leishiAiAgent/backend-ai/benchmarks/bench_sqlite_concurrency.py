@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+SQLite并发读写基准测试
+文件: backend-ai/benchmarks/bench_sqlite_concurrency.py
+功能: 一个写线程持续写入记忆的同时，多个读线程查询记忆列表和时间线，
+      对比两种连接配置下的读吞吐、读延迟和写入情况
+      - default: 回滚日志 + 默认连接参数，读写共用一个连接池
+      - tuned:   WAL + synchronous=NORMAL + mmap/页缓存 + 单写连接与只读连接池
+
+用法:
+    python benchmarks/bench_sqlite_concurrency.py --rows 20000 --readers 4 --seconds 10
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+import statistics
+from pathlib import Path
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.models.emotion import Memory, create_sqlite_engine
+from app.models.migrations import migrate
+from app.services import emotion_rollup, memory_search, memory_tags
+from app.services.emotion_rollup import query_daily
+from app.services.memory_fields import parse_fields, list_columns
+from app.services.pagination import paginate
+
+EMOTIONS = ["happy", "sad", "calm", "neutral", "anxious"]
+
+
+def prepare(db_path: str, rows: int, users: int, seed: int = 42):
+    """建表并用 executemany 写入初始数据，再回填派生表"""
+    engine = create_engine(f"sqlite:///{db_path}")
+    migrate(engine)
+    engine.dispose()
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'x')",
+        [(i, f"user{i}") for i in range(1, users + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO memories (user_id, memory_type, emotion_type, emotion_intensity, content, content_head, tags, created_at) "
+        "VALUES (?, 'text', ?, ?, ?, substr(?4, 1, 201), '[\"general\"]', ?)",
+        [
+            (
+                rng.randint(1, users),
+                rng.choice(EMOTIONS),
+                round(rng.random(), 3),
+                "今天的心情记录" * rng.randint(2, 20),
+                (now - timedelta(seconds=rng.randint(0, 90 * 86400))).strftime("%Y-%m-%d %H:%M:%S.%f")
+            )
+            for _ in range(rows)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+    # 回填派生表（标签、汇总、全文索引）
+    engine = create_engine(f"sqlite:///{db_path}")
+    db = sessionmaker(bind=engine)()
+    memory_tags.backfill(db)
+    emotion_rollup.backfill(db)
+    memory_search.rebuild(db)
+    db.close()
+    engine.dispose()
+
+
+def make_sessions(mode: str, db_path: str, readers: int):
+    """返回 (写会话工厂, 读会话工厂, 引擎列表)"""
+    url = f"sqlite:///{db_path}"
+    if mode == "tuned":
+        writer = create_sqlite_engine(url)
+        reader = create_sqlite_engine(url, readonly=True, pool_size=readers)
+        return sessionmaker(bind=writer), sessionmaker(bind=reader), [writer, reader]
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    factory = sessionmaker(bind=engine)
+    return factory, factory, [engine]
+
+
+def run(mode: str, db_path: str, users: int, readers: int, seconds: float, batch: int):
+    write_factory, read_factory, engines = make_sessions(mode, db_path, readers)
+    stop = threading.Event()
+    latencies, lock = [], threading.Lock()
+    writes = {"rows": 0, "errors": 0}
+    fields = parse_fields(None)
+
+    def write_loop():
+        rng = random.Random(1)
+        while not stop.is_set():
+            db = write_factory()
+            try:
+                db.add_all([
+                    Memory(
+                        user_id=rng.randint(1, users),
+                        memory_type="text",
+                        emotion_type=rng.choice(EMOTIONS),
+                        emotion_intensity=rng.random(),
+                        content="写入中的新记忆" * 5,
+                        tags=["general"]
+                    )
+                    for _ in range(batch)
+                ])
+                db.commit()
+                writes["rows"] += batch
+            except OperationalError:
+                db.rollback()
+                writes["errors"] += 1
+            finally:
+                db.close()
+
+    def read_loop(seed):
+        rng = random.Random(seed)
+        local = []
+        while not stop.is_set():
+            user_id = rng.randint(1, users)
+            start = time.perf_counter()
+            db = read_factory()
+            try:
+                query = db.query(*list_columns(fields)).filter(Memory.user_id == user_id)
+                paginate(query, None, 20)
+                query_daily(db, user_id)
+                local.append((time.perf_counter() - start) * 1000)
+            except OperationalError:
+                pass
+            finally:
+                db.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=write_loop)]
+    threads += [threading.Thread(target=read_loop, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    for engine in engines:
+        engine.dispose()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+    return {
+        "reads_per_s": len(latencies) / seconds,
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p99_ms": p99,
+        "writes_per_s": writes["rows"] / seconds,
+        "write_errors": writes["errors"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite并发读写基准测试")
+    parser.add_argument("--rows", type=int, default=20000, help="初始记忆条数")
+    parser.add_argument("--users", type=int, default=50, help="用户数")
+    parser.add_argument("--readers", type=int, default=4, help="读线程数")
+    parser.add_argument("--seconds", type=float, default=10, help="每种配置运行时长")
+    parser.add_argument("--batch", type=int, default=10, help="每次提交写入的记忆数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    template = os.path.join(workdir, "template.db")
+    print(f"准备 {args.rows} 条记忆 -> {template}")
+    prepare(template, args.rows, args.users)
+
+    print(f"{'mode':<10}{'reads/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'writes/s':>10}{'errors':>8}")
+    for mode in ("default", "tuned"):
+        db_path = os.path.join(workdir, f"{mode}.db")
+        with open(template, "rb") as src, open(db_path, "wb") as dst:
+            dst.write(src.read())
+        result = run(mode, db_path, args.users, args.readers, args.seconds, args.batch)
+        print(
+            f"{mode:<10}{result['reads_per_s']:>10.0f}{result['p50_ms']:>10.2f}"
+            f"{result['p99_ms']:>10.2f}{result['writes_per_s']:>10.0f}{result['write_errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
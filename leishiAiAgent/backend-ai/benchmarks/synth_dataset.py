@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+合成数据集生成器
+文件: backend-ai/benchmarks/synth_dataset.py
+功能: 为数据库规模的基准测试批量生成用户和记忆（默认 1万用户 / 1000万条记忆）
+      - 分布: 用户活跃度长尾（帕累托）、每个用户有自己的情绪倾向、
+              强度按情绪取 Beta 分布、正文长度对数正态、标签与情绪相关、
+              记录量随时间增长并有周末和晚间高峰
+      - 按天顺序生成，自增ID与 created_at 同序（与线上写入顺序一致）
+      - 写入走 SQLite 批量加载路径: 关闭日志和同步、先删二级索引，
+        executemany 写完后重建索引，再用 SQL 回填汇总表、标签表、情绪读数、全文索引、重复检测签名，并重建统计摘要
+
+正文以明文写入；需要测试压缩存储时之后再运行
+    python -m app.models.compression --train --recompress
+
+用法:
+    python benchmarks/synth_dataset.py --db /tmp/synth.db
+    python benchmarks/synth_dataset.py --db /tmp/synth.db --users 1000 --rows 1000000 --no-fts
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import random
+import sqlite3
+import argparse
+from pathlib import Path
+from itertools import accumulate
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models.emotion import CONTENT_HEAD_LENGTH
+from app.models.migrations import migrate
+from app.services import emotion_rollup, memory_search, memory_tags, memory_dedup, sketches
+from app.services.emotion_events import backfill_from_memories
+
+# 全局情绪占比（每个用户在此基础上随机偏移）
+EMOTION_WEIGHTS = {
+    "neutral": 0.24, "calm": 0.20, "happy": 0.20, "sad": 0.13,
+    "anxious": 0.10, "excited": 0.08, "angry": 0.05
+}
+EMOTIONS = list(EMOTION_WEIGHTS)
+# 各情绪强度的 Beta(a, b) 参数
+INTENSITY_BETA = {
+    "neutral": (2, 5), "calm": (3, 4), "happy": (4, 3), "sad": (4, 3),
+    "anxious": (5, 3), "excited": (5, 2), "angry": (6, 2)
+}
+MEMORY_TYPES = ["diary", "conversation", "music", "story"]
+MEMORY_TYPE_WEIGHTS = [0.5, 0.3, 0.1, 0.1]
+# 每小时的相对活跃度（晚间高峰）
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 1, 2, 4, 5, 5, 5, 6, 7, 6, 5, 5, 6, 7, 8, 9, 11, 12, 10, 5]
+
+COMMON_TAGS = ["日常", "general", "工作", "家庭", "朋友", "学习", "运动", "音乐", "旅行", "睡眠", "美食", "天气"]
+EMOTION_TAGS = {
+    "happy": ["聚会", "约会", "成就", "ktv"],
+    "excited": ["演唱会", "旅行", "新工作"],
+    "calm": ["冥想", "散步", "读书", "白噪音"],
+    "neutral": ["通勤", "记录"],
+    "sad": ["分手", "想家", "失落"],
+    "anxious": ["考试", "失眠", "加班", "面试"],
+    "angry": ["争吵", "堵车", "加班"]
+}
+
+SENTENCES = [
+    "今天早上醒得很早，窗外在下小雨。", "和朋友一起去公园散步，聊了很多以前的事情。",
+    "工作压力有点大，晚上一直睡不着。", "听了一首很久没听的老歌，突然有点想家。",
+    "下班路上堵车堵了一个小时，心情很烦躁。", "终于把拖了很久的项目交付了，松了一口气。",
+    "周末去海边看日落，风很大但是很舒服。", "晚上做了冥想，呼吸慢慢平稳下来。",
+    "和家里人视频通话，妈妈说最近身体还不错。", "考试成绩出来了，比预想的好一点。",
+    "一个人在咖啡店坐了一下午，看完了半本书。", "跟同事因为一件小事吵了起来，现在想想没必要。",
+    "跑步五公里，出了一身汗，整个人轻松了很多。", "面试的时候太紧张了，好几个问题都没答好。",
+    "今天什么特别的事情也没有发生，平平淡淡。", "给自己做了一顿晚饭，味道意外地不错。",
+    "失眠到凌晨三点，脑子里一直在想明天的事情。", "收到了老朋友寄来的明信片，很开心。",
+    "演唱会现场气氛太好了，嗓子都喊哑了。", "雨声和白噪音混在一起，很适合睡觉。"
+]
+
+
+def build_corpus(rng: random.Random, chars: int = 200_000) -> str:
+    """随机拼接句子得到一段长文本，正文从中按随机偏移截取"""
+    parts, total = [], 0
+    while total < chars:
+        sentence = rng.choice(SENTENCES)
+        parts.append(sentence)
+        total += len(sentence)
+    return "".join(parts)
+
+
+def user_profiles(rng: random.Random, users: int, pareto_alpha: float):
+    """
+    每个用户的活跃度和情绪倾向
+
+    Returns:
+        (用户累积权重, 每个用户的情绪累积权重)
+    """
+    activity = [rng.paretovariate(pareto_alpha) for _ in range(users)]
+    emotions = []
+    for _ in range(users):
+        # Gamma 噪声相当于以全局占比为均值的 Dirichlet 抽样
+        weights = [rng.gammavariate(EMOTION_WEIGHTS[e] * 20, 1) for e in EMOTIONS]
+        emotions.append(list(accumulate(weights)))
+    return list(accumulate(activity)), emotions
+
+
+def day_counts(rng: random.Random, rows: int, days: int) -> List[int]:
+    """每天的记忆条数: 从 0.2 线性增长到 1，周末多 30%，合计恰好为 rows"""
+    start = datetime.utcnow().date() - timedelta(days=days - 1)
+    weights = []
+    for d in range(days):
+        growth = 0.2 + 0.8 * d / max(1, days - 1)
+        weekend = 1.3 if (start + timedelta(days=d)).weekday() >= 5 else 1.0
+        weights.append(growth * weekend * rng.uniform(0.9, 1.1))
+    scale = rows / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    for d in rng.sample(range(days), rows - sum(counts)):
+        counts[d] += 1
+    return counts
+
+
+def _index_sql(conn, table: str) -> List[str]:
+    return [sql for (sql,) in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+    )]
+
+
+def generate(
+    db_path: str,
+    users: int = 10_000,
+    rows: int = 10_000_000,
+    days: int = 730,
+    seed: int = 42,
+    batch_size: int = 50_000,
+    pareto_alpha: float = 1.2,
+    fts: bool = True,
+    log=print
+):
+    """
+    生成合成数据集（覆盖已有文件）
+
+    Args:
+        fts: 是否构建全文索引（jieba分词约 1ms/条，千万级需数小时；跳过时检索走前缀LIKE）
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    engine = create_engine(f"sqlite:///{db_path}")
+    migrate(engine)
+    engine.dispose()
+
+    rng = random.Random(seed)
+    corpus = build_corpus(rng)
+    user_weights, emotion_weights = user_profiles(rng, users, pareto_alpha)
+    user_ids = range(1, users + 1)
+    hour_weights = list(accumulate(HOUR_WEIGHTS))
+    type_weights = list(accumulate(MEMORY_TYPE_WEIGHTS))
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in ("journal_mode=OFF", "synchronous=OFF", "locking_mode=EXCLUSIVE",
+                   "temp_store=MEMORY", "cache_size=-262144"):
+        conn.execute(f"PRAGMA {pragma}")
+
+    start = time.perf_counter()
+    signup = datetime.utcnow() - timedelta(days=days)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO users (id, username, email, password_hash, created_at) VALUES (?, ?, ?, 'x', ?)",
+        [(i, f"user{i}", f"user{i}@example.com", signup.strftime("%Y-%m-%d %H:%M:%S.%f")) for i in user_ids]
+    )
+
+    # 先删除二级索引，全部写完后一次性重建
+    indexes = _index_sql(conn, "memories")
+    for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'memories' AND sql IS NOT NULL"
+    ).fetchall():
+        conn.execute(f"DROP INDEX {name}")
+
+    insert = (
+        "INSERT INTO memories (user_id, memory_type, emotion_type, emotion_intensity, content, content_head, "
+        "summary, tags, created_at, updated_at, is_shared) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?9, 0)"
+    )
+    first_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    written, batch = 0, []
+    for d, count in enumerate(day_counts(rng, rows, days)):
+        day = first_day + timedelta(days=d)
+        owners = rng.choices(user_ids, cum_weights=user_weights, k=count)
+        hours = rng.choices(range(24), cum_weights=hour_weights, k=count)
+        offsets = sorted(h * 3600 + rng.randrange(3600) for h in hours)
+        for user_id, offset in zip(owners, offsets):
+            emotion = rng.choices(EMOTIONS, cum_weights=emotion_weights[user_id - 1])[0]
+            length = min(2000, max(4, int(rng.lognormvariate(math.log(60), 0.8))))
+            at = rng.randrange(len(corpus) - length)
+            content = corpus[at:at + length]
+            tags = rng.sample(COMMON_TAGS, rng.choice((0, 1, 1, 2)))
+            if rng.random() < 0.4:
+                tags.append(rng.choice(EMOTION_TAGS[emotion]))
+            batch.append((
+                user_id,
+                rng.choices(MEMORY_TYPES, cum_weights=type_weights)[0],
+                emotion,
+                round(rng.betavariate(*INTENSITY_BETA[emotion]), 3),
+                content,
+                content[:CONTENT_HEAD_LENGTH],
+                content[:30] if rng.random() < 0.3 else None,
+                json.dumps(tags, ensure_ascii=False),
+                (day + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S.%f")
+            ))
+        if len(batch) >= batch_size:
+            conn.executemany(insert, batch)
+            written += len(batch)
+            batch = []
+            log(f"  已写入 {written}/{rows} 条记忆（{time.perf_counter() - start:.0f}s）")
+    if batch:
+        conn.executemany(insert, batch)
+        written += len(batch)
+    conn.execute("COMMIT")
+    log(f"  写入 {users} 个用户、{written} 条记忆，耗时 {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    for sql in indexes:
+        conn.execute(sql)
+    log(f"  重建 {len(indexes)} 个索引，耗时 {time.perf_counter() - start:.1f}s")
+    if not fts:
+        # 空的索引表会让检索直接返回空结果，删掉后检索退回前缀LIKE
+        conn.execute(f"DROP TABLE IF EXISTS {memory_search.FTS_TABLE}")
+    conn.close()
+
+    # 派生表用各服务自己的回填函数（SQL 聚合，不经过ORM）
+    engine = create_engine(f"sqlite:///{db_path}")
+    db = sessionmaker(bind=engine)()
+    steps = [
+        ("每日汇总", lambda: emotion_rollup.backfill(db)),
+        ("标签表", lambda: memory_tags.backfill(db)),
+        ("情绪读数", lambda: backfill_from_memories(db)),
+        ("统计摘要", lambda: sketches.rebuild(db)),
+    ]
+    if fts:
+        steps.append(("全文索引", lambda: memory_search.rebuild(db, chunk_size=5000)))
+    if memory_dedup.enabled():
+        # 每条约 0.7ms，千万级数据不需要时用 MEMORY_DEDUP_MODE=off 跳过
+        steps.append(("重复检测签名", lambda: memory_dedup.backfill(db, chunk_size=5000)))
+    for name, step in steps:
+        start = time.perf_counter()
+        count = step()
+        db.commit()
+        log(f"  回填{name} {count} 行，耗时 {time.perf_counter() - start:.1f}s")
+
+    db.connection().exec_driver_sql("ANALYZE")
+    db.commit()
+    db.close()
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成数据库基准测试用的合成数据集")
+    parser.add_argument("--db", required=True, help="输出数据库文件（已存在则覆盖）")
+    parser.add_argument("--users", type=int, default=10_000, help="用户数")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="记忆条数")
+    parser.add_argument("--days", type=int, default=730, help="时间跨度（天）")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--alpha", type=float, default=1.2, help="用户活跃度的帕累托参数（越小越长尾）")
+    parser.add_argument("--no-fts", action="store_true", help="跳过全文索引构建")
+    args = parser.parse_args()
+
+    print(f"生成 {args.users} 个用户、{args.rows} 条记忆 -> {args.db}")
+    start = time.perf_counter()
+    generate(args.db, args.users, args.rows, args.days, args.seed, pareto_alpha=args.alpha, fts=not args.no_fts)
+    print(f"✓ 完成，总耗时 {time.perf_counter() - start:.1f}s，文件 {os.path.getsize(args.db) / 1024 / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
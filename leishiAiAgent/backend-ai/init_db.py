@@ -9,13 +9,32 @@ import os
 from datetime import datetime
 import json
 
+from sqlalchemy import create_engine
+
+from app.models.migrations import migrate, SCHEMA_VERSION
+from app.models.sharding import shard_router
+
 
 def init_database(db_path='soundscape.db'):
-    """初始化数据库"""
+    """
+    初始化数据库（可重复执行，不删除已有数据）
+
+    users / sessions / memories 等ORM表由版本化迁移创建和升级，
+    这里只补建 Node 后端共用的表并写入种子数据
+    """
 
-    # 删除旧数据库（开发环境）
-    if os.path.exists(db_path):
-        os.remove(db_path)
+    # ORM表结构（含旧结构数据迁移）
+    engine = create_engine(f"sqlite:///{db_path}")
+    try:
+        applied = migrate(engine)
+    finally:
+        engine.dispose()
+    print(f"✅ 数据库结构已是最新版本 {SCHEMA_VERSION}（本次执行 {applied} 步迁移）")
+
+    # 记忆分片（MEMORY_SHARDS > 1 时）
+    if shard_router.shards > 1:
+        applied = shard_router.migrate()
+        print(f"✅ {shard_router.shards} 个记忆分片已升级（本次执行 {applied} 步迁移）")
 
     # 创建连接
     conn = sqlite3.connect(db_path)
@@ -23,34 +42,6 @@ def init_database(db_path='soundscape.db'):
     cursor = conn.cursor()
 
     try:
-        # ==================== 用户表 ====================
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE,
-                created_at TEXT NOT NULL,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                last_login TEXT,
-                profile_data TEXT,
-                preferences TEXT
-            )
-        ''')
-
-        # ==================== 会话表 ====================
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                token TEXT UNIQUE NOT NULL,
-                created_at TEXT NOT NULL,
-                last_activity TEXT NOT NULL,
-                ended_at TEXT,
-                device_info TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-
         # ==================== 情绪记录表 ====================
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS emotion_records (
@@ -108,30 +99,6 @@ def init_database(db_path='soundscape.db'):
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_app_usage_user ON app_usage(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_app_usage_app ON app_usage(app_id)')
 
-        # ==================== 记忆表 ====================
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS memories (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                emotion_type TEXT,
-                emotion_intensity REAL,
-                app_used TEXT,
-                duration INTEGER,
-                content TEXT,
-                summary TEXT,
-                tags TEXT,
-                notes TEXT,
-                is_shared INTEGER DEFAULT 0,
-                share_token TEXT UNIQUE,
-                created_at TEXT NOT NULL,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_user ON memories(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_date ON memories(created_at)')
-
         # ==================== 推荐反馈表 ====================
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS recommendation_feedback (
@@ -199,7 +166,7 @@ def init_database(db_path='soundscape.db'):
 
         for app in seed_data:
             cursor.execute('''
-                INSERT INTO dapps 
+                INSERT OR IGNORE INTO dapps 
                 (id, name, type, category, description, icon, features, entry_point, created_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
@@ -211,15 +178,12 @@ def init_database(db_path='soundscape.db'):
         # 提交变更
         conn.commit()
         print(f"✅ 数据库初始化成功: {db_path}")
-        print(f"✅ 已创建以下表:")
-        print("   - users (用户表)")
-        print("   - sessions (会话表)")
+        print(f"✅ 已确认以下共用表:")
         print("   - emotion_records (情绪记录表)")
         print("   - dapps (DApp应用表)")
         print("   - app_usage (应用使用记录表)")
-        print("   - memories (记忆表)")
         print("   - recommendation_feedback (推荐反馈表)")
-        print(f"✅ 已插入 {len(seed_data)} 个应用")
+        print(f"✅ 已写入 {len(seed_data)} 个应用")
 
     except Exception as e:
         print(f"❌ 数据库初始化失败: {str(e)}")
@@ -235,6 +199,3 @@ if __name__ == '__main__':
     db_path = os.path.join(os.path.dirname(__file__), 'soundscape.db')
     init_database(db_path)
     print("Database initialized successfully with DApps data.")
-
-if __name__ == "__main__":
-    init_db()
\ No newline at end of file
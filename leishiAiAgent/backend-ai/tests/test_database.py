@@ -0,0 +1,1687 @@
+"""
+数据库层测试
+文件: backend-ai/tests/test_database.py
+功能: 测试写入路径、聚合与索引等数据库相关服务
+"""
+
+import os
+import json
+import pytest
+from fastapi import Request
+import sqlite3
+from datetime import datetime, date, timedelta
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker, close_all_sessions
+
+from app.models.emotion import Base, User, Memory, MemoryTag, Session as SessionModel, EmotionDailyRollup, ContentCache
+from app.models.emotion import DAppHistory, APIUsageLog, APIUsageHourly, EmotionEvent, EmotionPeriodRollup, EMOTION_CODES
+from app.models.emotion import MemorySignature, MemoryLSHBand
+from app.models.emotion import create_sqlite_engine, create_postgres_engine, CONTENT_HEAD_LENGTH
+from app.models.migrations import migrate, current_version, SCHEMA_VERSION
+from app.models.sharding import ShardRouter, ShardLayoutError, shard_for, layout_problems, check_layout
+from app.models import compression
+from app.services import memory_search, memory_tags, memory_archive
+from app.services.pagination import paginate, count_cache, InvalidCursorError
+from app.services.memory_fields import parse_fields, list_columns, serialize_row, InvalidFieldsError
+from app.services.emotion_rollup import backfill, intensity_trend, global_emotion_totals, query_rollup
+from app.services.downsample import lttb_indices
+from app.services.write_behind import WriteBehindWriter, WriteQueueFullError
+from app.services.content_cache import ContentCacheManager
+from app.services.emotion_events import daily_counts, backfill_from_memories
+from app.services import api_usage
+from app.services.bulk_delete import BulkDeleter, ChunkedDeleter, DeletionJob
+from app.services.response_cache import ResponseCache, response_cache
+from app.services import sketches, parquet_export, memory_transfer, memory_dedup, memory_vectors
+
+
+@pytest.fixture(scope="function")
+def session_factory(tmp_path):
+    """基于临时文件的SQLite数据库（后台线程需要共享同一数据库）"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = factory()
+    db.add(User(id=1, username="testuser", password_hash="x"))
+    db.commit()
+    db.close()
+
+    yield factory
+
+    engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def pg_session_factory():
+    """PostgreSQL数据库（需设置 TEST_POSTGRES_URL，否则跳过）"""
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("未设置 TEST_POSTGRES_URL")
+    engine = create_postgres_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = factory()
+    db.add(User(id=1, username="testuser", password_hash="x"))
+    db.commit()
+    db.close()
+
+    yield factory
+
+    # 失败的用例可能留下未关闭的会话，先释放其连接再删表，否则drop会等锁
+    close_all_sessions()
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE IF EXISTS schema_version")
+    engine.dispose()
+
+
+def make_record(**overrides):
+    """构造一条情绪分析记录"""
+    record = {
+        "user_id": 1,
+        "session_id": None,
+        "emotion": "happy",
+        "intensity": 0.8,
+        "memory_type": "text",
+        "content": "今天很开心",
+        "summary": "开心的一天",
+        "tags": ["general", "happy"],
+        "created_at": datetime.utcnow()
+    }
+    record.update(overrides)
+    return record
+
+
+class TestWriteBehindWriter:
+    """写后批量提交测试"""
+
+    def test_batches_records_into_few_transactions(self, session_factory):
+        """多条记录合并为少量事务提交"""
+        writer = WriteBehindWriter(session_factory, max_batch=50, flush_interval_ms=50)
+        for _ in range(100):
+            writer.submit(make_record())
+        writer.start()
+        writer.flush()
+        writer.stop()
+
+        db = session_factory()
+        assert db.query(Memory).count() == 100
+        assert db.query(SessionModel).count() == 100
+        assert all(m.session_id for m in db.query(Memory))
+        db.close()
+
+        assert writer.stats["written"] == 100
+        assert writer.stats["batches"] <= 4
+
+    def test_updates_existing_session(self, session_factory):
+        """已有会话只更新当前情绪，以最后一条为准"""
+        db = session_factory()
+        session_record = SessionModel(user_id=1, current_emotion="neutral")
+        db.add(session_record)
+        db.commit()
+        session_id = session_record.id
+        db.close()
+
+        writer = WriteBehindWriter(session_factory)
+        writer.submit(make_record(session_id=session_id, emotion="sad", intensity=0.4))
+        writer.submit(make_record(session_id=session_id, emotion="calm", intensity=0.3))
+        writer.stop()
+
+        db = session_factory()
+        assert db.query(SessionModel).count() == 1
+        assert db.get(SessionModel, session_id).current_emotion == "calm"
+        assert db.query(Memory).filter(Memory.session_id == session_id).count() == 2
+        db.close()
+
+    def test_back_pressure_when_queue_full(self, session_factory):
+        """队列满时拒绝入队，关闭时仍落盘已入队记录"""
+        writer = WriteBehindWriter(session_factory, queue_size=1, put_timeout=0.01)
+        writer.submit(make_record())
+        with pytest.raises(WriteQueueFullError):
+            writer.submit(make_record())
+
+        writer.stop()
+
+        db = session_factory()
+        assert db.query(Memory).count() == 1
+        db.close()
+        assert writer.stats["rejected"] == 1
+
+    def test_stats_consistent_across_threads(self, session_factory):
+        """多个线程同时提交时计数不丢失"""
+        import threading
+
+        writer = WriteBehindWriter(session_factory, max_batch=100, flush_interval_ms=1)
+        writer.start()
+        threads = [
+            threading.Thread(target=lambda: [writer.submit(make_record(content=None)) for _ in range(100)])
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+
+        stats = writer.snapshot()
+        assert stats["enqueued"] == stats["written"] == 800
+
+
+class TestEmotionEvents:
+    """情绪读数事件窄表测试"""
+
+    def test_readings_do_not_create_memories(self, session_factory):
+        """不带正文的识别记录只写事件，统计从事件聚合"""
+        writer = WriteBehindWriter(session_factory)
+        day = datetime(2024, 6, 1, 9)
+        for emotion, intensity, hours in [("sad", 0.8, 0), ("sad", 0.4, 1), ("calm", 0.5, 26)]:
+            writer.submit({
+                "user_id": 1, "session_id": None, "emotion": emotion, "intensity": intensity,
+                "valence": 0.3, "arousal": 0.6, "confidence": 0.9, "source": "audio",
+                "created_at": day + timedelta(hours=hours)
+            })
+        writer.stop()
+
+        db = session_factory()
+        assert db.query(Memory).count() == 0
+        events = db.query(EmotionEvent).order_by(EmotionEvent.id).all()
+        assert [e.emotion for e in events] == [EMOTION_CODES["sad"]] * 2 + [EMOTION_CODES["calm"]]
+        assert all(e.session_id and e.source == 2 for e in events)
+
+        rows = daily_counts(db, 1, day.date())
+        assert [(d, emotion, count) for d, emotion, count, _ in rows] == [
+            (day.date(), "sad", 2), ((day + timedelta(days=1)).date(), "calm", 1)
+        ]
+        assert rows[0][3] == pytest.approx(1.2)
+        assert daily_counts(db, 1, (day + timedelta(days=1)).date())[0][1] == "calm"
+        db.close()
+
+    def test_backfill_from_memories(self, session_factory):
+        """迁移时由已有记忆生成事件，未知情绪归为 unknown"""
+        db = session_factory()
+        now = datetime(2024, 6, 1, 12)
+        # 迁移前写入的记忆没有对应事件（Core插入，不经过ORM钩子）
+        db.execute(Memory.__table__.insert(), [
+            dict(user_id=1, memory_type="text", emotion_type="happy", emotion_intensity=0.9,
+                 content="a", tags=[], created_at=now),
+            dict(user_id=1, memory_type="text", emotion_type="bored", emotion_intensity=None,
+                 content="b", tags=[], created_at=now)
+        ])
+        db.commit()
+
+        assert backfill_from_memories(db) == 2
+        db.commit()
+        assert {(emotion, count) for _, emotion, count, _ in daily_counts(db, 1, now.date())} == {
+            ("happy", 1), ("unknown", 1)
+        }
+        db.close()
+
+    def test_memory_events_follow_orm_changes(self, session_factory):
+        """经ORM创建、修改、删除的记忆同步到事件表，统计包含迁移后新建的记忆"""
+        db = session_factory()
+        now = datetime(2024, 6, 1, 12)
+        memories = [
+            Memory(user_id=1, emotion_type="happy", emotion_intensity=0.9, content="a", created_at=now),
+            Memory(user_id=1, emotion_type="sad", emotion_intensity=None, content="b", created_at=now),
+        ]
+        db.add_all(memories)
+        db.commit()
+        assert sorted((emotion, count, round(total, 6)) for _, emotion, count, total in daily_counts(db, 1, now.date())) == [
+            ("happy", 1, 0.9), ("sad", 1, 0.5)
+        ]
+
+        memories[0].emotion_type = "calm"
+        memories[0].emotion_intensity = 0.3
+        db.commit()
+        db.delete(memories[1])
+        db.commit()
+        assert [(emotion, count, round(total, 6)) for _, emotion, count, total in daily_counts(db, 1, now.date())] == [
+            ("calm", 1, 0.3)
+        ]
+        assert db.query(EmotionEvent).count() == 1
+        db.close()
+
+
+class TestEmotionDailyRollup:
+    """每日情绪汇总测试"""
+
+    def rollup(self, db):
+        return {
+            (r.day.isoformat(), r.emotion_type): (r.count, round(r.sum_intensity, 6))
+            for r in db.query(EmotionDailyRollup).filter(EmotionDailyRollup.user_id == 1)
+        }
+
+    def test_maintained_on_insert_update_delete(self, session_factory):
+        """记忆增删改后汇总表与全量重建结果一致"""
+        db = session_factory()
+        day1 = datetime(2024, 1, 1, 9, 0)
+        day2 = datetime(2024, 1, 2, 9, 0)
+        memories = [
+            Memory(user_id=1, emotion_type="happy", emotion_intensity=0.8, content="a", created_at=day1),
+            Memory(user_id=1, emotion_type="happy", emotion_intensity=0.6, content="b", created_at=day1),
+            Memory(user_id=1, emotion_type="sad", emotion_intensity=0.4, content="c", created_at=day2),
+        ]
+        db.add_all(memories)
+        db.commit()
+        assert self.rollup(db) == {
+            ("2024-01-01", "happy"): (2, 1.4),
+            ("2024-01-02", "sad"): (1, 0.4),
+        }
+
+        memories[0].emotion_intensity = 0.2
+        memories[2].emotion_type = "calm"
+        db.commit()
+        db.delete(memories[1])
+        db.commit()
+
+        maintained = self.rollup(db)
+        assert maintained == {
+            ("2024-01-01", "happy"): (1, 0.2),
+            ("2024-01-02", "calm"): (1, 0.4),
+        }
+
+        backfill(db)
+        assert self.rollup(db) == maintained
+        db.close()
+
+    def test_period_pyramid(self, session_factory):
+        """周/月汇总随记忆增删同步维护，与由每日汇总重建的结果一致"""
+        db = session_factory()
+        days = [datetime(2024, 1, 28, 9), datetime(2024, 1, 31, 9), datetime(2024, 2, 1, 9), datetime(2024, 2, 5, 9)]
+        memories = [
+            Memory(user_id=1, emotion_type="happy", emotion_intensity=0.5, content="x", created_at=day)
+            for day in days
+        ]
+        db.add_all(memories)
+        db.commit()
+        db.delete(memories[1])
+        db.commit()
+
+        weeks = [(d.isoformat(), c) for d, _, c, _ in query_rollup(db, 1, "week")]
+        months = [(d.isoformat(), c) for d, _, c, _ in query_rollup(db, 1, "month")]
+        assert weeks == [("2024-01-22", 1), ("2024-01-29", 1), ("2024-02-05", 1)]
+        assert months == [("2024-01-01", 1), ("2024-02-01", 2)]
+        assert [d.isoformat() for d, *_ in query_rollup(db, 1, "week", date(2024, 2, 1), date(2024, 2, 4))] == ["2024-01-29"]
+
+        maintained = {(r.level, r.period_start, r.emotion_type, r.count) for r in db.query(EmotionPeriodRollup)}
+        backfill(db)
+        assert {(r.level, r.period_start, r.emotion_type, r.count) for r in db.query(EmotionPeriodRollup)} == maintained
+        db.close()
+
+    def test_lttb_keeps_shape(self):
+        """降采样保留首尾和尖峰，点数不超过上限"""
+        x = list(range(1000))
+        spike = [1.0 if i == 500 else 0.0 for i in x]
+        flat = [0.5] * 1000
+        keep = lttb_indices(x, [spike, flat], 20)
+        assert len(keep) == 20 and keep[0] == 0 and keep[-1] == 999
+        assert 500 in keep and keep == sorted(keep)
+        assert lttb_indices(x[:10], [spike[:10]], 20) == list(range(10))
+
+    def test_intensity_trend(self):
+        """前后半段平均强度比较"""
+        assert intensity_trend([]) == "stable"
+        assert intensity_trend([("d1", 1, 0.5)]) == "stable"
+        assert intensity_trend([("d1", 2, 0.4), ("d2", 2, 1.6)]) == "improving"
+        assert intensity_trend([("d1", 3, 2.4), ("d2", 1, 0.1)]) == "declining"
+
+
+class TestMemorySearch:
+    """记忆全文检索测试"""
+
+    def test_search_ranked_with_highlight(self, session_factory):
+        """中文分词检索、按相关度排序并返回高亮"""
+        db = session_factory()
+        db.add(User(id=2, username="other", password_hash="x"))
+        db.add_all([
+            Memory(user_id=1, emotion_type="happy", content="今天和朋友一起去公园散步，心情非常开心",
+                   summary="公园散步", tags=["朋友"]),
+            Memory(user_id=1, emotion_type="sad", content="工作压力很大，晚上失眠了", tags=["工作"]),
+            Memory(user_id=2, emotion_type="happy", content="我也去公园散步了"),
+        ])
+        db.commit()
+
+        results = memory_search.search(db, 1, "公园散步")
+        assert [r["id"] for r in results] == [1]
+        assert "<mark>公园</mark>" in results[0]["highlight"]
+        assert memory_search.SEPARATOR not in results[0]["highlight"]
+
+        assert [r["id"] for r in memory_search.search(db, 1, "工作", emotion_type="sad")] == [2]
+        assert memory_search.search(db, 1, "工作", emotion_type="happy") == []
+        assert memory_search.search(db, 1, "！？") is None
+        db.close()
+
+    def test_index_follows_update_and_delete(self, session_factory):
+        """更新和删除后索引同步"""
+        db = session_factory()
+        memory = Memory(user_id=1, emotion_type="calm", content="听音乐放松")
+        db.add(memory)
+        db.commit()
+        assert len(memory_search.search(db, 1, "音乐")) == 1
+
+        memory.content = "读了一本好书"
+        db.commit()
+        assert memory_search.search(db, 1, "音乐") == []
+        assert len(memory_search.search(db, 1, "好书")) == 1
+
+        db.delete(memory)
+        db.commit()
+        assert memory_search.search(db, 1, "好书") == []
+
+        assert memory_search.rebuild(db) == 0
+        db.close()
+
+
+class TestMemoryTags:
+    """记忆标签索引测试"""
+
+    def tags(self, db):
+        return sorted((t.memory_id, t.tag) for t in db.query(MemoryTag))
+
+    def test_maintained_and_backfilled(self, session_factory):
+        """标签表随记忆增删改同步，回填结果一致"""
+        db = session_factory()
+        first = Memory(user_id=1, emotion_type="sad", content="a", tags=["工作", " 压力 ", "工作"])
+        second = Memory(user_id=1, emotion_type="happy", content="b", tags=["工作"])
+        db.add_all([first, second])
+        db.commit()
+        assert self.tags(db) == [(1, "压力"), (1, "工作"), (2, "工作")]
+
+        first.tags = ["睡眠"]
+        db.commit()
+        db.delete(second)
+        db.commit()
+        assert self.tags(db) == [(1, "睡眠")]
+
+        assert memory_tags.backfill(db) == 1
+        assert self.tags(db) == [(1, "睡眠")]
+        db.close()
+
+    def test_counts_and_filter(self, session_factory):
+        """标签计数、情绪分布和按标签过滤"""
+        db = session_factory()
+        db.add_all([
+            Memory(user_id=1, emotion_type="sad", content="a", tags=["工作"]),
+            Memory(user_id=1, emotion_type="happy", content="b", tags=["工作", "朋友"]),
+        ])
+        db.commit()
+
+        counts = sorted(memory_tags.tag_emotion_counts(db, 1))
+        assert counts == [("工作", "happy", 1), ("工作", "sad", 1), ("朋友", "happy", 1)]
+
+        query = memory_tags.filter_by_tag(db.query(Memory), 1, "朋友")
+        assert [m.emotion_type for m in query] == ["happy"]
+        db.close()
+
+
+class TestPagination:
+    """游标分页测试"""
+
+    def test_cursor_pages_cover_all_rows(self, session_factory):
+        """逐页翻完与一次性排序结果一致（含相同时间戳）"""
+        db = session_factory()
+        same = datetime(2024, 1, 1, 12, 0)
+        db.add_all([
+            Memory(user_id=1, emotion_type="calm", content=str(i),
+                   created_at=same if i % 3 == 0 else datetime(2024, 1, 1, i % 24))
+            for i in range(25)
+        ])
+        db.commit()
+
+        query = db.query(Memory).filter(Memory.user_id == 1)
+        expected = [m.id for m in query.order_by(Memory.created_at.desc(), Memory.id.desc())]
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = paginate(query, cursor, 4)
+            seen.extend(m.id for m in page)
+            if cursor is None:
+                break
+        assert seen == expected
+
+        with pytest.raises(InvalidCursorError):
+            paginate(query, "not-a-cursor", 4)
+        db.close()
+
+    def test_search_pages_and_cached_total(self, session_factory):
+        """全文检索翻页，总数缓存随写入失效"""
+        db = session_factory()
+        db.add_all([Memory(user_id=1, emotion_type="happy", content=f"散步第{i}次") for i in range(5)])
+        db.commit()
+
+        first, cursor = memory_search.search_page(db, 1, "散步", limit=3)
+        second, last = memory_search.search_page(db, 1, "散步", limit=3, cursor=cursor)
+        assert last is None
+        assert sorted(r["id"] for r in first + second) == [1, 2, 3, 4, 5]
+
+        count_cache.clear()
+        assert count_cache.get_or_count(db, 1) == 5
+        db.add(Memory(user_id=1, emotion_type="sad", content="x"))
+        db.commit()
+        assert count_cache.get_or_count(db, 1) == 6
+        assert count_cache.get_or_count(db, 1, emotion_type="sad") == 1
+        db.close()
+
+
+class TestMemoryFields:
+    """列表字段投影测试"""
+
+    def test_projection_truncates_in_sql(self, session_factory):
+        """正文在SQL中截断，只返回请求的字段"""
+        db = session_factory()
+        db.add_all([
+            Memory(user_id=1, emotion_type="calm", content="长" * 300, tags=None),
+            Memory(user_id=1, emotion_type="calm", content="短"),
+        ])
+        db.commit()
+
+        fields = parse_fields(None)
+        rows = db.query(*list_columns(fields)).order_by(Memory.id).all()
+        assert rows[0].content == "长" * 100 + "..."
+        assert rows[1].content == "短"
+        assert serialize_row(rows[0], fields)["tags"] == []
+
+        fields = parse_fields("emotion_type, created_at")
+        row = db.query(*list_columns(fields)).first()
+        assert set(serialize_row(row, fields)) == {"emotion_type", "created_at"}
+        assert "content" not in row._fields
+
+        with pytest.raises(InvalidFieldsError):
+            parse_fields("id,password_hash")
+        db.close()
+
+
+class TestMigrations:
+    """版本化迁移测试"""
+
+    def test_upgrades_legacy_database(self, tmp_path):
+        """旧 init_db.py 结构在线升级，数据保留并回填派生表"""
+        path = tmp_path / "legacy.db"
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE users (id TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, email TEXT UNIQUE,
+                created_at TEXT NOT NULL, updated_at TEXT, last_login TEXT, profile_data TEXT, preferences TEXT);
+            CREATE TABLE memories (id TEXT PRIMARY KEY, user_id TEXT NOT NULL, emotion_type TEXT,
+                emotion_intensity REAL, app_used TEXT, duration INTEGER, content TEXT, summary TEXT, tags TEXT,
+                notes TEXT, is_shared INTEGER DEFAULT 0, share_token TEXT UNIQUE, created_at TEXT NOT NULL,
+                updated_at TEXT);
+            CREATE TABLE dapps (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+            INSERT INTO users (id, username, created_at) VALUES ('u-a', 'alice', '2024-01-01T08:00:00.000Z');
+            INSERT INTO memories (id, user_id, emotion_type, emotion_intensity, content, tags, created_at)
+                VALUES ('m-1', 'u-a', 'sad', 0.7, '工作压力很大', '["工作"]', '2024-01-02T09:30:00.250Z');
+            INSERT INTO memories (id, user_id, emotion_type, emotion_intensity, content, tags, created_at)
+                VALUES ('m-2', 'u-a', 'calm', 0.4, '散步', '散步,海边', '2024-01-03T17:30:00+08:00');
+            INSERT INTO dapps (id, name) VALUES (1, '声音疗愈站');
+        """)
+        conn.commit()
+        conn.close()
+
+        engine = create_engine(f"sqlite:///{path}")
+        assert migrate(engine) == SCHEMA_VERSION
+        assert migrate(engine) == 0
+
+        db = sessionmaker(bind=engine)()
+        memory, other = db.query(Memory).order_by(Memory.id).all()
+        assert memory.user.username == "alice"
+        assert memory.user.created_at == datetime(2024, 1, 1, 8, 0)
+        # ...Z 和带偏移的时间统一为不带时区的UTC
+        assert memory.created_at == datetime(2024, 1, 2, 9, 30, 0, 250000)
+        assert other.created_at == datetime(2024, 1, 3, 9, 30)
+        # 非法的JSON标签不中断迁移
+        assert other.tags == []
+        assert [t.tag for t in db.query(MemoryTag)] == ["工作"]
+        assert db.query(EmotionDailyRollup).count() == 2
+        assert [r["id"] for r in memory_search.search(db, memory.user_id, "工作")] == [memory.id]
+        db.close()
+
+        tables = set(inspect(engine).get_table_names())
+        assert {"legacy_users", "legacy_memories", "dapps"} <= tables
+        indexes = {i["name"] for i in inspect(engine).get_indexes("memories")}
+        assert {"ix_memories_user_created_id", "ix_memories_user_emotion_created"} <= indexes
+        assert "ix_memories_user_id" not in indexes
+        with engine.connect() as connection:
+            assert current_version(connection) == SCHEMA_VERSION
+        engine.dispose()
+
+    def test_tag_backfill_skips_invalid_json(self, session_factory):
+        """标签回填时非法JSON按空数组处理，不中断迁移"""
+        db = session_factory()
+        db.add(Memory(user_id=1, memory_type="text", emotion_type="sad", content="a", tags=["工作"]))
+        db.commit()
+        db.connection().exec_driver_sql(
+            "INSERT INTO memories (user_id, memory_type, emotion_type, content, tags) VALUES (1, 'text', 'sad', 'b', '工作,生活')"
+        )
+        assert memory_tags.backfill(db) == 1
+        db.commit()
+        assert [t.tag for t in db.query(MemoryTag)] == ["工作"]
+        db.close()
+
+    def test_history_query_uses_composite_index(self, tmp_path):
+        """历史查询走复合索引，不再需要临时B树排序"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+        migrate(engine)
+        with engine.connect() as connection:
+            plan = " ".join(row[-1] for row in connection.exec_driver_sql(
+                "EXPLAIN QUERY PLAN SELECT id FROM memories WHERE user_id = 1 "
+                "AND emotion_type = 'sad' ORDER BY created_at DESC"
+            ))
+        assert "ix_memories_user_emotion_created" in plan
+        assert "TEMP B-TREE" not in plan
+        engine.dispose()
+
+
+class TestSQLiteEngine:
+    """SQLite连接调优测试"""
+
+    def test_writer_and_read_pool_pragmas(self, tmp_path):
+        """写引擎开启WAL，读连接只读且不阻塞写入"""
+        url = f"sqlite:///{tmp_path / 'tuned.db'}"
+        writer = create_sqlite_engine(url)
+        reader = create_sqlite_engine(url, readonly=True)
+        migrate(writer)
+
+        with writer.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+            assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+
+        with reader.connect() as read_connection:
+            assert read_connection.exec_driver_sql("PRAGMA query_only").scalar() == 1
+            with pytest.raises(Exception):
+                read_connection.exec_driver_sql("DELETE FROM users")
+            read_connection.rollback()
+
+            # 读事务未结束时写入仍可提交
+            read_connection.exec_driver_sql("BEGIN")
+            read_connection.exec_driver_sql("SELECT count(*) FROM users").scalar()
+            with writer.begin() as connection:
+                connection.exec_driver_sql(
+                    "INSERT INTO users (username, password_hash) VALUES ('w', 'x')"
+                )
+            read_connection.exec_driver_sql("COMMIT")
+            assert read_connection.exec_driver_sql("SELECT count(*) FROM users").scalar() == 1
+
+        writer.dispose()
+        reader.dispose()
+
+
+class TestShardRouter:
+    """记忆分片路由测试"""
+
+    def _router(self, tmp_path, shards=3):
+        router = ShardRouter.from_urls(
+            [f"sqlite:///{tmp_path / f'shard_{i}.db'}" for i in range(shards)]
+        )
+        assert router.migrate() == shards * SCHEMA_VERSION
+        return router
+
+    def test_shard_for_is_stable(self):
+        """同一用户总是落在同一分片，单分片时都在0号"""
+        assert shard_for(42, 4) == shard_for(42, 4)
+        assert shard_for(42, 1) == 0
+        assert {shard_for(user_id, 4) for user_id in range(100)} == {0, 1, 2, 3}
+
+    def test_write_behind_and_fan_out(self, tmp_path):
+        """写后提交按用户写入所在分片，跨用户统计合并所有分片"""
+        router = self._router(tmp_path)
+        writer = WriteBehindWriter(router=router)
+        for user_id in range(1, 13):
+            writer.submit(make_record(user_id=user_id, emotion="happy" if user_id % 2 else "sad"))
+        writer.stop()
+
+        counts = router.fan_out(lambda db: db.query(Memory.user_id).all())
+        assert sum(len(rows) for rows in counts) == 12
+        for shard, rows in enumerate(counts):
+            assert all(router.shard_for(user_id) == shard for user_id, in rows)
+
+        db = router.read_session(5)
+        assert db.query(Memory).filter(Memory.user_id == 5).count() == 1
+        db.close()
+
+        totals = global_emotion_totals(router=router)
+        assert totals["happy"][0] == 6
+        assert totals["sad"][0] == 6
+        router.dispose()
+
+    def test_layout_check_refuses_unmoved_memories(self, tmp_path, session_factory):
+        """分片后主库仍有记忆、或分片中有不属于它的用户时拒绝启动"""
+        router = self._router(tmp_path)
+        assert layout_problems(router, session_factory) == []
+        check_layout(router, session_factory)
+
+        db = session_factory()
+        db.add(Memory(user_id=1, memory_type="text", emotion_type="calm", content="分片前写入的记忆"))
+        db.commit()
+        db.close()
+        assert layout_problems(router, session_factory) == ["主库仍有 1 条记忆"]
+        with pytest.raises(ShardLayoutError):
+            check_layout(router, session_factory)
+
+        # 分片数从 2 改为 3 后，原 1 号分片中的用户大多不再属于该分片
+        empty = sessionmaker(bind=create_engine(f"sqlite:///{tmp_path / 'main.db'}"))
+        user_id = next(u for u in range(1, 100) if shard_for(u, 2) == 1 and router.shard_for(u) != 1)
+        db = router.writer_factory(1)()
+        db.add(Memory(user_id=user_id, memory_type="text", emotion_type="calm", content="旧分片中的记忆"))
+        db.commit()
+        db.close()
+        assert layout_problems(router, empty) == ["分片 01 中有 1 个用户的记忆不属于该分片"]
+        router.dispose()
+
+
+
+class TestMemoryArchive:
+    """记忆冷热分层测试"""
+
+    def _seed(self, db, now):
+        for day in range(10):
+            db.add(Memory(
+                user_id=1, memory_type="text", emotion_type="happy" if day % 2 else "sad",
+                emotion_intensity=0.5, content=f"第{day}天的日记，去海边散步" if day == 8 else f"第{day}天的日记",
+                tags=["海边"] if day == 8 else ["日常"], created_at=now - timedelta(days=day)
+            ))
+        db.commit()
+
+    def test_archive_and_fall_through(self, session_factory):
+        """旧记忆移入冷库后汇总不变，列表翻完热数据后继续读冷数据"""
+        now = datetime(2024, 6, 30, 12)
+        db = session_factory()
+        self._seed(db, now)
+        rollup_before = db.query(EmotionDailyRollup.count).all()
+
+        assert memory_archive.archive(db, now - timedelta(days=5)) == 4
+        assert db.query(Memory).count() == 6
+        assert db.query(EmotionDailyRollup.count).all() == rollup_before
+        assert memory_archive.archive(db, now - timedelta(days=5)) == 0
+
+        seen, cursor = [], None
+        while True:
+            after = memory_archive.parse_cold_cursor(cursor)
+            query = db.query(*list_columns(parse_fields(None))).filter(Memory.user_id == 1)
+            rows, cursor = paginate(query, cursor, 3) if after is None else ([], None)
+            rows, cursor = memory_archive.fall_through(db, 1, rows, cursor, 3, after)
+            seen.extend(row.id for row in rows)
+            if cursor is None:
+                break
+        assert seen == list(range(1, 11))
+
+        archived = memory_archive.get_archived(db, 1, 9)
+        assert archived.content == "第8天的日记，去海边散步"
+        assert archived.created_at == now - timedelta(days=8)
+
+        rows, _ = memory_archive.fall_through(
+            db, 1, [], None, 10, predicate=memory_archive.matcher(query="海边")
+        )
+        assert [row.id for row in rows] == [9]
+        db.close()
+
+    def test_offset_paging_crosses_into_cold(self, session_factory):
+        """旧客户端按offset翻页，越过热数据后冷数据从剩余偏移处继续，不重复首页"""
+        now = datetime(2024, 6, 30, 12)
+        db = session_factory()
+        self._seed(db, now)
+        memory_archive.archive(db, now - timedelta(days=5))
+
+        query = db.query(*list_columns(parse_fields(None))).filter(Memory.user_id == 1)
+        seen = []
+        for offset in range(0, 12, 3):
+            rows, cursor = paginate(query, None, 3, offset)
+            rows, _ = memory_archive.fall_through(
+                db, 1, rows, cursor, 3, offset=offset, hot_count=query.count
+            )
+            seen.extend(row.id for row in rows)
+        assert seen == list(range(1, 11))
+        db.close()
+
+    def test_restore_before_delete(self, session_factory):
+        """删除冷记忆时先恢复到热表，汇总和标签随ORM删除同步"""
+        now = datetime(2024, 6, 30, 12)
+        db = session_factory()
+        self._seed(db, now)
+        memory_archive.archive(db, now - timedelta(days=5))
+
+        assert memory_archive.restore(db, 1, 9)
+        assert memory_archive.get_archived(db, 1, 9) is None
+        assert memory_search.search(db, 1, "海边")[0]["id"] == 9
+
+        db.delete(db.get(Memory, 9))
+        db.commit()
+        assert sum(c for c, in db.query(EmotionDailyRollup.count)) == 9
+        assert db.query(MemoryTag).filter(MemoryTag.tag == "海边").count() == 0
+        db.close()
+
+
+class TestContentCompression:
+    """记忆正文压缩存储测试"""
+
+    LONG = "今天和朋友去海边散步，听着海浪的声音，心情慢慢平静下来。" * 20
+
+    def test_transparent_round_trip(self, session_factory):
+        """长正文压缩为BLOB，短正文保持TEXT，读取、预览和检索不受影响"""
+        db = session_factory()
+        db.add_all([
+            Memory(user_id=1, memory_type="diary", emotion_type="calm", content=self.LONG, tags=[]),
+            Memory(user_id=1, memory_type="diary", emotion_type="happy", content="短日记", tags=[])
+        ])
+        db.commit()
+
+        stored = dict(db.connection().exec_driver_sql("SELECT id, typeof(content) FROM memories").all())
+        assert stored == {1: "blob", 2: "text"}
+
+        db.expunge_all()
+        memory = db.get(Memory, 1)
+        assert "content" not in memory.__dict__
+        assert memory.content == self.LONG
+        assert memory.content_head == self.LONG[:CONTENT_HEAD_LENGTH]
+
+        rows = db.query(*list_columns(parse_fields(None))).order_by(Memory.id).all()
+        assert serialize_row(rows[0], parse_fields(None))["content"] == self.LONG[:100] + "..."
+        assert [r["id"] for r in memory_search.search(db, 1, "海浪")] == [1]
+
+        result = compression.report(db.connection())
+        assert result["rows"] == 2 and result["compressed"] == 1
+        assert result["ratio"] > 2
+        db.close()
+
+    def test_update_keeps_head_and_index(self, session_factory):
+        """修改正文时同步明文前缀和全文索引"""
+        db = session_factory()
+        db.add(Memory(user_id=1, memory_type="diary", emotion_type="sad", content=self.LONG, tags=[]))
+        db.commit()
+
+        memory = db.get(Memory, 1)
+        memory.content = "工作压力很大" * 100
+        db.commit()
+
+        db.expunge_all()
+        memory = db.get(Memory, 1)
+        assert memory.content_head.startswith("工作压力很大")
+        assert [r["id"] for r in memory_search.search(db, 1, "压力")] == [1]
+        assert memory_search.search(db, 1, "海浪") == []
+        db.close()
+
+    def test_trained_dictionary(self, session_factory, tmp_path, monkeypatch):
+        """预置字典存入数据库，让短中文正文压缩得更小；库中没有该字典时拒绝解压"""
+        engine = session_factory.kw["bind"]
+        registry = compression.DictionaryRegistry(lambda: [engine], lambda: [engine])
+        monkeypatch.setattr(compression, "dictionaries", registry)
+        samples = [f"第{i}天，今天和朋友去海边散步，听着海浪的声音，心情慢慢平静下来。" for i in range(50)]
+        value = "今天和朋友去海边散步，听着海浪的声音，心情慢慢平静下来。"
+
+        assert compression.compress(value, min_bytes=0) == value
+        dict_id = registry.add(compression.train_dictionary(samples))
+        packed = compression.compress(value, min_bytes=0)
+
+        assert dict_id == 1 and registry.active() == 1
+        assert isinstance(packed, bytes) and len(packed) < len(value.encode("utf-8"))
+        assert compression.decompress(packed) == value
+
+        # 新进程（如换了工作目录或重新部署）从数据库读出同一字典
+        monkeypatch.setattr(compression, "dictionaries", compression.DictionaryRegistry(lambda: [engine]))
+        assert compression.dictionaries.active() == 1
+        assert compression.decompress(packed) == value
+
+        empty = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+        Base.metadata.create_all(bind=empty)
+        monkeypatch.setattr(compression, "dictionaries", compression.DictionaryRegistry(lambda: [empty]))
+        with pytest.raises(LookupError):
+            compression.decompress(packed)
+        empty.dispose()
+
+    def test_dictionary_load_during_flush(self, tmp_path, monkeypatch):
+        """写会话flush中首次读取字典时不占用单连接写引擎（否则等待连接池超时）"""
+        url = f"sqlite:///{tmp_path / 'dict.db'}"
+        writer = create_sqlite_engine(url, pool_timeout=2)
+        migrate(writer)
+        reader = create_sqlite_engine(url, readonly=True, pool_timeout=2)
+        router = ShardRouter([(sessionmaker(bind=writer), sessionmaker(bind=reader))])
+        samples = [f"第{i}天，今天和朋友去海边散步，听着海浪的声音，心情慢慢平静下来。" for i in range(50)]
+        compression.DictionaryRegistry(router.read_engines, router.engines).add(compression.train_dictionary(samples))
+        monkeypatch.setattr(compression, "dictionaries", compression.DictionaryRegistry(router.read_engines, router.engines))
+
+        content = "今天和朋友去海边散步，听着海浪的声音，心情慢慢平静下来。" * 20
+        db = router.session(1)
+        db.add(User(id=1, username="testuser", password_hash="x"))
+        db.add(Memory(id=1, user_id=1, emotion_type="calm", emotion_intensity=0.5, content=content))
+        db.commit()
+        db.expunge_all()
+        assert db.get(Memory, 1).content == content
+        assert compression.dictionaries.active() == 1
+        db.close()
+        router.dispose()
+
+    def test_migration_imports_legacy_dictionaries(self, tmp_path, monkeypatch):
+        """迁移把旧字典目录中的字典导入数据库"""
+        legacy = tmp_path / "content_dicts"
+        legacy.mkdir()
+        (legacy / "1.zdict").write_bytes("海边散步".encode("utf-8"))
+        monkeypatch.setattr(compression, "LEGACY_DICT_DIR", str(legacy))
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        migrate(engine)
+        registry = compression.DictionaryRegistry(lambda: [engine])
+        assert registry.active() == 1
+        assert registry.get(1) == "海边散步".encode("utf-8")
+        engine.dispose()
+
+
+class TestContentCache:
+    """内容缓存管理测试"""
+
+    def _keys(self, factory):
+        db = factory()
+        keys = sorted(key for key, in db.query(ContentCache.cache_key))
+        db.close()
+        return keys
+
+    def test_lru_budget_and_batched_hits(self, session_factory):
+        """超出类型预算时淘汰最久未访问的条目，命中计数批量写回"""
+        cache = ContentCacheManager(session_factory, budgets={"text": 300}, policy="lru")
+        start = datetime(2024, 6, 1)
+        for i in range(3):
+            cache.put(f"k{i}", "text", "x" * 100, now=start + timedelta(minutes=i))
+
+        assert cache.get("k0", now=start + timedelta(minutes=5)) == "x" * 100
+        assert cache.get("k0", now=start + timedelta(minutes=6)) == "x" * 100
+        db = session_factory()
+        assert db.query(ContentCache.hit_count).filter(ContentCache.cache_key == "k0").scalar() == 0
+        db.close()
+
+        cache.put("k3", "text", "x" * 100, now=start + timedelta(minutes=10))
+        assert self._keys(session_factory) == ["k0", "k2", "k3"]
+        assert cache.stats["evicted"] == 1
+
+        db = session_factory()
+        row = db.query(ContentCache).filter(ContentCache.cache_key == "k0").one()
+        assert row.hit_count == 2 and row.last_accessed_at == start + timedelta(minutes=6)
+        db.close()
+        assert cache.usage()["text"]["bytes"] == 300
+
+    def test_lfu_and_overwrite(self, session_factory):
+        """LFU 淘汰命中最少的条目；覆盖同一键时用量不重复累计"""
+        cache = ContentCacheManager(session_factory, budgets={"audio": 250}, policy="lfu")
+        now = datetime(2024, 6, 1)
+        cache.put("a", "audio", "x" * 100, now=now)
+        cache.put("b", "audio", "x" * 100, now=now + timedelta(minutes=1))
+        cache.put("a", "audio", "y" * 100, now=now + timedelta(minutes=2))
+        assert cache.usage()["audio"]["bytes"] == 200
+
+        cache.get("a", now=now + timedelta(minutes=3))
+        cache.put("c", "audio", "x" * 100, now=now + timedelta(minutes=4))
+        assert self._keys(session_factory) == ["a", "c"]
+
+    def test_sweep_expired_in_batches(self, session_factory):
+        """过期行分小批删除，未过期和不过期的行保留"""
+        cache = ContentCacheManager(session_factory, budgets={}, sweep_batch=3, sweep_pause_ms=0)
+        now = datetime(2024, 6, 1)
+        for i in range(7):
+            cache.put(f"old{i}", "image", "x", ttl=60, now=now)
+        cache.put("fresh", "image", "x", ttl=3600, now=now)
+        cache.put("forever", "image", "x", ttl=0, now=now)
+
+        later = now + timedelta(minutes=5)
+        assert cache.get("old0", now=later) is None
+        assert cache.sweep(now=later, max_batches=2) == 6
+        assert cache.sweep(now=later) == 1
+        assert self._keys(session_factory) == ["forever", "fresh"]
+
+
+class TestAPIUsage:
+    """API调用计量测试"""
+
+    def test_batched_flush_and_hourly_rollup(self, session_factory):
+        """记录只进缓冲区，flush 时写入明细并累加小时汇总"""
+        recorder = api_usage.UsageRecorder(session_factory, max_batch=2)
+        hour = datetime(2024, 6, 1, 10)
+        recorder.record("openai_chat", "healing_generator.chat", "gpt-4-turbo-preview",
+                        prompt_tokens=1000, completion_tokens=500, latency_ms=800, timestamp=hour)
+        recorder.record("openai_chat", "healing_generator.chat", "gpt-4-turbo-preview",
+                        status="http_429", latency_ms=50, timestamp=hour + timedelta(minutes=30))
+        recorder.record("openai_whisper", "emotion_analyzer._analyze_audio", "whisper-1",
+                        audio_seconds=90, latency_ms=1200, timestamp=hour + timedelta(hours=1))
+
+        db = session_factory()
+        assert db.query(APIUsageLog).count() == 0
+        assert recorder.flush() == 3
+        assert recorder.snapshot()["batches"] == 2
+        assert db.query(APIUsageLog).count() == 3
+
+        chat = db.query(APIUsageHourly).filter(APIUsageHourly.api_name == "openai_chat").one()
+        assert (chat.hour, chat.calls, chat.errors) == (hour, 2, 1)
+        assert chat.cost_usd == pytest.approx(0.025)
+        assert (chat.latency_ms_sum, chat.latency_ms_max) == (850, 800)
+
+        recorder.record("openai_chat", "healing_generator.chat", "gpt-4-turbo-preview",
+                        latency_ms=900, timestamp=hour + timedelta(minutes=45))
+        recorder.flush()
+        db.expire_all()
+        assert db.get(APIUsageHourly, (hour, "openai_chat", "healing_generator.chat", "gpt-4-turbo-preview")).latency_ms_max == 900
+
+        groups = api_usage.query_usage(db, hour, hour + timedelta(hours=2), ["api"])
+        assert [(g["api"], g["calls"]) for g in groups] == [("openai_chat", 3), ("openai_whisper", 1)]
+        assert groups[1]["cost_usd"] == pytest.approx(0.009)
+        assert groups[0]["error_rate"] == pytest.approx(1 / 3, abs=1e-4)
+        db.close()
+
+    def test_buffer_bounded(self, session_factory):
+        """缓冲区满时丢弃最旧的记录"""
+        recorder = api_usage.UsageRecorder(session_factory, buffer_size=3)
+        for i in range(5):
+            recorder.record("openai_tts", f"site{i}", "tts-1", input_chars=1000)
+        assert recorder.pending == 3 and recorder.snapshot()["dropped"] == 2
+
+        recorder.flush()
+        db = session_factory()
+        assert sorted(e for e, in db.query(APIUsageLog.endpoint)) == ["site2", "site3", "site4"]
+        db.close()
+
+    def test_counts_consistent_under_concurrent_flush(self, session_factory):
+        """多个线程记录、后台线程同时写入时计数不丢失"""
+        import threading
+
+        recorder = api_usage.UsageRecorder(session_factory, flush_interval=0.001, max_batch=50)
+        recorder.start()
+        threads = [
+            threading.Thread(target=lambda: [recorder.record("openai_chat", "site", "gpt-4") for _ in range(100)])
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        recorder.stop()
+
+        stats = recorder.snapshot()
+        assert stats["recorded"] == stats["written"] == 800 and stats["failed"] == 0
+        db = session_factory()
+        assert db.query(APIUsageLog).count() == 800
+        db.close()
+
+    def test_wrapper_records_call_site(self, session_factory, monkeypatch):
+        """包装函数按调用位置记录 token 和状态，异常照常抛出"""
+        import asyncio
+        from types import SimpleNamespace
+
+        recorder = api_usage.UsageRecorder(session_factory)
+        monkeypatch.setattr(api_usage, "recorder", recorder)
+
+        async def fake_create(**kwargs):
+            if kwargs["model"] == "broken":
+                raise RuntimeError("timeout")
+            return {"usage": {"prompt_tokens": 12, "completion_tokens": 30}}
+        monkeypatch.setattr(api_usage.openai, "ChatCompletion", SimpleNamespace(acreate=fake_create))
+
+        async def compose():
+            await api_usage.chat_completion(model="gpt-4", messages=[])
+            with pytest.raises(RuntimeError):
+                await api_usage.chat_completion(model="broken", messages=[])
+
+        asyncio.run(compose())
+        recorder.flush()
+        db = session_factory()
+        rows = db.query(APIUsageLog).order_by(APIUsageLog.id).all()
+        assert [(r.endpoint, r.status, r.tokens_used) for r in rows] == [
+            ("test_database.compose", "ok", 42),
+            ("test_database.compose", "error", 0)
+        ]
+        db.close()
+
+
+class TestBulkDelete:
+    """账号/会话批量删除测试"""
+
+    def _seed(self, db, now):
+        db.add(User(id=2, username="other", password_hash="x"))
+        db.add_all([SessionModel(id=1, user_id=1), SessionModel(id=2, user_id=1), SessionModel(id=3, user_id=2)])
+        for i in range(12):
+            db.add(Memory(
+                user_id=1, session_id=1 if i < 8 else 2, memory_type="text",
+                emotion_type="happy" if i % 2 else "sad", emotion_intensity=0.5,
+                content=f"第{i}天去海边散步", tags=["海边"], created_at=now - timedelta(days=i)
+            ))
+        db.add(Memory(user_id=2, session_id=3, memory_type="text", emotion_type="happy",
+                      content="我也去海边散步了", tags=["海边"], created_at=now))
+        db.add_all([
+            EmotionEvent(user_id=1, session_id=1, ts=now, emotion=1, intensity=0.5, source=1),
+            EmotionEvent(user_id=1, session_id=2, ts=now, emotion=1, intensity=0.5, source=1),
+            APIUsageLog(user_id=1, api_name="openai_chat", endpoint="test", status="ok")
+        ])
+        db.commit()
+
+    def deleter(self, session_factory):
+        router = ShardRouter([(session_factory, session_factory)])
+        return BulkDeleter(router, session_factory, ChunkedDeleter(chunk_size=5, pause_ms=0))
+
+    def test_purge_user_in_chunks(self, session_factory):
+        """删除账号清空记忆、派生表、事件、会话和冷库，其他用户不受影响"""
+        now = datetime(2024, 6, 30, 12)
+        db = session_factory()
+        self._seed(db, now)
+        memory_archive.archive(db, now - timedelta(days=9))
+        db.close()
+
+        deleter = self.deleter(session_factory)
+        job = deleter.submit_user(1)
+        deleter.wait()
+        deleter.stop()
+
+        assert job.status == "done", job.error
+        assert job.deleted["memories"] == 10
+        assert job.deleted["archived_memories"] == 2
+        assert job.deleted["users"] == 1
+        db = session_factory()
+        for model in (Memory, MemoryTag, EmotionDailyRollup, EmotionEvent, SessionModel):
+            assert db.query(model).filter(model.user_id == 1).count() == 0
+        assert db.get(User, 1) is None
+        assert db.query(APIUsageLog).one().user_id is None
+        assert memory_search.search(db, 1, "海边") == []
+        assert [r["id"] for r in memory_search.search(db, 2, "海边")] == [13]
+        assert memory_archive.cold_store(db.get_bind()).scan(1, None, 10) == []
+        db.close()
+
+    def test_purge_session_keeps_rollup_consistent(self, session_factory):
+        """删除会话只影响该会话的记忆和事件，汇总表与全量重建一致"""
+        now = datetime(2024, 6, 30, 12)
+        db = session_factory()
+        self._seed(db, now)
+        db.close()
+
+        job = DeletionJob(1, session_id=1)
+        self.deleter(session_factory).run(job)
+        assert job.status == "done", job.error
+        assert job.deleted["memories"] == 8
+        assert job.deleted["sessions"] == 1
+
+        db = session_factory()
+        assert db.query(Memory).filter(Memory.user_id == 1).count() == 4
+        assert db.query(EmotionEvent).filter(
+            EmotionEvent.user_id == 1, EmotionEvent.session_id == 1
+        ).count() == 0
+        assert db.query(EmotionEvent).filter(EmotionEvent.user_id == 1, EmotionEvent.session_id == 2).count() == 5
+        rollup = {(r.day, r.emotion_type): r.count for r in db.query(EmotionDailyRollup).filter_by(user_id=1)}
+        backfill(db, 1)
+        db.commit()
+        assert rollup == {(r.day, r.emotion_type): r.count for r in db.query(EmotionDailyRollup).filter_by(user_id=1)}
+        assert db.get(User, 1) is not None
+        db.close()
+
+
+class TestResponseCache:
+    """按用户版本号的响应缓存测试"""
+
+    def request(self, etag=None):
+        headers = [(b"if-none-match", etag.encode())] if etag else []
+        return Request({"type": "http", "method": "GET", "headers": headers})
+
+    def test_etag_and_not_modified(self):
+        """未命中时计算并返回 ETag，带匹配的 If-None-Match 再请求返回 304"""
+        cache = ResponseCache()
+        key = cache.key("timeline", 1, days=30)
+        assert cache.lookup(self.request(), key) is None
+
+        response = cache.respond(self.request(), key, {"user_id": 1, "timeline": {"2024-06-01": 2}})
+        etag = response.headers["etag"]
+        assert response.status_code == 200 and response.headers["x-cache"] == "MISS"
+
+        assert cache.lookup(self.request(etag), key).status_code == 304
+        assert cache.lookup(self.request(f'W/{etag}, "other"'), key).status_code == 304
+        assert cache.lookup(self.request('"other"'), key).body == response.body
+        assert cache.stats()["hits"] == 3 and cache.stats()["not_modified"] == 2
+
+    def test_bounded_by_bytes(self):
+        """超出字节上限时淘汰最久未用的条目；版本号已变化的结果不保存"""
+        cache = ResponseCache(max_bytes=3 * (1000 + 300))
+        keys = [cache.key("tags", user_id) for user_id in range(1, 5)]
+        for key in keys[:3]:
+            cache.put(key, b"x" * 1000)
+        assert cache.get(keys[0]) is not None
+        cache.put(keys[3], b"x" * 1000)
+
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) is not None
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] <= cache.max_bytes
+
+        stale = cache.key("tags", 9)
+        cache.bump([9])
+        cache.put(stale, b"{}")
+        assert cache.get(stale) is None and cache.get(cache.key("tags", 9)) is None
+
+    def test_orm_commit_bumps_version(self, session_factory):
+        """提交记忆或读数变更后递增用户版本号并丢弃旧条目，回滚不影响"""
+        key = response_cache.key("tags", 1)
+        response_cache.put(key, b"{}")
+        version = response_cache.version(1)
+
+        db = session_factory()
+        db.add(Memory(user_id=1, memory_type="text", emotion_type="happy", content="a", tags=[]))
+        db.flush()
+        assert response_cache.version(1) == version
+        db.rollback()
+        assert response_cache.version(1) == version
+
+        db.add(EmotionEvent(user_id=1, ts=datetime(2024, 6, 1), emotion=1, intensity=0.5, source=1))
+        db.commit()
+        assert response_cache.version(1) == version + 1
+        assert response_cache.get(key) is None
+        db.close()
+
+
+class TestSketches:
+    """流式统计摘要测试"""
+
+    def test_tdigest_quantiles_and_merge(self):
+        """分位数误差有界，分开构建再合并与整体构建结果一致，序列化后不变"""
+        import random
+        rng = random.Random(3)
+        values = [rng.betavariate(2, 5) for _ in range(20000)]
+        left, right = sketches.TDigest(), sketches.TDigest()
+        for i, value in enumerate(values):
+            (left if i % 2 else right).add(value)
+        left.merge(right)
+        restored = sketches.TDigest.from_bytes(left.to_bytes())
+
+        ordered = sorted(values)
+        for q in (0.5, 0.9, 0.99):
+            exact = ordered[int(q * len(ordered))]
+            assert abs(restored.quantile(q) - exact) < 0.01
+        assert restored.count == len(values)
+        assert len(restored.means) <= 2 * restored.compression
+
+    def test_count_min_top_k_and_hll(self):
+        """count-min 只高估且 top-k 找到高频标签；HLL 合并后去重计数"""
+        cms, other = sketches.CountMinTopK(k=5), sketches.CountMinTopK(k=5)
+        for i in range(200):
+            cms.add(f"tag{i}")
+        for tag, count in [("工作", 50), ("朋友", 30), ("失眠", 20)]:
+            other.add(tag, count)
+        cms.merge(sketches.CountMinTopK.from_bytes(other.to_bytes()))
+        assert [tag for tag, _ in cms.top_k(3)] == ["工作", "朋友", "失眠"]
+        assert cms.estimate("工作") >= 50 and cms.total == 300
+
+        day1, day2 = sketches.HyperLogLog(), sketches.HyperLogLog()
+        for user_id in range(5000):
+            day1.add(str(user_id))
+        for user_id in range(2500, 7500):
+            day2.add(str(user_id))
+        day1.merge(sketches.HyperLogLog.from_bytes(day2.to_bytes()))
+        assert abs(day1.count() - 7500) / 7500 < 0.05
+        assert sketches.HyperLogLog().count() == 0
+
+    def test_updates_recorded_after_commit(self, session_factory):
+        """提交后的记忆和读数在 flush 后合并进摘要表，回滚的不计入"""
+        recorder = sketches.SketchRecorder()
+        original, sketches.sketch_recorder = sketches.sketch_recorder, recorder
+        try:
+            db = session_factory()
+            db.add(EmotionEvent(user_id=1, ts=datetime(2024, 6, 1), emotion=EMOTION_CODES["sad"], intensity=0.9, source=1))
+            db.flush()
+            db.rollback()
+
+            # 直接创建的记忆经由其 source=memory 事件计入强度分位数
+            for i in range(100):
+                db.add(Memory(user_id=1, memory_type="text", emotion_type="happy", emotion_intensity=i / 100,
+                              content="a", tags=["工作"], created_at=datetime(2024, 6, 1)))
+            db.add(EmotionEvent(user_id=1, ts=datetime(2024, 6, 2), emotion=EMOTION_CODES["calm"], intensity=0.4, source=1))
+            db.commit()
+            assert recorder.pending > 0
+            assert recorder.flush() > 0 and recorder.pending == 0
+
+            percentiles = sketches.user_percentiles(db, 1)
+            assert set(percentiles) == {"happy", "calm", "all"}
+            assert percentiles["happy"]["count"] == 100
+            assert abs(percentiles["happy"]["p50"] - 0.5) < 0.03
+
+            router = ShardRouter([(session_factory, session_factory)])
+            assert sketches.global_top_tags(5, router)["tags"] == [{"tag": "工作", "count": 100}]
+            active = sketches.global_active_users(date(2024, 6, 1), date(2024, 6, 3), router)
+            assert [day["active_users"] for day in active["daily"]] == [1, 1, 0]
+            assert active["distinct_users"] == 1
+
+            # 重建结果与增量维护一致
+            assert sketches.rebuild(db) > 0
+            db.commit()
+            assert sketches.user_percentiles(db, 1)["happy"]["count"] == 100
+            db.close()
+        finally:
+            sketches.sketch_recorder = original
+
+
+class TestParquetExport:
+    """Parquet 增量导出测试（需要 pyarrow）"""
+
+    def test_incremental_export(self, session_factory, tmp_path):
+        """按日期分区导出，第二次只导出水位线之后的新行，快照表按时间水位线导出"""
+        pq = pytest.importorskip("pyarrow.parquet")
+        router = ShardRouter([(session_factory, session_factory)])
+        out = str(tmp_path / "analytics")
+
+        db = session_factory()
+        for day in (1, 2):
+            db.add(Memory(user_id=1, memory_type="text", emotion_type="happy", content="正文", tags=["工作"],
+                          created_at=datetime(2024, 6, day)))
+        db.add(DAppHistory(user_id=1, dapp_name="HealingStation", last_accessed=datetime(2024, 6, 1)))
+        db.commit()
+
+        counts = parquet_export.run_export(out, router=router, main_factory=session_factory, chunk_size=1)
+        assert counts == {"memories": 2, "sessions": 0, "dapp_history": 1, "api_usage_log": 0}
+        first = pq.read_table(os.path.join(out, "memories", "date=2024-06-01"))
+        assert first.column("tags").to_pylist() == [["工作"]]
+        assert "content" not in first.column_names
+
+        db.add(Memory(user_id=1, memory_type="text", emotion_type="sad", content="x", created_at=datetime(2024, 6, 2)))
+        history = db.query(DAppHistory).one()
+        history.open_count, history.last_accessed = 2, datetime(2024, 6, 3)
+        db.commit()
+        db.close()
+
+        counts = parquet_export.run_export(out, router=router, main_factory=session_factory)
+        assert counts["memories"] == 1 and counts["dapp_history"] == 1
+        assert pq.read_table(os.path.join(out, "memories")).num_rows == 3
+        assert pq.read_table(os.path.join(out, "dapp_history", "date=2024-06-03")).column("open_count").to_pylist() == [2]
+        assert parquet_export.load_watermarks(out)["dapp_history"]["ts"].startswith("2024-06-03")
+        assert not [name for _, _, files in os.walk(out) for name in files if name.endswith(".tmp")]
+
+
+class TestMemoryTransfer:
+    """记忆 NDJSON 导出/导入测试"""
+
+    def test_export_import_round_trip(self, session_factory):
+        """gzip 导出后导入给另一用户：记忆、读数、标签和汇总一致，坏行跳过"""
+        router = ShardRouter([(session_factory, session_factory)])
+        db = session_factory()
+        db.add(User(id=2, username="other", password_hash="x"))
+        contents = ["今天加班到很晚", "周末和朋友去爬山", "晚上一起吃火锅", "终于读完了那本小说", "梦见小时候的家"]
+        for i in range(5):
+            db.add(Memory(user_id=1, memory_type="text", emotion_type="happy" if i % 2 else "sad",
+                          emotion_intensity=0.1 * i, content=contents[i], tags=["工作", f"t{i}"],
+                          created_at=datetime(2024, 6, 1 + i)))
+        db.commit()
+
+        payload = b"".join(memory_transfer.ndjson_chunks(memory_transfer.iter_export(1, router, chunk_size=2), compress=True))
+        lines = list(memory_transfer.LineSplitter().feed(payload))
+        assert len(lines) == 5
+        exported = [json.loads(line) for line in lines]
+        assert [record["created_at"][:10] for record in exported] == [f"2024-06-0{day}" for day in range(5, 0, -1)]
+
+        recorder = sketches.SketchRecorder()
+        original, sketches.sketch_recorder = sketches.sketch_recorder, recorder
+        try:
+            importer = memory_transfer.MemoryImporter(2, router, chunk_size=2)
+            splitter = memory_transfer.LineSplitter()
+            for line in list(splitter.feed(payload[:10])) + list(splitter.feed(payload[10:])) + [b"{bad", b'{"tags": []}']:
+                if importer.add(line):
+                    importer.flush()
+            list(splitter.close())
+            importer.flush()
+        finally:
+            sketches.sketch_recorder = original
+
+        result = importer.result()
+        assert result["imported"] == 5 and result["skipped"] == 2 and result["duplicates"] == 0
+        assert [error["line"] for error in result["errors"]] == [6, 7]
+        assert recorder.pending == 5 * (3 + 2)  # 活跃 + 两个标签，读数强度 + 活跃
+
+        copied = db.query(Memory).filter(Memory.user_id == 2).order_by(Memory.created_at).all()
+        assert [m.content for m in copied] == contents
+        assert db.query(EmotionEvent).filter(EmotionEvent.user_id == 2).count() == 5
+        assert db.query(MemoryTag).filter(MemoryTag.user_id == 2, MemoryTag.tag == "工作").count() == 5
+        rollup = lambda user_id: sorted(
+            (r.day, r.emotion_type, r.count, round(r.sum_intensity, 6))
+            for r in db.query(EmotionDailyRollup).filter(EmotionDailyRollup.user_id == user_id)
+        )
+        assert rollup(2) == rollup(1)
+        db.close()
+
+    def test_line_splitter_limits(self):
+        """超长行和截断的 gzip 数据报错"""
+        splitter = memory_transfer.LineSplitter(max_line_bytes=10)
+        assert list(splitter.feed(b"abc\nde")) == [b"abc"]
+        with pytest.raises(memory_transfer.InvalidImportError):
+            list(splitter.feed(b"x" * 20))
+
+        payload = b"".join(memory_transfer.ndjson_chunks([{"content": "a"}], compress=True))
+        splitter = memory_transfer.LineSplitter()
+        list(splitter.feed(payload[:-4]))
+        with pytest.raises(memory_transfer.InvalidImportError):
+            list(splitter.close())
+
+
+class TestMemoryDedup:
+    """记忆近似重复检测测试（MinHash / LSH）"""
+
+    TEXT = "今天下午在公司开了很长的会，晚上回家路上下起了大雨，心情有点低落"
+
+    def test_similarity(self):
+        """近似文本相似度高，无关文本低，签名长度固定"""
+        sig = memory_dedup.signature(self.TEXT)
+        assert sig.dtype == "<u4" and sig.size == memory_dedup.MINHASH_PERMUTATIONS
+        assert memory_dedup.similarity(sig, memory_dedup.signature(self.TEXT + "。")) == 1.0
+        assert memory_dedup.similarity(sig, memory_dedup.signature("周末和朋友去海边看日出，特别开心")) < 0.3
+        assert memory_dedup.signature("，。！") is None
+
+    def test_hook_indexes_and_finds_duplicates(self, session_factory):
+        """ORM 写入维护签名和桶，修改正文后重算，删除后清除"""
+        db = session_factory()
+        memory = Memory(user_id=1, memory_type="text", emotion_type="sad", emotion_intensity=0.5, content=self.TEXT)
+        other = Memory(user_id=1, memory_type="text", emotion_type="happy", emotion_intensity=0.5, content="周末去海边")
+        db.add_all([memory, other])
+        db.commit()
+        assert db.query(MemorySignature).count() == 2
+        assert db.query(MemoryLSHBand).count() == 2 * memory_dedup.LSH_BANDS
+
+        match = memory_dedup.find_duplicate(db.connection(), 1, self.TEXT + "！")
+        assert match[0] == memory.id and match[1] >= memory_dedup.MEMORY_DEDUP_THRESHOLD
+        assert memory_dedup.find_duplicate(db.connection(), 2, self.TEXT) is None
+
+        memory.content = "完全不同的一段内容，和朋友吃了顿火锅"
+        db.commit()
+        assert memory_dedup.find_duplicate(db.connection(), 1, self.TEXT) is None
+
+        db.delete(other)
+        db.commit()
+        assert db.query(MemorySignature).count() == 1
+        assert db.query(MemoryLSHBand).filter(MemoryLSHBand.memory_id == other.id).count() == 0
+
+        # 回填结果与钩子维护的一致
+        bands = sorted((b.band, b.bucket) for b in db.query(MemoryLSHBand))
+        assert memory_dedup.backfill(db) == 1
+        db.commit()
+        assert sorted((b.band, b.bucket) for b in db.query(MemoryLSHBand)) == bands
+        db.close()
+
+    def test_import_skips_duplicates_in_merge_mode(self, session_factory, monkeypatch):
+        """合并模式下导入跳过与库中重复的记忆"""
+        monkeypatch.setattr(memory_dedup, "MEMORY_DEDUP_MODE", "merge")
+        db = session_factory()
+        db.add(Memory(user_id=1, memory_type="text", emotion_type="sad", emotion_intensity=0.5, content=self.TEXT))
+        db.commit()
+
+        importer = memory_transfer.MemoryImporter(1, ShardRouter([(session_factory, session_factory)]))
+        for content in [self.TEXT, "一段新的日记内容，记录了今天的晚饭"]:
+            importer.add(json.dumps({"content": content, "emotion_type": "calm", "emotion_intensity": 0.3}).encode())
+        importer.flush()
+        assert importer.result()["imported"] == 1 and importer.result()["duplicates"] == 1
+        assert db.query(Memory).count() == db.query(MemorySignature).count() == 2
+        db.close()
+
+    def test_create_reports_duplicate_by_default(self, session_factory, monkeypatch):
+        """检测模式（默认）下重复内容照常保存，只在响应中标出 duplicate_of"""
+        import asyncio
+        from app.api.endpoints import memory as memory_endpoint
+
+        monkeypatch.setattr(memory_dedup, "MEMORY_DEDUP_MODE", "detect")
+        monkeypatch.setattr(memory_endpoint, "shard_router", ShardRouter([(session_factory, session_factory)]))
+        db = session_factory()
+        request = memory_endpoint.MemoryCreateRequest(
+            user_id=1, memory_type="text", emotion_type="sad", emotion_intensity=0.5, content=self.TEXT
+        )
+        first = asyncio.run(memory_endpoint.create_memory(request, db=db))
+        second = asyncio.run(memory_endpoint.create_memory(request, db=db))
+        assert first.duplicate_of is None and second.duplicate_of == first.id
+        assert sorted(m.id for m in db.query(Memory)) == [first.id, second.id]
+        db.close()
+
+    def test_create_inserts_when_duplicate_vanished(self, session_factory, monkeypatch):
+        """合并模式下命中的记忆已被删除时，按新记忆写入而不是报错"""
+        import asyncio
+        from app.api.endpoints import memory as memory_endpoint
+
+        monkeypatch.setattr(memory_endpoint, "shard_router", ShardRouter([(session_factory, session_factory)]))
+        monkeypatch.setattr(memory_dedup, "MEMORY_DEDUP_MODE", "merge")
+        monkeypatch.setattr(memory_dedup, "find_duplicate", lambda connection, user_id, content: (999, 0.95))
+
+        db = session_factory()
+        request = memory_endpoint.MemoryCreateRequest(
+            user_id=1, memory_type="text", emotion_type="sad", emotion_intensity=0.5, content=self.TEXT
+        )
+        response = asyncio.run(memory_endpoint.create_memory(request, db=db))
+        assert response.duplicate_of is None
+        assert [m.id for m in db.query(Memory)] == [response.id]
+        db.close()
+
+
+class TestMemoryVectors:
+    """记忆向量检索测试（本地特征哈希向量）"""
+
+    @pytest.fixture
+    def indexer(self, monkeypatch):
+        monkeypatch.setattr(memory_vectors, "embedder", memory_vectors.HashingEmbedder(64))
+        indexer = memory_vectors.EmbeddingIndexer()
+        monkeypatch.setattr(memory_vectors, "embedding_indexer", indexer)
+        return indexer
+
+    def test_write_time_embedding_and_filtered_search(self, session_factory, indexer):
+        """提交后计算向量，检索可与情绪、时间、标签过滤组合；改正文追加新向量，删除后不再返回"""
+        db = session_factory()
+        rows = [
+            ("今天又加班到很晚，工作压力好大", "sad", ["工作"], datetime(2024, 6, 1)),
+            ("周末和朋友去爬山看日出", "happy", ["朋友"], datetime(2024, 6, 2)),
+            ("项目上线了，加班总算有了结果", "happy", ["工作"], datetime(2024, 6, 3)),
+            ("一个人在家看电影", "calm", [], datetime(2024, 6, 4)),
+        ]
+        memories = [
+            Memory(user_id=1, memory_type="text", emotion_type=emotion, emotion_intensity=0.5,
+                   content=content, tags=tags, created_at=created_at)
+            for content, emotion, tags, created_at in rows
+        ]
+        db.add_all(memories)
+        db.commit()
+        assert indexer.pending == 4 and indexer.flush() == 4
+
+        query = memory_vectors.embedder.embed(["加班 工作"])[0]
+        ids = lambda matches: [memory.id for memory, _ in matches]  # noqa: E731
+        assert ids(memory_vectors.similar_memories(db, 1, query, 2)) in (
+            [memories[0].id, memories[2].id], [memories[2].id, memories[0].id]
+        )
+        assert ids(memory_vectors.similar_memories(db, 1, query, 2, emotion="happy"))[0] == memories[2].id
+        assert ids(memory_vectors.similar_memories(db, 1, query, 5, end=datetime(2024, 6, 2))) == [memories[0].id]
+        assert set(ids(memory_vectors.similar_memories(db, 1, query, 5, tags=["朋友"]))) == {memories[1].id}
+        assert memory_vectors.similar_memories(db, 2, query, 5) == []
+
+        memories[0].content = "和家人一起吃晚饭"
+        db.commit()
+        indexer.flush()
+        store = memory_vectors.vector_store(db.get_bind())
+        assert len(store.load(1)) == 4 and store.load(1).count == 5
+        assert ids(memory_vectors.similar_memories(db, 1, query, 1)) == [memories[2].id]
+
+        db.delete(memories[2])
+        db.commit()
+        assert memories[2].id not in ids(memory_vectors.similar_memories(db, 1, query, 5))
+        assert memory_vectors.compact(db) == 2  # 被覆盖的旧向量和已删除记忆的向量
+        assert store.load(1).count == 3
+        db.close()
+
+    def test_backfill_and_cache(self, session_factory, indexer):
+        """补算只计算缺失的向量；追加后复用已解码矩阵，超出缓存上限时淘汰"""
+        db = session_factory()
+        db.add_all([
+            Memory(user_id=1, memory_type="text", emotion_type="calm", emotion_intensity=0.5, content=f"第{i}篇日记")
+            for i in range(3)
+        ])
+        db.commit()
+        indexer._buffer.clear()
+        assert memory_vectors.backfill(db) == 3
+        assert memory_vectors.backfill(db) == 0
+
+        store = memory_vectors.vector_store(db.get_bind())
+        vectors = store.load(1)
+        query = memory_vectors.embedder.embed(["第1篇日记"])[0]
+        assert vectors.search(query, 1)[0][1] > 0.99
+        store.append(1, [99], memory_vectors.embedder.embed(["新的一篇"]))
+        reloaded = store.load(1)
+        assert reloaded is not vectors and reloaded._matrix is not None and len(reloaded._matrix) == 4
+
+        store.append(2, [100], memory_vectors.embedder.embed(["另一个用户"]))
+        store.load(2).search(query, 1)
+        store.cache_bytes = 0
+        store.trim()
+        assert list(store._cache) == [2]
+        db.close()
+
+    def test_openai_embedder_uses_v1_client(self, session_factory, monkeypatch):
+        """OpenAI向量经v1客户端计算（dimensions 经 extra_body 传递），按 index 排序并归一化"""
+        from types import SimpleNamespace
+
+        calls = []
+
+        class FakeClient:
+            def __init__(self):
+                self.embeddings = SimpleNamespace(create=self.create)
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def create(self, **kwargs):
+                calls.append(kwargs)
+                return SimpleNamespace(
+                    data=[SimpleNamespace(index=1, embedding=[0.0, 2.0]), SimpleNamespace(index=0, embedding=[3.0, 0.0])],
+                    usage=SimpleNamespace(prompt_tokens=7)
+                )
+
+        monkeypatch.setattr(api_usage.openai, "AsyncOpenAI", FakeClient)
+        recorder = api_usage.UsageRecorder(session_factory)
+        monkeypatch.setattr(api_usage, "recorder", recorder)
+
+        vectors = memory_vectors.OpenAIEmbedder("text-embedding-3-small", 2).embed(["海边", "工作"])
+        assert vectors.tolist() == [[1.0, 0.0], [0.0, 1.0]]
+        assert calls[0]["extra_body"] == {"dimensions": 2} and "dimensions" not in calls[0]
+
+        recorder.flush()
+        db = session_factory()
+        row = db.query(APIUsageLog).one()
+        assert (row.api_name, row.tokens_used) == ("openai_embedding", 7)
+        db.close()
+
+
+class TestEmotionHistoryEndpoint:
+    """/emotion/analyze 写入的读数出现在 /emotion/history 和 /emotion/statistics 中"""
+
+    def test_analyzed_reading_appears_in_history(self, session_factory, monkeypatch):
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+        from app.api.endpoints import emotion
+        from app.models.sharding import get_user_read_db
+
+        async def analyze(**kwargs):
+            return {
+                "emotion": "sad", "intensity": 0.7, "valence": 0.2, "arousal": 0.4, "confidence": 0.9,
+                "color": "#4A90E2", "emoji": "😢", "label_cn": "悲伤", "reasoning": "", "recommendations": []
+            }
+
+        writer = WriteBehindWriter(session_factory, flush_interval_ms=10)
+        writer.start()
+        monkeypatch.setattr(emotion.emotion_analyzer, "analyze", analyze)
+        monkeypatch.setattr(emotion, "get_write_behind_writer", lambda: writer)
+
+        def read_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        db = session_factory()
+        db.add(Memory(user_id=1, memory_type="text", emotion_type="happy", content="海边散步",
+                      tags=[], created_at=datetime.utcnow() - timedelta(days=1)))
+        db.commit()
+        db.close()
+
+        app = FastAPI()
+        app.include_router(emotion.router)
+        app.dependency_overrides[get_user_read_db] = read_db
+        client = TestClient(app)
+        for text in ("今天很难过", "还是很难过"):
+            response = client.post("/api/v1/emotion/analyze", json={"text": text, "user_id": 1})
+            assert response.status_code == 200
+        writer.flush()
+        writer.stop()
+
+        response = client.get("/api/v1/emotion/history/1")
+        assert response.status_code == 200
+        history = response.json()
+        assert [(h["source"], h["emotion"]) for h in history] == [("text", "sad"), ("text", "sad"), ("memory", "happy")]
+        assert history[2]["content_summary"] == "海边散步"
+
+        # 逐条翻页与一次取回的结果一致
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 1, "cursor": cursor} if cursor else {"limit": 1}
+            response = client.get("/api/v1/emotion/history/1", params=params)
+            seen.extend((h["source"], h["emotion_id"]) for h in response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        assert seen == [(h["source"], h["emotion_id"]) for h in history]
+
+        # 统计同时包含识别读数和直接创建的记忆
+        response = client.get("/api/v1/emotion/statistics/1")
+        assert response.status_code == 200
+        assert response.json()["emotion_distribution"] == {"sad": 2, "happy": 1}
+
+
+class TestPostgresBackend:
+    """PostgreSQL后端测试（JSONB、tsvector全文索引、汇总upsert）"""
+
+    def _add_memories(self, db):
+        db.add_all([
+            Memory(user_id=1, memory_type="text", emotion_type="happy", emotion_intensity=0.8,
+                   content="今天和朋友去海边散步，心情很好", tags=["海边", "朋友"]),
+            Memory(user_id=1, memory_type="text", emotion_type="sad", emotion_intensity=0.4,
+                   content="工作压力很大，晚上睡不着", tags=["工作"]),
+        ])
+        db.commit()
+
+    def test_search_uses_tsvector(self, pg_session_factory):
+        """写入时维护tsvector索引，搜索返回高亮并支持游标翻页"""
+        db = pg_session_factory()
+        self._add_memories(db)
+
+        results, next_cursor = memory_search.search_page(db, 1, "朋友", limit=1)
+        assert len(results) == 1
+        assert "<mark>朋友</mark>" in results[0]["highlight"]
+        assert next_cursor is None
+
+        assert memory_search.search_page(db, 2, "朋友", limit=10) == ([], None)
+        db.close()
+
+    def test_tags_and_rollup(self, pg_session_factory):
+        """标签回填和每日汇总upsert在PostgreSQL上结果一致"""
+        db = pg_session_factory()
+        self._add_memories(db)
+
+        assert memory_tags.backfill(db, user_id=1) == 3
+        assert db.query(MemoryTag).filter(MemoryTag.tag == "朋友").count() == 1
+        assert backfill(db) == 2
+        assert sum(r.count for r in db.query(EmotionDailyRollup).all()) == 2
+        db.close()
+
+    def test_migrate_backfills_existing_database(self, pg_session_factory):
+        """只建过表的已有库按版本执行迁移，回填派生数据并记录版本号"""
+        db = pg_session_factory()
+        self._add_memories(db)
+        db.execute(MemoryTag.__table__.delete())
+        db.execute(EmotionEvent.__table__.delete())
+        db.commit()
+
+        engine = db.get_bind()
+        with engine.connect() as connection:
+            assert current_version(connection) == 0
+        assert migrate(engine) == SCHEMA_VERSION
+        assert migrate(engine) == 0
+        with engine.connect() as connection:
+            assert current_version(connection) == SCHEMA_VERSION
+
+        assert db.query(MemoryTag).count() == 3
+        assert db.query(EmotionEvent).count() == 2
+        assert db.query(MemorySignature).count() == 2
+        assert memory_search.search_page(db, 1, "工作", limit=10)[0][0]["content"] == "工作压力很大，晚上睡不着"
+        db.close()